@@ -1,8 +1,13 @@
 #! /usr/bin/python3
 
 import argparse
+import concurrent.futures
+import copy
+import datetime
+import functools
 import glob
 import grp
+import itertools
 import json
 import logging
 import os
@@ -10,12 +15,15 @@ import pathlib
 import re
 import shlex
 import shutil
+import socket
 import stat
 import subprocess
 import sys
 import tarfile
 import tempfile
 import termios
+import threading
+import time
 import urllib.parse
 from http import HTTPStatus
 
@@ -31,6 +39,8 @@ import tabulate
 
 import yaml
 
+from .utils import tracing
+
 
 logger = logging.getLogger("appmgr")
 
@@ -107,6 +117,797 @@ def parse_version(version_string):
     return packaging.version.parse(version_string)
 
 
+# Helpers for X authority files
+
+
+# Address families, as defined in <X11/Xauth.h>
+XAUTH_FAMILY_LOCAL = 256
+XAUTH_FAMILY_WILD = 65535
+
+
+def parse_local_display_number(display):
+    """Get the display number of a local DISPLAY, eg. ':0.0' -> '0'
+
+    Returns None if the display is not a local one (eg. 'localhost:10.0' as
+    set by SSH X11 forwarding), in which case it's better to let the xauth
+    program figure out what entries match.
+    """
+    m = re.match(r"^(?:unix)?:(\d+)(?:\.\d+)?$", display)
+    if not m:
+        return None
+    return m.group(1)
+
+
+def read_xauth_entries(filename):
+    """Read the entries of a Xauthority file
+
+    The format is a sequence of records made of a 16-bit family, followed
+    by four counted strings (address, display number, auth name and auth
+    data), all integers being big-endian.
+
+    Returns a list of (family, address, number, name, data) tuples.
+    Raises ValueError if the file is truncated.
+    """
+    with open(filename, "rb") as f:
+        buf = f.read()
+
+    entries = []
+    pos = 0
+    while pos < len(buf):
+        if pos + 2 > len(buf):
+            raise ValueError("Truncated Xauthority file %s" % filename)
+        family = int.from_bytes(buf[pos : pos + 2], "big")
+        pos += 2
+        fields = []
+        for _ in range(4):
+            if pos + 2 > len(buf):
+                raise ValueError("Truncated Xauthority file %s" % filename)
+            length = int.from_bytes(buf[pos : pos + 2], "big")
+            pos += 2
+            if pos + length > len(buf):
+                raise ValueError("Truncated Xauthority file %s" % filename)
+            fields.append(buf[pos : pos + length])
+            pos += length
+        entries.append((family, *fields))
+    return entries
+
+
+def write_xauth_entries(filename, entries):
+    """Write entries to a Xauthority file, replacing it atomically"""
+    buf = b""
+    for family, *fields in entries:
+        buf += family.to_bytes(2, "big")
+        for field in fields:
+            buf += len(field).to_bytes(2, "big") + field
+    dirname = os.path.dirname(filename) or "."
+    fd, tmpname = tempfile.mkstemp(dir=dirname, prefix=".xauth")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(buf)
+        os.replace(tmpname, filename)
+    except BaseException:
+        os.unlink(tmpname)
+        raise
+
+
+def merge_xauth_entries(entries, new_entries):
+    """Merge entries the same way 'xauth nmerge' does
+
+    An entry with the same family, address, display number and auth name
+    as a new entry is replaced by it.
+    """
+    keys = {e[:4] for e in new_entries}
+    merged = [e for e in entries if e[:4] not in keys]
+    merged.extend(new_entries)
+    return merged
+
+
+def get_local_xauth_entries(filename, number):
+    """Get the entries of a Xauthority file that match a local display
+
+    The entries returned have their family rewritten to FamilyWild, so that
+    they match whatever hostname the container has. This is the equivalent
+    of 'xauth nlist :N | sed -e "s/^..../ffff/"'.
+    """
+    hostname = socket.gethostname().encode()
+    number = number.encode()
+    matches = []
+    for family, address, num, name, data in read_xauth_entries(filename):
+        if num != number:
+            continue
+        if family == XAUTH_FAMILY_WILD or (
+            family == XAUTH_FAMILY_LOCAL and address == hostname
+        ):
+            matches.append((XAUTH_FAMILY_WILD, address, num, name, data))
+    return matches
+
+
+# Helpers for pulling images
+
+
+# How many images are pulled in parallel, by default
+DEFAULT_PULL_JOBS = 4
+
+# How many remote registries are queried in parallel
+DEFAULT_REGISTRY_JOBS = 8
+
+
+# Retries of a failed pull, and bounds of the exponential backoff in between
+PULL_RETRIES = 4
+PULL_BACKOFF_MIN = 2
+PULL_BACKOFF_MAX = 30
+
+# Errors of a pull that retrying won't fix, and errors that it might fix
+PERMANENT_PULL_ERRORS = re.compile(
+    r"manifest unknown|not found|unauthorized|authentication required|denied"
+    r"|invalid reference|no matching manifest|does not exist|no space left",
+    re.IGNORECASE,
+)
+TRANSIENT_PULL_ERRORS = re.compile(
+    r"timeout|timed out|connection (reset|refused)|unexpected EOF|broken pipe"
+    r"|no such host|temporary failure|TLS handshake|too ?many ?requests"
+    r"|service unavailable|bad gateway|gateway time|internal server error|\b(429|5\d\d)\b",
+    re.IGNORECASE,
+)
+
+# The statuses of the layers in the pull stream, the other events (eg.
+# 'Pulling from library/debian', 'Digest: ...') are about the image
+PULL_LAYER_STATUSES = {
+    "Pulling fs layer",
+    "Waiting",
+    "Downloading",
+    "Verifying Checksum",
+    "Download complete",
+    "Extracting",
+    "Pull complete",
+    "Already exists",
+}
+
+
+def is_transient_pull_error(message, status_code=None):
+    """Tell whether a failed pull is worth retrying
+
+    The errors of the network, the timeouts and the 5xx of the registry
+    are, a missing manifest or a denied access are not. An error that is
+    not known either way is retried if the daemon answered with a 5xx.
+    """
+    if PERMANENT_PULL_ERRORS.search(message):
+        return False
+    if TRANSIENT_PULL_ERRORS.search(message):
+        return True
+    return status_code is not None and status_code >= 500
+
+
+def format_bytes(n):
+    """Human-readable size, eg. 1536 -> '1.5 KB'"""
+    for unit in ["B", "KB", "MB", "GB"]:
+        if n < 1024 or unit == "GB":
+            break
+        n /= 1024
+    return "%.1f %s" % (n, unit) if unit != "B" else "%d B" % n
+
+
+def format_duration(seconds):
+    """Human-readable duration, eg. 75 -> '1m15s'"""
+    seconds = int(seconds)
+    if seconds < 60:
+        return "%ds" % seconds
+    return "%dm%02ds" % (seconds // 60, seconds % 60)
+
+
+class PullProgress:
+    """Progress of one or more image pulls
+
+    This consumes the JSON events streamed by the docker daemon during a
+    pull, keeps track of the layers of every image, and derives the
+    overall throughput and ETA from it. Pulls may run in parallel threads.
+
+    The progress is reported according to the mode:
+    - 'auto': a status line on stderr if it's a terminal, logs otherwise
+    - 'json': one JSON object per line on stdout, for machine consumption
+    - 'none': nothing
+    """
+
+    # Minimum time between two reports of the transfer progress
+    interval = 0.5
+
+    def __init__(self, total=1, mode="auto", stream=None):
+        self.total = total
+        self.mode = mode
+        if stream is None:
+            stream = sys.stdout if mode == "json" else sys.stderr
+        self.stream = stream
+        self.tty = mode == "auto" and self.stream.isatty()
+        self.lock = threading.Lock()
+        self.done = 0
+        self.failed = 0
+        # image name -> layer id -> [current, total, status]
+        self.layers = {}
+        self.started = time.monotonic()
+        self.last_report = 0
+        self.last_bytes = 0
+        self.last_time = self.started
+        self.rate = 0.0
+
+    def emit(self, event, **data):
+        if self.mode != "json":
+            return
+        data = {"event": event, "time": time.time(), **data}
+        self.stream.write(json.dumps(data) + "\n")
+        self.stream.flush()
+
+    def start(self, image_name):
+        with self.lock:
+            self.layers.setdefault(image_name, {})
+            self.emit("start", image=image_name)
+
+    def layer_event(self, image_name, event):
+        """Account for an event from the pull stream of the daemon"""
+        layer_id = event.get("id")
+        status = event.get("status", "")
+        if not layer_id or not (
+            status in PULL_LAYER_STATUSES or status.startswith("Retrying")
+        ):
+            # Not a layer event, eg. 'Pulling from library/debian'
+            return
+        detail = event.get("progressDetail") or {}
+        with self.lock:
+            layers = self.layers.setdefault(image_name, {})
+            layer = layers.setdefault(layer_id, [0, 0, ""])
+            if status == "Pulling fs layer":
+                layer[0] = 0
+            elif status == "Downloading":
+                layer[0] = detail.get("current", layer[0])
+                layer[1] = detail.get("total", layer[1])
+            elif status in ["Download complete", "Pull complete"]:
+                layer[0] = layer[1]
+            elif status == "Already exists":
+                # Nothing to transfer, the layer was found locally (eg. it
+                # was downloaded by a previous, interrupted, attempt)
+                layer[0] = layer[1] = 0
+            if status != layer[2]:
+                layer[2] = status
+                self.emit(
+                    "layer",
+                    image=image_name,
+                    layer=layer_id,
+                    status=status,
+                    current=layer[0],
+                    total=layer[1],
+                )
+            self.report()
+
+    def retry(self, image_name, attempt, delay, error):
+        with self.lock:
+            logger.warning(
+                "Pull of %s failed (%s), retrying in %ds", image_name, error, delay
+            )
+            self.emit(
+                "retry", image=image_name, attempt=attempt, delay=delay, error=error
+            )
+
+    def finish(self, image_name, ok):
+        with self.lock:
+            self.done += 1
+            if not ok:
+                self.failed += 1
+            self.emit("done", image=image_name, ok=ok)
+            if not self.tty:
+                logger.info(
+                    "[%d/%d] %s %s",
+                    self.done,
+                    self.total,
+                    "Pulled" if ok else "Failed to pull",
+                    image_name,
+                )
+            self.report(force=True)
+
+    def transferred(self):
+        """Returns the number of bytes downloaded so far, and the total"""
+        current = total = 0
+        for layers in self.layers.values():
+            for layer in layers.values():
+                current += layer[0]
+                total += layer[1]
+        return current, total
+
+    def report(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_report < self.interval:
+            return
+        self.last_report = now
+
+        current, total = self.transferred()
+        if now > self.last_time:
+            # Exponential moving average, to smooth out the bursts
+            rate = (current - self.last_bytes) / (now - self.last_time)
+            self.rate = rate if not self.rate else 0.7 * self.rate + 0.3 * rate
+        self.last_bytes = current
+        self.last_time = now
+        eta = (total - current) / self.rate if self.rate > 0 else None
+
+        self.emit(
+            "progress",
+            done=self.done,
+            failed=self.failed,
+            total_images=self.total,
+            current=current,
+            total=total,
+            bytes_per_second=round(self.rate),
+            eta=round(eta) if eta is not None else None,
+        )
+        if self.tty:
+            self.stream.write("\r\033[KPulling images: %s" % self.status(eta))
+            self.stream.flush()
+
+    def status(self, eta=None):
+        status = "%d/%d done" % (self.done, self.total)
+        if self.failed:
+            status += ", %d failed" % self.failed
+        current, total = self.transferred()
+        if total:
+            status += ", %s/%s" % (format_bytes(current), format_bytes(total))
+        if self.done < self.total and self.rate > 0:
+            status += ", %s/s" % format_bytes(self.rate)
+            if eta is not None:
+                status += ", ETA %s" % format_duration(eta)
+        return status
+
+    def close(self):
+        if self.tty and self.done:
+            self.stream.write("\n")
+            self.stream.flush()
+
+
+class PullScheduler:
+    """Pull a batch of images concurrently
+
+    Each distinct image is pulled only once, no matter how many callers
+    submitted it. The callbacks are run in the thread that calls run(), as
+    soon as their image is ready, while the other pulls keep going.
+    """
+
+    def __init__(self, pull, jobs=DEFAULT_PULL_JOBS, progress_mode="auto"):
+        self.pull = pull
+        self.jobs = max(1, jobs)
+        self.progress_mode = progress_mode
+        self.callbacks = {}
+
+    def submit(self, image_name, callback):
+        """Schedule a pull, callback(image) is called once it's done"""
+        self.callbacks.setdefault(image_name, []).append(callback)
+
+    def run(self):
+        """Pull all the images submitted so far
+
+        Returns: the list of images that could not be pulled.
+        """
+        failed = []
+        if not self.callbacks:
+            return failed
+
+        progress = PullProgress(len(self.callbacks), mode=self.progress_mode)
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs)
+        pull = tracing.bind(self.pull)
+        futures = {}
+        try:
+            futures = {
+                executor.submit(pull, image_name, progress=progress): image_name
+                for image_name in self.callbacks
+            }
+            for future in concurrent.futures.as_completed(futures):
+                image_name = futures[future]
+                try:
+                    image = future.result()
+                except Exception:
+                    logger.warning("Failed to pull %s", image_name, exc_info=1)
+                    image = None
+                if image is None:
+                    failed.append(image_name)
+                    continue
+                for callback in self.callbacks.pop(image_name):
+                    callback(image)
+        finally:
+            # Don't start the pulls that are still queued, on an error or an
+            # interrupt (shutdown() has cancel_futures from Python 3.9 only)
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)
+            progress.close()
+
+        return failed
+
+
+# Helpers for garbage collection of images
+
+
+# How many versions of an app are kept by 'appmgr gc', by default
+DEFAULT_KEEP_VERSIONS = 2
+
+
+def is_dangling(image):
+    """Whether an image summary, as returned by the Engine API, has no tag"""
+    tags = image.get("RepoTags") or []
+    return all(t == "<none>:<none>" for t in tags)
+
+
+def plan_image_gc(images, app_image_names, keep, keep_current=True):
+    """Decide which appmgr images can be removed
+
+    'images' is the list of image summaries returned by the Engine API
+    (/system/df), 'app_image_names' maps image names (local and remote)
+    to app ids. For each app, the images tagged 'current' and the 'keep'
+    most recent versions are kept, everything else goes. The tags that
+    are not versions (eg. 'nightly') were not made by appmgr, they keep
+    their image, unless it's a purge (keep=0, keep_current=False), where
+    all the images of the apps go. Dangling images that descend from an
+    appmgr image, ie. the images committed by 'appmgr run', go as well.
+    Images in use by a container are never removed.
+
+    Returns: a dict with the following lists of image summaries:
+    - remove: images to remove entirely, children before their parents
+    - untag: (image, tags) tuples, for images that still have tags to keep
+    - in_use: images that should go, but are in use by a container
+    """
+    by_id = {i["Id"]: i for i in images}
+
+    # Versions of every app, and the image they point to
+    versions = {}
+    current = {}
+    for image in images:
+        for tag in image.get("RepoTags") or []:
+            name, _, ver = tag.rpartition(":")
+            app = app_image_names.get(name)
+            if app is None:
+                continue
+            if ver == "current":
+                current[app] = image["Id"]
+            elif ver != "latest":
+                versions.setdefault(app, {}).setdefault(ver, set()).add(image["Id"])
+
+    # Find out what image ids must be kept
+    purge = keep <= 0 and not keep_current
+    kept = set()
+    for app in set(versions) | set(current):
+        if keep_current and app in current:
+            kept.add(current[app])
+        parsed = []
+        for ver, ids in versions.get(app, {}).items():
+            try:
+                parsed.append((parse_version(ver), ids))
+            except packaging.version.InvalidVersion:
+                # Not something that appmgr tagged, better leave it alone
+                if not purge:
+                    kept.update(ids)
+        parsed.sort(key=lambda x: x[0], reverse=True)
+        for _, ids in parsed[:keep]:
+            kept.update(ids)
+
+    plan = {"remove": [], "untag": [], "in_use": []}
+
+    def in_use(image):
+        return image.get("Containers", 0) > 0
+
+    # Tagged appmgr images
+    appmgr_ids = set()
+    for image in images:
+        tags = image.get("RepoTags") or []
+        app_tags = [t for t in tags if t.rpartition(":")[0] in app_image_names]
+        if not app_tags:
+            continue
+        appmgr_ids.add(image["Id"])
+        if image["Id"] in kept:
+            continue
+        if len(app_tags) < len(tags):
+            # Also tagged by something else than appmgr, just untag it
+            plan["untag"].append((image, app_tags))
+        elif in_use(image):
+            plan["in_use"].append(image)
+        else:
+            plan["remove"].append(image)
+
+    # Dangling descendants of appmgr images, deepest first
+    def depth(image):
+        d = 0
+        parent = image.get("ParentId")
+        while parent and parent not in appmgr_ids and parent in by_id:
+            d += 1
+            parent = by_id[parent].get("ParentId")
+        return d if parent in appmgr_ids else None
+
+    descendants = []
+    for image in images:
+        if not is_dangling(image):
+            continue
+        d = depth(image)
+        if d is None:
+            continue
+        if in_use(image):
+            plan["in_use"].append(image)
+        else:
+            descendants.append((d, image))
+    descendants.sort(key=lambda x: x[0], reverse=True)
+    plan["remove"] = [i for _, i in descendants] + plan["remove"]
+
+    return plan
+
+
+# Model of the docker objects, kept up to date from the events stream
+
+
+# The Engine API only replays that many past events, if a catch-up returns
+# as many, some were probably missed and the model must be rebuilt.
+DOCKER_EVENTS_BUFFER = 256
+
+# If the model was not updated for that long, rebuild it rather than replay
+# the events (in nanoseconds)
+DOCKER_MODEL_MAX_GAP = 300 * 10**9
+
+SYSTEM_TIME_RE = re.compile(
+    r"(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(?:\.(\d+))?(Z|[+-]\d\d:\d\d)$"
+)
+
+
+def format_event_time(t):
+    """Format a timestamp in nanoseconds for the 'since' and 'until' params"""
+    return "%d.%09d" % divmod(t, 10**9)
+
+
+def parse_system_time(value):
+    """Timestamp in nanoseconds of the RFC 3339 SystemTime of /info"""
+    m = SYSTEM_TIME_RE.match(value)
+    if not m:
+        raise ValueError("Invalid time: %s" % value)
+    seconds, fraction, zone = m.groups()
+    t = datetime.datetime.strptime(seconds, "%Y-%m-%dT%H:%M:%S")
+    if zone == "Z":
+        tz = datetime.timezone.utc
+    else:
+        hours, minutes = zone[1:].split(":")
+        offset = datetime.timedelta(hours=int(hours), minutes=int(minutes))
+        tz = datetime.timezone(-offset if zone[0] == "-" else offset)
+    t = t.replace(tzinfo=tz)
+    return int(t.timestamp()) * 10**9 + int((fraction or "0")[:9].ljust(9, "0"))
+
+
+class DockerModel:
+    """An in-memory view of the images, running containers and networks
+
+    It's built from a full listing, then updated incrementally from the
+    docker events, so that looking up an image or a container doesn't cost
+    a listing (and an inspect per object) every time. Each collection is
+    listed the first time it's read, a command that only looks at the
+    images never lists the containers or the networks.
+
+    Each read first replays the events that happened since the previous
+    one, so that the changes the caller just made are visible. A long-lived
+    process can also run a watcher (see watch()), a background thread that
+    applies the events as they come, so that there's little to replay and
+    the model never has to be rebuilt. The events already applied are
+    skipped, based on their timestamp.
+
+    The timestamps of the events come from the clock of the docker daemon,
+    that may not agree with ours: they're only compared with each other, and
+    with the time of the daemon, estimated from its /info when the model is
+    rebuilt.
+    """
+
+    def __init__(self, client, backend=None):
+        self.client = client
+        self.backend = backend or DockerBackend()
+        self.lock = threading.RLock()
+        # None until listed
+        self.images = None
+        self.containers = None
+        self.networks = None
+        # Difference (ns) between the clock of the daemon and ours, and how
+        # far off that estimate can be
+        self.clock_offset = 0
+        self.clock_error = 0
+        # Timestamp (ns, daemon clock) of the last event applied, and the
+        # events applied at that very timestamp
+        self.last_time = None
+        self.last_keys = set()
+        # When (ns, monotonic clock) the model was last known up to date
+        self.synced_at = None
+        self.watcher = None
+
+    def daemon_time(self):
+        """The current time of the daemon, in nanoseconds
+
+        It's the latest it can be: the events until then are all in.
+        """
+        return time.time_ns() + self.clock_offset + self.clock_error
+
+    def refresh(self):
+        """Rebuild the whole model from scratch
+
+        The collections are dropped, to be listed again when they're read.
+        """
+        with self.lock:
+            start = time.time_ns()
+            info = self.client.info()
+            end = time.time_ns()
+            system_time = parse_system_time(info["SystemTime"])
+            # The daemon read its clock about halfway through the request
+            self.clock_offset = system_time - (start + end) // 2
+            self.clock_error = (end - start) // 2 + 1
+            self.images = None
+            self.containers = None
+            self.networks = None
+            self.last_time = system_time
+            self.last_keys = set()
+            self.synced_at = time.monotonic_ns()
+
+    def load(self):
+        """List all the collections now, rather than on first read"""
+        with self.lock:
+            self.sync()
+            self.get_images()
+            self.get_containers()
+            self.get_networks()
+
+    def get_images(self):
+        # Events that happen while listing are applied later on, it doesn't
+        # hurt to apply them twice
+        if self.images is None:
+            images = {}
+            for attrs in self.backend.list_images(self.client):
+                image = self.client.images.prepare_model(attrs)
+                images[image.id] = image
+            self.images = images
+            logger.debug("Docker model: %d images", len(images))
+        return self.images
+
+    def get_containers(self):
+        if self.containers is None:
+            self.containers = {c.id: c for c in self.client.containers.list()}
+            logger.debug("Docker model: %d containers", len(self.containers))
+        return self.containers
+
+    def get_networks(self):
+        if self.networks is None:
+            self.networks = {n.id: n for n in self.client.networks.list()}
+            logger.debug("Docker model: %d networks", len(self.networks))
+        return self.networks
+
+    def sync(self):
+        """Apply the events that happened since the last update"""
+        with self.lock:
+            if (
+                self.last_time is None
+                or time.monotonic_ns() - self.synced_at > DOCKER_MODEL_MAX_GAP
+            ):
+                self.refresh()
+            synced_at = time.monotonic_ns()
+            events = list(
+                self.client.api.events(
+                    since=format_event_time(self.last_time),
+                    until=format_event_time(self.daemon_time()),
+                    filters={"type": ["image", "container", "network"]},
+                    decode=True,
+                )
+            )
+            if len(events) >= DOCKER_EVENTS_BUFFER:
+                logger.debug("Too many events to catch up with")
+                self.refresh()
+                return
+            for event in events:
+                self.apply(event)
+            self.synced_at = max(self.synced_at, synced_at)
+
+    def apply(self, event):
+        """Update the model according to a single docker event"""
+        t = event.get("timeNano", 0)
+        actor_id = event.get("Actor", {}).get("ID")
+        key = (t, event.get("Type"), event.get("Action"), actor_id)
+        with self.lock:
+            if t < self.last_time or key in self.last_keys:
+                return
+            if t > self.last_time:
+                self.last_time = t
+                self.last_keys = set()
+            self.last_keys.add(key)
+            self.synced_at = time.monotonic_ns()
+
+            # The collections that were not listed yet will be up to date
+            # when they are
+            kind = event.get("Type")
+            if kind == "image" and self.images is not None:
+                self.update_image(actor_id)
+            elif kind == "container" and self.containers is not None:
+                self.update_container(actor_id)
+            elif kind == "network" and self.networks is not None:
+                self.update_network(actor_id)
+
+    def update_image(self, name):
+        # Image events refer to the image by id, except 'pull' events that
+        # refer to it by name. Either way, the current state of the image is
+        # all we need.
+        try:
+            image = self.client.images.get(name)
+        except docker.errors.NotFound:
+            self.images.pop(name, None)
+            return
+        self.images[image.id] = image
+        # A tag moves from an image to another one when it's reused
+        tags = set(image.tags)
+        for other in self.images.values():
+            if other.id == image.id or not tags.intersection(other.tags):
+                continue
+            other.attrs["RepoTags"] = [
+                t for t in other.attrs.get("RepoTags") or [] if t not in tags
+            ]
+
+    def update_container(self, container_id):
+        # Like 'docker ps', keep only the running containers
+        try:
+            container = self.client.containers.get(container_id)
+        except docker.errors.NotFound:
+            container = None
+        if container and container.status in ("running", "paused", "restarting"):
+            self.containers[container.id] = container
+        else:
+            self.containers.pop(container_id, None)
+
+    def update_network(self, network_id):
+        try:
+            self.networks[network_id] = self.client.networks.get(network_id)
+        except docker.errors.NotFound:
+            self.networks.pop(network_id, None)
+
+    def list_images(self):
+        with self.lock:
+            self.sync()
+            return list(self.get_images().values())
+
+    def find_containers(self, name):
+        """Running containers whose name matches, like the 'name' filter"""
+        with self.lock:
+            self.sync()
+            return [
+                c for c in self.get_containers().values() if re.search(name, "/" + c.name)
+            ]
+
+    def find_network(self, name):
+        with self.lock:
+            self.sync()
+            for n in self.get_networks().values():
+                if n.name == name:
+                    return n
+        return None
+
+    def watch(self):
+        """Keep the model up to date from a background thread"""
+        if self.watcher is not None:
+            return
+        self.watcher = threading.Thread(
+            target=self._watch, name="docker-events", daemon=True
+        )
+        self.watcher.start()
+
+    def _watch(self):
+        delay = 1
+        while True:
+            try:
+                # Catch up first, then follow the stream from there. If the
+                # connection is lost, resume from the last event seen.
+                self.sync()
+                events = self.client.api.events(
+                    since=format_event_time(self.last_time),
+                    filters={"type": ["image", "container", "network"]},
+                    decode=True,
+                )
+                delay = 1
+                for event in events:
+                    self.apply(event)
+                logger.debug("Docker events stream closed")
+            except Exception as e:
+                logger.warning("Lost the docker events stream: %s", e)
+            time.sleep(delay)
+            delay = min(delay * 2, 30)
+
+
 # Main class
 
 
@@ -116,6 +917,36 @@ class Appmgr:
         self.parser.add_argument(
             "-v", "--verbose", action="count", default=0, help="increase verbosity"
         )
+        self.parser.add_argument(
+            "--engine",
+            choices=["docker-py", "native"],
+            help="client used for the Engine API hot paths (list, inspect, archive), "
+            "$APPMGR_ENGINE or %s by default" % DEFAULT_ENGINE,
+        )
+        self.parser.add_argument(
+            "--progress",
+            choices=["auto", "json", "none"],
+            default="auto",
+            help="how to report the progress of image pulls",
+        )
+        self.parser.add_argument(
+            "--trace",
+            metavar="FILE",
+            help="write a trace of the operations to FILE, in the Chrome trace format",
+        )
+        self.parser.add_argument(
+            "--profile",
+            metavar="FILE",
+            help="run the command under cProfile, write the statistics to FILE, "
+            "and report them with the Engine API requests",
+        )
+        self.parser.add_argument(
+            "--profile-top",
+            metavar="N",
+            type=int,
+            default=20,
+            help="how many functions and endpoints the profile report shows",
+        )
 
         subparsers = self.parser.add_subparsers(
             title="subcommands", help="action to perform", dest="action", required=True
@@ -171,10 +1002,24 @@ class Appmgr:
 
         parser_prepare = subparsers.add_parser("prepare", help="prepare container(s)")
         parser_prepare.add_argument("app", nargs="+")
+        parser_prepare.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            default=DEFAULT_PULL_JOBS,
+            help="number of images to pull in parallel",
+        )
         parser_prepare.set_defaults(func=self.cmd_prepare)
 
         parser_upgrade = subparsers.add_parser("upgrade", help="upgrade container(s)")
         parser_upgrade.add_argument("app", nargs="+")
+        parser_upgrade.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            default=DEFAULT_PULL_JOBS,
+            help="number of images to pull in parallel",
+        )
         parser_upgrade.set_defaults(func=self.cmd_upgrade)
 
         parser_list = subparsers.add_parser(
@@ -195,6 +1040,12 @@ class Appmgr:
         parser_list.add_argument(
             "--skip-headers", action="store_true", help="do not display column headers"
         )
+        parser_list.add_argument(
+            "--format",
+            choices=["table", "json", "ndjson"],
+            default="table",
+            help="output format (json and ndjson are streamed as apps are resolved)",
+        )
         parser_list.set_defaults(func=self.cmd_list)
 
         parser_build = subparsers.add_parser("build", help="build image")
@@ -254,6 +1105,23 @@ class Appmgr:
         parser_load.add_argument("file")
         parser_load.set_defaults(func=self.cmd_load)
 
+        parser_gc = subparsers.add_parser(
+            "gc", help="remove old versions and leftover images"
+        )
+        parser_gc.add_argument("app", nargs="*", help="apps to consider (default: all)")
+        parser_gc.add_argument(
+            "--keep",
+            type=int,
+            default=DEFAULT_KEEP_VERSIONS,
+            help="number of versions to keep per app, besides the current one",
+        )
+        parser_gc.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="only report what would be removed",
+        )
+        parser_gc.set_defaults(func=self.cmd_gc)
+
         parser_purge = subparsers.add_parser("purge", help="purge image")
         parser_purge.add_argument("app")
         parser_purge.add_argument(
@@ -261,6 +1129,33 @@ class Appmgr:
         )
         parser_purge.set_defaults(func=self.cmd_purge)
 
+        parser_validate = subparsers.add_parser(
+            "validate", help="check app config files against their schema"
+        )
+        parser_validate.add_argument(
+            "paths",
+            nargs="*",
+            metavar="path",
+            help="config file, or tree to search for them (default: the config paths)",
+        )
+        parser_validate.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            default=None,
+            help="number of processes (default: one per CPU)",
+        )
+        parser_validate.add_argument(
+            "--no-cache", action="store_true", help="check unchanged files again"
+        )
+        parser_validate.add_argument(
+            "--strict", action="store_true", help="fail on warnings too"
+        )
+        parser_validate.add_argument(
+            "--format", choices=["text", "json"], default="text", help="output format"
+        )
+        parser_validate.set_defaults(func=self.cmd_validate)
+
         self.config_paths = [
             ".",
             "/etc/appmgr",
@@ -271,6 +1166,11 @@ class Appmgr:
         self.backend = DockerBackend()
         self.registry = ContainerRegistry()
 
+        # Caches, they make a difference when the same Appmgr object serves
+        # several commands, see appmgrd
+        self.config_cache = {}
+        self.meta_file_cache = {}
+
     def setup_logging(self):
         loglevels = {
             0: "ERROR",
@@ -306,12 +1206,53 @@ class Appmgr:
 
         So there's no need to call containers.list() anymore at this point,
         however docker-py behavior might change again in the future, so let's
-        be cautions and double-check.
+        be cautions and double-check. With a ping: containers.list() inspects
+        every container, it's most of the startup time of the commands that
+        need nothing more.
+
+        If there's no access to Docker, fall back to the rootless Podman
+        service of the user, if it's running.
         """
-        conn = docker.from_env()
-        conn.containers.list()
+        try:
+            conn = docker.from_env()
+            conn.ping()
+        except Exception:
+            conn = self.connect_podman()
+            if conn is None:
+                raise
         self._docker_conn = conn
 
+    def connect_podman(self):
+        """Connect to the Podman service, through its Docker-compatible API
+
+        The rootless service runs as the user, so it needs no privilege
+        escalation. It's started with 'systemctl --user enable --now
+        podman.socket'.
+
+        Returns: a DockerClient, or None if Podman is not available.
+        """
+        from .core.engine import get_podman_socket_path
+
+        path = get_podman_socket_path()
+        if not os.path.exists(path):
+            return None
+        try:
+            conn = docker.DockerClient(base_url="unix://" + path)
+            conn.ping()
+        except Exception:
+            logger.debug("No access to Podman either", exc_info=1)
+            return None
+        logger.debug("Using the Podman service at %s", path)
+        self.backend.socket_path = path
+        return conn
+
+    @property
+    def docker_model(self):
+        """The DockerModel of this connection, created on first use"""
+        if not hasattr(self, "_docker_model"):
+            self._docker_model = DockerModel(self.docker_conn, self.backend)
+        return self._docker_model
+
     @property
     def docker_conn(self):
         if hasattr(self, "_docker_conn"):
@@ -333,19 +1274,51 @@ class Appmgr:
                     "docker or appmgr?\n"
                     "Consider adding yourself to the appmgr group with:\n\n"
                     "    sudo adduser $(whoami) appmgr\n\n"
-                    "Then log out and log back in for the change to take effect."
+                    "Then log out and log back in for the change to take effect.\n"
+                    "Alternatively, use rootless Podman, start it with:\n\n"
+                    "    systemctl --user enable --now podman.socket"
                 )
             logger.error(msg)
             sys.exit(1)
 
+    @property
+    def state_store(self):
+        """The StateStore of appmgr, opened on first use
+
+        It's not the one of ApplicationManager, they don't manage the same
+        applications.
+        """
+        if not hasattr(self, "_state_store"):
+            from .core.state import StateStore, get_state_db_path
+
+            self._state_store = StateStore.open(get_state_db_path("appmgr"))
+        return self._state_store
+
     def show_exception_in_debug_mode(self):
         if self.args.verbose >= 2:
             logger.exception("The following exception was caught")
 
     def go(self):
         self.args = self.parser.parse_args()
+        self.backend.engine = self.args.engine
         self.setup_logging()
 
+        # -vvv sums the trace up at exit
+        if self.args.trace or self.args.verbose >= 3:
+            tracing.enable()
+
+        exit_code = self.forward_to_daemon()
+        if exit_code is not None:
+            sys.exit(exit_code)
+
+        # The setup of the connection counts, it's a few requests already
+        profiler = None
+        if self.args.profile:
+            from .utils.profiling import Profiler
+
+            profiler = Profiler()
+            profiler.start()
+
         # Try to setup the docker connection.
         #
         # If it doesn't work, and we're in a position where we can elevate
@@ -359,12 +1332,16 @@ class Appmgr:
         # needed. So that if ever there is no need for a docker connection,
         # then appmgr has a chance to run successfully.
         #
+        # Before it gives up, setup_docker() tries the rootless Podman service,
+        # which needs no privilege at all.
+        #
         # Note: we could try to be more selective about the exception raised,
         # and elevate privileges only on "permission denied" error. But the
         # exact type of exception that we catch might change wit time, so let
         # not bother.
         try:
-            self.setup_docker()
+            with tracing.span("setup_docker"):
+                self.setup_docker()
         except Exception:
             logger.debug("Failed to setup docker connection")
             groups = list(map(lambda g: grp.getgrgid(g)[0], os.getgroups()))
@@ -377,7 +1354,51 @@ class Appmgr:
             else:
                 logger.debug("Can't elevate privileges, keep going")
 
-        self.args.func()
+        try:
+            with tracing.span("appmgr " + self.args.action):
+                self.args.func()
+        finally:
+            self.write_trace()
+            if profiler:
+                profiler.stop()
+                self.write_profile(profiler)
+
+    def write_trace(self):
+        if not tracing.is_enabled():
+            return
+        if self.args.trace:
+            try:
+                tracing.export_chrome_trace(self.args.trace)
+            except OSError as e:
+                logger.error("Could not write the trace to %s: %s", self.args.trace, e)
+        if self.args.verbose >= 3:
+            print(tracing.format_summary(), file=sys.stderr)
+
+    def write_profile(self, profiler):
+        try:
+            profiler.dump(self.args.profile)
+        except OSError as e:
+            logger.error("Could not write the profile to %s: %s", self.args.profile, e)
+        print(profiler.format_report(self.args.profile_top), file=sys.stderr)
+
+    def forward_to_daemon(self):
+        """Run the command in appmgrd, if it's running
+
+        Only the commands that don't need a terminal can be forwarded.
+
+        Returns: the exit code of the command, or None if it must run in
+        this process instead.
+        """
+        from .daemon import FORWARDED_ACTIONS, forward_command
+
+        if self.args.action not in FORWARDED_ACTIONS:
+            return None
+        # The operations must be traced, or profiled, in this process
+        if tracing.is_enabled() or self.args.profile:
+            return None
+        if os.getenv("APPMGR_NO_DAEMON"):
+            return None
+        return forward_command(sys.argv[1:])
 
     def run_hook_script(self, event, stop_on_failure=False):
         key = event + "_script"
@@ -425,7 +1446,7 @@ class Appmgr:
             tag_name = self.args.version
         else:
             self.prepare_or_upgrade([app])
-            current_apps, _, _, _ = self.list_apps()
+            current_apps, _, _, _ = self.list_installed_apps()
             tag_name = current_apps[app]["version"]
         self.read_config(app)
         image_name = self.backend.get_local_image_name(self.config)
@@ -643,7 +1664,7 @@ class Appmgr:
         self.read_config(app)
         run_mode = self.component_config["run_mode"]
         if run_mode == "headless":
-            containers = self.docker_conn.containers.list(filters={"name": app})
+            containers = self.docker_model.find_containers(app)
             if not containers:
                 logger.error("%s is not running", app)
                 sys.exit(1)
@@ -670,13 +1691,44 @@ class Appmgr:
             logger.error("Can't stop a non-headless component")
             sys.exit(1)
 
+    @tracing.traced()
     def get_meta_file(self, image, filename):
+        # Image ids are content-addressed, so a meta-file extracted from an
+        # image object never changes
+        key = (getattr(image, "id", None), filename)
+        if key in self.meta_file_cache:
+            return self.meta_file_cache[key]
+        if key[0] is not None:
+            v = self.state_store.get_meta_file(*key)
+            if v is not None:
+                self.meta_file_cache[key] = v
+                return v
         with tempfile.NamedTemporaryFile(mode="w+t", prefix="getmetafile") as tmp:
             self.extract_file_from_image(
                 image, os.path.join("/appmgr/", filename), tmp.name
             )
             v = str(open(tmp.name).read())
-            return v
+        if key[0] is not None:
+            self.meta_file_cache[key] = v
+            self.state_store.set_meta_file(key[0], filename, v)
+        return v
+
+    @tracing.traced()
+    def read_app_config_file(self, filename):
+        """Parse an appmgr.yaml file, unless it was parsed already
+
+        Returns a new AppmgrAppConfig object, that the caller can modify.
+        """
+        path = os.path.abspath(filename)
+        st = os.stat(path)
+        key = (st.st_mtime_ns, st.st_size)
+        cached = self.config_cache.get(path)
+        if cached is None or cached[0] != key:
+            cached = (key, AppmgrAppConfig(filename=filename).config)
+            self.config_cache[path] = cached
+        config = AppmgrAppConfig(config=copy.deepcopy(cached[1]))
+        config.filename = filename
+        return config
 
     def cmd_get_meta_file(self):
         self.read_config(self.args.app)
@@ -688,6 +1740,41 @@ class Appmgr:
         image = "appmgr/" + self.args.app
         print(self.get_meta_file(image, "version"))
 
+    def cmd_validate(self):
+        from .utils.validation import ValidationCache, find_config_files, validate_files
+
+        if self.args.paths:
+            files = find_config_files(self.args.paths)
+        else:
+            # Like find_configs_in_dir(), the config paths are not searched
+            # recursively
+            files = [
+                f
+                for p in self.config_paths
+                for g in ["appmgr.yaml", "*.appmgr.yaml"]
+                for f in sorted(glob.glob(os.path.join(p, g)))
+            ]
+        cache = None if self.args.no_cache else ValidationCache()
+        report = validate_files(files, jobs=self.args.jobs, cache=cache)
+
+        if self.args.format == "json":
+            print(json.dumps([vars(issue) for issue in report.issues], indent=2))
+        else:
+            for issue in report.issues:
+                print(issue)
+            print(
+                "%d files checked (%d unchanged), %d errors, %d warnings"
+                % (
+                    report.files,
+                    report.cached,
+                    len(report.errors),
+                    len(report.warnings),
+                ),
+                file=sys.stderr,
+            )
+        if report.errors or (self.args.strict and report.warnings):
+            sys.exit(1)
+
     def find_configs_in_dir(self, path, restrict=None, allow_duplicate=True):
         """Find Appmgr app config files in a given directory
 
@@ -708,7 +1795,7 @@ class Appmgr:
                 yamlfiles.append(f)
         for f in yamlfiles:
             try:
-                y = AppmgrAppConfig(filename=f)
+                y = self.read_app_config_file(f)
             except yaml.YAMLError:
                 logger.warning("Failed to parse %s as YAML", f, exc_info=1)
                 continue
@@ -743,7 +1830,7 @@ class Appmgr:
             if not os.path.isfile(config_file):
                 continue
             try:
-                y = AppmgrAppConfig(filename=config_file)
+                y = self.read_app_config_file(config_file)
             except yaml.YAMLError:
                 logger.warning("Failed to parse %s as YAML", config_file, exc_info=1)
                 continue
@@ -1211,11 +2298,16 @@ Categories={categories}
         except KeyError:
             pass
 
+    @tracing.traced()
     def extract_file_from_image(self, image, infile, outfile):
         temp_container = None
         try:
-            temp_container = self.docker_conn.containers.create(image)
-            (bits, stat) = temp_container.get_archive(infile)
+            temp_container = self.backend.create_container(
+                self.docker_conn, getattr(image, "id", image)
+            )
+            (bits, stat) = self.backend.get_archive(
+                self.docker_conn, temp_container, infile
+            )
             with tempfile.TemporaryFile() as temptar:
                 for chunk in bits:
                     temptar.write(chunk)
@@ -1227,7 +2319,7 @@ Categories={categories}
                     shutil.move(os.path.join(td, ti.name), outfile)
         finally:
             if temp_container:
-                temp_container.remove()
+                self.backend.remove_container(self.docker_conn, temp_container)
 
     def extract_file_from_tarball(self, tarball, infile, outfile):
         tf = tarfile.open(tarball)
@@ -1254,7 +2346,9 @@ Categories={categories}
             return v
 
     def inject_file_into_image(self, image, outfile, infile):
-        temp_container = self.docker_conn.containers.create(image)
+        temp_container = self.backend.create_container(
+            self.docker_conn, getattr(image, "id", image)
+        )
         with tempfile.TemporaryFile() as temptar:
             tf = tarfile.open(fileobj=temptar, mode="w")
             (dirname, filename) = os.path.split(infile)
@@ -1274,10 +2368,10 @@ Categories={categories}
                 if not b:
                     break
                 buf += b
-            temp_container.put_archive("/", buf)
-        image = temp_container.commit()
-        temp_container.remove()
-        return image
+            self.backend.put_archive(self.docker_conn, temp_container, "/", buf)
+        image_id = self.docker_conn.api.commit(temp_container)["Id"]
+        self.backend.remove_container(self.docker_conn, temp_container)
+        return self.docker_conn.images.get(image_id)
 
     def cmd_save(self):
         images = self.docker_conn.images.list()
@@ -1306,7 +2400,7 @@ Categories={categories}
         self.load_image(self.args.file, self.args.app, v)
 
     def find_image(self, name):
-        images = self.docker_conn.images.list()
+        images = self.docker_model.list_images()
         candidates = {}
         for image in images:
             for tag in image.tags:
@@ -1324,10 +2418,10 @@ Categories={categories}
         return None
 
     def cmd_prepare(self):
-        self.prepare_or_upgrade(self.args.app)
+        self.prepare_or_upgrade(self.args.app, jobs=self.args.jobs)
 
     def cmd_upgrade(self):
-        self.prepare_or_upgrade(self.args.app, upgrade=True)
+        self.prepare_or_upgrade(self.args.app, upgrade=True, jobs=self.args.jobs)
 
     def do_upgrade_scripts(self, app, oldver, newver):
         self.read_config(app)
@@ -1357,207 +2451,385 @@ Categories={categories}
                 allow_missing=True,
             )
 
-    def docker_pull(self, full_image_name, stop_on_error=False):
+    @tracing.traced()
+    def docker_pull(self, full_image_name, stop_on_error=False, progress=None):
+        """Pull an image from a registry, streaming the progress
+
+        Failed pulls are retried a few times, with an exponential backoff in
+        between, as long as the error is a transient one (see
+        is_transient_pull_error()). Layers that were fully downloaded by a
+        previous attempt are not downloaded again, the daemon reports them
+        as 'Already exists'.
+
+        Returns: the image, or None if the pull failed.
+        """
         logger.info("Pulling %s image from registry", full_image_name)
+        own_progress = progress is None
+        if own_progress:
+            progress = PullProgress(mode=self.args.progress)
+        repository, tag = docker.utils.parse_repository_tag(full_image_name)
+        progress.start(full_image_name)
+        image = None
         try:
-            image = self.docker_conn.images.pull(full_image_name)
-            return image
-        except docker.errors.APIError:
-            logger.exception("Could not pull %s, wrong URL?", full_image_name)
-            if stop_on_error:
-                sys.exit(1)
+            for attempt in range(1, PULL_RETRIES + 1):
+                try:
+                    for event in self.docker_conn.api.pull(
+                        repository, tag=tag, stream=True, decode=True
+                    ):
+                        if "error" in event:
+                            raise docker.errors.APIError(event["error"])
+                        progress.layer_event(full_image_name, event)
+                    image = self.docker_conn.images.get(full_image_name)
+                    break
+                except docker.errors.NotFound:
+                    logger.exception("Could not pull %s, wrong URL?", full_image_name)
+                    break
+                except (docker.errors.APIError, requests.RequestException) as e:
+                    # APIError is a RequestException too, the others are
+                    # failures to talk to the daemon
+                    if isinstance(e, docker.errors.APIError):
+                        transient = is_transient_pull_error(str(e), e.status_code)
+                    else:
+                        transient = True
+                    if attempt == PULL_RETRIES or not transient:
+                        logger.exception("Could not pull %s", full_image_name)
+                        break
+                    delay = min(PULL_BACKOFF_MAX, PULL_BACKOFF_MIN * 2 ** (attempt - 1))
+                    progress.retry(full_image_name, attempt, delay, str(e))
+                    time.sleep(delay)
+        finally:
+            progress.finish(full_image_name, image is not None)
+            if own_progress:
+                progress.close()
+
+        if image is None and stop_on_error:
+            sys.exit(1)
+        return image
 
-    def prepare_or_upgrade(self, apps, upgrade=False):
+    def prepare_or_upgrade(self, apps, upgrade=False, jobs=DEFAULT_PULL_JOBS):
         current_apps, registry_apps, tarball_apps, available_apps = self.list_apps(
             get_remotes=True, restrict=apps
         )
+
+        # Resolve the target version of every app first, so that all the
+        # images that need to be pulled are known before the first pull
+        # starts, then prepare the apps as their images become ready.
+        targets = []
         for app in apps:
-            logger.info("Preparing %s", app)
-            previous_version = None
-            m = re.search("([^=]+)=([^=]+)$", app)
-            if m:
-                app = m.group(1)
-                target_version = m.group(2)
-                if app in current_apps:
-                    previous_version = current_apps[app]["version"]
-                    if (
-                        parse_version(target_version) != parse_version(previous_version)
-                        and not upgrade
-                    ):
-                        logger.exception(
-                            "%s is at version %s, can't run %s=%s",
-                            app,
-                            previous_version,
-                            app,
-                            target_version,
-                        )
-                        sys.exit(1)
-            else:
-                maxavail = ""
-                try:
-                    maxavail = available_apps[app]["maxversion"]["version"]
-                except KeyError:
-                    logger.debug("No version in local repository")
-                try:
-                    tarball_ver = parse_version(tarball_apps[app]["version"])
-                    if maxavail == "" or tarball_ver > parse_version(maxavail):
-                        maxavail = tarball_apps[app]["version"]
-                except KeyError:
-                    logger.debug("No version found in tarball")
-                try:
-                    registry_ver = parse_version(registry_apps[app]["maxversion"])
-                    if maxavail == "" or registry_ver > parse_version(maxavail):
-                        maxavail = registry_apps[app]["maxversion"]
-                except KeyError:
-                    logger.debug("No version found in remote registry")
-
-                if app in current_apps:
-                    previous_version = current_apps[app]["version"]
-                    target_version = previous_version
-                else:
-                    target_version = maxavail
-                if upgrade:
-                    target_version = maxavail
-                self.read_config(app)
+            targets.append(
+                self.resolve_target_version(
+                    app,
+                    upgrade,
+                    current_apps,
+                    registry_apps,
+                    tarball_apps,
+                    available_apps,
+                )
+            )
 
-            if (
-                previous_version
-                and upgrade
-                and parse_version(target_version) <= parse_version(previous_version)
-            ):
+        scheduler = PullScheduler(
+            self.docker_pull, jobs=jobs, progress_mode=self.args.progress
+        )
+        for app, previous_version, target_version in targets:
+            self.prepare_app(
+                app, previous_version, target_version, available_apps, scheduler
+            )
+
+        failed = scheduler.run()
+        if failed:
+            logger.error("Could not pull %s", ", ".join(failed))
+            sys.exit(1)
+
+    def resolve_target_version(
+        self, app, upgrade, current_apps, registry_apps, tarball_apps, available_apps
+    ):
+        """Figure out what version of an app should be prepared
+
+        Returns: a tuple (app, previous_version, target_version).
+        """
+        logger.info("Preparing %s", app)
+        previous_version = None
+        m = re.search("([^=]+)=([^=]+)$", app)
+        if m:
+            app = m.group(1)
+            target_version = m.group(2)
+            if app in current_apps:
+                previous_version = current_apps[app]["version"]
+                if (
+                    parse_version(target_version) != parse_version(previous_version)
+                    and not upgrade
+                ):
+                    logger.exception(
+                        "%s is at version %s, can't run %s=%s",
+                        app,
+                        previous_version,
+                        app,
+                        target_version,
+                    )
+                    sys.exit(1)
+        else:
+            maxavail = ""
+            try:
+                maxavail = available_apps[app]["maxversion"]["version"]
+            except KeyError:
+                logger.debug("No version in local repository")
+            try:
+                tarball_ver = parse_version(tarball_apps[app]["version"])
+                if maxavail == "" or tarball_ver > parse_version(maxavail):
+                    maxavail = tarball_apps[app]["version"]
+            except KeyError:
+                logger.debug("No version found in tarball")
+            try:
+                registry_ver = parse_version(registry_apps[app]["maxversion"])
+                if maxavail == "" or registry_ver > parse_version(maxavail):
+                    maxavail = registry_apps[app]["maxversion"]
+            except KeyError:
+                logger.debug("No version found in remote registry")
+
+            if app in current_apps:
+                previous_version = current_apps[app]["version"]
                 target_version = previous_version
+            else:
+                target_version = maxavail
+            if upgrade:
+                target_version = maxavail
+            self.read_config(app)
+
+        if (
+            previous_version
+            and upgrade
+            and parse_version(target_version) <= parse_version(previous_version)
+        ):
+            target_version = previous_version
 
-            if not target_version:
-                # We could not find any version info, let's use the latest tag
-                logger.debug("No target version identified, use latest")
-                target_version = "latest"
-
-            config = self.load_config(app)
-            # XXX: come back here after list_apps
-            local_image_name = self.backend.get_local_image_name(config)
-            remote_image_name = self.backend.get_remote_image_name(config)
-            full_local_image_name = "%s:%s" % (local_image_name, target_version)
-            full_remote_image_name = "%s:%s" % (remote_image_name, target_version)
-            current_image_name = "%s:%s" % (local_image_name, "current")
-            if previous_version == target_version:
-                logger.debug(
-                    "Stopping because previous==target (%s==%s)",
-                    previous_version,
-                    target_version,
-                )
+        if not target_version:
+            # We could not find any version info, let's use the latest tag
+            logger.debug("No target version identified, use latest")
+            target_version = "latest"
+
+        return app, previous_version, target_version
+
+    @tracing.traced()
+    def prepare_app(
+        self, app, previous_version, target_version, available_apps, scheduler
+    ):
+        """Make the target version of an app the current one
+
+        Images that must be pulled from a registry are handed over to the
+        scheduler, and the app is prepared once the pull is done.
+        """
+        config = self.load_config(app)
+        # XXX: come back here after list_apps
+        local_image_name = self.backend.get_local_image_name(config)
+        remote_image_name = self.backend.get_remote_image_name(config)
+        full_local_image_name = "%s:%s" % (local_image_name, target_version)
+        full_remote_image_name = "%s:%s" % (remote_image_name, target_version)
+        current_image_name = "%s:%s" % (local_image_name, "current")
+        if previous_version == target_version:
+            logger.debug(
+                "Stopping because previous==target (%s==%s)",
+                previous_version,
+                target_version,
+            )
+            return
+
+        if "maxversion" in available_apps.get(app, {}):
+            max_avail_version = parse_version(
+                available_apps[app]["maxversion"]["version"]
+            )
+            logger.debug(
+                "Trying to find %s image for version %s", app, max_avail_version
+            )
+            if max_avail_version == parse_version(target_version):
+                image = self.find_image(full_local_image_name)
+                if not image and remote_image_name:
+                    image = self.find_image(full_remote_image_name)
+                if image:
+                    image.tag(current_image_name)
+                else:
+                    logger.error(
+                        "Could not find %s image for version %s",
+                        app,
+                        max_avail_version,
+                    )
+                self.do_upgrade_scripts(app, previous_version, target_version)
                 return
 
-            if "maxversion" in available_apps.get(app, {}):
-                max_avail_version = parse_version(
-                    available_apps[app]["maxversion"]["version"]
-                )
-                logger.debug(
-                    "Trying to find %s image for version %s", app, max_avail_version
+        if config.get("container:origin:registry"):
+            logger.debug("Trying to find image in registry")
+            found_image = self.find_image(full_remote_image_name)
+            if found_image:
+                logger.debug("Found in local registry")
+                found_image.tag(current_image_name)
+            else:
+                scheduler.submit(
+                    full_remote_image_name,
+                    functools.partial(
+                        self.tag_pulled_image,
+                        app,
+                        local_image_name,
+                        remote_image_name,
+                        previous_version,
+                        target_version,
+                    ),
                 )
-                if max_avail_version == parse_version(target_version):
-                    image = self.find_image(full_local_image_name)
-                    if not image and remote_image_name:
-                        image = self.find_image(full_remote_image_name)
-                    if image:
-                        image.tag(current_image_name)
-                    else:
-                        logger.error(
-                            "Could not find %s image for version %s",
-                            app,
-                            max_avail_version,
-                        )
-                    self.do_upgrade_scripts(app, previous_version, target_version)
-                    return
+            return
 
-            if config.get("container:origin:registry"):
-                logger.debug("Trying to find image in registry")
-                found_image = self.find_image(full_remote_image_name)
-                if found_image:
-                    logger.debug("Found in local registry")
-                    found_image.tag(current_image_name)
-                else:
-                    image = self.docker_pull(full_remote_image_name, stop_on_error=True)
-                    pulled_version = self.get_meta_file(image, "version").strip()
-                    if target_version == "latest":
-                        versioned_image_name = "%s:%s" % (
-                            remote_image_name,
-                            pulled_version,
-                        )
-                        if not self.find_image(versioned_image_name):
-                            image.tag(versioned_image_name)
-                    # Make remote image available in the local namespace
-                    versioned_image_name = "%s:%s" % (local_image_name, pulled_version)
-                    if not self.find_image(versioned_image_name):
-                        image.tag(versioned_image_name)
+        tarball = config.get("container:origin:tarball")
+        if tarball:
+            paths = [
+                ".",
+                "/usr/local/share/appmgr",
+                "/usr/share/appmgr",
+            ]
+            for p in paths:
+                tarfile = os.path.join(p, tarball)
+                if os.path.isfile(tarfile):
+                    logger.info("Loading image from %s", tarfile)
+                    image = self.load_image(tarfile, app, target_version)
                     image.tag(current_image_name)
-                    self.do_upgrade_scripts(app, previous_version, target_version)
+                self.do_upgrade_scripts(app, previous_version, target_version)
                 return
 
-            tarball = config.get("container:origin:tarball")
-            if tarball:
-                paths = [
-                    ".",
-                    "/usr/local/share/appmgr",
-                    "/usr/share/appmgr",
-                ]
-                for p in paths:
-                    tarfile = os.path.join(p, tarball)
-                    if os.path.isfile(tarfile):
-                        logger.info("Loading image from %s", tarfile)
-                        image = self.load_image(tarfile, app, target_version)
-                        image.tag(current_image_name)
+        if not self.find_image(full_local_image_name):
+            paths = [
+                ".",
+                "/usr/local/share/appmgr",
+                "/usr/share/appmgr",
+            ]
+            for p in paths:
+                tarfile = os.path.join(p, config.app_id + ".tar")
+                if os.path.isfile(tarfile):
+                    logger.info("Loading image from %s", tarfile)
+                    self.load_image(tarfile, app, target_version)
                     self.do_upgrade_scripts(app, previous_version, target_version)
                     return
 
-            if not self.find_image(full_local_image_name):
-                paths = [
-                    ".",
-                    "/usr/local/share/appmgr",
-                    "/usr/share/appmgr",
-                ]
-                for p in paths:
-                    tarfile = os.path.join(p, self.config.app_id + ".tar")
-                    if os.path.isfile(tarfile):
-                        logger.info("Loading image from %s", tarfile)
-                        self.load_image(tarfile, app, target_version)
-                        self.do_upgrade_scripts(app, previous_version, target_version)
-                        return
+        logger.error("Cannot prepare image")
+        sys.exit(1)
 
-            logger.error("Cannot prepare image")
-            sys.exit(1)
+    def tag_pulled_image(
+        self,
+        app,
+        local_image_name,
+        remote_image_name,
+        previous_version,
+        target_version,
+        image,
+    ):
+        """Make an image pulled from a registry the current one for an app"""
+        pulled_version = self.get_meta_file(image, "version").strip()
+        current_image_name = "%s:%s" % (local_image_name, "current")
+        if target_version == "latest":
+            versioned_image_name = "%s:%s" % (
+                remote_image_name,
+                pulled_version,
+            )
+            if not self.find_image(versioned_image_name):
+                image.tag(versioned_image_name)
+        # Make remote image available in the local namespace
+        versioned_image_name = "%s:%s" % (local_image_name, pulled_version)
+        if not self.find_image(versioned_image_name):
+            image.tag(versioned_image_name)
+        image.tag(current_image_name)
+        self.do_upgrade_scripts(app, previous_version, target_version)
 
     def cmd_purge(self):
         """Purge (uninstall) an application
 
-        XXX I believe we should clear all tags that are found, regardless
-            of 'maxversion'
-        XXX What about images that have the registry in their name, eg.
-            github.com/threatos/packages/APP-kbx/appmgr/APP?
+        All the images of the app go, whatever the version, including the
+        ones that have the registry in their name, eg.
+        github.com/threatos/packages/APP-kbx/appmgr/APP.
         """
+        n_removed_images = self.collect_images(
+            [self.args.app], keep=0, keep_current=False
+        )
+        if n_removed_images > 0 and self.args.prune:
+            self.docker_conn.images.prune(filters={"dangling": True})
 
-        app = self.args.app
-        n_removed_images = 0
+    def cmd_gc(self):
+        self.collect_images(
+            self.args.app or None, keep=self.args.keep, dry_run=self.args.dry_run
+        )
 
-        current_apps, _, _, available_apps = self.list_apps()
+    def find_app_image_names(self, restrict=None):
+        """Map the image names (local and remote) of appmgr apps to app ids"""
+        image_names = {}
+        for p in self.config_paths:
+            for app_config in self.find_configs_in_dir(p, restrict=restrict):
+                aid = app_config.app_id
+                image_names[self.backend.get_local_image_name(app_config)] = aid
+                remote_image_name = self.backend.get_remote_image_name(app_config)
+                if remote_image_name:
+                    image_names[remote_image_name] = aid
+        return image_names
+
+    def collect_images(
+        self, apps=None, keep=DEFAULT_KEEP_VERSIONS, keep_current=True, dry_run=False
+    ):
+        """Remove the images of apps that are not needed anymore
 
-        if app in current_apps:
-            imgname = f"appmgr/{app}:current"
-            if self.backend.remove_image(self.docker_conn, imgname):
-                n_removed_images += 1
+        See plan_image_gc() for the retention policy. Images are removed by
+        id, so that all their tags go in a single request.
 
-        if app in available_apps:
-            version = available_apps[app]["maxversion"]["version"]
-            imgname = f"appmgr/{app}:{version}"
-            if self.backend.remove_image(self.docker_conn, imgname):
-                n_removed_images += 1
+        Returns: the number of images removed.
+        """
+        image_names = self.find_app_image_names(restrict=apps)
+        if not image_names:
+            logger.error("No app found")
+            sys.exit(1)
 
-            imgname = f"appmgr/{app}"
-            if self.backend.remove_image(self.docker_conn, imgname):
-                n_removed_images += 1
+        # The disk usage endpoint is the one that tells what images are in
+        # use, and how much of their size is shared with other images.
+        images = self.docker_conn.df()["Images"]
+        plan = plan_image_gc(images, image_names, keep, keep_current=keep_current)
 
-        if n_removed_images > 0 and self.args.prune:
-            self.docker_conn.images.prune(filters={"dangling": True})
+        def describe(image, tags=None):
+            if tags is None and not is_dangling(image):
+                tags = image["RepoTags"]
+            return ", ".join(tags or []) or image["Id"][:19]
+
+        def reclaimable(image):
+            return image.get("Size", 0) - max(image.get("SharedSize", 0), 0)
+
+        for image in plan["in_use"]:
+            print("Keeping %s (in use by a container)" % describe(image))
+
+        for image, tags in plan["untag"]:
+            print("Untagging %s" % describe(image, tags))
+            if dry_run:
+                continue
+            for tag in tags:
+                self.docker_conn.api.remove_image(tag)
+
+        n_removed = 0
+        total = 0
+        for image in plan["remove"]:
+            size = reclaimable(image)
+            print("Removing %s (%s)" % (describe(image), format_bytes(size)))
+            if dry_run:
+                total += size
+                n_removed += 1
+                continue
+            try:
+                self.docker_conn.api.remove_image(image["Id"], force=True)
+            except docker.errors.APIError as e:
+                logger.warning("Failed to remove %s: %s", describe(image), e)
+                continue
+            total += size
+            n_removed += 1
+
+        print(
+            "%s %s in %d image(s)"
+            % (
+                "Would reclaim" if dry_run else "Reclaimed",
+                format_bytes(total),
+                n_removed,
+            )
+        )
+        return n_removed
 
+    @tracing.traced()
     def list_apps(self, get_remotes=False, restrict=None):
         current_apps = {}
         registry_apps = {}
@@ -1568,12 +2840,17 @@ Categories={categories}
             restrict = [re.sub("=.*", "", i) for i in restrict]
 
         logger.debug("Finding appmgr applications")
+        images = self.docker_model.list_images()
+        # Taken before the scan, a change during the scan makes it stale
+        fingerprint = self.installed_apps_fingerprint([i.attrs for i in images])
+        app_configs = {}
         for p in self.config_paths:
             parsed_configs = self.find_configs_in_dir(
                 p, restrict=restrict, allow_duplicate=True
             )
             for app_config in parsed_configs:
                 aid = app_config.app_id
+                app_configs[aid] = app_config
                 logger.debug("Analyzing %s", aid)
                 try:
                     imagenames = (
@@ -1582,7 +2859,7 @@ Categories={categories}
                     )
                     logger.debug("Looking for local docker image in %s", imagenames)
                     # XXX: factorize logic to find the right image
-                    for image in self.docker_conn.images.list():
+                    for image in images:
                         for tag in image.tags:
                             (imagename, ver) = tag.rsplit(":", 1)
                             if imagename not in imagenames:
@@ -1597,6 +2874,8 @@ Categories={categories}
                                     "packaging:revision"
                                 ),
                                 "image": imagename,
+                                "image-id": image.id,
+                                "digests": image.attrs.get("RepoDigests") or [],
                             }
                             if ver == "current":
                                 current_apps[aid] = item
@@ -1640,23 +2919,166 @@ Categories={categories}
                         "packaging-revision-from-yaml": _pkg_rev_yaml,
                     }
 
+        apps = (current_apps, registry_apps, tarball_apps, available_apps)
+        self.record_installed_apps(apps, app_configs, complete=restrict is None)
+        if restrict is None:
+            self.state_store.set_fingerprint("installed-apps", fingerprint)
+
         if get_remotes:
-            for aid in registry_apps:
-                app = registry_apps[aid]
-                app["versions"] = self.registry.get_versions_for_app(
-                    app["url"], app["image"]
+            for _ in self.iter_remote_versions(registry_apps):
+                pass
+
+        return apps
+
+    def installed_apps_fingerprint(self, images):
+        """What list_apps() finds the installed apps from
+
+        That's the config files, and the images tagged 'current'. Listing
+        them is cheap, compared to reading the config files, and the meta
+        files of the images.
+
+        'images' are the attrs of the images, as the engine lists them.
+        """
+        configs = []
+        for p in self.config_paths:
+            for g in ["appmgr.yaml", "*.appmgr.yaml"]:
+                for f in glob.glob(os.path.join(p, g)):
+                    try:
+                        st = os.stat(f)
+                    except OSError:
+                        continue
+                    configs.append([os.path.abspath(f), st.st_mtime_ns, st.st_size])
+        current = [
+            [tag, attrs["Id"]]
+            for attrs in images
+            for tag in attrs.get("RepoTags") or []
+            if tag.endswith(":current")
+        ]
+        return json.dumps([sorted(configs), sorted(current)])
+
+    def record_installed_apps(self, apps, app_configs, complete):
+        """Record the installed apps that list_apps() found in the state store
+
+        If the list is complete, the apps that are not in it anymore are
+        recorded as removed.
+        """
+        from .models import AppRecord
+
+        current_apps, registry_apps, tarball_apps, _ = apps
+        store = self.state_store
+        for aid, current in current_apps.items():
+            config_file = os.path.abspath(app_configs[aid].filename)
+            try:
+                st = os.stat(config_file)
+            except OSError:
+                continue
+            registry = registry_apps.get(aid, {})
+            if aid in registry_apps:
+                source = "registry"
+            elif aid in tarball_apps:
+                source = "tarball"
+            else:
+                source = "local"
+            store.record_app(
+                AppRecord(
+                    app_id=aid,
+                    version=current["version"],
+                    image=current["image"],
+                    image_id=current["image-id"],
+                    packaging_revision_image=current["packaging-revision-from-image"],
+                    packaging_revision_yaml=current["packaging-revision-from-yaml"],
+                    source=source,
+                    registry_url=registry.get("url"),
+                    registry_image=registry.get("image"),
+                    config_path=config_file,
+                    config_mtime=st.st_mtime_ns,
+                    config_size=st.st_size,
                 )
+            )
+            store.record_image(
+                current["image-id"],
+                aid,
+                current["image"],
+                current["version"],
+                current["digests"],
+            )
+        if complete:
+            for record in store.list_apps():
+                if record.app_id not in current_apps:
+                    store.remove_app(record.app_id)
+
+    @tracing.traced()
+    def list_installed_apps(self):
+        """Like list_apps(), but only the installed apps, and fast
+
+        The apps are read from the state store, if what they were found
+        from didn't change since (see installed_apps_fingerprint()), that
+        takes a listing of the images. Otherwise, it's list_apps() that
+        finds them, and updates the store. The registry apps and the
+        tarball apps are only there for the source of the installed apps.
+        """
+        images = self.backend.list_images(self.docker_conn)
+        fingerprint = self.installed_apps_fingerprint(images)
+        if self.state_store.get_fingerprint("installed-apps") != fingerprint:
+            logger.debug("Installed apps changed, scanning")
+            current_apps, registry_apps, tarball_apps, _ = self.list_apps()
+            return (current_apps, registry_apps, tarball_apps, {})
+
+        logger.debug("Installed apps from the state store")
+        current_apps = {}
+        registry_apps = {}
+        tarball_apps = {}
+        for record in self.state_store.list_apps():
+            current_apps[record.app_id] = {
+                "version": record.version,
+                "packaging-revision-from-image": record.packaging_revision_image,
+                "packaging-revision-from-yaml": record.packaging_revision_yaml,
+                "image": record.image,
+                "image-id": record.image_id,
+            }
+            if record.source == "registry":
+                registry_apps[record.app_id] = {
+                    "url": record.registry_url,
+                    "image": record.registry_image,
+                    "packaging-revision-from-yaml": record.packaging_revision_yaml,
+                }
+            elif record.source == "tarball":
+                tarball_apps[record.app_id] = {}
+        return (current_apps, registry_apps, tarball_apps, {})
+
+    def iter_remote_versions(self, registry_apps, jobs=DEFAULT_REGISTRY_JOBS):
+        """Query the remote registries for the versions of apps
+
+        The registries are queried concurrently, the results are stored in
+        'registry_apps'. Yields the app ids as their versions are known.
+        """
+        if not registry_apps:
+            return
+
+        @tracing.bind
+        def get_versions(aid):
+            app = registry_apps[aid]
+            return self.registry.get_versions_for_app(app["url"], app["image"])
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(get_versions, aid): aid for aid in registry_apps}
+            for future in concurrent.futures.as_completed(futures):
+                aid = futures[future]
+                app = registry_apps[aid]
+                app["versions"] = future.result()
 
                 curmax = max(
                     app["versions"], default=None, key=lambda x: parse_version(x)
                 )
+                self.state_store.record_registry_check(
+                    aid, app["url"], app["image"], app["versions"], curmax
+                )
                 if curmax:
                     logger.debug("Maximal version for image %s is %s", aid, curmax)
                     app["maxversion"] = curmax
                 else:
                     logger.debug("No versions found for image %s", aid)
-
-        return (current_apps, registry_apps, tarball_apps, available_apps)
+                yield aid
 
     def cmd_list(self):
         show_installed = self.args.installed
@@ -1668,81 +3090,74 @@ Categories={categories}
             show_upgradeable = True
         if not show_available and not show_upgradeable:
             show_installed = True
-        current_apps, registry_apps, tarball_apps, available_apps = self.list_apps(
-            get_remotes=(show_available or show_upgradeable)
-        )
-        app_data = {}
-        if show_installed:
-            for aid in current_apps:
-                if aid not in app_data:
-                    app_data[aid] = {"app": aid}
-                app_data[aid]["installed"] = current_apps[aid]["version"]
-                app_data[aid]["pacrev-yaml"] = current_apps[aid][
-                    "packaging-revision-from-yaml"
-                ]
-                app_data[aid]["pacrev-image"] = current_apps[aid][
-                    "packaging-revision-from-image"
-                ]
-        if show_available:
-            for aid in registry_apps:
-                for tag in registry_apps[aid]["versions"]:
-                    if aid not in app_data:
-                        app_data[aid] = {"app": aid}
-                    app_data[aid]["available"] = tag
-            for aid in available_apps:
-                if aid not in app_data:
-                    app_data[aid] = {"app": aid}
-                max_avail_version = parse_version(
-                    available_apps[aid]["maxversion"]["version"]
+        get_remotes = show_available or show_upgradeable
+        if get_remotes:
+            apps = self.list_apps()
+        else:
+            apps = self.list_installed_apps()
+        current_apps, registry_apps, _, _ = apps
+
+        def records(aids):
+            for aid in aids:
+                record = self.make_list_record(
+                    aid, apps, show_installed, show_available, show_upgradeable
                 )
-                if "available" not in app_data[
-                    aid
-                ] or max_avail_version > parse_version(app_data[aid]["available"]):
-                    app_data[aid]["available"] = available_apps[aid]["maxversion"][
-                        "version"
-                    ]
-
-        if show_upgradeable:
-            for aid in current_apps:
-                if aid not in app_data:
-                    app_data[aid] = {"app": aid}
-                app_data[aid]["installed"] = current_apps[aid]["version"]
-                app_data[aid]["pacrev-yaml"] = current_apps[aid][
-                    "packaging-revision-from-yaml"
-                ]
-                app_data[aid]["pacrev-image"] = current_apps[aid][
-                    "packaging-revision-from-image"
-                ]
-                if aid in registry_apps:
-                    if "maxversion" not in registry_apps[aid]:
-                        continue
-                    if parse_version(registry_apps[aid]["maxversion"]) > parse_version(
-                        current_apps[aid]["version"]
-                    ):
-                        app_data[aid]["available"] = registry_apps[aid]["maxversion"]
-                elif aid in tarball_apps:
-                    if parse_version(tarball_apps[aid]["version"]) > parse_version(
-                        current_apps[aid]["version"]
-                    ):
-                        app_data[aid]["available"] = tarball_apps[aid]["version"]
+                if record:
+                    yield record
+
+        # Only the apps whose record depends on a remote registry wait for
+        # it: all of them to show what's available, the installed ones to
+        # show what's upgradeable.
+        lookups = {}
+        if get_remotes:
+            lookups = {
+                aid: app
+                for aid, app in registry_apps.items()
+                if show_available or aid in current_apps
+            }
+
+        # Apps whose data is complete come first, then the apps that need
+        # a lookup on a remote registry, as the lookups complete.
+        aids = list(dict.fromkeys(itertools.chain(*apps)))
+        local_aids = [aid for aid in aids if aid not in lookups]
+        remote_aids = self.iter_remote_versions(lookups)
+
+        if self.args.format == "ndjson":
+            for record in itertools.chain(records(local_aids), records(remote_aids)):
+                print(json.dumps(record), flush=True)
+            return
+
+        if self.args.format == "json":
+            sep = "\n"
+            print("[", end="", flush=True)
+            for record in itertools.chain(records(local_aids), records(remote_aids)):
+                print(sep + "  " + json.dumps(record), end="", flush=True)
+                sep = ",\n"
+            print("\n]", flush=True)
+            return
+
+        # Every record is built once, the table keeps the order of the apps
+        app_data = {
+            record["app"]: record
+            for record in itertools.chain(records(local_aids), records(remote_aids))
+        }
+        app_data = {aid: app_data[aid] for aid in aids if aid in app_data}
 
         app_data_fields = {
             "app": "App",
             "installed": "Installed version",
             "available": "Available version",
-            "pacrev-yaml": "Packaging revision from YAML",
-            "pacrev-image": "Packaging revision from image",
+            "packaging_revision_yaml": "Packaging revision from YAML",
+            "packaging_revision_image": "Packaging revision from image",
         }
-        for aid in app_data:
-            app_data[aid]["app"] = aid
-            for k in app_data_fields:
-                if k not in app_data[aid]:
-                    app_data[aid][k] = "-"
-            app_data[aid] = {k: app_data[aid][k] for k in app_data_fields}
+        rows = [
+            [r[k] if r[k] is not None else "-" for k in app_data_fields]
+            for r in app_data.values()
+        ]
         if self.args.skip_headers:
             print(
                 tabulate.tabulate(
-                    app_data.values(),
+                    rows,
                     numalign="right",
                     disable_numparse=True,
                 )
@@ -1750,13 +3165,74 @@ Categories={categories}
         else:
             print(
                 tabulate.tabulate(
-                    app_data.values(),
-                    headers=app_data_fields,
+                    rows,
+                    headers=list(app_data_fields.values()),
                     numalign="right",
                     disable_numparse=True,
                 )
             )
 
+    def make_list_record(
+        self, aid, apps, show_installed, show_available, show_upgradeable
+    ):
+        """Build the record of an app, as shown by 'appmgr list'
+
+        The record always has the same keys, missing values are None. It's
+        the output of 'appmgr list --format json', so keep it stable.
+
+        Returns: the record, or None if the app is not to be listed.
+        """
+        current_apps, registry_apps, tarball_apps, available_apps = apps
+        record = {
+            "app": aid,
+            "installed": None,
+            "available": None,
+            "packaging_revision_yaml": None,
+            "packaging_revision_image": None,
+            "source": None,
+        }
+        listed = False
+
+        if (show_installed or show_upgradeable) and aid in current_apps:
+            listed = True
+            current = current_apps[aid]
+            record["installed"] = current["version"]
+            record["packaging_revision_yaml"] = current["packaging-revision-from-yaml"]
+            record["packaging_revision_image"] = current[
+                "packaging-revision-from-image"
+            ]
+        if show_available:
+            if aid in registry_apps:
+                for tag in registry_apps[aid].get("versions", []):
+                    listed = True
+                    record["available"] = tag
+            if aid in available_apps:
+                listed = True
+                max_avail_version = available_apps[aid]["maxversion"]["version"]
+                if record["available"] is None or parse_version(
+                    max_avail_version
+                ) > parse_version(record["available"]):
+                    record["available"] = max_avail_version
+        if show_upgradeable and aid in current_apps:
+            installed = parse_version(current_apps[aid]["version"])
+            if aid in registry_apps:
+                maxversion = registry_apps[aid].get("maxversion")
+                if maxversion and parse_version(maxversion) > installed:
+                    record["available"] = maxversion
+            elif aid in tarball_apps:
+                if parse_version(tarball_apps[aid]["version"]) > installed:
+                    record["available"] = tarball_apps[aid]["version"]
+
+        if not listed:
+            return None
+        if aid in registry_apps:
+            record["source"] = "registry"
+        elif aid in tarball_apps:
+            record["source"] = "tarball"
+        else:
+            record["source"] = "local"
+        return record
+
     def load_config(self, app):
         for p in self.config_paths:
             config = self.find_config_for_app_in_dir(p, app)
@@ -1767,6 +3243,7 @@ Categories={categories}
             logger.error("Hint: try removing the ending '-kbx' from the app name?")
         sys.exit(1)
 
+    @tracing.traced()
     def read_config(self, app):
         self.config = self.load_config(app)
 
@@ -1843,9 +3320,9 @@ Categories={categories}
         return opts
 
     def create_network(self, netname):
-        for n in self.docker_conn.networks.list():
-            if n.name == netname:
-                return n
+        n = self.docker_model.find_network(netname)
+        if n:
+            return n
         return self.docker_conn.networks.create(name=netname, driver="bridge")
 
     def create_xauth(self):
@@ -1861,6 +3338,48 @@ Categories={categories}
         self.xauth_out = os.path.join(home, ".docker.xauth")
         self.xauth_in = os.path.join(self.home_in, ".docker.xauth")
 
+        # The generated file only depends on the display and on the content
+        # of the user's Xauthority file, so there's no need to regenerate it
+        # as long as none of those changed.
+        xauth_src = os.getenv("XAUTHORITY") or os.path.join(home, ".Xauthority")
+        stamp_file = self.xauth_out + ".stamp"
+        try:
+            stamp = {
+                "display": display,
+                "source": xauth_src,
+                "mtime": os.stat(xauth_src).st_mtime_ns,
+            }
+        except OSError:
+            stamp = None
+        if stamp and os.path.exists(self.xauth_out):
+            try:
+                with open(stamp_file) as f:
+                    if json.load(f) == stamp:
+                        logger.debug("Reusing %s", self.xauth_out)
+                        return
+            except (OSError, ValueError):
+                pass
+
+        # Local displays are handled without the help of the xauth program
+        number = parse_local_display_number(display)
+        if stamp and number is not None:
+            try:
+                new_entries = get_local_xauth_entries(xauth_src, number)
+                if os.path.exists(self.xauth_out):
+                    entries = read_xauth_entries(self.xauth_out)
+                else:
+                    entries = []
+                write_xauth_entries(
+                    self.xauth_out, merge_xauth_entries(entries, new_entries)
+                )
+                with open(stamp_file, "w") as f:
+                    json.dump(stamp, f)
+                return
+            except (OSError, ValueError):
+                logger.debug(
+                    "Failed to parse Xauthority, fall back to xauth", exc_info=1
+                )
+
         # Create an empty file if needed, this is to avoid 'xauth nmerge' printing
         # 'xauth: file [...] does not exist', harmless but also useless.
         if not os.path.exists(self.xauth_out):
@@ -1887,6 +3406,10 @@ Categories={categories}
             logger.error("Failed to run xauth nmerge: %s", result.stderr)
             sys.exit(1)
 
+        if stamp:
+            with open(stamp_file, "w") as f:
+                json.dump(stamp, f)
+
 
 class AppmgrAppConfig:
     def __init__(self, config=None, filename=None):
@@ -1936,7 +3459,93 @@ class AppmgrAppConfig:
             f.write(yaml.dump(self.config))
 
 
+# Which client DockerBackend uses to talk to the Engine API: "docker-py", or
+# "native" for the lean client of appmgr.core.engine
+DEFAULT_ENGINE = "docker-py"
+
+
 class DockerBackend:
+    def __init__(self, engine=None):
+        self.engine = engine
+        # Socket of the engine, when it's not the one docker-py uses by default
+        self.socket_path = None
+        self._engine_client = None
+
+    @property
+    def engine(self):
+        return self._engine
+
+    @engine.setter
+    def engine(self, engine):
+        # APPMGR_ENGINE is read when the engine is set, not when the parser
+        # is built: appmgrd sets it for each command, in the client's environment
+        self._engine = engine or os.getenv("APPMGR_ENGINE", DEFAULT_ENGINE)
+
+    def get_engine_client(self):
+        """The native Engine API client, or None if docker-py is to be used"""
+        if self.engine != "native":
+            return None
+        if self._engine_client is None:
+            from .core.engine import EngineClient
+
+            try:
+                self._engine_client = EngineClient(self.socket_path)
+            except Exception as e:
+                logger.warning("Can't use the native engine client: %s", e)
+                self.engine = "docker-py"
+                return None
+        return self._engine_client
+
+    # The methods below are the hot paths of appmgr. They return what the
+    # Engine API returns, whatever the client, and leave the docker-py model
+    # objects (and the requests they cost) aside.
+
+    @tracing.traced()
+    def list_images(self, docker_conn):
+        """Image summaries, like 'docker images'"""
+        client = self.get_engine_client()
+        if client:
+            return client.images()
+        return docker_conn.api.images()
+
+    @tracing.traced()
+    def create_container(self, docker_conn, image):
+        """Create a container, that is not meant to run, and return its id"""
+        client = self.get_engine_client()
+        if client:
+            return client.create_container({"Image": image})
+        return docker_conn.api.create_container(image)["Id"]
+
+    @tracing.traced()
+    def remove_container(self, docker_conn, container_id, force=False):
+        client = self.get_engine_client()
+        if client:
+            client.remove_container(container_id, force=force)
+        else:
+            docker_conn.api.remove_container(container_id, force=force)
+
+    @tracing.traced()
+    def get_archive(self, docker_conn, container_id, path):
+        """Get a tar archive of a path in a container
+
+        Returns: an iterator over the chunks of the archive, and the stat of
+        the path.
+        """
+        client = self.get_engine_client()
+        if client:
+            stream, stat = client.get_archive(container_id, path)
+            return stream.iter_chunks(), stat
+        return docker_conn.api.get_archive(container_id, path)
+
+    @tracing.traced()
+    def put_archive(self, docker_conn, container_id, path, data):
+        """Extract a tar archive to a path in a container"""
+        client = self.get_engine_client()
+        if client:
+            client.put_archive(container_id, path, data)
+        else:
+            docker_conn.api.put_archive(container_id, path, data)
+
     def get_local_image_name(self, app_config):
         return "appmgr/%s" % app_config.app_id
 
@@ -1953,21 +3562,7 @@ class DockerBackend:
         image = registry_data.get("image", app_config.app_id)
         return "%s/%s" % (registry, image)
 
-    def remove_image(self, docker_conn, image_name):
-        """Remove a docker image
-
-        Returns: True if the image was removed, False otherwise.
-
-        XXX Should check if an image is in use before trying to remove it
-        """
-        try:
-            _ = docker_conn.images.get(image_name)
-        except docker.errors.ImageNotFound:
-            return False
-
-        docker_conn.images.remove(image_name)
-        return True
-
+    @tracing.traced()
     def run_command(
         self, docker_conn, image_name, command, start_options, allow_missing=False
     ):
@@ -2031,6 +3626,13 @@ def get_possible_gitlab_project_paths(full_path):
 
 
 class ContainerRegistry:
+    def __init__(self, cache_ttl=0):
+        # How long (in seconds) the versions of an image are cached, a long
+        # running appmgrd sets it, one-shot commands don't need it.
+        self.cache_ttl = cache_ttl
+        self.versions_cache = {}
+
+    @tracing.traced()
     def _request_json(self, url):
         logger.debug("Requesting %s", url)
         resp = None
@@ -2199,6 +3801,7 @@ class ContainerRegistry:
 
         return tags
 
+    @tracing.traced()
     def get_versions_for_app(self, registry_url, image):
         """List versions of an image on a remote registry.
 
@@ -2208,6 +3811,12 @@ class ContainerRegistry:
         if not re.match("^https?://", registry_url):
             registry_url = "https://" + registry_url
 
+        key = (registry_url, image)
+        cached = self.versions_cache.get(key)
+        if cached and time.monotonic() - cached[0] < self.cache_ttl:
+            logger.debug("Using cached versions for %s", image)
+            return list(cached[1])
+
         if "registry.gitlab.com" in registry_url:
             versions = self._get_tags_gitlab_registry(image)
         elif "registry.hub.docker.com" in registry_url:
@@ -2215,6 +3824,8 @@ class ContainerRegistry:
         else:
             versions = self._get_tags_docker_registry_v2(registry_url, image)
 
+        if self.cache_ttl:
+            self.versions_cache[key] = (time.monotonic(), list(versions))
         return versions
 
 
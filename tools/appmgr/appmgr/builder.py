@@ -16,6 +16,8 @@ import jinja2
 
 import yaml
 
+from appmgr.utils.logging import AsyncHandler
+
 logger = logging.getLogger("kbxbuilder")
 
 
@@ -39,9 +41,12 @@ class Builder:
         )
         parser_build_as_needed.set_defaults(func=self.cmd_build_as_needed)
 
+        # The handlers write from a background thread, the builds log a
+        # line per step, to the console and to several files
         ch = logging.StreamHandler()
         logger.setLevel(logging.INFO)
-        logger.addHandler(ch)
+        self.log_handler = AsyncHandler([ch])
+        logger.addHandler(self.log_handler)
 
         self.subloggers = {}
 
@@ -95,7 +100,7 @@ class Builder:
         ch = logging.FileHandler(logfile)
         ch.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
         ch.setLevel(logging.INFO)
-        logger.addHandler(ch)
+        self.log_handler.add_handler(ch)
 
         os.makedirs(self.config["builder"]["datadir"], exist_ok=True)
         self.statusfile = os.path.join(self.config["builder"]["datadir"], "status.yaml")
@@ -153,7 +158,7 @@ class Builder:
                     return False
 
             self.subloggers[app].addFilter(flt)
-            logger.addHandler(self.subloggers[app])
+            self.log_handler.add_handler(self.subloggers[app])
         try:
             buildmode = self.apps[app]["buildmode"]
         except KeyError:
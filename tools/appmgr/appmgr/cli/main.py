@@ -2,11 +2,13 @@
 
 import logging
 import sys
+import time
 from pathlib import Path
 from typing import Any, Dict, List, Optional
 
 import click
 from rich.console import Console
+from rich.live import Live
 from rich.logging import RichHandler
 from rich.progress import (
     BarColumn,
@@ -15,52 +17,91 @@ from rich.progress import (
     TextColumn,
     TimeElapsedColumn,
 )
+from rich.table import Table
 
-from ...core import ApplicationManager
-from ...core.exceptions import AppManagerError
-from ...utils.logging import setup_logging, LoggingContext
+from .. import format_bytes
+from ..core import ApplicationManager
+from ..core.application import parse_duration
+from ..core.exceptions import AppManagerError, ValidationError
+from ..core.logs import parse_timestamp
+from ..core.stats import aggregate_stats, format_ndjson, format_prometheus, write_textfile
+from ..models import ContainerStats
+from ..utils.config import ConfigResolver
+from ..utils.logging import setup_logging, LoggingContext
 
 # Configure rich console
 console = Console()
+err_console = Console(stderr=True)
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# The lowest layer of the configuration, see ConfigResolver
+DEFAULTS = {
+    'log_level': 'info',
+    'log_format': 'text',
+    'config_dir': str(Path.home() / ".config" / "threatos" / "apps"),
+}
+
 @click.group(invoke_without_command=True)
 @click.option(
     '--log-level',
     type=click.Choice(['debug', 'info', 'warning', 'error', 'critical'], case_sensitive=False),
-    default='info',
     help='Set the logging level.',
-    show_default=True,
+    show_default=DEFAULTS['log_level'],
 )
 @click.option(
     '--log-file',
     type=click.Path(dir_okay=False, writable=True, path_type=Path),
     help='Log file path.',
 )
+@click.option(
+    '--log-format',
+    type=click.Choice(['text', 'json']),
+    help='Format of the logs, json for one object per line.',
+    show_default=DEFAULTS['log_format'],
+)
 @click.option(
     '--config-dir',
     type=click.Path(file_okay=False, dir_okay=True, writable=True, path_type=Path),
-    default=Path.home() / ".config" / "threatos" / "apps",
     help='Configuration directory for applications.',
-    show_default=True,
+    show_default=DEFAULTS['config_dir'],
 )
 @click.version_option()
 @click.pass_context
 def cli(
     ctx: click.Context,
-    log_level: str,
+    log_level: Optional[str],
     log_file: Optional[Path],
-    config_dir: Path,
+    log_format: Optional[str],
+    config_dir: Optional[Path],
 ) -> None:
-    """ThreatOS Application Manager - Manage containerized applications."""
+    """ThreatOS Application Manager - Manage containerized applications.
+
+    The options can also be set in /etc/threatos/appmgr.yaml, in
+    ~/.config/threatos/appmgr.yaml, or in the environment (eg.
+    THREATOS_LOG_LEVEL), the ones given here take precedence.
+    """
+    config = ConfigResolver.default(DEFAULTS, cli={
+        'log_level': log_level,
+        'log_file': str(log_file) if log_file else None,
+        'log_format': log_format,
+        'config_dir': str(config_dir) if config_dir else None,
+    })
+    
     # Set up logging
-    setup_logging(level=log_level, log_file=log_file)
+    # From a background thread, so that a slow disk doesn't slow the commands
+    setup_logging(
+        level=config.get('log_level'),
+        log_file=config.get('log_file'),
+        json_format=config.get('log_format') == 'json',
+        use_queue=True,
+    )
     
     # Create a context object to pass to subcommands
     ctx.ensure_object(dict)
-    ctx.obj['CONFIG_DIR'] = config_dir
+    ctx.obj['CONFIG'] = config
+    ctx.obj['CONFIG_DIR'] = Path(config.get('config_dir')).expanduser()
     
     # If no command is provided, show help
     if ctx.invoked_subcommand is None:
@@ -107,7 +148,7 @@ def start(
                 console.print(f"[green]✓[/] Application '{app_id}' started successfully")
             except Exception as e:
                 progress.stop()
-                console.print(f"[red]✗[/] Failed to start application: {e}", err=True)
+                err_console.print(f"[red]✗[/] Failed to start application: {e}")
                 sys.exit(1)
     except KeyboardInterrupt:
         console.print("\n[yellow]Operation cancelled by user[/]")
@@ -134,7 +175,7 @@ def stop(
         app_mgr.stop_application(app_id, timeout=timeout)
         console.print(f"[green]✓[/] Application '{app_id}' stopped successfully")
     except Exception as e:
-        console.print(f"[red]✗[/] Failed to stop application: {e}", err=True)
+        err_console.print(f"[red]✗[/] Failed to stop application: {e}")
         sys.exit(1)
 
 @cli.command()
@@ -156,7 +197,7 @@ def install(
         app = app_mgr.install_application(source, runtime=runtime)
         console.print(f"[green]✓[/] Application '{app.id}' installed successfully")
     except Exception as e:
-        console.print(f"[red]✗[/] Failed to install application: {e}", err=True)
+        err_console.print(f"[red]✗[/] Failed to install application: {e}")
         sys.exit(1)
 
 @cli.command()
@@ -181,7 +222,7 @@ def uninstall(
         else:
             console.print(f"[yellow]![/] Application '{app_id}' not found or already uninstalled")
     except Exception as e:
-        console.print(f"[red]✗[/] Failed to uninstall application: {e}", err=True)
+        err_console.print(f"[red]✗[/] Failed to uninstall application: {e}")
         sys.exit(1)
 
 @cli.command()
@@ -198,12 +239,179 @@ def list_apps(
     """List installed applications."""
     try:
         app_mgr = ApplicationManager(config_dir=ctx.obj['CONFIG_DIR'])
-        # TODO: Implement application listing
-        console.print("List of installed applications:")
-        console.print("  - app1")
-        console.print("  - app2")
+        records = app_mgr.list_installed()
+        if not records:
+            console.print("No application installed")
+            return
+        table = Table(box=None)
+        for column in ("ID", "NAME", "VERSION", "INSTALLED"):
+            table.add_column(column)
+        for record in records:
+            installed = time.strftime("%Y-%m-%d %H:%M", time.localtime(record.installed_at))
+            table.add_row(record.app_id, record.name or "", record.version, installed)
+        console.print(table)
+    except Exception as e:
+        err_console.print(f"[red]✗[/] Failed to list applications: {e}")
+        sys.exit(1)
+
+def parse_time(value: str) -> float:
+    """Parse a --since/--until time: a Unix time, an RFC 3339 one, or a duration ago."""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return parse_timestamp(value if "T" in value else value + "T00:00:00Z") / 1e9
+    except ValueError:
+        pass
+    try:
+        return time.time() - parse_duration(value) / 1e9
+    except ValidationError:
+        raise click.BadParameter(f"not a time or a duration: {value}")
+
+@cli.command()
+@click.argument('app_id')
+@click.option('-f', '--follow', is_flag=True, help='Follow the new lines.')
+@click.option('-n', '--tail', type=click.IntRange(min=0), help='Start with the last N lines.')
+@click.option('--since', help='Only the lines since a time, or a duration ago (like 10m).')
+@click.option('--until', help='Only the lines up to a time, or a duration ago.')
+@click.option('-t', '--timestamps', is_flag=True, help='Show the timestamps.')
+@click.option(
+    '--runtime',
+    type=click.Choice(['docker', 'podman'], case_sensitive=False),
+    help='Container runtime to use.',
+)
+@click.pass_context
+def logs(
+    ctx: click.Context,
+    app_id: str,
+    follow: bool,
+    tail: Optional[int],
+    since: Optional[str],
+    until: Optional[str],
+    timestamps: bool,
+    runtime: Optional[str],
+) -> None:
+    """Show the logs of all the containers of an application, merged."""
+    since_time = parse_time(since) if since else None
+    until_time = parse_time(until) if until else None
+    try:
+        app_mgr = ApplicationManager(config_dir=ctx.obj['CONFIG_DIR'])
+        lines = app_mgr.stream_logs(
+            app_id, follow=follow, tail=tail, since=since_time, until=until_time,
+            runtime=runtime,
+        )
+        width = 0
+        for line in lines:
+            # Plain output: the logs are not rich markup
+            width = max(width, len(line.container))
+            prefix = click.style(f"{line.container:<{width}} |", fg="cyan")
+            if timestamps:
+                prefix += " " + line.time.isoformat()
+            click.echo(f"{prefix} {line.text}")
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        err_console.print(f"[red]✗[/] Failed to get logs: {e}")
+        sys.exit(1)
+
+def stats_table(stats: List[ContainerStats], overhead: Optional[float]) -> Table:
+    """The stats of each application, followed by the ones of its components."""
+    table = Table(box=None, caption=(
+        f"appmgr CPU: {overhead:.2f}%" if overhead is not None else None
+    ))
+    table.add_column("APPLICATION / COMPONENT")
+    for column in ("CPU %", "MEM USAGE / LIMIT", "MEM %", "NET I/O", "BLOCK I/O", "PIDS"):
+        table.add_column(column, justify="right")
+    totals = aggregate_stats(stats)
+    for app_id, total in totals.items():
+        for s in [total] + [s for s in stats if s.app_id == app_id]:
+            table.add_row(
+                f"[bold]{app_id}[/]" if s.component is None else f"  {s.component}",
+                f"{s.cpu_percent:.2f}",
+                f"{format_bytes(s.memory_usage)} / {format_bytes(s.memory_limit)}",
+                f"{s.memory_percent:.2f}",
+                f"{format_bytes(s.network_rx)} / {format_bytes(s.network_tx)}",
+                f"{format_bytes(s.block_read)} / {format_bytes(s.block_write)}",
+                str(s.pids),
+            )
+    return table
+
+@cli.command()
+@click.argument('app_ids', nargs=-1)
+@click.option(
+    '-i', '--interval',
+    type=click.FloatRange(min=1),
+    default=2,
+    help='Seconds between two samples.',
+    show_default=True,
+)
+@click.option(
+    '--format', 'output_format',
+    type=click.Choice(['table', 'ndjson', 'prometheus'], case_sensitive=False),
+    default='table',
+    help='Live table, one JSON object per line, or the Prometheus text format.',
+    show_default=True,
+)
+@click.option(
+    '-o', '--output',
+    type=click.Path(dir_okay=False, writable=True, path_type=Path),
+    help='With --format prometheus, the file to rewrite at each sample '
+         '(for the textfile collector of node_exporter).',
+)
+@click.option('-n', '--count', type=click.IntRange(min=1), help='Stop after N samples.')
+@click.option(
+    '--runtime',
+    type=click.Choice(['docker', 'podman'], case_sensitive=False),
+    help='Container runtime to use.',
+)
+@click.pass_context
+def stats(
+    ctx: click.Context,
+    app_ids: List[str],
+    interval: float,
+    output_format: str,
+    output: Optional[Path],
+    count: Optional[int],
+    runtime: Optional[str],
+) -> None:
+    """Show the resource usage of the containers of applications, or of all of them."""
+    if output is not None and output_format != 'prometheus':
+        raise click.UsageError("--output is for --format prometheus")
+    try:
+        app_mgr = ApplicationManager(config_dir=ctx.obj['CONFIG_DIR'])
+        sampler = app_mgr.sample_stats(list(app_ids) or None, interval, runtime=runtime)
+        live = None
+        if output_format == 'table':
+            live = Live(stats_table([], None), console=console, auto_refresh=False)
+            live.start()
+        try:
+            # The CPU time of appmgr itself, over the last interval
+            cpu, wall = time.process_time(), time.monotonic()
+            for n, samples in enumerate(sampler, 1):
+                if output_format == 'table':
+                    cpu_now, wall_now = time.process_time(), time.monotonic()
+                    overhead = 100 * (cpu_now - cpu) / (wall_now - wall)
+                    cpu, wall = cpu_now, wall_now
+                    live.update(stats_table(samples, overhead), refresh=True)
+                elif output_format == 'ndjson':
+                    sys.stdout.write(format_ndjson(samples, time.time()))
+                    sys.stdout.flush()
+                elif output is not None:
+                    write_textfile(output, format_prometheus(samples))
+                else:
+                    sys.stdout.write(format_prometheus(samples))
+                    sys.stdout.flush()
+                if count is not None and n >= count:
+                    break
+        finally:
+            sampler.close()
+            if live is not None:
+                live.stop()
+    except KeyboardInterrupt:
+        pass
     except Exception as e:
-        console.print(f"[red]✗[/] Failed to list applications: {e}", err=True)
+        err_console.print(f"[red]✗[/] Failed to get stats: {e}")
         sys.exit(1)
 
 def main() -> None:
@@ -211,13 +419,13 @@ def main() -> None:
     try:
         cli(obj={})
     except AppManagerError as e:
-        console.print(f"[red]Error:[/] {e}", err=True)
+        err_console.print(f"[red]Error:[/] {e}")
         sys.exit(1)
     except KeyboardInterrupt:
         console.print("\n[yellow]Operation cancelled by user[/]")
         sys.exit(130)  # 128 + SIGINT
     except Exception as e:
-        console.print(f"[red]Unexpected error:[/] {e}", err=True)
+        err_console.print(f"[red]Unexpected error:[/] {e}")
         if logger.isEnabledFor(logging.DEBUG):
             import traceback
             console.print(traceback.format_exc())
@@ -5,6 +5,9 @@ __all__ = [
     'ContainerRuntime',
     'DockerRuntime',
     'PodmanRuntime',
+    'AsyncContainerRuntime',
+    'AsyncDockerRuntime',
+    'SyncRuntimeAdapter',
     'ApplicationError',
     'ContainerRuntimeError',
     'RegistryError',
@@ -12,4 +15,5 @@ __all__ = [
 
 from .application import ApplicationManager
 from .runtime import ContainerRuntime, DockerRuntime, PodmanRuntime
+from .async_runtime import AsyncContainerRuntime, AsyncDockerRuntime, SyncRuntimeAdapter
 from .exceptions import ApplicationError, ContainerRuntimeError, RegistryError
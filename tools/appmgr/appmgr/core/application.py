@@ -1,19 +1,173 @@
 """Application management functionality."""
 
 import logging
+import os
+import re
+import time
 import yaml
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Optional, Any, Union
+from typing import Callable, Dict, Iterator, List, Optional, Any, Set, Union
 
+from .engine import split_image_name
 from .exceptions import ApplicationError, ConfigurationError, ValidationError
-from .runtime import ContainerRuntime, get_available_runtimes
-from ..models import Application, ApplicationConfig, ContainerSpec, VolumeSpec
+from .graph import DependencyError, DependencyGraph
+from .health import HealthWaiter
+from .logs import LogLine, multiplex_logs
+from .runtime import (
+    PULL_IF_NOT_PRESENT,
+    PULL_POLICIES,
+    RUNTIME_CLASSES,
+    ContainerRuntime,
+    get_available_runtimes,
+    probe_runtimes,
+)
+from .state import StateStore
+from .stats import DEFAULT_INTERVAL, StatsSampler
+from ..models import (
+    AppRecord,
+    Application,
+    ApplicationConfig,
+    Container,
+    ContainerSpec,
+    VolumeSpec,
+)
+from ..utils import tracing
 from ..utils.config import load_config, save_config
 
 logger = logging.getLogger(__name__)
 
+# Labels of the containers of the applications
+APP_LABEL = "org.threatos.appmgr.app"
+COMPONENT_LABEL = "org.threatos.appmgr.component"
+
+# How long a container gets to become healthy, its dependents wait for it
+HEALTH_TIMEOUT = 300
+
+
+def parse_duration(value: Union[str, int, float]) -> int:
+    """Parse a compose-style duration ('1m30s', '500ms', or seconds) into nanoseconds."""
+    if isinstance(value, (int, float)):
+        return int(value * 1e9)
+    units = {"h": 3600e9, "m": 60e9, "s": 1e9, "ms": 1e6, "us": 1e3, "ns": 1}
+    parts = re.findall(r"(\d+(?:\.\d+)?)(h|ms|m|s|us|ns)", value)
+    if not parts or "".join(n + u for n, u in parts) != value.replace(" ", ""):
+        raise ValidationError(f"Invalid duration: {value}")
+    return int(sum(float(n) * units[u] for n, u in parts))
+
+
+def healthcheck_options(healthcheck: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Translate the healthcheck of an app.yaml into run_container() options."""
+    if not healthcheck or healthcheck.get("disable"):
+        return None
+    options: Dict[str, Any] = {"test": healthcheck.get("test")}
+    for key in ("interval", "timeout", "start_period"):
+        if healthcheck.get(key) is not None:
+            options[key] = parse_duration(healthcheck[key])
+    if healthcheck.get("retries") is not None:
+        options["retries"] = int(healthcheck["retries"])
+    return options
+
+
+def parse_restart_policy(value: Any) -> str:
+    """The restart policy of an app.yaml, where YAML 1.1 reads 'no' as False."""
+    if value is None or value is False:
+        return "no"
+    if not isinstance(value, str):
+        raise ValidationError(f"Invalid restart policy: {value!r}")
+    return value
+
+
+def restart_policy_options(policy: str) -> Optional[Dict[str, Any]]:
+    """Translate 'no', 'always', 'unless-stopped' or 'on-failure[:N]' into run_container()'s."""
+    name, _, retries = (policy or "no").partition(":")
+    if name == "no":
+        return None
+    if name not in ("always", "unless-stopped", "on-failure"):
+        raise ValidationError(f"Invalid restart policy: {policy}")
+    return {"Name": name, "MaximumRetryCount": int(retries or 0)}
+
+
+class ApplicationIndex(MutableMapping):
+    """The applications of a config directory, by id, parsed on first access.
+
+    An application is looked up in the directory named after its id first,
+    so that a command about one application only reads its app.yaml. The
+    whole directory is only parsed to iterate, or when an id is not the
+    name of its directory.
+    """
+
+    def __init__(self, config_dir: Path, loader: Callable[[Path], Application]):
+        self.config_dir = config_dir
+        self._loader = loader
+        self._apps: Dict[str, Application] = {}
+        self._loaded: Set[Path] = set()
+        self._complete = False
+
+    def _load(self, config_file: Path) -> Optional[Application]:
+        self._loaded.add(config_file)
+        try:
+            app = self._loader(config_file)
+        except Exception as e:
+            logger.error(f"Failed to load application from {config_file}: {e}")
+            return None
+        self._apps.setdefault(app.id, app)
+        logger.info(f"Loaded application: {app.id} (v{app.version})")
+        return app
+
+    def load_all(self) -> None:
+        """Parse the applications that were not loaded yet."""
+        if self._complete:
+            return
+        for config_file in sorted(self.config_dir.glob("*/app.yaml")):
+            if config_file not in self._loaded:
+                self._load(config_file)
+        self._complete = True
+
+    def reset(self) -> None:
+        """Forget the loaded applications, to read them again."""
+        self._apps.clear()
+        self._loaded.clear()
+        self._complete = False
+
+    def __getitem__(self, app_id: str) -> Application:
+        if app_id in self._apps:
+            return self._apps[app_id]
+        if not self._complete:
+            config_file = self.config_dir / app_id / "app.yaml"
+            if ("/" not in app_id and app_id not in (".", "..")
+                    and config_file not in self._loaded and config_file.is_file()):
+                app = self._load(config_file)
+                if app is not None and app.id == app_id:
+                    return app
+            self.load_all()
+            if app_id in self._apps:
+                return self._apps[app_id]
+        raise KeyError(app_id)
+
+    def __setitem__(self, app_id: str, app: Application) -> None:
+        self._apps[app_id] = app
+
+    def __delitem__(self, app_id: str) -> None:
+        del self._apps[app_id]
+
+    def __iter__(self) -> Iterator[str]:
+        self.load_all()
+        return iter(list(self._apps))
+
+    def __len__(self) -> int:
+        self.load_all()
+        return len(self._apps)
+
+
 class ApplicationManager:
-    """Manages containerized applications."""
+    """Manages containerized applications.
+
+    Nothing is done up front: the applications are parsed when they're
+    first looked up (see ApplicationIndex), and the container runtime is
+    connected to when it's first used.
+    """
     
     def __init__(self, config_dir: Optional[Union[str, Path]] = None):
         """Initialize the application manager.
@@ -24,28 +178,101 @@ class ApplicationManager:
         self.config_dir = Path(config_dir) if config_dir else Path.home() / ".config" / "threatos" / "apps"
         self.config_dir.mkdir(parents=True, exist_ok=True)
         
-        self.runtimes = get_available_runtimes()
-        if not self.runtimes:
-            raise ApplicationError("No container runtime (Docker/Podman) is available")
-            
-        self.default_runtime = next(iter(self.runtimes.values()))
-        logger.info(f"Using container runtime: {self.default_runtime.runtime_name}")
+        self._runtimes: Optional[Dict[str, ContainerRuntime]] = None
+        self._default_runtime: Optional[ContainerRuntime] = None
+        self._state_store: Optional[StateStore] = None
         
-        self.applications: Dict[str, Application] = {}
-        self._load_applications()
+        self.applications = ApplicationIndex(self.config_dir, self._read_application)
     
-    def _load_applications(self) -> None:
-        """Load all application configurations from the config directory."""
-        self.applications.clear()
-        
-        for config_file in self.config_dir.glob("*/app.yaml"):
+    @property
+    def runtimes(self) -> Dict[str, ContainerRuntime]:
+        """The available container runtimes, connected on first use."""
+        if self._runtimes is None:
+            runtimes = get_available_runtimes()
+            if not runtimes:
+                raise ApplicationError("No container runtime (Docker/Podman) is available")
+            self._runtimes = runtimes
+        return self._runtimes
+    
+    @runtimes.setter
+    def runtimes(self, runtimes: Dict[str, ContainerRuntime]) -> None:
+        self._runtimes = runtimes
+    
+    @property
+    def default_runtime(self) -> ContainerRuntime:
+        if self._default_runtime is None:
+            self._default_runtime = next(iter(self.runtimes.values()))
+            logger.info(f"Using container runtime: {self._default_runtime.runtime_name}")
+        return self._default_runtime
+    
+    @default_runtime.setter
+    def default_runtime(self, runtime: ContainerRuntime) -> None:
+        self._default_runtime = runtime
+    
+    @property
+    def state_store(self) -> StateStore:
+        """The state store, opened on first use."""
+        if self._state_store is None:
+            self._state_store = StateStore.open()
+        return self._state_store
+    
+    @tracing.traced()
+    def _read_application(self, config_file: Path) -> Application:
+        app = self._create_application(load_config(config_file), config_file.parent)
+        app.state = self.state_store.load_state(app.id)
+        return app
+    
+    @tracing.traced()
+    def list_installed(self) -> List[AppRecord]:
+        """The applications of the config directory, as the state store records them.
+
+        The records are checked against the mtimes and sizes of the
+        app.yaml files: only the files that changed since the last time are
+        parsed, and the applications that were added, upgraded or removed
+        are recorded as such.
+        """
+        store = self.state_store
+        prefix = str(self.config_dir.resolve()) + os.sep
+        records = {
+            r.config_path: r for r in store.list_apps()
+            if r.config_path and r.config_path.startswith(prefix)
+        }
+        seen: Dict[str, str] = {}
+        for config_file in sorted(self.config_dir.glob("*/app.yaml")):
+            path = str(config_file.resolve())
+            try:
+                st = config_file.stat()
+            except OSError:
+                continue
+            record = records.get(path)
+            if record and (record.config_mtime, record.config_size) == (st.st_mtime_ns, st.st_size):
+                seen[path] = record.app_id
+                continue
             try:
-                app_config = load_config(config_file)
-                app = self._create_application(app_config, config_file.parent)
-                self.applications[app.id] = app
-                logger.info(f"Loaded application: {app.id} (v{app.version})")
+                app = self._read_application(config_file)
             except Exception as e:
                 logger.error(f"Failed to load application from {config_file}: {e}")
+                continue
+            # Like ApplicationIndex, the first one of an id wins
+            if app.id in seen.values():
+                continue
+            seen[path] = app.id
+            store.record_app(AppRecord(
+                app_id=app.id, version=app.version, name=app.name, source="local",
+                config_path=path, config_mtime=st.st_mtime_ns, config_size=st.st_size,
+            ))
+        for record in records.values():
+            if record.app_id not in seen.values():
+                store.remove_app(record.app_id)
+        return [
+            r for r in store.list_apps()
+            if r.config_path and r.config_path.startswith(prefix)
+        ]
+    
+    def _load_applications(self) -> None:
+        """Load all application configurations from the config directory."""
+        self.applications.reset()
+        self.applications.load_all()
     
     def _create_application(self, config_data: Dict[str, Any], config_dir: Path) -> Application:
         """Create an Application instance from configuration data."""
@@ -75,8 +302,13 @@ class ApplicationManager:
                 ports=container_data.get("ports", {}),
                 depends_on=container_data.get("depends_on", []),
                 healthcheck=container_data.get("healthcheck"),
-                restart_policy=container_data.get("restart", "no")
+                restart_policy=parse_restart_policy(container_data.get("restart")),
+                pull_policy=container_data.get("pull_policy", PULL_IF_NOT_PRESENT)
             )
+            if container.pull_policy not in PULL_POLICIES:
+                raise ValidationError(
+                    f"Invalid pull policy for {container.name}: {container.pull_policy}"
+                )
             containers.append(container)
         
         # Create application config
@@ -108,43 +340,311 @@ class ApplicationManager:
         # TODO: Implement application uninstallation
         pass
     
+    @tracing.traced()
     def start_application(
         self, 
         app_id: str, 
         runtime: Optional[str] = None,
-        detach: bool = True
+        detach: bool = True,
+        timeout: float = HEALTH_TIMEOUT
     ) -> bool:
-        """Start an application."""
+        """Start an application.
+
+        The images of all the containers are pulled concurrently, then the
+        containers are started following their 'depends_on' graph: each one
+        as soon as its dependencies are up, and healthy if they have a
+        healthcheck. The application comes up in the time of its longest
+        dependency chain.
+
+        Args:
+            app_id: The id of the application.
+            runtime: The name of the container runtime, or None for the default.
+            detach: Unused, the containers always run in the background.
+            timeout: How long each container gets to become healthy.
+        """
         if app_id not in self.applications:
             raise ApplicationError(f"Application not found: {app_id}")
         
         app = self.applications[app_id]
         rt = self._get_runtime(runtime)
+        specs = {spec.name: spec for spec in app.config.containers}
+        graph = DependencyGraph.from_containers(app.config.containers)
         
         try:
-            # Pull required images
-            for container in app.config.containers:
-                rt.pull_image(container.image)
-            
-            # Start containers
-            # TODO: Implement container startup with dependencies
-            
-            logger.info(f"Started application: {app_id}")
-            return True
-            
+            self._pull_images(rt, app.config.containers, app_id)
         except Exception as e:
             logger.error(f"Failed to start application {app_id}: {e}")
             raise ApplicationError(f"Failed to start application: {e}")
+        
+        waiter = HealthWaiter(rt)
+        try:
+            futures = graph.run(tracing.bind(
+                lambda name: self._start_container(rt, waiter, app, specs[name], timeout)
+            ))
+        finally:
+            waiter.close()
+        errors = []
+        for name in graph.order:
+            error = futures[name].exception()
+            if isinstance(error, DependencyError):
+                logger.warning(f"Not starting {name}: {error}")
+            elif error is not None:
+                logger.error(f"Failed to start {name}: {error}")
+                errors.append(f"{name}: {error}")
+        if errors:
+            raise ApplicationError(f"Failed to start application: {'; '.join(errors)}")
+        
+        logger.info(f"Started application: {app_id}")
+        return True
     
-    def stop_application(self, app_id: str, timeout: int = 10) -> bool:
-        """Stop a running application."""
-        # TODO: Implement application stop
-        pass
+    @tracing.traced()
+    def _pull_images(self, rt: ContainerRuntime, containers: List[ContainerSpec],
+                     app_id: Optional[str] = None) -> None:
+        """Pull the images of the containers, all at once, as their pull policies say.
+
+        An image used by several containers is pulled once, with the
+        policy that pulls the most. The images are recorded in the state
+        store, with their digests, for the application.
+        """
+        policies: Dict[str, str] = {}
+        for spec in containers:
+            current = policies.get(spec.image, spec.pull_policy)
+            policies[spec.image] = min(current, spec.pull_policy, key=PULL_POLICIES.index)
+        if not policies:
+            return
+        
+        def pull(image: str) -> None:
+            name, tag = split_image_name(image)
+            with tracing.span("pull_image", image=image):
+                pulled = rt.pull_image(name, tag=tag, policy=policies[image])
+            if pulled is not None and app_id is not None:
+                self.state_store.record_image(
+                    pulled.id, app_id, name, tag, list(pulled.digests or [])
+                )
+        
+        with ThreadPoolExecutor(max_workers=len(policies)) as pool:
+            for _ in pool.map(tracing.bind(pull), policies):
+                pass
+    
+    def container_name(self, app: Application, spec: ContainerSpec) -> str:
+        """Name of the container of a component of an application."""
+        return f"{app.id}-{spec.name}"
+    
+    def _run_options(self, app: Application, spec: ContainerSpec) -> Dict[str, Any]:
+        """The run_container() arguments for a component of an application."""
+        volumes = {}
+        for vol in spec.volumes:
+            if not vol.source:
+                logger.warning(f"{spec.name}: ignoring volume {vol.target}, it has no source")
+                continue
+            volumes[vol.source] = {"bind": vol.target, "mode": "ro" if vol.read_only else "rw"}
+        options: Dict[str, Any] = {
+            "name": self.container_name(app, spec),
+            "command": spec.command,
+            "environment": {**app.config.environment, **spec.environment},
+            "volumes": volumes,
+            "ports": spec.ports,
+            "detach": True,
+            "labels": {**app.config.labels, APP_LABEL: app.id, COMPONENT_LABEL: spec.name},
+        }
+        restart_policy = restart_policy_options(spec.restart_policy)
+        if restart_policy:
+            options["restart_policy"] = restart_policy
+        healthcheck = healthcheck_options(spec.healthcheck)
+        if healthcheck:
+            options["healthcheck"] = healthcheck
+        if spec.user:
+            options["user"] = spec.user
+        if spec.working_dir:
+            options["working_dir"] = spec.working_dir
+        return options
+    
+    @tracing.traced()
+    def _start_container(
+        self,
+        rt: ContainerRuntime,
+        waiter: HealthWaiter,
+        app: Application,
+        spec: ContainerSpec,
+        timeout: float
+    ) -> Container:
+        """Start a component of an application, and wait until it's healthy."""
+        start = time.monotonic()
+        options = self._run_options(app, spec)
+        existing = rt.get_container(options["name"])
+        if (existing is not None and existing.state == "running"
+                and existing.labels.get(APP_LABEL) == app.id):
+            logger.info(f"{spec.name} is already running")
+            container = existing
+        else:
+            if existing is not None:
+                rt.remove_container(existing.id, force=True)
+            container = rt.run_container(spec.image, **options)
+        if "healthcheck" in options:
+            container = waiter.wait(container.id, timeout).result()
+        logger.info(f"Started {spec.name} in {time.monotonic() - start:.2f}s")
+        return container
+    
+    @tracing.traced()
+    def stop_application(
+        self,
+        app_id: str,
+        timeout: int = 10,
+        runtime: Optional[str] = None
+    ) -> bool:
+        """Stop a running application.
+
+        The containers are stopped in the reverse order of their
+        'depends_on' graph, each one as soon as its dependents are stopped.
+        The timeout is shared by the whole application: every container gets
+        what's left of it to stop, and is killed once it's spent. The time
+        each container took to stop is logged, and kept in the state of the
+        application, under 'stop_latency'.
+
+        Args:
+            app_id: The id of the application.
+            timeout: Seconds the whole application gets to stop.
+            runtime: The name of the container runtime, or None for the default.
+        """
+        if app_id not in self.applications:
+            raise ApplicationError(f"Application not found: {app_id}")
+        
+        app = self.applications[app_id]
+        rt = self._get_runtime(runtime)
+        graph = DependencyGraph.from_containers(app.config.containers).reversed()
+        
+        running: Dict[str, Container] = {}
+        for container in rt.list_containers(filters={"label": f"{APP_LABEL}={app_id}"}):
+            component = container.labels.get(COMPONENT_LABEL, container.name)
+            running[component] = container
+        if not running:
+            logger.info(f"Application {app_id} is not running")
+            return True
+        # Components that are not in app.yaml anymore go first
+        stale = {name: [] for name in running if name not in graph.dependencies}
+        if stale:
+            graph = DependencyGraph({**graph.dependencies, **stale})
+        
+        deadline = time.monotonic() + timeout
+        latencies: Dict[str, float] = {}
+        
+        @tracing.bind
+        def stop(name: str) -> Optional[Exception]:
+            container = running.get(name)
+            if container is None:
+                return None
+            start = time.monotonic()
+            # A stop with no time left is a kill
+            remaining = max(0, round(deadline - start))
+            try:
+                with tracing.span("stop_container", container=name):
+                    rt.stop_container(container.id, timeout=remaining)
+            except Exception as e:
+                return e
+            finally:
+                latencies[name] = time.monotonic() - start
+            how = "Stopped" if remaining else "Killed"
+            logger.info(f"{how} {name} in {latencies[name]:.2f}s")
+            return None
+        
+        futures = graph.run(stop)
+        app.state["stop_latency"] = latencies
+        self.state_store.save_state(app_id, app.state)
+        errors = [
+            f"{name}: {futures[name].result()}"
+            for name in graph.order if futures[name].result() is not None
+        ]
+        if errors:
+            logger.error(f"Failed to stop application {app_id}: {'; '.join(errors)}")
+            raise ApplicationError(f"Failed to stop application: {'; '.join(errors)}")
+        
+        logger.info(f"Stopped application: {app_id}")
+        return True
+    
+    def stream_logs(
+        self,
+        app_id: str,
+        follow: bool = False,
+        tail: Optional[int] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        runtime: Optional[str] = None
+    ) -> Iterator[LogLine]:
+        """The logs of all the containers of an application, merged in time order.
+
+        Args:
+            app_id: The id of the application.
+            follow: Whether to carry on with the new lines.
+            tail: How many of the last lines to start with, or None for all.
+            since: Only the lines from this time on (Unix time), if not None.
+            until: Only the lines up to this time (Unix time), if not None.
+            runtime: The name of the container runtime, or None for the default.
+
+        Returns: the lines, with the names of the components they come from.
+        """
+        if app_id not in self.applications:
+            raise ApplicationError(f"Application not found: {app_id}")
+        
+        rt = self._get_runtime(runtime)
+        containers = {
+            container.labels.get(COMPONENT_LABEL, container.name): container.id
+            for container in rt.list_containers(
+                all=True, filters={"label": f"{APP_LABEL}={app_id}"}
+            )
+        }
+        if not containers:
+            raise ApplicationError(f"Application {app_id} has no containers")
+        
+        def open_logs(name, follow, tail, since, until):
+            return rt.stream_logs(containers[name], follow, tail, since, until)
+        
+        return multiplex_logs(sorted(containers), open_logs, follow, tail, since, until)
+    
+    def sample_stats(
+        self,
+        app_ids: Optional[List[str]] = None,
+        interval: float = DEFAULT_INTERVAL,
+        runtime: Optional[str] = None
+    ) -> StatsSampler:
+        """Follow the resource usage of the running containers of applications.
+
+        Args:
+            app_ids: The ids of the applications, or None for all the
+                containers appmgr started.
+            interval: Seconds between two samples.
+            runtime: The name of the container runtime, or None for the default.
+
+        Returns: a sampler, that gives the stats of the containers every interval.
+        """
+        for app_id in app_ids or []:
+            if app_id not in self.applications:
+                raise ApplicationError(f"Application not found: {app_id}")
+        
+        rt = self._get_runtime(runtime)
+        
+        def list_containers():
+            containers = {}
+            for container in rt.list_containers(filters={"label": APP_LABEL}):
+                app_id = container.labels.get(APP_LABEL)
+                if app_ids and app_id not in app_ids:
+                    continue
+                containers[container.id] = (
+                    app_id, container.labels.get(COMPONENT_LABEL, container.name)
+                )
+            return containers
+        
+        return StatsSampler(rt, list_containers, interval)
     
     def _get_runtime(self, runtime_name: Optional[str] = None) -> ContainerRuntime:
         """Get a container runtime by name or return the default."""
         if runtime_name:
-            if runtime_name not in self.runtimes:
-                raise ApplicationError(f"Unsupported container runtime: {runtime_name}")
-            return self.runtimes[runtime_name]
+            if self._runtimes is None or runtime_name not in self._runtimes:
+                # Only the preferred runtime is connected to, see get_available_runtimes()
+                if runtime_name not in RUNTIME_CLASSES:
+                    raise ApplicationError(f"Unsupported container runtime: {runtime_name}")
+                found = probe_runtimes([runtime_name])
+                if not found:
+                    raise ApplicationError(f"Container runtime not available: {runtime_name}")
+                self._runtimes = {**(self._runtimes or {}), **found}
+            return self._runtimes[runtime_name]
         return self.default_runtime
@@ -0,0 +1,668 @@
+"""Asynchronous container runtime, talking to the Engine API directly."""
+
+import abc
+import asyncio
+import json
+import logging
+import os
+import threading
+from typing import Any, AsyncIterator, Dict, List, Optional, Union
+from urllib.parse import quote, urlencode
+
+from ..models import Container, Image
+from .engine import (
+    DEFAULT_DOCKER_SOCKET,
+    IDEMPOTENT_METHODS,
+    demux_log_stream,
+    encode_filters,
+    get_docker_socket_path,
+    split_image_name,
+)
+from .exceptions import ContainerRuntimeError, EngineAPIError
+from .registry import get_registry_auth
+from .runtime import (
+    PULL_ALWAYS,
+    ContainerRuntime,
+    container_from_api,
+    containers_from_api,
+    healthcheck_from_options,
+    image_from_api,
+    needs_pull,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class EngineResponse:
+    """A response from the Engine API, whose body is read on demand."""
+
+    def __init__(self, client: "AsyncEngineClient", conn: "_Connection", status: int,
+                 headers: Dict[str, str]):
+        self._client = client
+        self._conn: Optional[_Connection] = conn
+        self.status = status
+        self.headers = headers
+        self._chunked = headers.get("transfer-encoding", "").lower() == "chunked"
+        length = headers.get("content-length")
+        self._remaining = int(length) if length is not None else None
+        self._done = status in (204, 304) or self._remaining == 0
+
+    async def iter_chunks(self) -> AsyncIterator[bytes]:
+        """Yield the body as it arrives."""
+        try:
+            while not self._done:
+                chunk = await self._read_chunk()
+                if chunk:
+                    yield chunk
+        finally:
+            self.release()
+
+    async def _read_chunk(self) -> bytes:
+        reader = self._conn.reader
+        if self._chunked:
+            size = int((await reader.readline()).split(b";", 1)[0], 16)
+            if size == 0:
+                # Skip the trailers
+                while (await reader.readline()) not in (b"\r\n", b""):
+                    pass
+                self._done = True
+                return b""
+            data = await reader.readexactly(size)
+            await reader.readexactly(2)
+            return data
+        if self._remaining is not None:
+            data = await reader.read(min(self._remaining, 65536))
+            if not data:
+                raise ContainerRuntimeError("Connection closed by the engine")
+            self._remaining -= len(data)
+            self._done = self._remaining == 0
+            return data
+        # Neither length nor chunks, the body ends with the connection
+        data = await reader.read(65536)
+        if not data:
+            self._done = True
+            self._conn.keep_alive = False
+        return data
+
+    async def read(self) -> bytes:
+        return b"".join([chunk async for chunk in self.iter_chunks()])
+
+    async def json(self) -> Any:
+        body = await self.read()
+        return json.loads(body) if body else None
+
+    async def iter_lines(self) -> AsyncIterator[bytes]:
+        """Yield the body line by line, as the progress streams are."""
+        buf = b""
+        async for chunk in self.iter_chunks():
+            buf += chunk
+            *lines, buf = buf.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield line
+        if buf.strip():
+            yield buf
+
+    def release(self) -> None:
+        """Give the connection back, or close it if the body was not read."""
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        self._client._release(conn, reusable=self._done and conn.keep_alive)
+
+
+class _Connection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.keep_alive = True
+        # Whether the last request was written in full
+        self.sent = False
+
+    def is_dropped(self) -> bool:
+        # Nothing is expected on an idle connection: the engine closed it
+        return self.writer.is_closing() or self.reader.at_eof()
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class AsyncEngineClient:
+    """A minimal HTTP/1.1 client for the Engine API, over a Unix socket.
+
+    Connections are kept alive and reused, and at most max_connections of
+    them are open at once.
+    """
+
+    def __init__(self, socket_path: str, max_connections: int = 8, timeout: float = 60):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._idle: List[_Connection] = []
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        body: Any = None,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: Optional[float] = None,
+    ) -> EngineResponse:
+        """Send a request, and return the response once its headers are in.
+
+        The caller must read the body, or release() the response. Error
+        statuses are raised as EngineAPIError. The timeout applies to the
+        connection and the response headers, not to the body, which can be
+        an endless stream.
+        """
+        if params:
+            params = {k: v for k, v in params.items() if v is not None}
+            path += "?" + urlencode(params)
+        data = b""
+        lines = [f"{method} {path} HTTP/1.1", "Host: docker"]
+        if body is not None:
+            data = json.dumps(body).encode()
+            lines.append("Content-Type: application/json")
+        lines.append(f"Content-Length: {len(data)}")
+        lines.extend(f"{k}: {v}" for k, v in (headers or {}).items())
+        raw = ("\r\n".join(lines) + "\r\n\r\n").encode() + data
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_connections)
+        await self._semaphore.acquire()
+        try:
+            response = await self._send(method, raw, timeout or self.timeout)
+        except BaseException:
+            self._semaphore.release()
+            raise
+        if response.status >= 400:
+            error = await response.read()
+            try:
+                message = json.loads(error).get("message", "")
+            except ValueError:
+                message = error.decode(errors="replace")
+            raise EngineAPIError(f"{method} {path}: {message}", response.status)
+        return response
+
+    async def _send(self, method: str, raw: bytes, timeout: float) -> EngineResponse:
+        while self._idle:
+            conn = self._idle.pop()
+            if conn.is_dropped():
+                conn.close()
+                continue
+            try:
+                return await self._exchange(conn, raw, timeout)
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                # The engine closed the idle connection, try another one.
+                # Unless the request was sent, and might have been run
+                # already: only the ones that change nothing can be sent twice.
+                if conn.sent and method not in IDEMPOTENT_METHODS:
+                    raise ContainerRuntimeError(f"No answer from {self.socket_path}: {e!r}")
+            except asyncio.TimeoutError as e:
+                raise ContainerRuntimeError(f"No answer from {self.socket_path}: {e!r}")
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_unix_connection(self.socket_path), timeout
+            )
+            return await self._exchange(_Connection(reader, writer), raw, timeout)
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+            raise ContainerRuntimeError(f"No answer from {self.socket_path}: {e!r}")
+
+    async def _exchange(self, conn: _Connection, raw: bytes, timeout: float) -> EngineResponse:
+        try:
+            conn.sent = False
+            conn.writer.write(raw)
+            await conn.writer.drain()
+            conn.sent = True
+            status_line = await asyncio.wait_for(conn.reader.readline(), timeout)
+            if not status_line:
+                raise asyncio.IncompleteReadError(b"", None)
+            status = int(status_line.split(b" ", 2)[1])
+            headers = {}
+            while True:
+                line = await asyncio.wait_for(conn.reader.readline(), timeout)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                key, _, value = line.decode("latin-1").partition(":")
+                headers[key.strip().lower()] = value.strip()
+        except BaseException:
+            conn.close()
+            raise
+        if headers.get("connection", "").lower() == "close":
+            conn.keep_alive = False
+        return EngineResponse(self, conn, status, headers)
+
+    def _release(self, conn: _Connection, reusable: bool) -> None:
+        if reusable and len(self._idle) < self.max_connections:
+            self._idle.append(conn)
+        else:
+            conn.close()
+        self._semaphore.release()
+
+    async def get_json(self, path: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        return await (await self.request("GET", path, params)).json()
+
+    async def post_json(self, path: str, params: Optional[Dict[str, Any]] = None,
+                        body: Any = None) -> Any:
+        return await (await self.request("POST", path, params, body)).json()
+
+    async def close(self) -> None:
+        """Close the idle connections."""
+        while self._idle:
+            conn = self._idle.pop()
+            conn.close()
+            try:
+                await conn.writer.wait_closed()
+            except OSError:
+                pass
+
+
+def build_create_config(
+    image: str,
+    command: Optional[Union[str, List[str]]] = None,
+    environment: Optional[Dict[str, str]] = None,
+    volumes: Optional[Dict[str, Dict[str, str]]] = None,
+    ports: Optional[Dict[str, Union[int, str]]] = None,
+    remove: bool = False,
+    labels: Optional[Dict[str, str]] = None,
+    network: Optional[str] = None,
+    user: Optional[str] = None,
+    working_dir: Optional[str] = None,
+    entrypoint: Optional[Union[str, List[str]]] = None,
+    restart_policy: Optional[Dict[str, Any]] = None,
+    hostname: Optional[str] = None,
+    tty: bool = False,
+    healthcheck: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """Translate run_container() arguments into a /containers/create body.
+
+    The arguments follow docker-py's containers.run().
+    """
+    host_config: Dict[str, Any] = {"AutoRemove": remove}
+    config: Dict[str, Any] = {"Image": image, "Tty": tty, "HostConfig": host_config}
+    if isinstance(command, str):
+        command = ["/bin/sh", "-c", command]
+    if command is not None:
+        config["Cmd"] = command
+    if isinstance(entrypoint, str):
+        entrypoint = [entrypoint]
+    if entrypoint is not None:
+        config["Entrypoint"] = entrypoint
+    if environment:
+        config["Env"] = [f"{k}={v}" for k, v in environment.items()]
+    if labels:
+        config["Labels"] = labels
+    if user:
+        config["User"] = user
+    if working_dir:
+        config["WorkingDir"] = working_dir
+    if hostname:
+        config["Hostname"] = hostname
+    if volumes:
+        host_config["Binds"] = [
+            f"{source}:{v['bind']}:{v.get('mode', 'rw')}" for source, v in volumes.items()
+        ]
+    if ports:
+        exposed = {}
+        bindings = {}
+        for port, host in ports.items():
+            port = str(port)
+            if "/" not in port:
+                port += "/tcp"
+            exposed[port] = {}
+            if isinstance(host, tuple):
+                bindings[port] = [{"HostIp": host[0], "HostPort": str(host[1])}]
+            elif host is None:
+                bindings[port] = [{"HostPort": ""}]
+            else:
+                bindings[port] = [{"HostPort": str(host)}]
+        config["ExposedPorts"] = exposed
+        host_config["PortBindings"] = bindings
+    if network:
+        host_config["NetworkMode"] = network
+    if restart_policy:
+        host_config["RestartPolicy"] = restart_policy
+    if healthcheck:
+        config["Healthcheck"] = healthcheck_from_options(healthcheck)
+    return config
+
+
+class AsyncContainerRuntime(abc.ABC):
+    """Abstract base class for asynchronous container runtimes."""
+
+    def __init__(self, runtime_name: str):
+        self.runtime_name = runtime_name
+        self.connected = False
+
+    @abc.abstractmethod
+    async def connect(self) -> bool:
+        """Connect to the container runtime."""
+        pass
+
+    @abc.abstractmethod
+    def is_available(self) -> bool:
+        """Check if the runtime is available on the system."""
+        pass
+
+    @abc.abstractmethod
+    async def pull_image(self, image_name: str, tag: str = "latest",
+                         policy: str = PULL_ALWAYS) -> Image:
+        """Pull a container image from a registry, see ContainerRuntime.pull_image()."""
+        pass
+
+    @abc.abstractmethod
+    async def run_container(
+        self,
+        image: str,
+        name: Optional[str] = None,
+        command: Optional[Union[str, List[str]]] = None,
+        environment: Optional[Dict[str, str]] = None,
+        volumes: Optional[Dict[str, Dict[str, str]]] = None,
+        ports: Optional[Dict[str, Union[int, str]]] = None,
+        detach: bool = False,
+        remove: bool = False,
+        **kwargs
+    ) -> Container:
+        """Run a container with the given configuration."""
+        pass
+
+    @abc.abstractmethod
+    async def stop_container(self, container_id: str, timeout: int = 10) -> bool:
+        """Stop a running container."""
+        pass
+
+    @abc.abstractmethod
+    async def remove_container(self, container_id: str, force: bool = False) -> bool:
+        """Remove a container."""
+        pass
+
+    @abc.abstractmethod
+    async def list_containers(self, all: bool = False,
+                              filters: Optional[Dict] = None) -> List[Container]:
+        """List containers."""
+        pass
+
+    @abc.abstractmethod
+    async def get_container(self, container_id: str) -> Optional[Container]:
+        """Get a container by ID."""
+        pass
+
+    @abc.abstractmethod
+    async def get_container_logs(
+        self,
+        container_id: str,
+        follow: bool = False,
+        tail: Optional[int] = None
+    ) -> str:
+        """Get logs from a container."""
+        pass
+
+    async def close(self) -> None:
+        """Release the resources held by the runtime."""
+        pass
+
+
+class AsyncDockerRuntime(AsyncContainerRuntime):
+    """Docker runtime over the Engine API, without docker-py.
+
+    All the calls share a pool of keep-alive connections to the Docker
+    socket, so that concurrent pulls, starts and stops don't wait for each
+    other.
+    """
+
+    def __init__(self, socket_path: Optional[str] = None, max_connections: int = 8):
+        super().__init__("docker")
+        self.socket_path = socket_path or get_docker_socket_path() or DEFAULT_DOCKER_SOCKET
+        self._client = AsyncEngineClient(self.socket_path, max_connections=max_connections)
+
+    async def connect(self) -> bool:
+        try:
+            await (await self._client.request("GET", "/_ping")).read()
+            self.connected = True
+            logger.info("Connected to Docker daemon")
+            return True
+        except (ContainerRuntimeError, OSError, asyncio.TimeoutError) as e:
+            logger.error(f"Failed to connect to Docker: {e}")
+            self.connected = False
+            return False
+
+    def is_available(self) -> bool:
+        return os.path.exists(self.socket_path)
+
+    async def _ensure_connected(self) -> None:
+        if not self.connected and not await self.connect():
+            raise ContainerRuntimeError("Not connected to Docker daemon")
+
+    async def pull_image(self, image_name: str, tag: str = "latest",
+                         policy: str = PULL_ALWAYS) -> Image:
+        await self._ensure_connected()
+        full_image = f"{image_name}@{tag}" if ":" in tag else f"{image_name}:{tag}"
+        if policy != PULL_ALWAYS:
+            try:
+                local: Optional[Image] = image_from_api(
+                    await self._client.get_json(f"/images/{quote(full_image, safe='')}/json")
+                )
+            except EngineAPIError as e:
+                if e.status != 404:
+                    raise
+                local = None
+            # The registry is queried with blocking calls
+            pull = await asyncio.get_running_loop().run_in_executor(
+                None, needs_pull, local, image_name, tag, policy
+            )
+            if not pull:
+                logger.debug(f"Image {full_image} is up to date")
+                return local
+        logger.info(f"Pulling image {full_image}")
+
+        headers = {}
+        auth = get_registry_auth(image_name)
+        if auth:
+            headers["X-Registry-Auth"] = auth
+        try:
+            response = await self._client.request(
+                "POST", "/images/create", {"fromImage": image_name, "tag": tag}, headers=headers
+            )
+            async for line in response.iter_lines():
+                event = json.loads(line)
+                if "error" in event:
+                    raise ContainerRuntimeError(event["error"])
+            data = await self._client.get_json(f"/images/{quote(full_image, safe='')}/json")
+        except ContainerRuntimeError as e:
+            logger.error(f"Failed to pull image {full_image}: {e}")
+            raise ContainerRuntimeError(f"Failed to pull image {full_image}: {e}")
+        return image_from_api(data)
+
+    async def run_container(
+        self,
+        image: str,
+        name: Optional[str] = None,
+        command: Optional[Union[str, List[str]]] = None,
+        environment: Optional[Dict[str, str]] = None,
+        volumes: Optional[Dict[str, Dict[str, str]]] = None,
+        ports: Optional[Dict[str, Union[int, str]]] = None,
+        detach: bool = False,
+        remove: bool = False,
+        **kwargs
+    ) -> Container:
+        await self._ensure_connected()
+        # Without detach, the container is removed after we waited for it
+        config = build_create_config(
+            image, command, environment, volumes, ports, remove=remove and detach, **kwargs
+        )
+        params = {"name": name}
+        try:
+            created = await self._client.post_json("/containers/create", params, config)
+        except EngineAPIError as e:
+            if e.status != 404:
+                raise ContainerRuntimeError(f"Failed to create container from {image}: {e}")
+            # Like 'docker run', pull the image if it's missing
+            await self.pull_image(*split_image_name(image))
+            created = await self._client.post_json("/containers/create", params, config)
+        container_id = created["Id"]
+
+        try:
+            await (await self._client.request("POST", f"/containers/{container_id}/start")).read()
+            if detach:
+                return await self._inspect(container_id)
+            await self._client.post_json(f"/containers/{container_id}/wait")
+            container = await self._inspect(container_id)
+        except ContainerRuntimeError as e:
+            raise ContainerRuntimeError(f"Failed to run container {name or container_id}: {e}")
+        if remove:
+            await self.remove_container(container_id, force=True)
+        return container
+
+    async def _inspect(self, container_id: str) -> Container:
+        data = await self._client.get_json(f"/containers/{quote(container_id, safe='')}/json")
+        return container_from_api(data)
+
+    async def stop_container(self, container_id: str, timeout: int = 10) -> bool:
+        await self._ensure_connected()
+        try:
+            response = await self._client.request(
+                "POST", f"/containers/{quote(container_id, safe='')}/stop", {"t": timeout},
+                timeout=self._client.timeout + timeout
+            )
+            await response.read()
+        except EngineAPIError as e:
+            if e.status == 404:
+                return False
+            raise ContainerRuntimeError(f"Failed to stop container {container_id}: {e}")
+        return True
+
+    async def remove_container(self, container_id: str, force: bool = False) -> bool:
+        await self._ensure_connected()
+        try:
+            response = await self._client.request(
+                "DELETE", f"/containers/{quote(container_id, safe='')}",
+                {"force": str(force).lower()}
+            )
+            await response.read()
+        except EngineAPIError as e:
+            if e.status == 404:
+                return False
+            raise ContainerRuntimeError(f"Failed to remove container {container_id}: {e}")
+        return True
+
+    async def list_containers(self, all: bool = False,
+                              filters: Optional[Dict] = None) -> List[Container]:
+        await self._ensure_connected()
+        params: Dict[str, Any] = {"all": str(all).lower()}
+        if filters:
+            params["filters"] = encode_filters(filters)
+        data = await self._client.get_json("/containers/json", params)
+        return containers_from_api(data)
+
+    async def get_container(self, container_id: str) -> Optional[Container]:
+        await self._ensure_connected()
+        try:
+            return await self._inspect(container_id)
+        except EngineAPIError as e:
+            if e.status == 404:
+                return None
+            raise
+
+    async def get_container_logs(
+        self,
+        container_id: str,
+        follow: bool = False,
+        tail: Optional[int] = None
+    ) -> str:
+        await self._ensure_connected()
+        path = f"/containers/{quote(container_id, safe='')}"
+        info = await self._client.get_json(f"{path}/json")
+        params = {
+            "stdout": "true",
+            "stderr": "true",
+            "follow": str(follow).lower(),
+            "tail": "all" if tail is None else tail,
+        }
+        data = await (await self._client.request("GET", f"{path}/logs", params)).read()
+        if not (info.get("Config") or {}).get("Tty"):
+            data = demux_log_stream(data)
+        return data.decode(errors="replace")
+
+    async def close(self) -> None:
+        await self._client.close()
+
+
+class SyncRuntimeAdapter(ContainerRuntime):
+    """Expose an AsyncContainerRuntime through the synchronous interface.
+
+    The coroutines run in an event loop owned by the adapter, in a
+    background thread, so the adapter can be used from any thread, and
+    from code that already runs an event loop.
+    """
+
+    def __init__(self, runtime: AsyncContainerRuntime):
+        super().__init__(runtime.runtime_name)
+        self.runtime = runtime
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    def _run(self, coro):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever, name=f"{self.runtime_name}-runtime", daemon=True
+                ).start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def connect(self) -> bool:
+        self.connected = self._run(self.runtime.connect())
+        return self.connected
+
+    def is_available(self) -> bool:
+        return self.runtime.is_available()
+
+    def pull_image(self, image_name: str, tag: str = "latest",
+                   policy: str = PULL_ALWAYS) -> Image:
+        return self._run(self.runtime.pull_image(image_name, tag, policy))
+
+    def run_container(
+        self,
+        image: str,
+        name: Optional[str] = None,
+        command: Optional[Union[str, List[str]]] = None,
+        environment: Optional[Dict[str, str]] = None,
+        volumes: Optional[Dict[str, Dict[str, str]]] = None,
+        ports: Optional[Dict[str, Union[int, str]]] = None,
+        detach: bool = False,
+        remove: bool = False,
+        **kwargs
+    ) -> Container:
+        return self._run(self.runtime.run_container(
+            image, name, command, environment, volumes, ports, detach, remove, **kwargs
+        ))
+
+    def stop_container(self, container_id: str, timeout: int = 10) -> bool:
+        return self._run(self.runtime.stop_container(container_id, timeout))
+
+    def remove_container(self, container_id: str, force: bool = False) -> bool:
+        return self._run(self.runtime.remove_container(container_id, force))
+
+    def list_containers(self, all: bool = False, filters: Optional[Dict] = None) -> List[Container]:
+        return self._run(self.runtime.list_containers(all, filters))
+
+    def get_container(self, container_id: str) -> Optional[Container]:
+        return self._run(self.runtime.get_container(container_id))
+
+    def get_container_logs(
+        self,
+        container_id: str,
+        follow: bool = False,
+        tail: Optional[int] = None
+    ) -> str:
+        return self._run(self.runtime.get_container_logs(container_id, follow, tail))
+
+    def close(self) -> None:
+        """Close the runtime, and stop the event loop."""
+        if self._loop is None:
+            return
+        self._run(self.runtime.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop = None
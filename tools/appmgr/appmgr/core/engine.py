@@ -0,0 +1,353 @@
+"""Lean synchronous client for the Engine API over a Unix socket."""
+
+import base64
+import http.client
+import json
+import logging
+import os
+import select
+import socket
+import struct
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import quote, urlencode
+
+from .exceptions import ContainerRuntimeError, EngineAPIError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DOCKER_SOCKET = "/var/run/docker.sock"
+
+# The requests that can be sent again when the engine may have got them
+# already: they change nothing.
+IDEMPOTENT_METHODS = ("GET", "HEAD")
+
+
+def get_docker_socket_path() -> Optional[str]:
+    """Path of the Docker socket, or None if DOCKER_HOST is not a Unix socket."""
+    host = os.environ.get("DOCKER_HOST", "")
+    if not host:
+        return DEFAULT_DOCKER_SOCKET
+    if host.startswith("unix://"):
+        return host[len("unix://"):]
+    return None
+
+
+def get_podman_socket_path() -> str:
+    """Path of the socket of the Podman service, rootless unless running as root."""
+    host = os.environ.get("CONTAINER_HOST", "")
+    if host.startswith("unix://"):
+        return host[len("unix://"):]
+    if os.getuid() == 0:
+        return "/run/podman/podman.sock"
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or f"/run/user/{os.getuid()}"
+    return os.path.join(runtime_dir, "podman", "podman.sock")
+
+
+def split_image_name(image: str) -> Tuple[str, str]:
+    """Split an image reference into a name and a tag (or digest)."""
+    if "@" in image:
+        name, digest = image.split("@", 1)
+        return name, digest
+    name, sep, tag = image.rpartition(":")
+    if not sep or "/" in tag:
+        # No tag, the colon (if any) belongs to a registry port
+        return image, "latest"
+    return name, tag
+
+
+def demux_log_stream(data: bytes) -> bytes:
+    """Strip the stream headers the engine puts in the logs of non-TTY containers."""
+    out = []
+    pos = 0
+    while pos + 8 <= len(data):
+        _, length = struct.unpack(">BxxxL", data[pos:pos + 8])
+        out.append(data[pos + 8:pos + 8 + length])
+        pos += 8 + length
+    return b"".join(out)
+
+
+def iter_log_frames(chunks: Iterable[bytes]) -> Iterator[Tuple[int, bytes]]:
+    """Split a multiplexed log stream into (stream, payload) frames, as they come."""
+    buf = bytearray()
+    for chunk in chunks:
+        buf += chunk
+        while len(buf) >= 8:
+            stream, length = struct.unpack(">BxxxL", buf[:8])
+            if len(buf) < 8 + length:
+                break
+            yield stream, bytes(buf[8:8 + length])
+            del buf[:8 + length]
+
+
+def iter_log_lines(frames: Iterable[Tuple[int, bytes]]) -> Iterator[str]:
+    """Reassemble the lines of the frames of log streams, each stream on its own."""
+    buffers: Dict[int, bytes] = {}
+    for stream, data in frames:
+        *lines, buffers[stream] = (buffers.get(stream, b"") + data).split(b"\n")
+        for line in lines:
+            yield line.decode(errors="replace")
+    for rest in buffers.values():
+        if rest:
+            yield rest.decode(errors="replace")
+
+
+def encode_filters(filters: Dict[str, Any]) -> str:
+    """Encode list filters the way the Engine API wants them."""
+    return json.dumps({k: v if isinstance(v, list) else [v] for k, v in filters.items()})
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """An HTTPConnection to a Unix socket."""
+
+    def __init__(self, socket_path: str, timeout: Optional[float] = None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self) -> None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+class EngineStream:
+    """A streamed response body, its connection is released once it's read or closed."""
+
+    def __init__(self, client: "EngineClient", conn: UnixHTTPConnection,
+                 response: http.client.HTTPResponse):
+        self._client = client
+        self._conn: Optional[UnixHTTPConnection] = conn
+        self.response = response
+        self.headers = response.headers
+
+    def iter_chunks(self, size: int = 65536) -> Iterator[bytes]:
+        try:
+            while True:
+                chunk = self.response.read1(size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            self.close()
+
+    def iter_lines(self) -> Iterator[bytes]:
+        buf = b""
+        for chunk in self.iter_chunks():
+            buf += chunk
+            *lines, buf = buf.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield line
+        if buf.strip():
+            yield buf
+
+    def read(self) -> bytes:
+        try:
+            return self.response.read()
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        self._client._release(conn, self.response)
+
+    def abort(self) -> None:
+        """Stop an endless stream, even while another thread is reading it."""
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        if conn.sock is not None:
+            try:
+                # Unlike close(), this wakes up a blocked recv()
+                conn.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        conn.close()
+
+    def __enter__(self) -> "EngineStream":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class EngineClient:
+    """A thin client for the Engine API endpoints appmgr uses.
+
+    It returns the JSON documents as decoded by json, and the streamed
+    bodies as they are, where docker-py builds model objects (and sends an
+    inspect per object for some of them). Connections are kept alive and
+    reused, the client can be shared between threads.
+    """
+
+    def __init__(self, socket_path: Optional[str] = None, timeout: float = 60,
+                 max_idle: int = 4):
+        self.socket_path = socket_path or get_docker_socket_path()
+        if self.socket_path is None:
+            raise ContainerRuntimeError("The Engine client only supports Unix sockets")
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._idle: List[UnixHTTPConnection] = []
+        self._lock = threading.Lock()
+
+    def _acquire(self) -> Tuple[UnixHTTPConnection, bool]:
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn = self._idle.pop()
+            if not self._is_dropped(conn):
+                return conn, True
+            conn.close()
+        return UnixHTTPConnection(self.socket_path, self.timeout), False
+
+    @staticmethod
+    def _is_dropped(conn: UnixHTTPConnection) -> bool:
+        # Nothing is expected on an idle connection: if there's something to
+        # read, it's the end of the stream, the engine closed it
+        if conn.sock is None:
+            return True
+        try:
+            readable, _, _ = select.select([conn.sock], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        return bool(readable)
+
+    def _release(self, conn: UnixHTTPConnection, response: http.client.HTTPResponse) -> None:
+        # http.client reuses the socket only once the body was read in full
+        if response.isclosed() and not response.will_close:
+            with self._lock:
+                if len(self._idle) < self.max_idle:
+                    self._idle.append(conn)
+                    return
+        conn.close()
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        body: Any = None,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: Optional[float] = -1,
+    ) -> EngineStream:
+        """Send a request, and return the response, for the caller to read.
+
+        A dict or a list body is sent as JSON, bytes are sent as they are.
+        Error statuses are raised as EngineAPIError. A timeout of None
+        disables it, for endless streams.
+        """
+        if params:
+            params = {k: v for k, v in params.items() if v is not None}
+            path += "?" + urlencode(params)
+        headers = dict(headers or {})
+        if body is not None and not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        elif body is not None:
+            headers.setdefault("Content-Type", "application/x-tar")
+        if timeout == -1:
+            timeout = self.timeout
+
+        conn, reused = self._acquire()
+        try:
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            sent = False
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                sent = True
+                response = conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionError):
+                # The engine closed the idle connection, start over. Unless
+                # the request was sent, and might have been run already:
+                # only the ones that change nothing can be sent twice.
+                if not reused or (sent and method not in IDEMPOTENT_METHODS):
+                    raise
+                conn.close()
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            raise ContainerRuntimeError(f"No answer from {self.socket_path}: {e!r}")
+
+        stream = EngineStream(self, conn, response)
+        if response.status >= 400:
+            error = stream.read()
+            try:
+                message = json.loads(error).get("message", "")
+            except ValueError:
+                message = error.decode(errors="replace")
+            raise EngineAPIError(f"{method} {path}: {message}", response.status)
+        return stream
+
+    def json(self, method: str, path: str, params: Optional[Dict[str, Any]] = None,
+             body: Any = None) -> Any:
+        data = self.request(method, path, params, body).read()
+        return json.loads(data) if data else None
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    # Endpoints
+
+    def ping(self) -> bool:
+        return self.request("GET", "/_ping").read() == b"OK"
+
+    def images(self, all: bool = False, filters: Optional[Dict[str, Any]] = None) -> List[Dict]:
+        """Image summaries, like 'docker images'."""
+        params = {"all": str(all).lower()}
+        if filters:
+            params["filters"] = encode_filters(filters)
+        return self.json("GET", "/images/json", params)
+
+    def inspect_image(self, name: str) -> Dict:
+        return self.json("GET", f"/images/{quote(name, safe='')}/json")
+
+    def containers(self, all: bool = False,
+                   filters: Optional[Dict[str, Any]] = None) -> List[Dict]:
+        """Container summaries, like 'docker ps'."""
+        params = {"all": str(all).lower()}
+        if filters:
+            params["filters"] = encode_filters(filters)
+        return self.json("GET", "/containers/json", params)
+
+    def inspect_container(self, container_id: str) -> Dict:
+        return self.json("GET", f"/containers/{quote(container_id, safe='')}/json")
+
+    def create_container(self, config: Dict[str, Any], name: Optional[str] = None) -> str:
+        """Create a container, and return its id."""
+        return self.json("POST", "/containers/create", {"name": name}, config)["Id"]
+
+    def remove_container(self, container_id: str, force: bool = False,
+                         volumes: bool = False) -> None:
+        self.request(
+            "DELETE", f"/containers/{quote(container_id, safe='')}",
+            {"force": str(force).lower(), "v": str(volumes).lower()}
+        ).read()
+
+    def get_archive(self, container_id: str, path: str) -> Tuple[EngineStream, Dict]:
+        """Get a tar archive of a path in a container, and the stat of that path."""
+        stream = self.request(
+            "GET", f"/containers/{quote(container_id, safe='')}/archive", {"path": path},
+            timeout=None
+        )
+        stat = stream.headers.get("X-Docker-Container-Path-Stat")
+        return stream, json.loads(base64.b64decode(stat)) if stat else {}
+
+    def put_archive(self, container_id: str, path: str, data: bytes) -> None:
+        """Extract a tar archive to a path in a container."""
+        self.request(
+            "PUT", f"/containers/{quote(container_id, safe='')}/archive", {"path": path}, data
+        ).read()
@@ -12,6 +12,13 @@ class ContainerRuntimeError(AppManagerError):
     """Raised when there's an error with the container runtime."""
     pass
 
+class EngineAPIError(ContainerRuntimeError):
+    """Raised when the container engine API answers with an error status."""
+
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
+
 class RegistryError(AppManagerError):
     """Raised when there's an error with container registry operations."""
     pass
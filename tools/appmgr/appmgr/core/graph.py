@@ -0,0 +1,146 @@
+"""Dependency graph of the containers of an application."""
+
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from .exceptions import ValidationError
+from ..models import ContainerSpec
+
+logger = logging.getLogger(__name__)
+
+
+class DependencyError(Exception):
+    """Raised for a node that was not run because one of its dependencies failed."""
+
+    def __init__(self, name: str, dependency: str):
+        super().__init__(f"{name} not run, {dependency} failed")
+        self.name = name
+        self.dependency = dependency
+
+
+class DependencyGraph:
+    """The 'depends_on' graph of a set of containers.
+
+    Edges go from a container to the containers it depends on. The graph
+    is checked when it's built: unknown dependencies and cycles raise a
+    ValidationError.
+    """
+
+    def __init__(self, dependencies: Dict[str, List[str]]):
+        self.dependencies = {name: list(deps) for name, deps in dependencies.items()}
+        for name, deps in self.dependencies.items():
+            for dep in deps:
+                if dep not in self.dependencies:
+                    raise ValidationError(f"{name} depends on an unknown container: {dep}")
+        self.order = self._sort()
+
+    @classmethod
+    def from_containers(cls, containers: List[ContainerSpec]) -> "DependencyGraph":
+        graph: Dict[str, List[str]] = {}
+        for spec in containers:
+            if spec.name in graph:
+                raise ValidationError(f"Duplicate container name: {spec.name}")
+            graph[spec.name] = spec.depends_on or []
+        return cls(graph)
+
+    def _sort(self) -> List[str]:
+        """Topological order, dependencies first, that keeps the order of declaration."""
+        order: List[str] = []
+        state: Dict[str, int] = {}  # 1: being visited, 2: done
+
+        def visit(name: str, path: List[str]) -> None:
+            if state.get(name) == 2:
+                return
+            if state.get(name) == 1:
+                cycle = path[path.index(name):] + [name]
+                raise ValidationError(f"Dependency cycle: {' -> '.join(cycle)}")
+            state[name] = 1
+            for dep in self.dependencies[name]:
+                visit(dep, path + [name])
+            state[name] = 2
+            order.append(name)
+
+        for name in self.dependencies:
+            visit(name, [])
+        return order
+
+    def dependents(self) -> Dict[str, List[str]]:
+        """The reverse graph: for each container, the containers that depend on it."""
+        result: Dict[str, List[str]] = {name: [] for name in self.dependencies}
+        for name in self.order:
+            for dep in self.dependencies[name]:
+                result[dep].append(name)
+        return result
+
+    def reversed(self) -> "DependencyGraph":
+        return DependencyGraph(self.dependents())
+
+    def levels(self) -> List[List[str]]:
+        """The containers grouped by depth, each level only depends on the previous ones."""
+        depth: Dict[str, int] = {}
+        for name in self.order:
+            depth[name] = 1 + max((depth[dep] for dep in self.dependencies[name]), default=-1)
+        levels: List[List[str]] = [[] for _ in range(max(depth.values(), default=-1) + 1)]
+        for name in self.order:
+            levels[depth[name]].append(name)
+        return levels
+
+    def run(self, func: Callable[[str], Any],
+            max_workers: Optional[int] = None) -> Dict[str, Future]:
+        """Call func for every node, concurrently, once its dependencies succeeded.
+
+        Each node runs as soon as all its dependencies are done, so the whole
+        graph takes the time of its longest chain. The nodes whose
+        dependencies failed are not run, their futures hold a DependencyError.
+
+        Returns: the futures of all the nodes, all of them done.
+        """
+        futures: Dict[str, Future] = {name: Future() for name in self.order}
+        remaining = {name: len(deps) for name, deps in self.dependencies.items()}
+        dependents = self.dependents()
+        lock = threading.Lock()
+        done = threading.Event()
+        pending = len(self.order)
+
+        with ThreadPoolExecutor(max_workers=max_workers or len(self.order) or 1) as pool:
+
+            def finish(name: str) -> None:
+                nonlocal pending
+                ready = []
+                with lock:
+                    for dependent in dependents[name]:
+                        remaining[dependent] -= 1
+                        if remaining[dependent] == 0:
+                            ready.append(dependent)
+                    pending -= 1
+                    if pending == 0:
+                        done.set()
+                for dependent in ready:
+                    submit(dependent)
+
+            def call(name: str) -> None:
+                failed = next(
+                    (dep for dep in self.dependencies[name] if futures[dep].exception()),
+                    None,
+                )
+                if failed is not None:
+                    futures[name].set_exception(DependencyError(name, failed))
+                else:
+                    try:
+                        futures[name].set_result(func(name))
+                    except BaseException as e:
+                        futures[name].set_exception(e)
+                finish(name)
+
+            def submit(name: str) -> None:
+                pool.submit(call, name)
+
+            if not self.order:
+                return futures
+            for name in self.order:
+                if not self.dependencies[name]:
+                    submit(name)
+            done.wait()
+        return futures
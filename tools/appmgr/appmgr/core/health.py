@@ -0,0 +1,193 @@
+"""Waiting for containers to pass their healthchecks."""
+
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+
+from .exceptions import ContainerRuntimeError
+from .runtime import ContainerRuntime, EventStream, event_container_id, event_health_status
+from ..models import Container
+
+logger = logging.getLogger(__name__)
+
+# The events that tell about the health of a container: its health checks,
+# and its death ('died' for libpod)
+HEALTH_EVENTS = ["health_status", "die", "died"]
+
+
+class HealthWaiter:
+    """Wait for containers to become healthy, following the events of the runtime.
+
+    wait() returns a future per container, resolved with the inspected
+    container when it turns healthy, or failed with a ContainerRuntimeError
+    when it turns unhealthy, dies, or is still not healthy by its deadline.
+    All the containers share a single events stream, which is only open
+    while some of them are waited for. If the runtime can't stream its
+    events, the containers are inspected instead, with an exponential
+    backoff.
+    """
+
+    def __init__(self, runtime: ContainerRuntime, poll_interval: float = 0.1,
+                 max_poll_interval: float = 2.0):
+        self.runtime = runtime
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self._lock = threading.Lock()
+        self._futures: Dict[str, List[Future]] = {}
+        self._stream: Optional[EventStream] = None
+        self._events_available = True
+
+    def wait(self, container_id: str, timeout: float) -> Future:
+        """Start waiting for a container to become healthy."""
+        future: Future = Future()
+        with self._lock:
+            self._futures.setdefault(container_id, []).append(future)
+        future.add_done_callback(lambda f: self._forget(container_id, f))
+
+        timer = threading.Timer(timeout, self._expire, (container_id, future, timeout))
+        timer.daemon = True
+        timer.start()
+        future.add_done_callback(lambda f: timer.cancel())
+
+        # Subscribe before the first inspect, not to miss what happens in between
+        if self._subscribe():
+            self._check(container_id)
+        else:
+            threading.Thread(
+                target=self._poll, args=(container_id, future), daemon=True,
+                name=f"health-{container_id[:12]}",
+            ).start()
+        return future
+
+    def close(self) -> None:
+        """Give up on all the containers, and stop following the events."""
+        with self._lock:
+            futures = [f for fs in self._futures.values() for f in fs]
+        for future in futures:
+            self._resolve(future, error=ContainerRuntimeError("No longer waiting"))
+        self._unsubscribe()
+
+    def _subscribe(self) -> bool:
+        with self._lock:
+            if self._stream is not None:
+                return True
+            if not self._events_available:
+                return False
+            try:
+                self._stream = self.runtime.events(
+                    filters={"type": "container", "event": HEALTH_EVENTS}
+                )
+            except ContainerRuntimeError as e:
+                logger.debug(f"No events, inspecting the containers instead: {e}")
+                self._events_available = False
+                return False
+            stream = self._stream
+        threading.Thread(
+            target=self._follow, args=(stream,), daemon=True, name="health-events"
+        ).start()
+        return True
+
+    def _unsubscribe(self) -> None:
+        with self._lock:
+            stream, self._stream = self._stream, None
+        if stream is not None:
+            stream.close()
+
+    def _forget(self, container_id: str, future: Future) -> None:
+        with self._lock:
+            futures = self._futures.get(container_id, [])
+            if future in futures:
+                futures.remove(future)
+            if not futures:
+                self._futures.pop(container_id, None)
+            idle = not self._futures
+        if idle:
+            self._unsubscribe()
+
+    def _follow(self, stream: EventStream) -> None:
+        try:
+            for event in stream:
+                container_id = event_container_id(event)
+                with self._lock:
+                    watched = container_id in self._futures
+                if not watched:
+                    continue
+                status = event_health_status(event)
+                if status == "healthy" or status is None:
+                    # Healthy, or dead (unless it restarts): see for ourselves
+                    self._check(container_id)
+                elif status == "unhealthy":
+                    self._fail(container_id, ContainerRuntimeError(f"{container_id} is unhealthy"))
+        except Exception as e:
+            with self._lock:
+                current = self._stream is stream
+            if current:
+                logger.warning(f"Lost the events stream: {e}")
+        with self._lock:
+            if self._stream is not stream:
+                return
+            # The stream ended on its own, carry on by inspecting the containers
+            self._stream = None
+            self._events_available = False
+            pending = [(cid, f) for cid, fs in self._futures.items() for f in fs]
+        for container_id, future in pending:
+            threading.Thread(
+                target=self._poll, args=(container_id, future), daemon=True
+            ).start()
+
+    def _check(self, container_id: str) -> bool:
+        """Inspect a container, and resolve its futures if it's settled."""
+        try:
+            container = self.runtime.get_container(container_id)
+        except ContainerRuntimeError as e:
+            logger.debug(f"Failed to inspect {container_id}: {e}")
+            return False
+        if container is None:
+            error = ContainerRuntimeError(f"{container_id} disappeared")
+        elif container.health == "healthy":
+            with self._lock:
+                futures = list(self._futures.get(container_id, []))
+            for future in futures:
+                self._resolve(future, container)
+            return True
+        elif container.health == "unhealthy":
+            error = ContainerRuntimeError(f"{container.name} is unhealthy")
+        elif container.state in ("exited", "dead"):
+            error = ContainerRuntimeError(f"{container.name} exited")
+        else:
+            return False
+        self._fail(container_id, error)
+        return True
+
+    def _fail(self, container_id: str, error: Exception) -> None:
+        with self._lock:
+            futures = list(self._futures.get(container_id, []))
+        for future in futures:
+            self._resolve(future, error=error)
+
+    def _poll(self, container_id: str, future: Future) -> None:
+        delay = self.poll_interval
+        while not future.done():
+            if self._check(container_id):
+                return
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_poll_interval)
+
+    def _expire(self, container_id: str, future: Future, timeout: float) -> None:
+        self._resolve(future, error=ContainerRuntimeError(
+            f"{container_id} is not healthy after {timeout:g}s"
+        ))
+
+    @staticmethod
+    def _resolve(future: Future, container: Optional[Container] = None,
+                 error: Optional[Exception] = None) -> None:
+        try:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(container)
+        except Exception:
+            # InvalidStateError (3.8+): it was resolved in the meantime
+            pass
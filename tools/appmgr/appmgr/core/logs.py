@@ -0,0 +1,217 @@
+"""Merging the logs of the containers of an application."""
+
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from .runtime import LogStream
+
+logger = logging.getLogger(__name__)
+
+# How long a line waits for older lines of the other containers, when following
+FOLLOW_WINDOW = 0.1
+
+# How many lines can wait to be merged, shared between the streams, the readers
+# block beyond that
+MAX_BUFFERED_LINES = 1024
+
+# Opens the logs of a container: (name, follow, tail, since, until) -> LogStream
+LogOpener = Callable[[str, bool, Optional[int], Optional[float], Optional[float]], LogStream]
+
+
+class LogLine(NamedTuple):
+    """A line of the logs of a container."""
+    timestamp: int  # Nanoseconds since the epoch
+    container: str
+    text: str
+
+    @property
+    def time(self) -> datetime:
+        return datetime.fromtimestamp(self.timestamp / 1e9, tz=timezone.utc)
+
+
+def parse_timestamp(value: str) -> int:
+    """Parse an RFC 3339 timestamp, with up to nanoseconds, into nanoseconds since the epoch."""
+    value = value.replace("Z", "+00:00")
+    head, _, rest = value.partition(".")
+    digits = len(rest) - len(rest.lstrip("0123456789"))
+    fraction, offset = rest[:digits], rest[digits:]
+    seconds = datetime.fromisoformat(head + offset).timestamp()
+    return int(seconds) * 10**9 + int(fraction.ljust(9, "0")[:9] or 0)
+
+
+def parse_log_line(raw: str) -> Tuple[int, str]:
+    """Split a line the engines sent with timestamps=true into its timestamp and its text."""
+    stamp, _, text = raw.partition(" ")
+    try:
+        return parse_timestamp(stamp), text
+    except ValueError:
+        # A line without timestamp, keep it as it is
+        return 0, raw
+
+
+class LogMultiplexer:
+    """Merge the log streams of several containers into one, in time order.
+
+    Each stream is read by its own thread, into its own bounded queue: a
+    reader blocks when its lines are not consumed fast enough, and the
+    engine then stops sending. The merge holds the next line of every
+    stream, and lets the oldest one through once all the streams have one,
+    or ended, which orders the past logs exactly. Following streams that
+    may stay silent, a line waits for at most `window` seconds.
+
+    The lines outside of [since, until] are dropped, for the engines that
+    can't filter with the precision of the timestamps.
+    """
+
+    def __init__(self, streams: Dict[str, LogStream], window: Optional[float] = None,
+                 since: Optional[float] = None, until: Optional[float] = None,
+                 max_buffered: int = MAX_BUFFERED_LINES):
+        self.streams = streams
+        self.window = window
+        self.since = int(since * 1e9) if since else None
+        self.until = int(until * 1e9) if until else None
+        size = max(1, max_buffered // max(1, len(streams)))
+        self._queues: Dict[str, "queue.Queue[Optional[Tuple[int, str]]]"] = {
+            name: queue.Queue(size) for name in streams
+        }
+        self._ready = threading.Condition()
+        self._closed = threading.Event()
+
+    def _read(self, name: str, stream: LogStream) -> None:
+        try:
+            for raw in stream:
+                if self._closed.is_set():
+                    break
+                timestamp, text = parse_log_line(raw)
+                if self.since is not None and timestamp < self.since:
+                    continue
+                if self.until is not None and timestamp > self.until:
+                    continue
+                self._put(name, (timestamp, text))
+        except Exception as e:
+            if not self._closed.is_set():
+                logger.warning(f"Lost the logs of {name}: {e}")
+        finally:
+            self._put(name, None)
+
+    def _put(self, name: str, item: Optional[Tuple[int, str]]) -> None:
+        while not self._closed.is_set():
+            try:
+                self._queues[name].put(item, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        with self._ready:
+            self._ready.notify()
+
+    def __iter__(self) -> Iterator[LogLine]:
+        for name, stream in self.streams.items():
+            threading.Thread(
+                target=self._read, args=(name, stream), daemon=True, name=f"logs-{name}"
+            ).start()
+
+        live = set(self.streams)
+        # The next line of each stream: (timestamp, text, arrival)
+        heads: Dict[str, Tuple[int, str, float]] = {}
+        try:
+            while live or heads:
+                for name in [n for n in live if n not in heads]:
+                    try:
+                        item = self._queues[name].get_nowait()
+                    except queue.Empty:
+                        continue
+                    if item is None:
+                        live.discard(name)
+                    else:
+                        heads[name] = (item[0], item[1], time.monotonic())
+
+                waiting = [n for n in live if n not in heads]
+                timeout = None
+                if heads and waiting and self.window is not None:
+                    oldest = min(arrival for _, _, arrival in heads.values())
+                    timeout = oldest + self.window - time.monotonic()
+                if heads and (not waiting or (timeout is not None and timeout <= 0)):
+                    name = min(heads, key=lambda n: heads[n][0])
+                    timestamp, text, _ = heads.pop(name)
+                    yield LogLine(timestamp, name, text)
+                    continue
+                if not waiting:
+                    continue
+
+                with self._ready:
+                    if all(self._queues[n].empty() for n in waiting):
+                        self._ready.wait(min(timeout, 1.0) if timeout is not None else 1.0)
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        self._closed.set()
+        for stream in self.streams.values():
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+
+def multiplex_logs(
+    names: List[str],
+    open_logs: LogOpener,
+    follow: bool = False,
+    tail: Optional[int] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+) -> Iterator[LogLine]:
+    """The merged logs of several containers.
+
+    With a tail, each container sends its own last lines, and the last ones
+    of the merge are kept in a ring buffer of that size. When following,
+    the new lines are then asked for from the last line of each container.
+
+    Args:
+        names: The names of the containers.
+        open_logs: Opens the logs of a container, see LogOpener.
+        follow: Whether to carry on with the new lines.
+        tail: How many of the last lines to start with, or None for all.
+        since: Only the lines from this time on (Unix time), if not None.
+        until: Only the lines up to this time (Unix time), if not None.
+    """
+    if tail is None:
+        streams = {name: open_logs(name, follow, None, since, until) for name in names}
+        yield from LogMultiplexer(
+            streams, FOLLOW_WINDOW if follow else None, since, until
+        )
+        return
+
+    ring: "deque[LogLine]" = deque(maxlen=tail)
+    last: Dict[str, int] = {}
+    seen: Dict[str, Set[str]] = {}
+    if tail > 0:
+        streams = {name: open_logs(name, False, tail, since, until) for name in names}
+        for line in LogMultiplexer(streams, None, since, until):
+            ring.append(line)
+            if line.timestamp != last.get(line.container):
+                last[line.container] = line.timestamp
+                seen[line.container] = set()
+            seen[line.container].add(line.text)
+    yield from ring
+    if not follow:
+        return
+
+    # Carry on from where each container was, the engines only take whole seconds
+    streams = {
+        name: open_logs(name, True, None if name in last else 0,
+                        last[name] / 1e9 if name in last else since, until)
+        for name in names
+    }
+    for line in LogMultiplexer(streams, FOLLOW_WINDOW, since, until):
+        if line.container in last:
+            if line.timestamp < last[line.container]:
+                continue
+            if line.timestamp == last[line.container] and line.text in seen[line.container]:
+                continue
+        yield line
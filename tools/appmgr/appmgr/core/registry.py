@@ -0,0 +1,132 @@
+"""Minimal client for the registries, to compare digests without pulling."""
+
+import base64
+import json
+import logging
+import os
+import re
+import urllib.error
+import urllib.request
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlencode
+
+from .exceptions import RegistryError
+
+logger = logging.getLogger(__name__)
+
+DOCKER_HUB = "docker.io"
+DOCKER_HUB_API = "registry-1.docker.io"
+
+# What the engines ask for when they pull, so that the digests match the
+# RepoDigests of the local images (the index, for multi-arch images)
+MANIFEST_TYPES = ", ".join([
+    "application/vnd.oci.image.index.v1+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.oci.image.manifest.v1+json",
+    "application/vnd.docker.distribution.manifest.v2+json",
+])
+
+
+def split_registry(image_name: str) -> Tuple[str, str]:
+    """Split an image name into its registry and its repository."""
+    first, _, rest = image_name.partition("/")
+    if rest and ("." in first or ":" in first or first == "localhost"):
+        return first, rest
+    if not rest:
+        return DOCKER_HUB, f"library/{image_name}"
+    return DOCKER_HUB, image_name
+
+
+def get_registry_credentials(image_name: str) -> Optional[Tuple[str, str]]:
+    """The username and password for the registry of an image, from ~/.docker/config.json.
+
+    Only the credentials stored in the file itself are supported, not the
+    credential helpers.
+    """
+    registry, _ = split_registry(image_name)
+    if registry == DOCKER_HUB:
+        registry = "https://index.docker.io/v1/"
+    config_dir = os.environ.get("DOCKER_CONFIG") or os.path.join(Path.home(), ".docker")
+    try:
+        with open(os.path.join(config_dir, "config.json")) as f:
+            auths = json.load(f).get("auths", {})
+    except (OSError, ValueError):
+        return None
+    for server, entry in auths.items():
+        host = server.split("://", 1)[-1].split("/", 1)[0]
+        if server != registry and host != registry.split("://", 1)[-1].split("/", 1)[0]:
+            continue
+        if "auth" not in entry:
+            continue
+        username, _, password = base64.b64decode(entry["auth"]).decode().partition(":")
+        return username, password
+    return None
+
+
+def get_registry_auth(image_name: str) -> Optional[str]:
+    """Build the X-Registry-Auth header of the Engine API for an image."""
+    credentials = get_registry_credentials(image_name)
+    if credentials is None:
+        return None
+    registry, _ = split_registry(image_name)
+    server = "https://index.docker.io/v1/" if registry == DOCKER_HUB else registry
+    auth = {"username": credentials[0], "password": credentials[1], "serveraddress": server}
+    return base64.urlsafe_b64encode(json.dumps(auth).encode()).decode()
+
+
+def _parse_challenge(header: str) -> Dict[str, str]:
+    """Parse a 'Bearer realm="...",service="...",scope="..."' challenge."""
+    return dict(re.findall(r'(\w+)="([^"]*)"', header))
+
+
+def _get_token(challenge: Dict[str, str], credentials: Optional[Tuple[str, str]],
+               timeout: float) -> str:
+    params = {k: v for k, v in challenge.items() if k in ("service", "scope")}
+    request = urllib.request.Request(challenge["realm"] + "?" + urlencode(params))
+    if credentials:
+        basic = base64.b64encode(":".join(credentials).encode()).decode()
+        request.add_header("Authorization", f"Basic {basic}")
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        data = json.load(response)
+    return data.get("token") or data["access_token"]
+
+
+def remote_digest(image_name: str, tag: str = "latest", timeout: float = 10) -> str:
+    """Get the digest of an image on its registry, with a HEAD of its manifest.
+
+    Anonymous access goes through the token flow of the registries, with
+    the credentials of ~/.docker/config.json if there are some.
+
+    Raises:
+        RegistryError: If the registry can't be reached, or doesn't know the image.
+    """
+    if tag.startswith("sha256:"):
+        return tag
+    registry, repository = split_registry(image_name)
+    host = DOCKER_HUB_API if registry == DOCKER_HUB else registry
+    # Like the engines, registries on the loopback interface are spoken to in plain HTTP
+    scheme = "http" if host.split(":", 1)[0] in ("localhost", "127.0.0.1") else "https"
+    url = f"{scheme}://{host}/v2/{repository}/manifests/{tag}"
+    headers = {"Accept": MANIFEST_TYPES}
+    try:
+        for attempt in range(2):
+            request = urllib.request.Request(url, headers=headers, method="HEAD")
+            try:
+                with urllib.request.urlopen(request, timeout=timeout) as response:
+                    digest = response.headers.get("Docker-Content-Digest")
+                    break
+            except urllib.error.HTTPError as e:
+                challenge = e.headers.get("WWW-Authenticate", "")
+                if e.code != 401 or attempt or not challenge.lower().startswith("bearer"):
+                    raise
+                token = _get_token(
+                    _parse_challenge(challenge), get_registry_credentials(image_name), timeout
+                )
+                headers["Authorization"] = f"Bearer {token}"
+    except (OSError, ValueError, KeyError) as e:
+        # URLError and HTTPError are OSErrors
+        raise RegistryError(f"Failed to get the digest of {image_name}:{tag}: {e}")
+    if not digest:
+        raise RegistryError(f"{host} gave no digest for {image_name}:{tag}")
+    return digest
@@ -1,14 +1,327 @@
 """Container runtime abstraction layer."""
 
 import abc
+import itertools
+import json
 import logging
-from typing import Dict, List, Optional, Any, Union
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterator, List, Optional, Any, Union
 from pathlib import Path
+from urllib.parse import quote
 
-from ..models import Container, Image, Volume, Network
+from ..models import Container, Decoders, Image
+from .engine import (
+    EngineClient,
+    demux_log_stream,
+    encode_filters,
+    iter_log_frames,
+    iter_log_lines,
+    get_podman_socket_path,
+    split_image_name,
+)
+from .exceptions import ContainerRuntimeError, EngineAPIError, RegistryError
+from .registry import remote_digest
 
 logger = logging.getLogger(__name__)
 
+# When pull_image() pulls, the policies go from the one that pulls the most
+PULL_ALWAYS = "always"
+PULL_IF_DIGEST_CHANGED = "if-digest-changed"
+PULL_IF_NOT_PRESENT = "if-not-present"
+PULL_POLICIES = (PULL_ALWAYS, PULL_IF_DIGEST_CHANGED, PULL_IF_NOT_PRESENT)
+
+
+def needs_pull(local: Optional[Image], image_name: str, tag: str, policy: str) -> bool:
+    """Whether an image must be pulled, given the local one (None if missing).
+
+    With PULL_IF_DIGEST_CHANGED, the digest of the image on its registry is
+    compared with the ones of the local image. If the registry can't be
+    reached, the local image is used.
+    """
+    if policy not in PULL_POLICIES:
+        raise ValueError(f"Invalid pull policy: {policy}")
+    if policy == PULL_ALWAYS or local is None:
+        return True
+    if policy == PULL_IF_NOT_PRESENT or tag.startswith("sha256:"):
+        return False
+    try:
+        digest = remote_digest(image_name, tag)
+    except RegistryError as e:
+        logger.warning(f"{e}, using the local image")
+        return False
+    return not any(d.endswith("@" + digest) for d in local.digests)
+
+
+def parse_api_time(value: Any) -> datetime:
+    """Parse a timestamp from the Engine API.
+
+    Lists give Unix timestamps, inspects give RFC 3339 strings with up to
+    nanosecond precision, which datetime can't take as is.
+    """
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, tz=timezone.utc)
+    if not value:
+        return datetime.fromtimestamp(0, tz=timezone.utc)
+    value = value.replace("Z", "+00:00")
+    if "." in value:
+        head, tail = value.split(".", 1)
+        digits = len(tail) - len(tail.lstrip("0123456789"))
+        value = head + "." + tail[:min(digits, 6)].ljust(6, "0") + tail[digits:]
+    return datetime.fromisoformat(value)
+
+
+def _image_labels(data: Dict[str, Any]) -> Dict[str, str]:
+    labels = data.get("Labels")
+    if labels is None:
+        labels = (data.get("Config") or {}).get("Labels")
+    return labels or {}
+
+
+# The fields of an Image, from an image summary or inspect result
+IMAGE_DECODERS: Decoders = {
+    "id": lambda d: d["Id"],
+    "tags": lambda d: [t for t in d.get("RepoTags") or [] if t != "<none>:<none>"],
+    "created": lambda d: d.get("Created", ""),
+    "size": lambda d: d.get("Size", 0),
+    "labels": _image_labels,
+    "digests": lambda d: d.get("RepoDigests") or [],
+}
+
+
+def image_from_api(data: Dict[str, Any]) -> Image:
+    """Build an Image from an image summary or inspect result."""
+    return Image.from_api(data, IMAGE_DECODERS)
+
+
+def _summary_ports(data: Dict[str, Any]) -> Dict[str, List[Dict[str, str]]]:
+    ports: Dict[str, List[Dict[str, str]]] = {}
+    for p in data.get("Ports") or []:
+        key = f"{p['PrivatePort']}/{p.get('Type', 'tcp')}"
+        bindings = ports.setdefault(key, [])
+        if "PublicPort" in p:
+            bindings.append({"HostIp": p.get("IP", ""), "HostPort": str(p["PublicPort"])})
+    return ports
+
+
+def _libpod_ports(data: Dict[str, Any]) -> Dict[str, List[Dict[str, str]]]:
+    ports: Dict[str, List[Dict[str, str]]] = {}
+    for p in data.get("Ports") or []:
+        for i in range(p.get("range") or 1):
+            key = f"{p['container_port'] + i}/{p.get('protocol', 'tcp')}"
+            ports.setdefault(key, []).append(
+                {"HostIp": p.get("host_ip", ""), "HostPort": str(p["host_port"] + i)}
+            )
+    return ports
+
+
+def _summary_image(data: Dict[str, Any]) -> Image:
+    return Image(id=data.get("ImageID", ""), tags=[data.get("Image", "")], created="", size=0)
+
+
+# The fields of a Container, from a container summary, as returned by a list
+CONTAINER_SUMMARY_DECODERS: Decoders = {
+    "id": lambda d: d["Id"],
+    "name": lambda d: (d["Names"] or [""])[0].lstrip("/"),
+    "image": _summary_image,
+    "status": lambda d: d.get("Status", ""),
+    "state": lambda d: d.get("State", ""),
+    "created": lambda d: parse_api_time(d.get("Created")),
+    "ports": _summary_ports,
+    "labels": lambda d: d.get("Labels") or {},
+    "network_settings": lambda d: d.get("NetworkSettings") or {},
+}
+
+# The fields of a Container, from an inspect result
+CONTAINER_INSPECT_DECODERS: Decoders = {
+    "id": lambda d: d["Id"],
+    "name": lambda d: d.get("Name", "").lstrip("/"),
+    "image": lambda d: Image(
+        id=d.get("Image", ""), tags=[(d.get("Config") or {}).get("Image", "")], created="", size=0
+    ),
+    "status": lambda d: (d.get("State") or {}).get("Status", ""),
+    "state": lambda d: (d.get("State") or {}).get("Status", ""),
+    "created": lambda d: parse_api_time(d.get("Created")),
+    "ports": lambda d: {
+        k: v or [] for k, v in ((d.get("NetworkSettings") or {}).get("Ports") or {}).items()
+    },
+    "labels": lambda d: (d.get("Config") or {}).get("Labels") or {},
+    "network_settings": lambda d: d.get("NetworkSettings") or {},
+    "health": lambda d: ((d.get("State") or {}).get("Health") or {}).get("Status"),
+}
+
+# The fields of a Container, from a libpod container summary
+LIBPOD_CONTAINER_DECODERS: Decoders = {
+    "id": lambda d: d["Id"],
+    "name": lambda d: (d.get("Names") or [""])[0],
+    "image": _summary_image,
+    "status": lambda d: d.get("Status") or d.get("State", ""),
+    "state": lambda d: d.get("State", ""),
+    "created": lambda d: parse_api_time(d.get("Created")),
+    "ports": _libpod_ports,
+    "labels": lambda d: d.get("Labels") or {},
+    "network_settings": lambda d: {"Networks": d.get("Networks") or []},
+}
+
+
+def container_from_api(data: Dict[str, Any]) -> Container:
+    """Build a Container from a container summary or inspect result."""
+    if "Names" in data:
+        return Container.from_api(data, CONTAINER_SUMMARY_DECODERS)
+    return Container.from_api(data, CONTAINER_INSPECT_DECODERS)
+
+
+def containers_from_api(items: List[Dict[str, Any]]) -> List[Container]:
+    """Build the Containers of a list of container summaries."""
+    return Container.from_list(items, CONTAINER_SUMMARY_DECODERS)
+
+
+def container_from_libpod_summary(data: Dict[str, Any]) -> Container:
+    """Build a Container from a libpod container summary."""
+    return Container.from_api(data, LIBPOD_CONTAINER_DECODERS)
+
+
+def healthcheck_from_options(options: Dict[str, Any]) -> Dict[str, Any]:
+    """Translate docker-py healthcheck options (durations in ns) into the API's."""
+    keys = {
+        "test": "Test",
+        "interval": "Interval",
+        "timeout": "Timeout",
+        "retries": "Retries",
+        "start_period": "StartPeriod",
+    }
+    result = {keys.get(k, k): v for k, v in options.items() if v is not None}
+    if isinstance(result.get("Test"), str):
+        result["Test"] = ["CMD-SHELL", result["Test"]]
+    return result
+
+
+def build_podman_spec(
+    image: str,
+    name: Optional[str] = None,
+    command: Optional[Union[str, List[str]]] = None,
+    environment: Optional[Dict[str, str]] = None,
+    volumes: Optional[Dict[str, Dict[str, str]]] = None,
+    ports: Optional[Dict[str, Union[int, str]]] = None,
+    remove: bool = False,
+    labels: Optional[Dict[str, str]] = None,
+    network: Optional[str] = None,
+    user: Optional[str] = None,
+    working_dir: Optional[str] = None,
+    entrypoint: Optional[Union[str, List[str]]] = None,
+    restart_policy: Optional[Dict[str, Any]] = None,
+    hostname: Optional[str] = None,
+    tty: bool = False,
+    healthcheck: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """Translate run_container() arguments into a libpod container spec.
+
+    The arguments follow docker-py's containers.run(), like for the other
+    runtimes.
+    """
+    spec: Dict[str, Any] = {"image": image, "remove": remove, "terminal": tty}
+    if name:
+        spec["name"] = name
+    if isinstance(command, str):
+        command = ["/bin/sh", "-c", command]
+    if command is not None:
+        spec["command"] = command
+    if isinstance(entrypoint, str):
+        entrypoint = [entrypoint]
+    if entrypoint is not None:
+        spec["entrypoint"] = entrypoint
+    if environment:
+        spec["env"] = dict(environment)
+    if labels:
+        spec["labels"] = labels
+    if user:
+        spec["user"] = user
+    if working_dir:
+        spec["work_dir"] = working_dir
+    if hostname:
+        spec["hostname"] = hostname
+    for source, v in (volumes or {}).items():
+        options = [v.get("mode", "rw")]
+        if source.startswith("/"):
+            spec.setdefault("mounts", []).append({
+                "Type": "bind", "Source": source, "Destination": v["bind"], "Options": options
+            })
+        else:
+            spec.setdefault("volumes", []).append(
+                {"Name": source, "Dest": v["bind"], "Options": options}
+            )
+    for port, host in (ports or {}).items():
+        port, _, protocol = str(port).partition("/")
+        mapping: Dict[str, Any] = {"container_port": int(port), "protocol": protocol or "tcp"}
+        if isinstance(host, tuple):
+            mapping["host_ip"], mapping["host_port"] = host[0], int(host[1])
+        elif host is not None:
+            mapping["host_port"] = int(host)
+        spec.setdefault("portmappings", []).append(mapping)
+    if network:
+        spec["netns"] = {"nsmode": "bridge"}
+        spec["Networks"] = {network: {}}
+    if restart_policy:
+        spec["restart_policy"] = restart_policy.get("Name", "no")
+        if restart_policy.get("MaximumRetryCount"):
+            spec["restart_tries"] = restart_policy["MaximumRetryCount"]
+    if healthcheck:
+        spec["healthconfig"] = healthcheck_from_options(healthcheck)
+    return spec
+
+
+class ClosableStream:
+    """What a runtime sends, as it comes.
+
+    close() can be called from another thread, to stop a reader blocked
+    waiting for the next item.
+    """
+
+    def __init__(self, items: Iterator[Any], close: Callable[[], None]):
+        self._items = items
+        self._close = close
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self._items)
+
+    def close(self) -> None:
+        self._close()
+
+
+class EventStream(ClosableStream):
+    """The decoded events of a runtime."""
+
+
+class LogStream(ClosableStream):
+    """The lines of the logs of a container, each one starting with its timestamp."""
+
+
+class StatsStream(ClosableStream):
+    """The resource usage of a container, as the Engine API sends it, about once a second."""
+
+
+def event_container_id(event: Dict[str, Any]) -> str:
+    """The id of the container of an event."""
+    return event.get("id") or (event.get("Actor") or {}).get("ID", "")
+
+
+def event_health_status(event: Dict[str, Any]) -> Optional[str]:
+    """The health status of a health_status event, None for the other events.
+
+    Docker puts it in the action ('health_status: healthy'), libpod in the
+    attributes of the actor.
+    """
+    action = event.get("Action") or event.get("status") or ""
+    if not action.startswith("health_status"):
+        return None
+    status = action.partition(":")[2].strip()
+    attributes = (event.get("Actor") or {}).get("Attributes") or {}
+    return status or attributes.get("health_status") or event.get("HealthStatus")
+
+
 class ContainerRuntime(abc.ABC):
     """Abstract base class for container runtimes."""
     
@@ -27,8 +340,17 @@ class ContainerRuntime(abc.ABC):
         pass
     
     @abc.abstractmethod
-    def pull_image(self, image_name: str, tag: str = "latest") -> Image:
-        """Pull a container image from a registry."""
+    def pull_image(self, image_name: str, tag: str = "latest",
+                   policy: str = PULL_ALWAYS) -> Image:
+        """Pull a container image from a registry.
+
+        Args:
+            image_name: The name of the image.
+            tag: Its tag, or digest.
+            policy: When to pull: PULL_ALWAYS, PULL_IF_NOT_PRESENT, or
+                PULL_IF_DIGEST_CHANGED, to pull only if the registry has
+                another image under that tag.
+        """
         pass
     
     @abc.abstractmethod
@@ -77,6 +399,41 @@ class ContainerRuntime(abc.ABC):
         """Get logs from a container."""
         pass
 
+    def stream_logs(
+        self,
+        container_id: str,
+        follow: bool = False,
+        tail: Optional[int] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None
+    ) -> LogStream:
+        """Stream the logs of a container, line by line, with their timestamps.
+
+        Args:
+            container_id: The id or name of the container.
+            follow: Whether to carry on with the new lines.
+            tail: How many of the last lines to start with, or None for all.
+            since: Only the lines from this time on (Unix time), if not None.
+            until: Only the lines up to this time (Unix time), if not None.
+        """
+        raise ContainerRuntimeError(f"{self.runtime_name} can't stream logs")
+
+    def stats(self, container_id: str) -> StatsStream:
+        """Follow the resource usage of a container, like 'docker stats'.
+
+        Raises:
+            ContainerRuntimeError: If the runtime can't stream the stats.
+        """
+        raise ContainerRuntimeError(f"{self.runtime_name} can't stream stats")
+
+    def events(self, filters: Optional[Dict] = None) -> EventStream:
+        """Follow the events of the runtime, like 'docker events'.
+
+        Raises:
+            ContainerRuntimeError: If the runtime can't stream its events.
+        """
+        raise ContainerRuntimeError(f"{self.runtime_name} has no events stream")
+
 
 class DockerRuntime(ContainerRuntime):
     """Docker container runtime implementation."""
@@ -105,38 +462,187 @@ class DockerRuntime(ContainerRuntime):
         except ImportError:
             return False
     
-    def pull_image(self, image_name: str, tag: str = "latest") -> Image:
+    def _ensure_connected(self) -> None:
+        if not self.connected and not self.connect():
+            raise ContainerRuntimeError("Not connected to Docker daemon")
+
+    def pull_image(self, image_name: str, tag: str = "latest",
+                   policy: str = PULL_ALWAYS) -> Image:
+        import docker
         if not self.connected and not self.connect():
             raise ContainerRuntimeError("Not connected to Docker daemon")
             
-        full_image = f"{image_name}:{tag}"
+        full_image = f"{image_name}@{tag}" if ":" in tag else f"{image_name}:{tag}"
+        if policy != PULL_ALWAYS:
+            try:
+                local: Optional[Image] = image_from_api(self._client.api.inspect_image(full_image))
+            except docker.errors.NotFound:
+                local = None
+            if not needs_pull(local, image_name, tag, policy):
+                logger.debug(f"Image {full_image} is up to date")
+                return local
         logger.info(f"Pulling image {full_image}")
         
         try:
             image = self._client.images.pull(image_name, tag=tag)
-            return Image(
-                id=image.short_id,
-                tags=image.tags,
-                created=image.attrs['Created'],
-                size=image.attrs['Size']
-            )
+            # The full id, like the other runtimes: it's the key of the
+            # images in the state store
+            return image_from_api(image.attrs)
         except Exception as e:
             logger.error(f"Failed to pull image {full_image}: {e}")
             raise ContainerRuntimeError(f"Failed to pull image {full_image}: {e}")
 
+    def run_container(
+        self,
+        image: str,
+        name: Optional[str] = None,
+        command: Optional[Union[str, List[str]]] = None,
+        environment: Optional[Dict[str, str]] = None,
+        volumes: Optional[Dict[str, Dict[str, str]]] = None,
+        ports: Optional[Dict[str, Union[int, str]]] = None,
+        detach: bool = False,
+        remove: bool = False,
+        **kwargs
+    ) -> Container:
+        self._ensure_connected()
+        try:
+            container = self._client.containers.create(
+                image,
+                command,
+                name=name,
+                environment=environment,
+                volumes=volumes,
+                ports=ports,
+                auto_remove=remove and detach,
+                **kwargs
+            )
+            container.start()
+            if not detach:
+                container.wait()
+            container.reload()
+            result = container_from_api(container.attrs)
+            if remove and not detach:
+                container.remove(force=True)
+            return result
+        except Exception as e:
+            logger.error(f"Failed to run container from {image}: {e}")
+            raise ContainerRuntimeError(f"Failed to run container from {image}: {e}")
+
+    def stop_container(self, container_id: str, timeout: int = 10) -> bool:
+        import docker
+        self._ensure_connected()
+        try:
+            self._client.api.stop(container_id, timeout=timeout)
+            return True
+        except docker.errors.NotFound:
+            return False
+        except docker.errors.APIError as e:
+            raise ContainerRuntimeError(f"Failed to stop container {container_id}: {e}")
+
+    def remove_container(self, container_id: str, force: bool = False) -> bool:
+        import docker
+        self._ensure_connected()
+        try:
+            self._client.api.remove_container(container_id, force=force)
+            return True
+        except docker.errors.NotFound:
+            return False
+        except docker.errors.APIError as e:
+            raise ContainerRuntimeError(f"Failed to remove container {container_id}: {e}")
+
+    def list_containers(self, all: bool = False, filters: Optional[Dict] = None) -> List[Container]:
+        self._ensure_connected()
+        # The low-level API returns the summaries as they are, where
+        # containers.list() would inspect every container
+        return containers_from_api(self._client.api.containers(all=all, filters=filters))
+
+    def get_container(self, container_id: str) -> Optional[Container]:
+        import docker
+        self._ensure_connected()
+        try:
+            return container_from_api(self._client.api.inspect_container(container_id))
+        except docker.errors.NotFound:
+            return None
+
+    def get_container_logs(
+        self,
+        container_id: str,
+        follow: bool = False,
+        tail: Optional[int] = None
+    ) -> str:
+        self._ensure_connected()
+        try:
+            logs = self._client.api.logs(
+                container_id, follow=follow, tail="all" if tail is None else tail
+            )
+        except Exception as e:
+            raise ContainerRuntimeError(f"Failed to get logs of {container_id}: {e}")
+        return logs.decode(errors="replace")
+
+    def stream_logs(
+        self,
+        container_id: str,
+        follow: bool = False,
+        tail: Optional[int] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None
+    ) -> LogStream:
+        self._ensure_connected()
+        # docker-py wants whole seconds, the caller drops the extra lines
+        try:
+            stream = self._client.api.logs(
+                container_id, stream=True, follow=follow, timestamps=True,
+                tail="all" if tail is None else tail,
+                since=int(since) if since else None,
+                until=int(until) + 1 if until else None,
+            )
+        except Exception as e:
+            raise ContainerRuntimeError(f"Failed to get logs of {container_id}: {e}")
+        # The stream is demultiplexed already
+        return LogStream(iter_log_lines((1, chunk) for chunk in stream), stream.close)
+
+    def stats(self, container_id: str) -> StatsStream:
+        self._ensure_connected()
+        try:
+            samples = self._client.api.stats(container_id, decode=True, stream=True)
+        except Exception as e:
+            raise ContainerRuntimeError(f"Failed to get stats of {container_id}: {e}")
+        # docker-py gives a bare generator, that can't be closed from another
+        # thread: the reader stops at the next sample instead
+        closed = threading.Event()
+        return StatsStream(
+            itertools.takewhile(lambda _: not closed.is_set(), samples), closed.set
+        )
+
+    def events(self, filters: Optional[Dict] = None) -> EventStream:
+        self._ensure_connected()
+        try:
+            # A CancellableStream, whose close() shuts the socket down
+            stream = self._client.api.events(decode=True, filters=filters)
+        except Exception as e:
+            raise ContainerRuntimeError(f"Failed to follow the events: {e}")
+        return EventStream(stream, stream.close)
+
 
 class PodmanRuntime(ContainerRuntime):
-    """Podman container runtime implementation."""
-    
-    def __init__(self):
+    """Podman container runtime, over the libpod REST API.
+
+    It talks to the socket of the Podman service, the rootless one of the
+    user (see 'systemctl --user enable --now podman.socket'), or the system
+    one when running as root. No privilege escalation is needed.
+    """
+
+    API = "/libpod"
+
+    def __init__(self, socket_path: Optional[str] = None):
         super().__init__("podman")
-        self._client = None
-    
+        self.socket_path = socket_path or get_podman_socket_path()
+        self._client: Optional[EngineClient] = None
+
     def connect(self) -> bool:
         try:
-            import podman
-            self._client = podman.PodmanClient()
-            self._client.ping()
+            self._client = EngineClient(self.socket_path)
+            self._client.request("GET", f"{self.API}/_ping").read()
             self.connected = True
             logger.info("Connected to Podman service")
             return True
@@ -144,30 +650,291 @@ class PodmanRuntime(ContainerRuntime):
             logger.error(f"Failed to connect to Podman: {e}")
             self.connected = False
             return False
-    
+
     def is_available(self) -> bool:
+        return os.path.exists(self.socket_path)
+
+    def _ensure_connected(self) -> None:
+        if not self.connected and not self.connect():
+            raise ContainerRuntimeError("Not connected to Podman service")
+
+    # The pull policies of libpod, 'newer' compares the digests like we do
+    LIBPOD_PULL_POLICIES = {
+        PULL_ALWAYS: None,
+        PULL_IF_NOT_PRESENT: "missing",
+        PULL_IF_DIGEST_CHANGED: "newer",
+    }
+
+    def pull_image(self, image_name: str, tag: str = "latest",
+                   policy: str = PULL_ALWAYS) -> Image:
+        self._ensure_connected()
+        if policy not in self.LIBPOD_PULL_POLICIES:
+            raise ValueError(f"Invalid pull policy: {policy}")
+        full_image = f"{image_name}@{tag}" if ":" in tag else f"{image_name}:{tag}"
+        logger.info(f"Pulling image {full_image}")
+
         try:
-            import podman
-            return True
-        except ImportError:
-            return False
-    
-    # Implement other required methods similar to DockerRuntime
-    # ...
+            stream = self._client.request(
+                "POST", f"{self.API}/images/pull",
+                {"reference": full_image, "policy": self.LIBPOD_PULL_POLICIES[policy]}, timeout=None
+            )
+            for line in stream.iter_lines():
+                report = json.loads(line)
+                if report.get("error"):
+                    raise ContainerRuntimeError(report["error"])
+            data = self._client.json(
+                "GET", f"{self.API}/images/{quote(full_image, safe='')}/json"
+            )
+        except ContainerRuntimeError as e:
+            logger.error(f"Failed to pull image {full_image}: {e}")
+            raise ContainerRuntimeError(f"Failed to pull image {full_image}: {e}")
+        return image_from_api(data)
+
+    def run_container(
+        self,
+        image: str,
+        name: Optional[str] = None,
+        command: Optional[Union[str, List[str]]] = None,
+        environment: Optional[Dict[str, str]] = None,
+        volumes: Optional[Dict[str, Dict[str, str]]] = None,
+        ports: Optional[Dict[str, Union[int, str]]] = None,
+        detach: bool = False,
+        remove: bool = False,
+        **kwargs
+    ) -> Container:
+        self._ensure_connected()
+        spec = build_podman_spec(
+            image, name, command, environment, volumes, ports, remove=remove and detach,
+            **kwargs
+        )
+        try:
+            try:
+                created = self._client.json("POST", f"{self.API}/containers/create", body=spec)
+            except EngineAPIError as e:
+                if e.status != 404:
+                    raise
+                # Like 'podman run', pull the image if it's missing
+                self.pull_image(*split_image_name(image))
+                created = self._client.json("POST", f"{self.API}/containers/create", body=spec)
+            container_id = created["Id"]
+            self._client.request("POST", f"{self.API}/containers/{container_id}/start").read()
+            if not detach:
+                self._client.request(
+                    "POST", f"{self.API}/containers/{container_id}/wait", timeout=None
+                ).read()
+            result = self._inspect(container_id)
+        except ContainerRuntimeError as e:
+            logger.error(f"Failed to run container from {image}: {e}")
+            raise ContainerRuntimeError(f"Failed to run container from {image}: {e}")
+        if remove and not detach:
+            self.remove_container(container_id, force=True)
+        return result
 
+    def _inspect(self, container_id: str) -> Container:
+        return container_from_api(
+            self._client.json("GET", f"{self.API}/containers/{quote(container_id, safe='')}/json")
+        )
 
-def get_available_runtimes() -> Dict[str, ContainerRuntime]:
-    """Get a dictionary of available container runtimes."""
-    runtimes = {}
-    
-    # Check for Docker
-    docker_rt = DockerRuntime()
-    if docker_rt.is_available() and docker_rt.connect():
-        runtimes["docker"] = docker_rt
-    
-    # Check for Podman
-    podman_rt = PodmanRuntime()
-    if podman_rt.is_available() and podman_rt.connect():
-        runtimes["podman"] = podman_rt
-    
+    def stop_container(self, container_id: str, timeout: int = 10) -> bool:
+        self._ensure_connected()
+        try:
+            self._client.request(
+                "POST", f"{self.API}/containers/{quote(container_id, safe='')}/stop",
+                {"timeout": timeout}, timeout=self._client.timeout + timeout
+            ).read()
+        except EngineAPIError as e:
+            if e.status == 404:
+                return False
+            raise ContainerRuntimeError(f"Failed to stop container {container_id}: {e}")
+        return True
+
+    def remove_container(self, container_id: str, force: bool = False) -> bool:
+        self._ensure_connected()
+        try:
+            self._client.request(
+                "DELETE", f"{self.API}/containers/{quote(container_id, safe='')}",
+                {"force": str(force).lower()}
+            ).read()
+        except EngineAPIError as e:
+            if e.status == 404:
+                return False
+            raise ContainerRuntimeError(f"Failed to remove container {container_id}: {e}")
+        return True
+
+    def list_containers(self, all: bool = False, filters: Optional[Dict] = None) -> List[Container]:
+        self._ensure_connected()
+        params: Dict[str, Any] = {"all": str(all).lower()}
+        if filters:
+            params["filters"] = encode_filters(filters)
+        data = self._client.json("GET", f"{self.API}/containers/json", params)
+        return Container.from_list(data, LIBPOD_CONTAINER_DECODERS)
+
+    def get_container(self, container_id: str) -> Optional[Container]:
+        self._ensure_connected()
+        try:
+            return self._inspect(container_id)
+        except EngineAPIError as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def get_container_logs(
+        self,
+        container_id: str,
+        follow: bool = False,
+        tail: Optional[int] = None
+    ) -> str:
+        self._ensure_connected()
+        path = f"{self.API}/containers/{quote(container_id, safe='')}"
+        info = self._client.json("GET", f"{path}/json")
+        params = {
+            "stdout": "true",
+            "stderr": "true",
+            "follow": str(follow).lower(),
+            "tail": "all" if tail is None else tail,
+        }
+        data = self._client.request("GET", f"{path}/logs", params, timeout=None).read()
+        if not (info.get("Config") or {}).get("Tty"):
+            data = demux_log_stream(data)
+        return data.decode(errors="replace")
+
+    def stream_logs(
+        self,
+        container_id: str,
+        follow: bool = False,
+        tail: Optional[int] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None
+    ) -> LogStream:
+        self._ensure_connected()
+        path = f"{self.API}/containers/{quote(container_id, safe='')}"
+        info = self._client.json("GET", f"{path}/json")
+        params = {
+            "stdout": "true",
+            "stderr": "true",
+            "follow": str(follow).lower(),
+            "timestamps": "true",
+            "tail": "all" if tail is None else tail,
+            "since": f"{since:.9f}" if since else None,
+            "until": f"{until:.9f}" if until else None,
+        }
+        stream = self._client.request("GET", f"{path}/logs", params, timeout=None)
+        if (info.get("Config") or {}).get("Tty"):
+            frames = ((1, chunk) for chunk in stream.iter_chunks())
+        else:
+            frames = iter_log_frames(stream.iter_chunks())
+        return LogStream(iter_log_lines(frames), stream.abort)
+
+    def stats(self, container_id: str) -> StatsStream:
+        self._ensure_connected()
+        # The compat endpoint, whose samples are the ones of Docker
+        path = f"/containers/{quote(container_id, safe='')}/stats"
+        stream = self._client.request("GET", path, {"stream": "true"}, timeout=None)
+        return StatsStream((json.loads(line) for line in stream.iter_lines()), stream.abort)
+
+    def events(self, filters: Optional[Dict] = None) -> EventStream:
+        self._ensure_connected()
+        params: Dict[str, Any] = {"stream": "true"}
+        if filters:
+            params["filters"] = encode_filters(filters)
+        stream = self._client.request("GET", f"{self.API}/events", params, timeout=None)
+        return EventStream((json.loads(line) for line in stream.iter_lines()), stream.abort)
+
+
+# How long the runtimes get to answer, a hung socket must not stall appmgr
+RUNTIME_PROBE_TIMEOUT = 2.0
+
+# The supported runtimes, in order of preference
+RUNTIME_CLASSES = {
+    "docker": DockerRuntime,
+    "podman": PodmanRuntime,
+}
+
+
+def get_state_dir() -> Path:
+    """Directory where appmgr keeps its state, under XDG_STATE_HOME."""
+    base = os.environ.get("XDG_STATE_HOME") or str(Path.home() / ".local" / "state")
+    return Path(base) / "threatos" / "appmgr"
+
+
+def _read_last_runtime(state_file: Path) -> Optional[str]:
+    try:
+        with open(state_file) as f:
+            return json.load(f).get("runtime")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _write_last_runtime(state_file: Path, name: str) -> None:
+    tmp_file = state_file.with_suffix(".tmp")
+    try:
+        state_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp_file, "w") as f:
+            json.dump({"runtime": name}, f)
+        os.replace(tmp_file, state_file)
+    except OSError as e:
+        logger.debug(f"Failed to record the runtime in {state_file}: {e}")
+
+
+def probe_runtimes(names: List[str], timeout: float = RUNTIME_PROBE_TIMEOUT
+                   ) -> Dict[str, ContainerRuntime]:
+    """Connect to the given runtimes concurrently, and return the ones that answered.
+
+    The runtimes that don't answer within the timeout are left behind, the
+    probes run in daemon threads so that they don't hold the exit either.
+    """
+    results: "queue.Queue[tuple]" = queue.Queue()
+
+    def probe(name: str) -> None:
+        runtime = RUNTIME_CLASSES[name]()
+        try:
+            ok = runtime.is_available() and runtime.connect()
+        except Exception as e:
+            logger.debug(f"Probing {name} failed: {e}")
+            ok = False
+        results.put((name, runtime if ok else None))
+
+    for name in names:
+        threading.Thread(target=probe, args=(name,), name=f"probe-{name}", daemon=True).start()
+
+    found: Dict[str, ContainerRuntime] = {}
+    pending = set(names)
+    deadline = time.monotonic() + timeout
+    while pending:
+        try:
+            name, runtime = results.get(timeout=max(0, deadline - time.monotonic()))
+        except queue.Empty:
+            logger.warning(f"No answer from {', '.join(sorted(pending))} "
+                           f"within {timeout:g}s, giving up")
+            break
+        pending.discard(name)
+        if runtime is not None:
+            found[name] = runtime
+    # Keep the order of preference, not the order of the answers
+    return {name: found[name] for name in names if name in found}
+
+
+def get_available_runtimes(timeout: float = RUNTIME_PROBE_TIMEOUT,
+                           use_cache: bool = True) -> Dict[str, ContainerRuntime]:
+    """Get a dictionary of available container runtimes.
+
+    The runtime that worked last time is recorded in the state directory,
+    and tried alone first: the others are only probed if it fails.
+
+    Args:
+        timeout: How long the runtimes get to answer.
+        use_cache: Whether to try the runtime that worked last time first.
+    """
+    state_file = get_state_dir() / "runtime.json"
+    if use_cache:
+        last = _read_last_runtime(state_file)
+        if last in RUNTIME_CLASSES:
+            runtimes = probe_runtimes([last], timeout)
+            if runtimes:
+                return runtimes
+            logger.info(f"{last} is gone, probing all the runtimes")
+
+    runtimes = probe_runtimes(list(RUNTIME_CLASSES), timeout)
+    if runtimes:
+        _write_last_runtime(state_file, next(iter(runtimes)))
     return runtimes
@@ -0,0 +1,365 @@
+"""Persistent state of the installed applications, in SQLite."""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+from .runtime import get_state_dir
+from ..models import AppRecord
+
+logger = logging.getLogger(__name__)
+
+# The upserts (INSERT ... ON CONFLICT DO UPDATE) need SQLite 3.24
+MIN_SQLITE_VERSION = (3, 24, 0)
+
+# Bump it, and add the migration to MIGRATIONS, when the schema changes
+SCHEMA_VERSION = 1
+
+MIGRATIONS = {
+    1: """
+        CREATE TABLE apps (
+            app_id TEXT PRIMARY KEY,
+            version TEXT,
+            name TEXT,
+            image TEXT,
+            image_id TEXT,
+            packaging_revision_image TEXT,
+            packaging_revision_yaml TEXT,
+            source TEXT,
+            registry_url TEXT,
+            registry_image TEXT,
+            config_path TEXT,
+            config_mtime INTEGER,
+            config_size INTEGER,
+            installed_at REAL,
+            updated_at REAL,
+            state TEXT
+        );
+        CREATE INDEX apps_version ON apps (version);
+
+        -- What happened to the applications: install, upgrade, remove
+        CREATE TABLE events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            app_id TEXT NOT NULL,
+            action TEXT NOT NULL,
+            version TEXT,
+            previous_version TEXT,
+            image_id TEXT,
+            time REAL NOT NULL
+        );
+        CREATE INDEX events_app_id ON events (app_id, time);
+
+        -- The images seen for the applications, and their registry digests
+        CREATE TABLE images (
+            image_id TEXT PRIMARY KEY,
+            app_id TEXT,
+            name TEXT,
+            version TEXT,
+            digests TEXT,
+            seen_at REAL
+        );
+        CREATE INDEX images_app_id ON images (app_id, version);
+
+        -- The files of /appmgr in the images, which never change: image ids
+        -- are content-addressed
+        CREATE TABLE meta_files (
+            image_id TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            content TEXT NOT NULL,
+            PRIMARY KEY (image_id, filename)
+        );
+
+        -- What the records were computed from, to tell whether they're still
+        -- up to date, see set_fingerprint()
+        CREATE TABLE fingerprints (
+            name TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+
+        CREATE TABLE registry_checks (
+            app_id TEXT PRIMARY KEY,
+            url TEXT,
+            image TEXT,
+            versions TEXT,
+            max_version TEXT,
+            checked_at REAL
+        );
+    """,
+}
+
+# The columns of the apps table that an AppRecord holds
+APP_COLUMNS = (
+    "app_id", "version", "name", "image", "image_id", "packaging_revision_image",
+    "packaging_revision_yaml", "source", "registry_url", "registry_image", "config_path",
+    "config_mtime", "config_size", "installed_at", "updated_at",
+)
+
+
+def get_state_db_path(name: str = "state") -> Path:
+    return get_state_dir() / f"{name}.db"
+
+
+class StateStore:
+    """What appmgr knows about the installed applications, kept across commands.
+
+    The installed versions, the images and their digests, the metadata
+    read from the images and the last registry checks are recorded as
+    commands find them out, so that the next commands don't have to
+    compute them again from the engine and the YAML files. The callers
+    check the records against what they can see cheaply (the image ids,
+    the mtimes of the files) before they trust them.
+
+    The database is in WAL mode, so that appmgr and appmgrd can read it
+    while the other one writes. A store can be shared between threads.
+    It needs SQLite 3.24 or later, see MIN_SQLITE_VERSION.
+    """
+
+    def __init__(self, path: Optional[Union[str, Path]] = None):
+        if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+            raise sqlite3.NotSupportedError(
+                f"SQLite {sqlite3.sqlite_version} is too old for the state store, it needs "
+                + ".".join(map(str, MIN_SQLITE_VERSION))
+            )
+        self.path = str(path or get_state_db_path())
+        if self.path != ":memory:":
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.RLock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # Durable enough for a cache of what can be recomputed
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._migrate()
+
+    @classmethod
+    def open(cls, path: Optional[Union[str, Path]] = None) -> "StateStore":
+        """Open the store, or an in-memory one if it can't be written to.
+
+        Raises: sqlite3.NotSupportedError if SQLite is too old, in memory
+        or not.
+        """
+        try:
+            return cls(path)
+        except sqlite3.NotSupportedError:
+            raise
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"Failed to open the state store, not keeping any state: {e}")
+            return cls(":memory:")
+
+    def _migrate(self) -> None:
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        for target in range(version + 1, SCHEMA_VERSION + 1):
+            with self._conn:
+                self._conn.executescript(MIGRATIONS[target])
+                self._conn.execute(f"PRAGMA user_version = {target}")
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._lock, self._conn:
+            yield self._conn
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    # Applications
+
+    def get_app(self, app_id: str) -> Optional[AppRecord]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(APP_COLUMNS)} FROM apps WHERE app_id = ?", (app_id,)
+            ).fetchone()
+        return AppRecord(**dict(row)) if row else None
+
+    def list_apps(self) -> List[AppRecord]:
+        """The installed applications, sorted by id."""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(APP_COLUMNS)} FROM apps"
+                " WHERE version IS NOT NULL ORDER BY app_id"
+            ).fetchall()
+        return [AppRecord(**dict(row)) for row in rows]
+
+    def record_app(self, record: AppRecord) -> Optional[str]:
+        """Record an installed application, and what happened to it since last time.
+
+        Returns: 'install', or 'upgrade' when the version changed (either
+        way), or None.
+        """
+        now = time.time()
+        with self.transaction() as conn:
+            row = conn.execute(
+                f"SELECT {', '.join(APP_COLUMNS)} FROM apps WHERE app_id = ?", (record.app_id,)
+            ).fetchone()
+            previous = row["version"] if row else None
+            if previous is None:
+                action: Optional[str] = "install"
+                record.installed_at = now
+            else:
+                action = "upgrade" if previous != record.version else None
+                record.installed_at = row["installed_at"]
+                if all(row[c] == getattr(record, c) for c in APP_COLUMNS[:-1]):
+                    # Nothing new, and no write: most commands only read
+                    record.updated_at = row["updated_at"]
+                    return None
+            record.updated_at = now
+            values = {c: getattr(record, c) for c in APP_COLUMNS}
+            conn.execute(
+                f"INSERT INTO apps ({', '.join(APP_COLUMNS)})"
+                f" VALUES ({', '.join('?' for _ in APP_COLUMNS)})"
+                " ON CONFLICT (app_id) DO UPDATE SET "
+                + ", ".join(f"{c} = excluded.{c}" for c in APP_COLUMNS[1:]),
+                [values[c] for c in APP_COLUMNS],
+            )
+            if action:
+                conn.execute(
+                    "INSERT INTO events (app_id, action, version, previous_version, image_id,"
+                    " time) VALUES (?, ?, ?, ?, ?, ?)",
+                    (record.app_id, action, record.version, previous, record.image_id, now),
+                )
+        if action:
+            logger.debug(f"{record.app_id}: {action} {previous or ''} -> {record.version}")
+        return action
+
+    def remove_app(self, app_id: str) -> bool:
+        """Record that an application is no longer installed."""
+        with self.transaction() as conn:
+            row = conn.execute(
+                "SELECT version, image_id FROM apps WHERE app_id = ?", (app_id,)
+            ).fetchone()
+            if row is None or row["version"] is None:
+                return False
+            # The state of the application stays, for when it comes back
+            conn.execute(
+                "UPDATE apps SET version = NULL, image_id = NULL, updated_at = ?"
+                " WHERE app_id = ?", (time.time(), app_id),
+            )
+            conn.execute(
+                "INSERT INTO events (app_id, action, previous_version, image_id, time)"
+                " VALUES (?, 'remove', ?, ?, ?)",
+                (app_id, row["version"], row["image_id"], time.time()),
+            )
+        return True
+
+    def history(self, app_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """The installs, upgrades and removals, oldest first."""
+        query = "SELECT app_id, action, version, previous_version, image_id, time FROM events"
+        params: tuple = ()
+        if app_id is not None:
+            query += " WHERE app_id = ?"
+            params = (app_id,)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY time, id", params).fetchall()
+        return [dict(row) for row in rows]
+
+    def load_state(self, app_id: str) -> Dict[str, Any]:
+        """The state an application saved, see Application.state."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state FROM apps WHERE app_id = ?", (app_id,)
+            ).fetchone()
+        return json.loads(row["state"]) if row and row["state"] else {}
+
+    def save_state(self, app_id: str, state: Dict[str, Any]) -> None:
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT INTO apps (app_id, state) VALUES (?, ?)"
+                " ON CONFLICT (app_id) DO UPDATE SET state = excluded.state",
+                (app_id, json.dumps(state)),
+            )
+
+    # Images
+
+    def record_image(self, image_id: str, app_id: Optional[str] = None,
+                     name: Optional[str] = None, version: Optional[str] = None,
+                     digests: Optional[List[str]] = None) -> None:
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT INTO images (image_id, app_id, name, version, digests, seen_at)"
+                " VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (image_id) DO UPDATE SET"
+                " app_id = coalesce(excluded.app_id, app_id),"
+                " name = coalesce(excluded.name, name),"
+                " version = coalesce(excluded.version, version),"
+                " digests = coalesce(excluded.digests, digests),"
+                " seen_at = excluded.seen_at",
+                (image_id, app_id, name, version,
+                 json.dumps(digests) if digests is not None else None, time.time()),
+            )
+
+    def list_images(self, app_id: str) -> List[Dict[str, Any]]:
+        """The images seen for an application, the last seen first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT image_id, app_id, name, version, digests, seen_at FROM images"
+                " WHERE app_id = ? ORDER BY seen_at DESC", (app_id,)
+            ).fetchall()
+        images = [dict(row) for row in rows]
+        for image in images:
+            image["digests"] = json.loads(image["digests"]) if image["digests"] else []
+        return images
+
+    def get_meta_file(self, image_id: str, filename: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content FROM meta_files WHERE image_id = ? AND filename = ?",
+                (image_id, filename),
+            ).fetchone()
+        return row["content"] if row else None
+
+    def set_meta_file(self, image_id: str, filename: str, content: str) -> None:
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO meta_files (image_id, filename, content)"
+                " VALUES (?, ?, ?)", (image_id, filename, content),
+            )
+
+    # Fingerprints
+
+    def get_fingerprint(self, name: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM fingerprints WHERE name = ?", (name,)
+            ).fetchone()
+        return row["value"] if row else None
+
+    def set_fingerprint(self, name: str, value: str) -> None:
+        """Record what some records were computed from.
+
+        A caller that finds the same fingerprint later on can trust the
+        records, without computing them again.
+        """
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO fingerprints (name, value) VALUES (?, ?)", (name, value)
+            )
+
+    # Registries
+
+    def record_registry_check(self, app_id: str, url: str, image: str,
+                              versions: List[str], max_version: Optional[str]) -> None:
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO registry_checks"
+                " (app_id, url, image, versions, max_version, checked_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (app_id, url, image, json.dumps(versions), max_version, time.time()),
+            )
+
+    def get_registry_check(self, app_id: str) -> Optional[Dict[str, Any]]:
+        """The last check of the registry of an application, with its time (checked_at)."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT app_id, url, image, versions, max_version, checked_at"
+                " FROM registry_checks WHERE app_id = ?", (app_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        check = dict(row)
+        check["versions"] = json.loads(check["versions"] or "[]")
+        return check
@@ -0,0 +1,265 @@
+"""Sampling the resource usage of the containers of the applications."""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from .exceptions import ContainerRuntimeError
+from .runtime import ContainerRuntime, StatsStream
+from ..models import ContainerStats
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two samples; the engines send a sample a second anyway
+DEFAULT_INTERVAL = 2.0
+
+# Seconds between two listings of the containers, to follow the new ones
+REFRESH_INTERVAL = 10.0
+
+# Lists the containers to follow: container id -> (application id, component)
+ContainerLister = Callable[[], Dict[str, Tuple[str, str]]]
+
+
+def _sum_bytes(entries: Optional[List[Dict[str, Any]]], op: str) -> int:
+    return sum(e.get("value", 0) for e in entries or [] if e.get("op", "").lower() == op)
+
+
+def container_stats_from_api(data: Dict[str, Any], app_id: str, component: str) -> ContainerStats:
+    """Build a ContainerStats from a sample of the Engine API, the way 'docker stats' does."""
+    cpu = data.get("cpu_stats") or {}
+    precpu = data.get("precpu_stats") or {}
+    cpu_delta = ((cpu.get("cpu_usage") or {}).get("total_usage", 0)
+                 - (precpu.get("cpu_usage") or {}).get("total_usage", 0))
+    system_delta = cpu.get("system_cpu_usage", 0) - precpu.get("system_cpu_usage", 0)
+    online_cpus = (cpu.get("online_cpus")
+                   or len((cpu.get("cpu_usage") or {}).get("percpu_usage") or []) or 1)
+    cpu_percent = 0.0
+    # Without a previous sample, that would be the average since the container started
+    if precpu.get("system_cpu_usage") and cpu_delta > 0 and system_delta > 0:
+        cpu_percent = 100.0 * cpu_delta / system_delta * online_cpus
+
+    memory = data.get("memory_stats") or {}
+    details = memory.get("stats") or {}
+    # The page cache can be reclaimed, 'docker stats' leaves it out
+    cache = details.get("total_inactive_file", details.get("inactive_file", 0))
+    usage = memory.get("usage", 0)
+    networks = (data.get("networks") or {}).values()
+    blkio = (data.get("blkio_stats") or {}).get("io_service_bytes_recursive")
+    return ContainerStats(
+        app_id=app_id,
+        component=component,
+        cpu_percent=cpu_percent,
+        memory_usage=usage - cache if cache < usage else usage,
+        memory_limit=memory.get("limit", 0),
+        network_rx=sum(n.get("rx_bytes", 0) for n in networks),
+        network_tx=sum(n.get("tx_bytes", 0) for n in networks),
+        block_read=_sum_bytes(blkio, "read"),
+        block_write=_sum_bytes(blkio, "write"),
+        pids=(data.get("pids_stats") or {}).get("current", 0),
+    )
+
+
+def aggregate_stats(stats: List[ContainerStats]) -> Dict[str, ContainerStats]:
+    """Sum the usage of the containers of each application."""
+    totals: Dict[str, ContainerStats] = {}
+    for s in stats:
+        total = totals.setdefault(s.app_id, ContainerStats(s.app_id, None))
+        total.cpu_percent += s.cpu_percent
+        total.memory_usage += s.memory_usage
+        # The containers share the memory of the host, unless they are limited
+        total.memory_limit = max(total.memory_limit, s.memory_limit)
+        total.network_rx += s.network_rx
+        total.network_tx += s.network_tx
+        total.block_read += s.block_read
+        total.block_write += s.block_write
+        total.pids += s.pids
+    return totals
+
+
+class StatsSampler:
+    """Sample the resource usage of containers, at a fixed interval.
+
+    Each container is followed with its own stats stream, by its own
+    thread, which keeps the last sample it got: sampling is then just
+    reading those, and the only cost is decoding about a sample a second
+    per container. The containers are listed again every `refresh`
+    seconds, the streams of the containers that stopped end by themselves.
+
+    Iterating gives, every `interval` seconds, the stats of the followed
+    containers, sorted by application and component.
+    """
+
+    def __init__(self, runtime: ContainerRuntime, list_containers: ContainerLister,
+                 interval: float = DEFAULT_INTERVAL, refresh: float = REFRESH_INTERVAL):
+        self.runtime = runtime
+        self.list_containers = list_containers
+        self.interval = interval
+        self.refresh = refresh
+        self._lock = threading.Lock()
+        self._streams: Dict[str, StatsStream] = {}
+        self._owners: Dict[str, Tuple[str, str]] = {}
+        self._samples: Dict[str, Dict[str, Any]] = {}
+        self._closed = threading.Event()
+
+    def _follow(self, container_id: str, stream: StatsStream) -> None:
+        try:
+            for data in stream:
+                if self._closed.is_set():
+                    break
+                with self._lock:
+                    self._samples[container_id] = data
+        except Exception as e:
+            if not self._closed.is_set():
+                logger.debug(f"Lost the stats of {container_id}: {e}")
+        finally:
+            with self._lock:
+                if self._streams.get(container_id) is stream:
+                    del self._streams[container_id]
+                    self._samples.pop(container_id, None)
+
+    def _update(self) -> None:
+        """Start following the containers that are not yet."""
+        try:
+            owners = self.list_containers()
+        except ContainerRuntimeError as e:
+            logger.warning(f"Failed to list the containers: {e}")
+            return
+        for container_id, owner in owners.items():
+            with self._lock:
+                if container_id in self._streams:
+                    continue
+            try:
+                stream = self.runtime.stats(container_id)
+            except ContainerRuntimeError as e:
+                logger.debug(f"Failed to follow the stats of {container_id}: {e}")
+                continue
+            with self._lock:
+                self._streams[container_id] = stream
+                self._owners[container_id] = owner
+            threading.Thread(
+                target=self._follow, args=(container_id, stream), daemon=True,
+                name=f"stats-{container_id[:12]}",
+            ).start()
+
+    def sample(self) -> List[ContainerStats]:
+        """The last stats of each followed container."""
+        with self._lock:
+            samples = [(self._owners[cid], data) for cid, data in self._samples.items()]
+        stats = [container_stats_from_api(data, *owner) for owner, data in samples]
+        return sorted(stats, key=lambda s: (s.app_id, s.component or ""))
+
+    def __iter__(self) -> Iterator[List[ContainerStats]]:
+        try:
+            self._update()
+            refreshed = time.monotonic()
+            # The first samples come after a second or so, with the CPU usage
+            # only from the second one on
+            self._closed.wait(min(self.interval, 1.5))
+            start = time.monotonic()
+            ticks = 0
+            while not self._closed.is_set():
+                yield self.sample()
+                ticks += 1
+                # Keep to the schedule, whatever the consumer took
+                self._closed.wait(max(0.0, start + ticks * self.interval - time.monotonic()))
+                if time.monotonic() - refreshed >= self.refresh:
+                    self._update()
+                    refreshed = time.monotonic()
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        self._closed.set()
+        with self._lock:
+            streams = list(self._streams.values())
+        for stream in streams:
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+
+def stats_records(stats: List[ContainerStats], timestamp: float) -> List[Dict[str, Any]]:
+    """The stats of the containers, then of each application, as JSON objects."""
+    records = []
+    for s in stats + list(aggregate_stats(stats).values()):
+        record: Dict[str, Any] = {"time": round(timestamp, 3)}
+        record.update(vars(s))
+        record["cpu_percent"] = round(s.cpu_percent, 2)
+        records.append(record)
+    return records
+
+
+def format_ndjson(stats: List[ContainerStats], timestamp: float) -> str:
+    """One JSON object per line, see stats_records()."""
+    return "".join(
+        json.dumps(record, separators=(",", ":")) + "\n"
+        for record in stats_records(stats, timestamp)
+    )
+
+
+PROMETHEUS_METRICS = [
+    # (name, type, help, attribute)
+    ("cpu_percent", "gauge", "CPU usage, in percent of one CPU.", "cpu_percent"),
+    ("memory_usage_bytes", "gauge", "Memory usage, without the page cache.", "memory_usage"),
+    ("memory_limit_bytes", "gauge", "Memory limit.", "memory_limit"),
+    ("network_receive_bytes_total", "counter", "Bytes received.", "network_rx"),
+    ("network_transmit_bytes_total", "counter", "Bytes sent.", "network_tx"),
+    ("block_read_bytes_total", "counter", "Bytes read from block devices.", "block_read"),
+    ("block_write_bytes_total", "counter", "Bytes written to block devices.", "block_write"),
+    ("pids", "gauge", "Number of processes.", "pids"),
+]
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _value(value: float) -> str:
+    # Every digit of the byte counters, for rate() to see them grow
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+def format_prometheus(stats: List[ContainerStats]) -> str:
+    """The stats in the Prometheus text format, per component and per application.
+
+    The metrics are named appmgr_container_* for the components, and
+    appmgr_app_* for the sums over the applications.
+    """
+    totals = list(aggregate_stats(stats).values())
+    lines = []
+    for prefix, items in (("appmgr_container", stats), ("appmgr_app", totals)):
+        for name, kind, help, attribute in PROMETHEUS_METRICS:
+            lines.append(f"# HELP {prefix}_{name} {help}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for s in items:
+                labels = f'app="{_label(s.app_id)}"'
+                if s.component is not None:
+                    labels += f',component="{_label(s.component)}"'
+                lines.append(f"{prefix}_{name}{{{labels}}} {_value(getattr(s, attribute))}")
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path: Path, text: str) -> None:
+    """Write a file for the textfile collector of node_exporter, atomically.
+
+    The collector may read the file at any time, so it's written next to
+    it, then renamed.
+    """
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
@@ -0,0 +1,369 @@
+#! /usr/bin/python3
+
+"""appmgrd, a long-lived process that runs appmgr commands
+
+Every appmgr command starts a new interpreter, connects to the docker
+daemon, parses the appmgr.yaml files and scans the images. appmgrd does
+all of that once, keeps it warm (the docker objects are followed through
+the events stream, see DockerModel), and runs the commands that appmgr
+forwards to it over a Unix socket.
+
+The protocol is made of JSON objects, one per line. Once it made sure
+that the daemon runs as the same user (SO_PEERCRED), the client sends a
+single request:
+
+    {"argv": [...], "cwd": "...", "env": {...}, "tty": false}
+
+and the daemon replies with any number of output frames, followed by the
+exit code of the command:
+
+    {"stdout": "..."}
+    {"stderr": "..."}
+    {"exit": 0}
+
+Only the variables of FORWARDED_ENV are sent in "env", they replace the
+ones of the daemon for the time of the command.
+
+Commands run one at a time, as the Appmgr object holds per-command state.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import stat
+import struct
+import sys
+import tempfile
+import threading
+
+logger = logging.getLogger("appmgrd")
+
+# Commands that can run in the daemon: the ones that need neither a
+# terminal nor user interaction.
+FORWARDED_ACTIONS = [
+    "list",
+    "ls",
+    "prepare",
+    "upgrade",
+    "get-meta-file",
+    "get-upstream-version",
+    "gc",
+    "purge",
+]
+
+# The environment variables that appmgr, docker-py and requests read. The
+# rest of the environment of the client is none of the daemon's business.
+FORWARDED_ENV = {
+    "HOME",
+    "PATH",
+    "LANG",
+    "DISPLAY",
+    "XAUTHORITY",
+    "CONTAINER_HOST",
+    "REQUESTS_CA_BUNDLE",
+    "CURL_CA_BUNDLE",
+    "http_proxy",
+    "https_proxy",
+    "no_proxy",
+    "all_proxy",
+    "HTTP_PROXY",
+    "HTTPS_PROXY",
+    "NO_PROXY",
+    "ALL_PROXY",
+}
+FORWARDED_ENV_PREFIXES = ("APPMGR_", "DOCKER_", "XDG_", "LC_")
+
+# How long the versions found on remote registries are cached by the daemon
+REGISTRY_CACHE_TTL = 60
+
+
+def get_socket_path():
+    """Path of the appmgrd socket for the current user"""
+    path = os.getenv("APPMGRD_SOCKET")
+    if path:
+        return path
+    runtime_dir = os.getenv("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "appmgrd.sock")
+    # No runtime directory: one of our own in /tmp, see prepare_socket_path()
+    return os.path.join(
+        tempfile.gettempdir(), "appmgrd-%d" % os.getuid(), "appmgrd.sock"
+    )
+
+
+def prepare_socket_path(socket_path):
+    """Make room for the socket of the daemon
+
+    The directory of the socket is created if needed. It must be owned by
+    the current user and closed to the others, so that nobody can replace
+    the socket. A socket left by a previous daemon is removed.
+
+    Raises: OSError if the directory is not safe, or if the path is taken
+    by something else than a socket.
+    """
+    directory = os.path.dirname(os.path.abspath(socket_path))
+    try:
+        os.mkdir(directory, 0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(directory)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid():
+        raise PermissionError("%s is not a directory of the current user" % directory)
+    if st.st_mode & 0o022:
+        raise PermissionError("%s is writable by other users" % directory)
+    try:
+        st = os.lstat(socket_path)
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(st.st_mode):
+        raise FileExistsError("%s exists and is not a socket" % socket_path)
+    os.unlink(socket_path)
+
+
+def get_peer_uid(sock):
+    """The uid of the process at the other end of a Unix socket"""
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    _, uid, _ = struct.unpack("3i", creds)
+    return uid
+
+
+def filter_env(env):
+    """The variables of env that are forwarded to the daemon"""
+    return {
+        k: v
+        for k, v in env.items()
+        if k in FORWARDED_ENV or k.startswith(FORWARDED_ENV_PREFIXES)
+    }
+
+
+def forward_command(argv, socket_path=None):
+    """Run an appmgr command in appmgrd
+
+    Returns: the exit code of the command, or None if appmgrd is not
+    running, in which case the caller should run the command itself.
+    """
+    socket_path = socket_path or get_socket_path()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        logger.debug("appmgrd is not running, run in-process")
+        sock.close()
+        return None
+
+    # Whoever listens on the socket gets the environment and runs the
+    # command: it must be us.
+    uid = get_peer_uid(sock)
+    if uid != os.getuid():
+        logger.warning("%s belongs to uid %d, run in-process", socket_path, uid)
+        sock.close()
+        return None
+
+    request = {
+        "argv": argv,
+        "cwd": os.getcwd(),
+        "env": filter_env(os.environ),
+        "tty": sys.stderr.isatty(),
+    }
+    with sock, sock.makefile("rwb") as f:
+        f.write((json.dumps(request) + "\n").encode())
+        f.flush()
+        for line in f:
+            frame = json.loads(line)
+            if "stdout" in frame:
+                sys.stdout.write(frame["stdout"])
+                sys.stdout.flush()
+            elif "stderr" in frame:
+                sys.stderr.write(frame["stderr"])
+                sys.stderr.flush()
+            elif "exit" in frame:
+                return frame["exit"]
+
+    # The daemon went away in the middle of the command. Don't run it again
+    # in-process, it might have done part of the job already.
+    sys.stderr.write("appmgrd: connection lost\n")
+    return 1
+
+
+class FrameWriter(io.TextIOBase):
+    """A text stream that sends what's written to it as frames"""
+
+    def __init__(self, wfile, name, lock, tty=False):
+        self.wfile = wfile
+        self.name = name
+        self.lock = lock
+        self.tty = tty
+
+    def isatty(self):
+        return self.tty
+
+    def writable(self):
+        return True
+
+    def write(self, s):
+        if s:
+            with self.lock:
+                self.wfile.write((json.dumps({self.name: s}) + "\n").encode())
+                self.wfile.flush()
+        return len(s)
+
+
+@contextlib.contextmanager
+def environment(env):
+    """Temporarily replace the forwarded variables of the environment
+
+    The ones that env doesn't define are unset, the others are left alone.
+    """
+    saved = dict(os.environ)
+    for k in filter_env(saved):
+        del os.environ[k]
+    os.environ.update(filter_env(env))
+    try:
+        yield
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+
+
+@contextlib.contextmanager
+def working_directory(path):
+    saved = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(saved)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # The socket is only accessible to its owner, but let's make sure
+        uid = get_peer_uid(self.request)
+        if uid != os.getuid():
+            logger.warning("Rejecting connection from uid %d", uid)
+            return
+
+        try:
+            request = json.loads(self.rfile.readline())
+            argv = request["argv"]
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Rejecting malformed request")
+            return
+
+        logger.info("Running: appmgr %s", " ".join(argv))
+        exit_code = self.server.run_command(
+            argv,
+            request.get("cwd", "/"),
+            request.get("env", {}),
+            self.wfile,
+            request.get("tty", False),
+        )
+        try:
+            self.wfile.write((json.dumps({"exit": exit_code}) + "\n").encode())
+            self.wfile.flush()
+        except OSError:
+            logger.debug("Client went away before the end of the command")
+
+
+class AppmgrDaemon(socketserver.UnixStreamServer):
+    """Serve appmgr commands, one at a time, from a warm Appmgr object"""
+
+    def __init__(self, socket_path, appmgr):
+        self.appmgr = appmgr
+        self.appmgr.registry.cache_ttl = REGISTRY_CACHE_TTL
+        prepare_socket_path(socket_path)
+        old_umask = os.umask(0o177)
+        try:
+            super().__init__(socket_path, RequestHandler)
+        finally:
+            os.umask(old_umask)
+
+    def run_command(self, argv, cwd, env, wfile, tty):
+        appmgr = self.appmgr
+        lock = threading.Lock()
+        stdout = FrameWriter(wfile, "stdout", lock)
+        stderr = FrameWriter(wfile, "stderr", lock, tty=tty)
+        appmgr_logger = logging.getLogger("appmgr")
+        handlers = list(appmgr_logger.handlers)
+        exit_code = 0
+        try:
+            with contextlib.ExitStack() as stack:
+                stack.enter_context(environment(env))
+                stack.enter_context(working_directory(cwd))
+                stack.enter_context(contextlib.redirect_stdout(stdout))
+                stack.enter_context(contextlib.redirect_stderr(stderr))
+                appmgr.args = appmgr.parser.parse_args(argv)
+                appmgr.backend.engine = appmgr.args.engine
+                appmgr.setup_logging()
+                appmgr.args.func()
+        except SystemExit as e:
+            if e.code is None:
+                exit_code = 0
+            elif isinstance(e.code, int):
+                exit_code = e.code
+            else:
+                stderr.write("%s\n" % e.code)
+                exit_code = 1
+        except OSError as e:
+            # Most likely the client went away
+            logger.warning("Command failed: %s", e)
+            exit_code = 1
+        except Exception:
+            logger.exception("Command failed")
+            exit_code = 1
+        finally:
+            for handler in appmgr_logger.handlers[:]:
+                if handler not in handlers:
+                    appmgr_logger.removeHandler(handler)
+        return exit_code
+
+
+def main():
+    from . import Appmgr
+
+    parser = argparse.ArgumentParser(prog="appmgrd")
+    parser.add_argument(
+        "-v", "--verbose", action="count", default=0, help="increase verbosity"
+    )
+    parser.add_argument("--socket", help="path of the socket to listen on")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(name)s: %(message)s",
+    )
+
+    appmgr = Appmgr()
+    try:
+        appmgr.setup_docker()
+        appmgr.docker_model.load()
+    except Exception as e:
+        logger.error("No access to Docker: %s", e)
+        sys.exit(1)
+    appmgr.docker_model.watch()
+
+    socket_path = args.socket or get_socket_path()
+    try:
+        server = AppmgrDaemon(socket_path, appmgr)
+    except OSError as e:
+        logger.error("Cannot listen on %s: %s", socket_path, e)
+        sys.exit(1)
+    logger.info("Listening on %s", socket_path)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,164 @@
 """Data models for the ThreatOS Application Manager."""
 
-from dataclasses import dataclass, field
+from dataclasses import MISSING, Field, dataclass, field
 from datetime import datetime
-from typing import Dict, List, Optional, Any
+from typing import Callable, Dict, Iterable, List, Optional, Any, Tuple, Union
 
 __all__ = [
+    'ApiModel',
+    'AppRecord',
     'Application',
     'ApplicationConfig',
     'Container',
     'ContainerSpec',
+    'ContainerStats',
     'Image',
     'Network',
     'Volume',
     'VolumeSpec',
 ]
 
+# Decode the fields of a model from the JSON of the API: field name -> function of the JSON
+Decoders = Dict[str, Callable[[Dict[str, Any]], Any]]
+
+
+class _Field:
+    """A field of an ApiModel, stored in a slot, and decoded on its first access."""
+
+    __slots__ = ("name", "slot", "bit")
+
+    def __init__(self, name: str, slot: Any, bit: int):
+        self.name = name
+        self.slot = slot
+        self.bit = bit
+
+    def __get__(self, obj: Any, owner: type) -> Any:
+        if obj is None:
+            return self
+        # A bit per field tells whether it's decoded, an unset slot would
+        # raise an AttributeError, which costs more than the decoding
+        if obj._decoded & self.bit:
+            return self.slot.__get__(obj, owner)
+        value = obj._decode(self.name)
+        self.slot.__set__(obj, value)
+        obj._decoded |= self.bit
+        return value
+
+    def __set__(self, obj: Any, value: Any) -> None:
+        self.slot.__set__(obj, value)
+        obj._decoded |= self.bit
+
+
+class _ApiModelMeta(type):
+    """Turn the annotated fields of a class body into slots, like a slotted dataclass."""
+
+    def __new__(mcs, name: str, bases: Tuple[type, ...], namespace: Dict[str, Any]):
+        fields = tuple(f for f in namespace.get("__annotations__", {}) if not f.startswith("_"))
+        defaults = {f: namespace.pop(f) for f in fields if f in namespace}
+        namespace["__slots__"] = tuple(namespace.get("__slots__", ())) + tuple(
+            f"_{f}" for f in fields
+        )
+        cls = super().__new__(mcs, name, bases, namespace)
+        if fields:
+            cls._fields = fields
+            cls._defaults = defaults
+        for i, f in enumerate(fields):
+            setattr(cls, f, _Field(f, cls.__dict__[f"_{f}"], 1 << i))
+        return cls
+
+
+class ApiModel(metaclass=_ApiModelMeta):
+    """Base of the models of the objects of the container engines.
+
+    The fields are declared like the ones of a dataclass, and kept in
+    slots. A model built with from_api() keeps the JSON the engine sent,
+    and only decodes each field on its first access: listing hundreds of
+    containers doesn't copy their ports, labels or network settings until
+    they are used.
+    """
+
+    __slots__ = ("_raw", "_decoders", "_decoded")
+    _fields: Tuple[str, ...] = ()
+    _defaults: Dict[str, Any] = {}
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        self._decoded = 0
+        if len(args) > len(self._fields):
+            raise TypeError(f"{type(self).__name__} takes {len(self._fields)} arguments")
+        for name, value in zip(self._fields, args):
+            if name in kwargs:
+                raise TypeError(f"{type(self).__name__} got multiple values for {name!r}")
+            kwargs[name] = value
+        for name in self._fields:
+            if name in kwargs:
+                value = kwargs.pop(name)
+            elif name in self._defaults:
+                value = self._default(name)
+            else:
+                raise TypeError(f"{type(self).__name__} missing required argument: {name!r}")
+            setattr(self, name, value)
+        if kwargs:
+            raise TypeError(f"{type(self).__name__} got unexpected arguments: {', '.join(kwargs)}")
+        self._raw: Optional[Dict[str, Any]] = None
+        self._decoders: Optional[Decoders] = None
+
+    @classmethod
+    def from_api(cls, data: Dict[str, Any], decoders: Decoders) -> Any:
+        """Wrap the JSON of an object, to decode its fields with the decoders."""
+        obj = cls.__new__(cls)
+        obj._raw = data
+        obj._decoders = decoders
+        obj._decoded = 0
+        return obj
+
+    @classmethod
+    def from_list(cls, items: Iterable[Dict[str, Any]], decoders: Decoders) -> List[Any]:
+        """Wrap the JSON objects of a list response."""
+        new = cls.__new__
+        result = []
+        for data in items:
+            obj = new(cls)
+            obj._raw = data
+            obj._decoders = decoders
+            obj._decoded = 0
+            result.append(obj)
+        return result
+
+    @property
+    def raw(self) -> Optional[Dict[str, Any]]:
+        """The JSON the model was built from, if it was."""
+        return self._raw
+
+    def _default(self, name: str) -> Any:
+        default = self._defaults[name]
+        if isinstance(default, Field):
+            if default.default_factory is not MISSING:
+                return default.default_factory()
+            return default.default
+        return default
+
+    def _decode(self, name: str) -> Any:
+        decoders = self._decoders
+        if decoders is None:
+            raise AttributeError(name)
+        if name in decoders:
+            return decoders[name](self._raw)
+        if name in self._defaults:
+            return self._default(name)
+        raise AttributeError(f"{type(self).__name__} can't decode {name!r}")
+
+    def __eq__(self, other: Any) -> bool:
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, f) == getattr(other, f) for f in self._fields)
+
+    __hash__ = None  # type: ignore  # Mutable, like a dataclass
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{f}={getattr(self, f)!r}" for f in self._fields)
+        return f"{type(self).__name__}({fields})"
+
+
 @dataclass
 class Application:
     """Represents a containerized application."""
@@ -34,6 +178,25 @@ class Application:
     def version(self) -> str:
         return self.config.version
 
+@dataclass
+class AppRecord:
+    """What the state store knows about an installed application."""
+    app_id: str
+    version: Optional[str] = None
+    name: Optional[str] = None
+    image: Optional[str] = None  # The image name, without tag
+    image_id: Optional[str] = None
+    packaging_revision_image: Optional[str] = None
+    packaging_revision_yaml: Optional[str] = None
+    source: Optional[str] = None  # 'registry', 'tarball' or 'local'
+    registry_url: Optional[str] = None
+    registry_image: Optional[str] = None
+    config_path: Optional[str] = None  # The config file, and its mtime (ns) and size
+    config_mtime: Optional[int] = None
+    config_size: Optional[int] = None
+    installed_at: Optional[float] = None
+    updated_at: Optional[float] = None
+
 @dataclass
 class ApplicationConfig:
     """Configuration for a containerized application."""
@@ -62,12 +225,13 @@ class ContainerSpec:
     restart_policy: str = "no"
     user: Optional[str] = None
     working_dir: Optional[str] = None
+    pull_policy: str = "if-not-present"  # 'always', 'if-not-present' or 'if-digest-changed'
 
 @dataclass
 class VolumeSpec:
     """Volume specification for a container."""
     source: Optional[str] = None
-    target: str
+    target: str = ""
     type: str = "volume"  # 'volume', 'bind', 'tmpfs', 'npipe', or 'cluster'
     read_only: bool = False
     
@@ -75,8 +239,7 @@ class VolumeSpec:
         if not self.target:
             raise ValueError("Volume target is required")
 
-@dataclass
-class Container:
+class Container(ApiModel):
     """Represents a running or stopped container."""
     id: str
     name: str
@@ -87,18 +250,36 @@ class Container:
     ports: Dict[str, List[Dict[str, str]]]
     labels: Dict[str, str]
     network_settings: Dict[str, Any]
+    health: Optional[str] = None  # 'starting', 'healthy', 'unhealthy', or None without healthcheck
 
 @dataclass
-class Image:
+class ContainerStats:
+    """Resource usage of a container of an application, or of a whole application."""
+    app_id: str
+    component: Optional[str]  # None for the sum over the application
+    cpu_percent: float = 0.0  # Of one CPU, like 'docker stats'
+    memory_usage: int = 0
+    memory_limit: int = 0
+    network_rx: int = 0
+    network_tx: int = 0
+    block_read: int = 0
+    block_write: int = 0
+    pids: int = 0
+
+    @property
+    def memory_percent(self) -> float:
+        return 100.0 * self.memory_usage / self.memory_limit if self.memory_limit else 0.0
+
+class Image(ApiModel):
     """Represents a container image."""
     id: str
     tags: List[str]
     created: str
     size: int
     labels: Dict[str, str] = field(default_factory=dict)
+    digests: List[str] = field(default_factory=list)
 
-@dataclass
-class Network:
+class Network(ApiModel):
     """Represents a container network."""
     id: str
     name: str
@@ -107,8 +288,7 @@ class Network:
     labels: Dict[str, str] = field(default_factory=dict)
     options: Dict[str, str] = field(default_factory=dict)
 
-@dataclass
-class Volume:
+class Volume(ApiModel):
     """Represents a volume."""
     name: str
     driver: str
@@ -4,6 +4,8 @@ __all__ = [
     'config',
     'logging',
     'validation',
+    'tracing',
+    'profiling',
     'templates',
     'plugins',
 ]
@@ -4,7 +4,7 @@ import logging
 import os
 import yaml
 from pathlib import Path
-from typing import Any, Dict, Optional, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 logger = logging.getLogger(__name__)
 
@@ -87,3 +87,242 @@ def load_environment_vars(prefix: str = "THREATOS_") -> Dict[str, str]:
         for k, v in os.environ.items() 
         if k.startswith(prefix)
     }
+
+def merge_layers(layers: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Merge configuration dictionaries, the last one taking precedence.
+
+    Like merging them pairwise with merge_configs, but in one pass, and
+    without copying anything that a single layer defines: such subtrees
+    are shared with the layer, only the dictionaries that several layers
+    define are new. The result must not be modified.
+
+    Args:
+        layers: The configuration dictionaries, from the lowest precedence.
+
+    Returns:
+        The merged configuration.
+    """
+    layers = [layer for layer in layers if layer]
+    if not layers:
+        return {}
+    if len(layers) == 1:
+        return layers[0]
+    values: Dict[str, List[Any]] = {}
+    for layer in layers:
+        for key, value in layer.items():
+            values.setdefault(key, []).append(value)
+    result = {}
+    for key, candidates in values.items():
+        top = candidates[-1]
+        if isinstance(top, dict):
+            # The dictionaries down to the first value that is not one
+            start = len(candidates) - 1
+            while start > 0 and isinstance(candidates[start - 1], dict):
+                start -= 1
+            result[key] = merge_layers(candidates[start:])
+        else:
+            result[key] = top
+    return result
+
+def get_user_config_file() -> Path:
+    """The configuration file of the user, under XDG_CONFIG_HOME."""
+    base = os.environ.get("XDG_CONFIG_HOME") or str(Path.home() / ".config")
+    return Path(base) / "threatos" / "appmgr.yaml"
+
+SYSTEM_CONFIG_FILE = Path("/etc/threatos/appmgr.yaml")
+
+class ConfigLayer:
+    """A layer of configuration: a name, and the values it sets.
+
+    The values of a plain layer only change with set(). Subclasses read
+    them from somewhere else, and say when they changed.
+    """
+
+    def __init__(self, name: str, data: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.data: Dict[str, Any] = data or {}
+
+    def changed(self) -> bool:
+        """Whether the values must be loaded again."""
+        return False
+
+    def invalidate(self) -> None:
+        """Load the values again on next access."""
+
+    def load(self) -> Dict[str, Any]:
+        return self.data
+
+    def set(self, data: Dict[str, Any]) -> None:
+        self.data = data
+
+class FileLayer(ConfigLayer):
+    """A layer read from a YAML file, again when its mtime or size changes.
+
+    A missing file is an empty layer.
+    """
+
+    def __init__(self, name: str, path: Union[str, Path]):
+        super().__init__(name)
+        self.path = Path(path)
+        self._key: Optional[Tuple[int, int]] = None
+        self._loaded = False
+
+    def _stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = self.path.stat()
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def changed(self) -> bool:
+        return not self._loaded or self._stat() != self._key
+
+    def invalidate(self) -> None:
+        self._loaded = False
+
+    def load(self) -> Dict[str, Any]:
+        key = self._stat()
+        self.data = load_config(self.path) if key is not None else {}
+        self._key = key
+        self._loaded = True
+        return self.data
+
+class EnvironmentLayer(ConfigLayer):
+    """A layer read from the environment variables with a prefix.
+
+    Like load_environment_vars, with '__' for nesting:
+    THREATOS_LOGGING__LEVEL sets 'level' in 'logging'. The values are
+    strings.
+    """
+
+    def __init__(self, name: str, prefix: str = "THREATOS_"):
+        super().__init__(name)
+        self.prefix = prefix
+        self._variables: Optional[Dict[str, str]] = None
+
+    def changed(self) -> bool:
+        return load_environment_vars(self.prefix) != self._variables
+
+    def invalidate(self) -> None:
+        self._variables = None
+
+    def load(self) -> Dict[str, Any]:
+        self._variables = load_environment_vars(self.prefix)
+        data: Dict[str, Any] = {}
+        for name, value in sorted(self._variables.items()):
+            *parents, key = name.split("__")
+            node = data
+            for parent in parents:
+                child = node.get(parent)
+                if not isinstance(child, dict):
+                    child = node[parent] = {}
+                node = child
+            node[key] = value
+        self.data = data
+        return data
+
+class ConfigResolver:
+    """The configuration of appmgr, merged from layers.
+
+    By default (see default()), from the lowest precedence: the defaults,
+    the system configuration file, the one of the user, the THREATOS_*
+    environment variables, and the command line flags.
+
+    The merged view is built once, and again only when a layer changed
+    (a file layer when its file did): reading the configuration costs a
+    stat of the files. It shares what a single layer defines with that
+    layer (see merge_layers()), so it must not be modified. origin()
+    tells which layer a value comes from.
+    """
+
+    def __init__(self, layers: List[ConfigLayer]):
+        self.layers = layers
+        self._config: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def default(cls, defaults: Optional[Dict[str, Any]] = None,
+                cli: Optional[Dict[str, Any]] = None) -> "ConfigResolver":
+        """The standard layers: defaults, system, user, environment and cli.
+
+        The cli values that are None are left out, they're the flags that
+        were not given.
+        """
+        return cls([
+            ConfigLayer("defaults", defaults),
+            FileLayer("system", SYSTEM_CONFIG_FILE),
+            FileLayer("user", get_user_config_file()),
+            EnvironmentLayer("environment"),
+            ConfigLayer("cli", {k: v for k, v in (cli or {}).items() if v is not None}),
+        ])
+
+    def layer(self, name: str) -> ConfigLayer:
+        for layer in self.layers:
+            if layer.name == name:
+                return layer
+        raise KeyError(name)
+
+    def set_layer(self, name: str, data: Dict[str, Any]) -> None:
+        """Replace the values of a layer."""
+        self.layer(name).set(data)
+        self._config = None
+
+    def invalidate(self) -> None:
+        """Load every layer again on next access."""
+        self._config = None
+        for layer in self.layers:
+            layer.invalidate()
+
+    @property
+    def config(self) -> Dict[str, Any]:
+        """The merged configuration, see merge_layers()."""
+        changed = [layer for layer in self.layers if layer.changed()]
+        for layer in changed:
+            logger.debug(f"Loading configuration layer {layer.name}")
+            layer.load()
+        if changed or self._config is None:
+            self._config = merge_layers([layer.data for layer in self.layers])
+        return self._config
+
+    def get(self, key_path: str, default: Any = None) -> Any:
+        """A value, by its dotted path (eg. 'logging.level')."""
+        node: Any = self.config
+        for key in key_path.split("."):
+            if not isinstance(node, dict) or key not in node:
+                return default
+            node = node[key]
+        return node
+
+    def origin(self, key_path: str) -> Optional[str]:
+        """The name of the layer a value comes from, or None if it's not set.
+
+        For a dictionary that several layers define, that's the layer with
+        the highest precedence.
+        """
+        self.config  # Loads the layers that changed
+        return self._origin(key_path)
+
+    def _origin(self, key_path: str) -> Optional[str]:
+        for layer in reversed(self.layers):
+            node: Any = layer.data
+            for key in key_path.split("."):
+                if not isinstance(node, dict) or key not in node:
+                    break
+                node = node[key]
+            else:
+                return layer.name
+        return None
+
+    def explain(self) -> Dict[str, Tuple[Any, str]]:
+        """Every value, by dotted path, with the layer it comes from."""
+        result: Dict[str, Tuple[Any, str]] = {}
+
+        def walk(node: Dict[str, Any], prefix: str) -> None:
+            for key, value in node.items():
+                path = f"{prefix}{key}"
+                if isinstance(value, dict) and value:
+                    walk(value, path + ".")
+                else:
+                    result[path] = (value, self._origin(path) or "")
+
+        walk(self.config, "")
+        return result
@@ -1,11 +1,18 @@
 """Logging configuration for the ThreatOS Application Manager."""
 
+import copy
+import json
 import logging
 import logging.handlers
 import os
+import queue
+import signal
 import sys
+import threading
+import weakref
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Optional, Union
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
 
 # Default log format
 DEFAULT_LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
@@ -20,6 +27,103 @@ LOG_LEVELS = {
     'critical': logging.CRITICAL,
 }
 
+# The attributes of every LogRecord, the others come from extra=
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message", "asctime",
+}
+
+# The AsyncHandlers to flush on a signal
+_async_handlers: "weakref.WeakSet[AsyncHandler]" = weakref.WeakSet()
+
+class JsonFormatter(logging.Formatter):
+    """Format the records as JSON objects, one per line.
+
+    The object has the time (ISO 8601, UTC), the level, the logger and
+    the message, with the exception if any, and the attributes given
+    with extra=.
+    """
+    
+    def format(self, record: logging.LogRecord) -> str:
+        data: Dict[str, Any] = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                data[key] = value
+        return json.dumps(data, default=str)
+
+class AsyncHandler(logging.handlers.QueueHandler):
+    """Hand the records to a background thread, that passes them to handlers.
+
+    Logging only costs the caller a put in a queue, whatever the handlers
+    do with the record (writing to a slow disk, rotating files). flush()
+    waits for the records queued so far to be handled, close() stops the
+    thread once they all are; logging.shutdown() does it at exit, and so
+    does a SIGTERM or a SIGHUP (see setup_logging()).
+    """
+    
+    def __init__(self, handlers: Iterable[logging.Handler]):
+        super().__init__(queue.Queue())
+        self.listener = logging.handlers.QueueListener(
+            self.queue, *handlers, respect_handler_level=True
+        )
+        self.listener.start()
+        _async_handlers.add(self)
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # QueueHandler.prepare() formats the message with the exception,
+        # and drops exc_info and args, for the queues that pickle the
+        # records. This one doesn't: the handlers get the record as it was
+        # logged, and JsonFormatter can still tell the exception apart.
+        return copy.copy(record)
+    
+    @property
+    def handlers(self) -> Tuple[logging.Handler, ...]:
+        return self.listener.handlers
+    
+    def add_handler(self, handler: logging.Handler) -> None:
+        self.listener.handlers = self.listener.handlers + (handler,)
+    
+    def remove_handler(self, handler: logging.Handler) -> None:
+        self.listener.handlers = tuple(h for h in self.listener.handlers if h is not handler)
+    
+    def flush(self) -> None:
+        # Once the thread is stopped, nothing handles the queue anymore
+        if self.listener._thread is not None:
+            self.queue.join()
+        for handler in self.listener.handlers:
+            handler.flush()
+    
+    def close(self) -> None:
+        if self.listener._thread is not None:
+            self.listener.stop()
+        for handler in self.listener.handlers:
+            handler.close()
+        _async_handlers.discard(self)
+        super().close()
+
+def _flush_on_signal(signum: int, frame: Any) -> None:
+    for handler in list(_async_handlers):
+        handler.close()
+    # Then die of the signal, as if it was not handled
+    signal.signal(signum, signal.SIG_DFL)
+    os.kill(os.getpid(), signum)
+
+def _install_signal_handlers() -> None:
+    """Flush the AsyncHandlers on SIGTERM and SIGHUP, unless they're handled already."""
+    if threading.current_thread() is not threading.main_thread():
+        return
+    for signum in (signal.SIGTERM, signal.SIGHUP):
+        if signal.getsignal(signum) is signal.SIG_DFL:
+            signal.signal(signum, _flush_on_signal)
+
 def setup_logging(
     level: Union[str, int] = logging.INFO,
     log_file: Optional[Union[str, Path]] = None,
@@ -27,6 +131,8 @@ def setup_logging(
     date_format: str = DEFAULT_DATE_FORMAT,
     max_bytes: int = 10 * 1024 * 1024,  # 10 MB
     backup_count: int = 5,
+    json_format: bool = False,
+    use_queue: bool = False,
 ) -> None:
     """Configure logging for the application.
     
@@ -37,13 +143,19 @@ def setup_logging(
         date_format: Date format for log messages.
         max_bytes: Maximum log file size before rotation.
         backup_count: Number of backup log files to keep.
+        json_format: Log JSON objects, one per line, see JsonFormatter.
+        use_queue: Write the logs from a background thread, see AsyncHandler.
     """
     # Convert string log level to numeric if needed
     if isinstance(level, str):
         level = LOG_LEVELS.get(level.lower(), logging.INFO)
     
     # Create formatter
-    formatter = logging.Formatter(fmt=log_format, datefmt=date_format)
+    formatter: logging.Formatter
+    if json_format:
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(fmt=log_format, datefmt=date_format)
     
     # Configure root logger
     root_logger = logging.getLogger()
@@ -52,11 +164,15 @@ def setup_logging(
     # Remove existing handlers
     for handler in root_logger.handlers[:]:
         root_logger.removeHandler(handler)
+        if isinstance(handler, AsyncHandler):
+            handler.close()
+    
+    handlers = []
     
     # Add console handler
     console_handler = logging.StreamHandler(sys.stderr)
     console_handler.setFormatter(formatter)
-    root_logger.addHandler(console_handler)
+    handlers.append(console_handler)
     
     # Add file handler if log file is specified
     if log_file:
@@ -70,7 +186,14 @@ def setup_logging(
             encoding='utf-8',
         )
         file_handler.setFormatter(formatter)
-        root_logger.addHandler(file_handler)
+        handlers.append(file_handler)
+    
+    if use_queue:
+        root_logger.addHandler(AsyncHandler(handlers))
+        _install_signal_handlers()
+    else:
+        for handler in handlers:
+            root_logger.addHandler(handler)
 
 def get_logger(name: str) -> logging.Logger:
     """Get a logger with the specified name.
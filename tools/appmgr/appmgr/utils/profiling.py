@@ -0,0 +1,204 @@
+"""Profiling of the commands of the ThreatOS Application Manager.
+
+A Profiler runs cProfile, and counts the requests sent to the Engine API,
+by docker-py and by the native EngineClient alike, with their latency, per
+endpoint. How many round-trips to the daemon a command costs is most of
+what makes it fast or slow.
+"""
+
+import cProfile
+import functools
+import io
+import math
+import pstats
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+# The upper bounds of the buckets of the latency histograms, in seconds,
+# the last bucket has no bound
+HISTOGRAM_BOUNDS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+# The path segments that follow a collection, and that are not ids
+_COLLECTION_ACTIONS = {
+    "containers": {"json", "create", "prune"},
+    "images": {"json", "create", "load", "get", "search", "prune"},
+    "networks": {"create", "prune"},
+    "volumes": {"create", "prune"},
+    "exec": set(),
+}
+
+# The actions on an image, its name might have slashes in the path
+_IMAGE_ACTIONS = {"json", "history", "push", "tag", "get"}
+
+_VERSION = re.compile(r"^v\d+\.\d+$")
+
+
+def endpoint(method: str, path: str) -> str:
+    """The endpoint of a request: its method and its path, with neither the
+    API version, nor the query, nor the ids and names
+
+    For example "GET /v1.43/containers/3f4e/archive?path=/a" is "GET
+    /containers/{id}/archive".
+    """
+    segments = [s for s in urlsplit(path).path.split("/") if s]
+    if segments and _VERSION.match(segments[0]):
+        del segments[0]
+    actions = _COLLECTION_ACTIONS.get(segments[0]) if segments else None
+    if actions is not None and len(segments) >= 2 and segments[1] not in actions:
+        rest = segments[1:]
+        if segments[0] != "images":
+            segments = [segments[0], "{id}"] + rest[1:]
+        elif len(rest) > 1 and rest[-1] in _IMAGE_ACTIONS:
+            segments = ["images", "{name}", rest[-1]]
+        else:
+            segments = ["images", "{name}"]
+    return "%s /%s" % (method.upper(), "/".join(segments))
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """The nearest-rank percentile of sorted values."""
+    return values[max(0, math.ceil(len(values) * percent / 100) - 1)]
+
+
+class ApiStats:
+    """The count and the latencies of the Engine API requests, per endpoint.
+
+    The latency of a request is the time until its response comes, not
+    until its body is read: for the streams (pulls, archives, logs), it's
+    the time to the first byte.
+    """
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+        # The patched classes, with what they had before
+        self._patched: List[Tuple[type, str, Optional[Callable]]] = []
+
+    def record(self, method: str, path: str, latency: float) -> None:
+        key = endpoint(method, path)
+        with self._lock:
+            self.latencies.setdefault(key, []).append(latency)
+
+    def _wrap(self, func: Callable, get_request: Callable[..., Tuple[str, str]]) -> Callable:
+        @functools.wraps(func)
+        def wrapper(client, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(client, *args, **kwargs)
+            finally:
+                self.record(*get_request(*args, **kwargs), time.perf_counter() - start)
+        return wrapper
+
+    def _patch(self, cls: type, name: str, get_request: Callable[..., Tuple[str, str]]) -> None:
+        own = cls.__dict__.get(name)
+        setattr(cls, name, self._wrap(getattr(cls, name), get_request))
+        self._patched.append((cls, name, own))
+
+    def install(self) -> None:
+        """Record the requests of every client, until uninstall()
+
+        The transports are patched at the class level, so that the
+        requests of the clients being created count too (docker-py asks
+        for the version of the API).
+        """
+        from ..core.engine import EngineClient
+
+        self._patch(
+            EngineClient, "request",
+            lambda method, path, *args, **kwargs: (method, path),
+        )
+        try:
+            from docker.api.client import APIClient
+        except ImportError:
+            return
+        # APIClient is a requests.Session, every request goes through send()
+        self._patch(APIClient, "send", lambda request, **kwargs: (request.method, request.path_url))
+
+    def uninstall(self) -> None:
+        for cls, name, own in reversed(self._patched):
+            if own is None:
+                delattr(cls, name)
+            else:
+                setattr(cls, name, own)
+        self._patched.clear()
+
+    @property
+    def count(self) -> int:
+        return sum(len(values) for values in self.latencies.values())
+
+    def histogram(self, key: str) -> List[int]:
+        """How many requests to an endpoint fall into each bucket of HISTOGRAM_BOUNDS."""
+        counts = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+        for latency in self.latencies.get(key, ()):
+            i = 0
+            while i < len(HISTOGRAM_BOUNDS) and latency >= HISTOGRAM_BOUNDS[i]:
+                i += 1
+            counts[i] += 1
+        return counts
+
+    def format_report(self, top: Optional[int] = None) -> str:
+        """The endpoints that took the most time, with their latencies and their histogram."""
+        with self._lock:
+            latencies = {key: sorted(values) for key, values in self.latencies.items()}
+        total = sum(sum(values) for values in latencies.values())
+        labels = ["<%s" % _format_bound(b) for b in HISTOGRAM_BOUNDS]
+        labels.append(">=%s" % _format_bound(HISTOGRAM_BOUNDS[-1]))
+        lines = [
+            "Engine API: %d requests, %.1fms" % (self.count, total * 1000),
+            "%-36s %5s %9s %8s %8s %8s  %s" % (
+                "endpoint", "count", "total", "p50", "p95", "max",
+                " ".join("%6s" % label for label in labels),
+            ),
+        ]
+        keys = sorted(latencies, key=lambda key: -sum(latencies[key]))
+        for key in keys[:top]:
+            values = latencies[key]
+            lines.append("%-36s %5d %7.1fms %6.1fms %6.1fms %6.1fms  %s" % (
+                key, len(values), sum(values) * 1000,
+                percentile(values, 50) * 1000, percentile(values, 95) * 1000, values[-1] * 1000,
+                " ".join("%6s" % (count or ".") for count in self.histogram(key)),
+            ))
+        return "\n".join(lines)
+
+
+def _format_bound(seconds: float) -> str:
+    if seconds < 1:
+        return "%gms" % (seconds * 1000)
+    return "%gs" % seconds
+
+
+class Profiler:
+    """Run cProfile, and count the Engine API requests, between start() and stop().
+
+    cProfile only sees the thread that calls start(), the work of the
+    thread pools (pulls, registry requests) shows as the time the thread
+    waits for it. The Engine API requests are counted whatever thread
+    sends them.
+    """
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.api_stats = ApiStats()
+
+    def start(self) -> None:
+        self.api_stats.install()
+        self.profile.enable()
+
+    def stop(self) -> None:
+        self.profile.disable()
+        self.api_stats.uninstall()
+
+    def dump(self, path: Union[str, Path]) -> None:
+        """Write the cProfile statistics to a file, for pstats, snakeviz..."""
+        self.profile.dump_stats(str(path))
+
+    def format_report(self, top: int = 20) -> str:
+        """The top functions by cumulative time, and the top endpoints of the Engine API."""
+        stream = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=stream)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+        return stream.getvalue().strip("\n") + "\n\n" + self.api_stats.format_report(top)
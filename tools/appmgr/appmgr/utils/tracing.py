@@ -0,0 +1,236 @@
+"""Tracing of the operations of the ThreatOS Application Manager.
+
+A span times a section of code, and the spans opened while another one is
+open nest under it, per thread. The spans are exported in the Chrome trace
+format (chrome://tracing, https://ui.perfetto.dev), or summed up in a tree
+where the spans of the same name, under the same parents, add up.
+
+Tracing is off until enable() is called. Until then span() returns a
+shared object that does nothing, and the functions decorated with traced()
+only pay for a check of a global.
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar, Union
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+# A finished span: (path, start, duration, thread id, args), times in ns
+Event = Tuple[Tuple[str, ...], int, int, int, Dict[str, Any]]
+
+_enabled = False
+_events: List[Event] = []
+_origin = 0
+_thread_names: Dict[int, str] = {}
+_local = threading.local()
+
+
+def _stack() -> List["Span"]:
+    try:
+        return _local.stack
+    except AttributeError:
+        _local.stack = []
+        _thread_names[threading.get_ident()] = threading.current_thread().name
+        return _local.stack
+
+
+class Span:
+    """A timed section of code, see span()."""
+
+    __slots__ = ("name", "args", "path", "start")
+
+    def __init__(self, name: str, args: Dict[str, Any]):
+        self.name = name
+        self.args = args
+
+    def __enter__(self) -> "Span":
+        stack = _stack()
+        self.path = (stack[-1].path if stack else ()) + (self.name,)
+        stack.append(self)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> bool:
+        end = time.perf_counter_ns()
+        _stack().pop()
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        _events.append((self.path, self.start, end - self.start, threading.get_ident(), self.args))
+        return False
+
+    def set(self, **args: Any) -> None:
+        """Add arguments to the span, they show in the trace."""
+        self.args.update(args)
+
+
+class _NoSpan:
+    """What span() returns when tracing is off."""
+
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoSpan":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> bool:
+        return False
+
+    def set(self, **args: Any) -> None:
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def enable() -> None:
+    """Start recording the spans."""
+    global _enabled, _origin
+    if not _enabled:
+        _origin = _origin or time.perf_counter_ns()
+        _enabled = True
+
+
+def disable() -> None:
+    """Stop recording the spans, the ones recorded so far are kept."""
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset() -> None:
+    """Forget the spans recorded so far."""
+    global _origin
+    _events.clear()
+    _origin = time.perf_counter_ns() if _enabled else 0
+
+
+def span(name: str, /, **args: Any) -> Union[Span, _NoSpan]:
+    """A span, to be used as a context manager.
+
+    Args:
+        name: The name of the span, the spans of the same name add up in the summary.
+        args: Arguments of the span, they show in the trace.
+    """
+    if not _enabled:
+        return _NO_SPAN
+    return Span(name, args)
+
+
+def traced(name: Optional[str] = None) -> Callable[[F], F]:
+    """Decorate a function, so that every call is a span.
+
+    Args:
+        name: The name of the span, the qualified name of the function by default.
+    """
+    def decorator(func: F) -> F:
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with Span(span_name, {}):
+                return func(*args, **kwargs)
+        return wrapper  # type: ignore[return-value]
+    return decorator
+
+
+def bind(func: F) -> F:
+    """Nest the spans of func under the current span, whatever thread it runs in.
+
+    For the functions handed to a thread pool: without it, their spans
+    would have no parent.
+    """
+    if not _enabled:
+        return func
+    parent = _stack()[-1:]
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        stack = _stack()
+        saved = stack[:]
+        stack[:] = parent
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stack[:] = saved
+    return wrapper  # type: ignore[return-value]
+
+
+def events() -> List[Event]:
+    """The spans recorded so far, in the order they ended."""
+    return list(_events)
+
+
+def chrome_trace() -> Dict[str, Any]:
+    """The spans recorded so far, in the Chrome trace format."""
+    pid = os.getpid()
+    tids = {}
+    trace = []
+    for path, start, duration, ident, args in sorted(_events, key=lambda e: (e[1], -e[2])):
+        tid = tids.setdefault(ident, len(tids) + 1)
+        event = {
+            "name": path[-1], "ph": "X", "pid": pid, "tid": tid,
+            "ts": (start - _origin) / 1000, "dur": duration / 1000,
+        }
+        if args:
+            event["args"] = args
+        trace.append(event)
+    for ident, tid in tids.items():
+        trace.append({
+            "name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+            "args": {"name": _thread_names.get(ident, str(ident))},
+        })
+    return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+
+def export_chrome_trace(path: Union[str, Path]) -> None:
+    """Write the spans recorded so far to a file, in the Chrome trace format."""
+    with open(path, "w") as f:
+        json.dump(chrome_trace(), f, default=str)
+
+
+def format_summary(min_percent: float = 0.0) -> str:
+    """The spans recorded so far, as a tree.
+
+    The spans of the same name, under the same parents, add up. Each line
+    has the total time of the spans, its share of the time of the top-level
+    spans, a bar of that share, and how many spans there were. The children
+    of a span come by decreasing time.
+
+    Args:
+        min_percent: Leave out the spans that take a smaller share than that.
+    """
+    totals: Dict[Tuple[str, ...], List[int]] = {}
+    for path, _, duration, _, _ in _events:
+        total = totals.setdefault(path, [0, 0])
+        total[0] += duration
+        total[1] += 1
+    children: Dict[Tuple[str, ...], List[Tuple[str, ...]]] = {}
+    for path in totals:
+        children.setdefault(path[:-1], []).append(path)
+    root_time = sum(totals[path][0] for path in children.get((), ())) or 1
+
+    lines = []
+
+    def walk(parent: Tuple[str, ...]) -> None:
+        for path in sorted(children.get(parent, ()), key=lambda p: -totals[p][0]):
+            duration, count = totals[path]
+            percent = 100 * duration / root_time
+            if percent < min_percent:
+                continue
+            lines.append("%10.1fms %5.1f%% %-20s %s%s (%d)" % (
+                duration / 1e6, percent, "#" * round(percent / 5),
+                "  " * (len(path) - 1), path[-1], count,
+            ))
+            walk(path)
+
+    walk(())
+    return "\n".join(lines)
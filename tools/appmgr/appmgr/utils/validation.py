@@ -0,0 +1,527 @@
+"""Validation of the configuration files of the applications.
+
+The files are checked against schemas, a subset of JSON Schema (type,
+enum, pattern, properties, required, additionalProperties, items), that
+are compiled once into validation functions. The YAML is only composed,
+not constructed, so that every problem comes with its line and column.
+"""
+
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple, Union
+
+import yaml
+
+from ..core.runtime import PULL_POLICIES, get_state_dir
+
+logger = logging.getLogger(__name__)
+
+# libyaml, when PyYAML was built with it, composes about ten times faster
+_Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+ERROR = "error"
+WARNING = "warning"
+
+# An issue, as the validators report it: (line, column, path, message, severity)
+RawIssue = Tuple[int, int, str, str, str]
+Validator = Callable[[yaml.Node, str, List[RawIssue]], None]
+
+NAME_PATTERN = r"^[a-zA-Z0-9][a-zA-Z0-9_.-]*$"
+DURATION_PATTERN = r"^(\d+(\.\d+)?(h|ms|m|s|us|ns))+$"
+
+_STRING = {"type": "string"}
+_SCALAR = {"type": ["string", "number", "boolean"]}
+_DURATION = {"type": ["string", "number"], "pattern": DURATION_PATTERN}
+
+# The app.yaml files of ApplicationManager
+APP_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "required": ["id", "name", "version", "containers"],
+    "properties": {
+        "id": {"type": "string", "pattern": NAME_PATTERN},
+        "name": _STRING,
+        # A version like 1.10 would be the number 1.1
+        "version": _STRING,
+        "description": _STRING,
+        "maintainer": _STRING,
+        "containers": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["name", "image"],
+                "properties": {
+                    "name": {"type": "string", "pattern": NAME_PATTERN},
+                    "image": _STRING,
+                    "command": {"type": ["string", "array"], "items": _STRING},
+                    "environment": {"type": "object", "additionalProperties": _SCALAR},
+                    "volumes": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "required": ["target"],
+                            "properties": {
+                                "source": _STRING,
+                                "target": _STRING,
+                                "type": {"type": "string", "enum": ["volume", "bind", "tmpfs"]},
+                                "read_only": {"type": "boolean"},
+                            },
+                            "additionalProperties": False,
+                        },
+                    },
+                    "ports": {"type": "object", "additionalProperties": _SCALAR},
+                    "depends_on": {"type": "array", "items": _STRING},
+                    "healthcheck": {
+                        "type": "object",
+                        "properties": {
+                            "test": {"type": ["string", "array"], "items": _STRING},
+                            "interval": _DURATION,
+                            "timeout": _DURATION,
+                            "start_period": _DURATION,
+                            "retries": {"type": "integer"},
+                            "disable": {"type": "boolean"},
+                        },
+                        "additionalProperties": False,
+                    },
+                    # 'no' is a boolean in YAML 1.1, there's no policy for true
+                    "restart": {
+                        "type": ["string", "boolean"],
+                        "enum": [False],
+                        "pattern": r"^(no|always|unless-stopped|on-failure(:\d+)?)$",
+                    },
+                    "pull_policy": {"type": "string", "enum": list(PULL_POLICIES)},
+                },
+                "additionalProperties": False,
+            },
+        },
+        "networks": {"type": "object"},
+        "volumes": {"type": "object"},
+        "environment": {"type": "object", "additionalProperties": _SCALAR},
+    },
+    "additionalProperties": False,
+}
+
+_SCRIPT = {"type": "string"}
+
+# The appmgr.yaml files of appmgr
+APPMGR_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "required": ["application", "components"],
+    "properties": {
+        "application": {
+            "type": "object",
+            "required": ["id", "name"],
+            "properties": {
+                "id": {"type": "string", "pattern": NAME_PATTERN},
+                "name": _STRING,
+                "description": _STRING,
+                "categories": _STRING,
+            },
+        },
+        "components": {
+            "type": "object",
+            "additionalProperties": {
+                "type": "object",
+                "required": ["run_mode"],
+                "properties": {
+                    "name": _STRING,
+                    "run_mode": {"type": "string", "enum": ["cli", "gui", "headless"]},
+                    "run_as_root": {"type": "boolean"},
+                    "executable": _STRING,
+                    "extra_opts": _STRING,
+                    "networks": {"type": "array", "items": _STRING},
+                    "publish_ports": {"type": "array", "items": {"type": ["string", "integer"]}},
+                    "mounts": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "required": ["source", "target"],
+                            "properties": {"source": _STRING, "target": _STRING},
+                            "additionalProperties": False,
+                        },
+                    },
+                    "docker_options": {"type": "object"},
+                    "reuse_container": {"type": "boolean"},
+                    "allow_x11": {"type": "boolean"},
+                    "start_message": _STRING,
+                    "stop_message": _STRING,
+                    "before_run_script": _SCRIPT,
+                    "after_run_script": _SCRIPT,
+                    "before_stop_script": _SCRIPT,
+                    "after_stop_script": _SCRIPT,
+                },
+                "additionalProperties": False,
+            },
+        },
+        "container": {
+            "type": "object",
+            "properties": {
+                "default_component": _STRING,
+                "origin": {
+                    "type": "object",
+                    "properties": {
+                        "registry": {
+                            "type": "object",
+                            "required": ["url"],
+                            "properties": {"url": _STRING, "image": _STRING},
+                        },
+                        "tarball": _STRING,
+                    },
+                },
+            },
+        },
+        "packaging": {
+            "type": "object",
+            "properties": {
+                "revision": {"type": ["string", "integer"]},
+                "min_upstream_version": {"type": ["string", "number"]},
+                "max_upstream_version": {"type": ["string", "number"]},
+            },
+        },
+        "build": {
+            "type": "object",
+            "properties": {
+                "docker": {
+                    "type": "object",
+                    "properties": {"file": _STRING, "parameters": {"type": "object"}},
+                },
+            },
+        },
+        "install": {
+            "type": "object",
+            "properties": {
+                "cli-helpers": {"type": ["boolean", "array"]},
+                "desktop-files": {"type": ["boolean", "array"]},
+                "icon": _STRING,
+                "extract-icon": _STRING,
+            },
+        },
+    },
+}
+
+SCHEMAS = {"app": APP_SCHEMA, "appmgr": APPMGR_SCHEMA}
+
+# Changes with the schemas, so that the cached results don't outlive them
+SCHEMAS_HASH = hashlib.sha256(
+    json.dumps(SCHEMAS, sort_keys=True).encode()
+).hexdigest()[:16]
+
+_TAG_TYPES = {
+    "tag:yaml.org,2002:str": "string",
+    "tag:yaml.org,2002:int": "integer",
+    "tag:yaml.org,2002:float": "number",
+    "tag:yaml.org,2002:bool": "boolean",
+    "tag:yaml.org,2002:null": "null",
+    "tag:yaml.org,2002:map": "object",
+    "tag:yaml.org,2002:seq": "array",
+    # Dates look like strings to the humans who write them
+    "tag:yaml.org,2002:timestamp": "string",
+}
+
+# How YAML 1.1 spells the booleans
+_BOOLEANS = yaml.constructor.SafeConstructor.bool_values
+
+
+@dataclass(frozen=True)
+class ConfigIssue:
+    """A problem found in a configuration file."""
+    file: str
+    line: int
+    column: int
+    path: str  # Where in the document, eg. 'containers[0].image'
+    message: str
+    severity: str = ERROR
+
+    def __str__(self) -> str:
+        where = f" {self.path}:" if self.path else ""
+        return f"{self.file}:{self.line}:{self.column}: {self.severity}:{where} {self.message}"
+
+
+@dataclass
+class ValidationReport:
+    """The issues found in a set of files."""
+    files: int = 0
+    cached: int = 0  # Files whose results came from the cache
+    issues: List[ConfigIssue] = field(default_factory=list)
+
+    @property
+    def errors(self) -> List[ConfigIssue]:
+        return [i for i in self.issues if i.severity == ERROR]
+
+    @property
+    def warnings(self) -> List[ConfigIssue]:
+        return [i for i in self.issues if i.severity == WARNING]
+
+
+def _node_type(node: yaml.Node) -> str:
+    kind = _TAG_TYPES.get(node.tag)
+    if kind is not None:
+        return kind
+    if isinstance(node, yaml.MappingNode):
+        return "object"
+    if isinstance(node, yaml.SequenceNode):
+        return "array"
+    return "string"
+
+
+def _issue(node: yaml.Node, path: str, message: str, severity: str = ERROR) -> RawIssue:
+    return (node.start_mark.line + 1, node.start_mark.column + 1, path, message, severity)
+
+
+def compile_schema(schema: Dict[str, Any]) -> Validator:
+    """Compile a schema into a function that validates a YAML node.
+
+    The function appends the issues it finds to a list, as RawIssues.
+    'additionalProperties: false' makes the unknown keys warnings, not
+    errors: they're most likely typos, but they break nothing.
+    """
+    checks: List[Callable[[yaml.Node, str, List[RawIssue]], None]] = []
+
+    types = schema.get("type")
+    allowed: Optional[Set[str]] = None
+    if types is not None:
+        allowed = {types} if isinstance(types, str) else set(types)
+        if "number" in allowed:
+            allowed.add("integer")
+        expected = " or ".join(sorted({types} if isinstance(types, str) else set(types)))
+
+    if "enum" in schema:
+        # The booleans are compared by value, whichever way YAML spells them,
+        # the other choices by text. A node is only checked against the
+        # choices of its kind, the other kinds are left to 'type' and 'pattern'.
+        flags = [c for c in schema["enum"] if isinstance(c, bool)]
+        choices = [str(c) for c in schema["enum"] if not isinstance(c, bool)]
+
+        def check_enum(node: yaml.Node, path: str, issues: List[RawIssue]) -> None:
+            if not isinstance(node, yaml.ScalarNode):
+                return
+            if _node_type(node) == "boolean":
+                if flags and _BOOLEANS.get(node.value.lower()) not in flags:
+                    wanted = " or ".join(str(f).lower() for f in flags)
+                    issues.append(_issue(node, path, f"must be {wanted}, not {node.value!r}"))
+            elif choices and node.value not in choices:
+                issues.append(_issue(
+                    node, path, f"must be one of {', '.join(choices)}, not {node.value!r}"
+                ))
+        checks.append(check_enum)
+
+    if "pattern" in schema:
+        pattern = re.compile(schema["pattern"])
+
+        def check_pattern(node: yaml.Node, path: str, issues: List[RawIssue]) -> None:
+            if _node_type(node) == "string" and not pattern.search(node.value):
+                issues.append(_issue(node, path, f"invalid value: {node.value!r}"))
+        checks.append(check_pattern)
+
+    properties = {k: compile_schema(v) for k, v in schema.get("properties", {}).items()}
+    required = schema.get("required", [])
+    additional = schema.get("additionalProperties", True)
+    additional_validator = compile_schema(additional) if isinstance(additional, dict) else None
+    if properties or required or additional is not True:
+        def check_mapping(node: yaml.Node, path: str, issues: List[RawIssue]) -> None:
+            if not isinstance(node, yaml.MappingNode):
+                return
+            seen: Set[str] = set()
+            for key_node, value_node in node.value:
+                key = str(key_node.value)
+                if key == "<<":
+                    continue
+                key_path = f"{path}.{key}" if path else key
+                if key in seen:
+                    issues.append(_issue(key_node, key_path, "duplicate key"))
+                seen.add(key)
+                validator = properties.get(key)
+                if validator is not None:
+                    validator(value_node, key_path, issues)
+                elif additional_validator is not None:
+                    additional_validator(value_node, key_path, issues)
+                elif additional is False:
+                    issues.append(_issue(key_node, key_path, "unknown key", WARNING))
+            for key in required:
+                if key not in seen:
+                    issues.append(_issue(node, path, f"missing required key: {key}"))
+        checks.append(check_mapping)
+
+    if "items" in schema:
+        items = compile_schema(schema["items"])
+
+        def check_items(node: yaml.Node, path: str, issues: List[RawIssue]) -> None:
+            if isinstance(node, yaml.SequenceNode):
+                for i, item in enumerate(node.value):
+                    items(item, f"{path}[{i}]", issues)
+        checks.append(check_items)
+
+    def validate(node: yaml.Node, path: str, issues: List[RawIssue]) -> None:
+        if allowed is not None:
+            kind = _node_type(node)
+            if kind not in allowed:
+                issues.append(_issue(node, path, f"must be {expected}, not {kind}"))
+                return
+        for check in checks:
+            check(node, path, issues)
+
+    return validate
+
+
+@lru_cache(maxsize=None)
+def get_validator(kind: str) -> Validator:
+    """The compiled schema of a kind of file, compiled once per process."""
+    return compile_schema(SCHEMAS[kind])
+
+
+def get_schema_kind(path: Union[str, Path]) -> str:
+    """'app' for app.yaml, 'appmgr' for the appmgr.yaml files."""
+    return "app" if Path(path).name == "app.yaml" else "appmgr"
+
+
+def validate_content(content: bytes, kind: str) -> List[RawIssue]:
+    """Validate the content of a file against the schema of its kind."""
+    try:
+        node = yaml.compose(content, Loader=_Loader)
+    except yaml.MarkedYAMLError as e:
+        mark = e.problem_mark or e.context_mark
+        line, column = (mark.line + 1, mark.column + 1) if mark else (1, 1)
+        return [(line, column, "", f"invalid YAML: {e.problem or e}", ERROR)]
+    except yaml.YAMLError as e:
+        return [(1, 1, "", f"invalid YAML: {e}", ERROR)]
+    if node is None:
+        return [(1, 1, "", "empty file", ERROR)]
+    issues: List[RawIssue] = []
+    get_validator(kind)(node, "", issues)
+    return sorted(issues)
+
+
+def _validate_batch(batch: List[Tuple[bytes, str]]) -> List[List[RawIssue]]:
+    return [validate_content(content, kind) for content, kind in batch]
+
+
+CONFIG_FILE_NAMES = ("app.yaml", "appmgr.yaml")
+
+
+def find_config_files(paths: Iterable[Union[str, Path]]) -> List[Path]:
+    """The app.yaml and (*.)appmgr.yaml files in trees, or the files given.
+
+    Hidden directories are skipped.
+    """
+    found = []
+    for path in map(Path, paths):
+        if path.is_file():
+            found.append(path)
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+            for name in sorted(files):
+                if name in CONFIG_FILE_NAMES or name.endswith(".appmgr.yaml"):
+                    found.append(Path(root) / name)
+    return found
+
+
+def get_validation_cache_path() -> Path:
+    return get_state_dir() / "validation-cache.json"
+
+
+class ValidationCache:
+    """The issues found in files, by content hash, kept across runs.
+
+    Only the entries used by the last run are kept, so that it follows the
+    trees it's used for.
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = Path(path or get_validation_cache_path())
+        self._entries: Dict[str, List[RawIssue]] = {}
+        self._used: Dict[str, List[RawIssue]] = {}
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get("schemas") == SCHEMAS_HASH:
+                self._entries = data.get("entries", {})
+        except (OSError, ValueError, AttributeError):
+            pass
+
+    @staticmethod
+    def key(content: bytes, kind: str) -> str:
+        return f"{kind}:{hashlib.sha256(content).hexdigest()}"
+
+    def get(self, key: str) -> Optional[List[RawIssue]]:
+        issues = self._entries.get(key)
+        if issues is None:
+            return None
+        issues = [tuple(i) for i in issues]  # type: ignore[misc]
+        self._used[key] = issues
+        return issues
+
+    def set(self, key: str, issues: List[RawIssue]) -> None:
+        self._used[key] = issues
+
+    def save(self) -> None:
+        """Write the cache atomically, a concurrent run may be reading it."""
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.path.parent, prefix=f".{self.path.name}.")
+            with os.fdopen(fd, "w") as f:
+                json.dump({"schemas": SCHEMAS_HASH, "entries": self._used}, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning(f"Failed to save the validation cache: {e}")
+
+
+def validate_files(paths: Sequence[Union[str, Path]], jobs: Optional[int] = None,
+                   cache: Optional[ValidationCache] = None) -> ValidationReport:
+    """Validate configuration files, in parallel, with the results of the cache.
+
+    The files are read and hashed here, the ones that are not in the
+    cache are validated by a pool of processes, in batches.
+
+    Args:
+        paths: The files.
+        jobs: How many processes, None for one per CPU, 1 for none at all.
+        cache: Where to find and keep the results, None for no cache.
+    """
+    report = ValidationReport(files=len(paths))
+    results: Dict[int, List[RawIssue]] = {}
+    todo: List[Tuple[int, str, bytes, str]] = []
+    for i, path in enumerate(paths):
+        kind = get_schema_kind(path)
+        try:
+            content = Path(path).read_bytes()
+        except OSError as e:
+            results[i] = [(1, 1, "", f"unreadable: {e.strerror}", ERROR)]
+            continue
+        key = ValidationCache.key(content, kind)
+        cached = cache.get(key) if cache is not None else None
+        if cached is not None:
+            results[i] = cached
+            report.cached += 1
+        else:
+            todo.append((i, key, content, kind))
+
+    jobs = jobs or os.cpu_count() or 1
+    # Below a few files, starting the processes costs more than it saves
+    if jobs == 1 or len(todo) < 2 * jobs:
+        computed = _validate_batch([(content, kind) for _, _, content, kind in todo])
+    else:
+        size = max(1, min(64, len(todo) // (4 * jobs)))
+        batches = [
+            [(content, kind) for _, _, content, kind in todo[n:n + size]]
+            for n in range(0, len(todo), size)
+        ]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+            computed = [issues for batch in pool.map(_validate_batch, batches) for issues in batch]
+    for (i, key, _, _), issues in zip(todo, computed):
+        results[i] = issues
+        if cache is not None:
+            cache.set(key, issues)
+    if cache is not None:
+        cache.save()
+
+    for i, path in enumerate(paths):
+        report.issues.extend(ConfigIssue(str(path), *issue) for issue in results[i])
+    return report
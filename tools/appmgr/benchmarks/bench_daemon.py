@@ -0,0 +1,83 @@
+#! /usr/bin/python3
+
+"""Compare appmgr commands run in-process and forwarded to appmgrd
+
+Usage: bench_daemon.py [-n RUNS] [-- APPMGR ARGS...]
+
+Starts appmgrd on a private socket, then runs the same appmgr command
+(by default 'list --format json') a number of times, first with
+APPMGR_NO_DAEMON=1, then through the daemon, and prints the timings.
+Needs a working Docker setup.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+APPMGR = [sys.executable, "-c", "import appmgr; appmgr.main()"]
+APPMGRD = [sys.executable, "-m", "appmgr.daemon"]
+
+
+def run(argv, env, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(APPMGR + argv, env=env, stdout=subprocess.DEVNULL, check=True)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name, timings):
+    print(
+        "%-10s min %7.1f ms  median %7.1f ms  max %7.1f ms"
+        % (
+            name,
+            min(timings) * 1000,
+            statistics.median(timings) * 1000,
+            max(timings) * 1000,
+        )
+    )
+
+
+def wait_for_socket(path, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path):
+        if time.monotonic() > deadline:
+            sys.exit("appmgrd did not start")
+        time.sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--runs", type=int, default=10)
+    parser.add_argument("argv", nargs="*", default=["list", "--format", "json"])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        socket_path = os.path.join(tmpdir, "appmgrd.sock")
+        env = dict(os.environ, APPMGRD_SOCKET=socket_path)
+
+        in_process = run(args.argv, dict(env, APPMGR_NO_DAEMON="1"), args.runs)
+
+        daemon = subprocess.Popen(APPMGRD, env=env, stderr=subprocess.DEVNULL)
+        try:
+            wait_for_socket(socket_path)
+            # The first forwarded command fills the caches
+            cold = run(args.argv, env, 1)
+            warm = run(args.argv, env, args.runs)
+        finally:
+            daemon.terminate()
+            daemon.wait()
+
+    print("appmgr %s, %d runs" % (" ".join(args.argv), args.runs))
+    report("in-process", in_process)
+    report("daemon 1st", cold)
+    report("daemon", warm)
+
+
+if __name__ == "__main__":
+    main()
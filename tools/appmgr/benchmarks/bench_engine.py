@@ -0,0 +1,106 @@
+#! /usr/bin/python3
+
+"""Compare docker-py and the native Engine API client on appmgr's hot paths
+
+Usage: bench_engine.py [--images N] [--image IMAGE] [-n RUNS]
+
+Tags IMAGE (which must have a /appmgr/version file, or any file given
+with --file) N times as appmgr-bench/imgXXX:1.0, then times:
+
+- listing the images: docker-py images.list(), docker-py api.images(),
+  and EngineClient.images()
+- extracting a file from an image, as get_meta_file() does: with
+  docker-py models, and with DockerBackend using each engine
+
+The tags are removed at the end. Needs a working Docker setup.
+"""
+
+import argparse
+import statistics
+import time
+
+import docker
+
+from appmgr import DockerBackend
+from appmgr.core.engine import EngineClient
+
+
+def timeit(func, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name, timings):
+    print(
+        "%-32s min %8.1f ms  median %8.1f ms"
+        % (name, min(timings) * 1000, statistics.median(timings) * 1000)
+    )
+
+
+def extract_with_models(conn, image, path):
+    container = conn.containers.create(image)
+    try:
+        bits, _ = container.get_archive(path)
+        for _ in bits:
+            pass
+    finally:
+        container.remove()
+
+
+def extract_with_backend(backend, conn, image, path):
+    container_id = backend.create_container(conn, image)
+    try:
+        bits, _ = backend.get_archive(conn, container_id, path)
+        for _ in bits:
+            pass
+    finally:
+        backend.remove_container(conn, container_id)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, default=500)
+    parser.add_argument("--image", default="busybox:latest")
+    parser.add_argument("--file", default="/bin/true")
+    parser.add_argument("-n", "--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    conn = docker.from_env()
+    engine = EngineClient()
+    image = conn.images.get(args.image)
+    tags = ["appmgr-bench/img%03d:1.0" % i for i in range(args.images)]
+    for tag in tags:
+        image.tag(tag)
+    try:
+        n = len(engine.images())
+        print("%d images, %d runs" % (n, args.runs))
+        report("docker-py images.list()", timeit(conn.images.list, args.runs))
+        report("docker-py api.images()", timeit(conn.api.images, args.runs))
+        report("native images()", timeit(engine.images, args.runs))
+
+        runs = args.runs * 4
+        report(
+            "docker-py models extract",
+            timeit(lambda: extract_with_models(conn, image.id, args.file), runs),
+        )
+        for name in ("docker-py", "native"):
+            backend = DockerBackend(engine=name)
+            report(
+                "DockerBackend(%s) extract" % name,
+                timeit(
+                    lambda: extract_with_backend(backend, conn, image.id, args.file),
+                    runs,
+                ),
+            )
+    finally:
+        for tag in tags:
+            conn.api.remove_image(tag)
+        engine.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#! /usr/bin/python3
+
+"""Time 'threatos-appmgr start' with many installed applications
+
+Usage: bench_lazy_load.py [--apps N] [--image IMAGE] [-n RUNS] [--cli]
+
+Writes N application directories (app000/app.yaml ...) to a temporary
+config directory, each with a single container running IMAGE, then times
+what ApplicationManager does before it starts anything:
+
+- parsing every app.yaml, as it did up front before it was lazy
+- looking up the application of the command, the way start does
+
+With --cli, it also times the whole 'threatos-appmgr start' and 'stop'
+commands for the application in the middle, which needs a working Docker
+or Podman setup, and IMAGE to be available.
+"""
+
+import argparse
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from appmgr.core.application import ApplicationManager
+
+APP_YAML = """\
+id: app{i:03d}
+name: Benchmark application {i}
+version: "1.0"
+containers:
+  - name: main
+    image: {image}
+    command: sleep 3600
+    environment:
+      APP: "{i}"
+"""
+
+
+def timeit(func, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name, timings):
+    print(
+        "%-32s min %8.1f ms  median %8.1f ms"
+        % (name, min(timings) * 1000, statistics.median(timings) * 1000)
+    )
+
+
+def load_all(config_dir):
+    manager = ApplicationManager(config_dir=config_dir)
+    manager._load_applications()
+
+
+def lookup(config_dir, app_id):
+    manager = ApplicationManager(config_dir=config_dir)
+    assert manager.applications[app_id].id == app_id
+
+
+def cli(config_dir, *args):
+    subprocess.run(
+        [sys.executable, "-m", "appmgr.cli.main", "--log-level", "error",
+         "--config-dir", str(config_dir), *args],
+        check=True,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--apps", type=int, default=500)
+    parser.add_argument("--image", default="busybox:latest")
+    parser.add_argument("-n", "--runs", type=int, default=5)
+    parser.add_argument("--cli", action="store_true", help="time the CLI commands too")
+    args = parser.parse_args()
+
+    config_dir = Path(tempfile.mkdtemp(prefix="appmgr-bench-"))
+    try:
+        for i in range(args.apps):
+            (config_dir / f"app{i:03d}").mkdir()
+            (config_dir / f"app{i:03d}" / "app.yaml").write_text(
+                APP_YAML.format(i=i, image=args.image)
+            )
+        app_id = f"app{args.apps // 2:03d}"
+        print("%d applications, %d runs" % (args.apps, args.runs))
+        report("parse all app.yaml", timeit(lambda: load_all(config_dir), args.runs))
+        report("look up %s" % app_id, timeit(lambda: lookup(config_dir, app_id), args.runs))
+
+        if args.cli:
+            report("threatos-appmgr --help", timeit(lambda: cli(config_dir, "--help"), args.runs))
+            timings = []
+            for _ in range(args.runs):
+                timings.extend(timeit(lambda: cli(config_dir, "start", app_id), 1))
+                cli(config_dir, "stop", app_id, "--timeout", "0")
+            report("threatos-appmgr start", timings)
+    finally:
+        shutil.rmtree(config_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+#! /usr/bin/python3
+
+"""Compare the lazily-decoded models with eagerly-built dataclasses
+
+Usage: bench_models.py [--count N] [-n RUNS]
+
+Builds N containers from container summaries and from inspect results,
+and N images from image summaries, as the runtimes do for their list
+responses, and reports for each:
+
+- the time to build them all, and to build them and read their name (or
+  tags), and their labels, as a listing does
+- the memory the models take on top of the JSON they come from
+
+The eager baseline is a plain dataclass with the same fields, built by
+decoding every field up front, as the models were before.
+"""
+
+import argparse
+import gc
+import statistics
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from appmgr.core.runtime import (
+    CONTAINER_INSPECT_DECODERS,
+    CONTAINER_SUMMARY_DECODERS,
+    IMAGE_DECODERS,
+)
+from appmgr.models import Container, Image
+
+
+@dataclass
+class EagerContainer:
+    id: str
+    name: str
+    image: Any
+    status: str
+    state: str
+    created: datetime
+    ports: Dict[str, List[Dict[str, str]]]
+    labels: Dict[str, str]
+    network_settings: Dict[str, Any]
+    health: Optional[str] = None
+
+
+@dataclass
+class EagerImage:
+    id: str
+    tags: List[str]
+    created: str
+    size: int
+    labels: Dict[str, str] = field(default_factory=dict)
+    digests: List[str] = field(default_factory=list)
+
+
+def summary(i):
+    return {
+        "Id": "%064x" % i, "Names": ["/app%d-web" % i], "Image": "nginx:alpine",
+        "ImageID": "sha256:%064x" % i, "Command": "nginx -g 'daemon off;'",
+        "Created": 1672531200 + i, "State": "running", "Status": "Up 2 hours",
+        "Ports": [{"IP": "0.0.0.0", "PrivatePort": 80, "PublicPort": 8000 + i % 1000,
+                   "Type": "tcp"}, {"PrivatePort": 443, "Type": "tcp"}],
+        "Labels": {"org.threatos.appmgr.app": "app%d" % i,
+                   "org.threatos.appmgr.component": "web", "maintainer": "NGINX"},
+        "HostConfig": {"NetworkMode": "bridge"},
+        "NetworkSettings": {"Networks": {"bridge": {
+            "NetworkID": "%064x" % i, "EndpointID": "%064x" % i, "Gateway": "172.17.0.1",
+            "IPAddress": "172.17.%d.%d" % (i // 250, i % 250 + 2), "IPPrefixLen": 16,
+            "MacAddress": "02:42:ac:11:00:02",
+        }}},
+        "Mounts": [{"Type": "volume", "Name": "data%d" % i, "Destination": "/data"}],
+    }
+
+
+def inspect(i):
+    data = summary(i)
+    return {
+        "Id": data["Id"], "Name": data["Names"][0], "Image": data["ImageID"],
+        "Created": "2023-01-01T00:00:00.123456789Z",
+        "State": {"Status": "running", "Running": True, "Pid": 1000 + i,
+                  "Health": {"Status": "healthy", "FailingStreak": 0, "Log": []}},
+        "Config": {"Image": data["Image"], "Labels": data["Labels"], "Env": ["PATH=/usr/bin"],
+                   "Cmd": ["nginx", "-g", "daemon off;"], "Tty": False},
+        "NetworkSettings": dict(data["NetworkSettings"], Ports={
+            "80/tcp": [{"HostIp": "0.0.0.0", "HostPort": str(8000 + i % 1000)}],
+            "443/tcp": None,
+        }),
+        "HostConfig": {"NetworkMode": "bridge", "RestartPolicy": {"Name": "no"}},
+        "Mounts": data["Mounts"],
+    }
+
+
+def image(i):
+    return {
+        "Id": "sha256:%064x" % i, "ParentId": "", "RepoTags": ["appmgr/app%d:1.0" % i],
+        "RepoDigests": ["appmgr/app%d@sha256:%064x" % (i, i)], "Created": 1672531200 + i,
+        "Size": 10 ** 7 + i, "SharedSize": -1, "VirtualSize": 10 ** 7 + i,
+        "Labels": {"org.threatos.appmgr.app": "app%d" % i}, "Containers": -1,
+    }
+
+
+def eager(cls, decoders):
+    def build(items):
+        return [cls(**{name: decode(d) for name, decode in decoders.items()}) for d in items]
+    return build
+
+
+def lazy(cls, decoders):
+    def build(items):
+        return cls.from_list(items, decoders)
+    return build
+
+
+def timeit(func, runs):
+    timings = []
+    for _ in range(runs):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def memory(func):
+    """Bytes allocated by func, and still held by what it returns."""
+    gc.collect()
+    tracemalloc.start()
+    result = func()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=5000)
+    parser.add_argument("-n", "--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    cases = [
+        ("container summaries", [summary(i) for i in range(args.count)],
+         EagerContainer, Container, CONTAINER_SUMMARY_DECODERS, "name"),
+        ("container inspects", [inspect(i) for i in range(args.count)],
+         EagerContainer, Container, CONTAINER_INSPECT_DECODERS, "name"),
+        ("image summaries", [image(i) for i in range(args.count)],
+         EagerImage, Image, IMAGE_DECODERS, "tags"),
+    ]
+    print("%d objects, median of %d runs" % (args.count, args.runs))
+    print("%-22s %-6s %10s %14s %10s" % ("", "", "build", "build + read", "memory"))
+    for name, items, eager_cls, lazy_cls, decoders, attribute in cases:
+        for kind, build in (("eager", eager(eager_cls, decoders)),
+                            ("lazy", lazy(lazy_cls, decoders))):
+            def build_and_read():
+                for obj in build(items):
+                    getattr(obj, attribute)
+                    obj.labels
+            print("%-22s %-6s %8.1fms %12.1fms %8.0fKB" % (
+                name, kind,
+                timeit(lambda: build(items), args.runs) * 1000,
+                timeit(build_and_read, args.runs) * 1000,
+                memory(lambda: build(items)) / 1024,
+            ))
+
+
+if __name__ == "__main__":
+    main()
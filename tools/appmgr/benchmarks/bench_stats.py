@@ -0,0 +1,60 @@
+#! /usr/bin/python3
+
+"""Measure the CPU usage of 'threatos-appmgr stats'
+
+Usage: bench_stats.py [--containers N] [--image IMAGE] [--interval S] [--duration S]
+
+Runs N containers of IMAGE (sleeping), labelled as the components of an
+application appmgr-bench, then samples their stats with StatsSampler for
+DURATION seconds, as 'threatos-appmgr stats --format ndjson' does, and
+reports the CPU time the process took, in percent of one CPU. The
+containers are removed at the end. Needs a working Docker setup.
+"""
+
+import argparse
+import time
+
+from appmgr.core.application import APP_LABEL, COMPONENT_LABEL
+from appmgr.core.runtime import DockerRuntime
+from appmgr.core.stats import StatsSampler, format_ndjson
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--containers", type=int, default=20)
+    parser.add_argument("--image", default="busybox:latest")
+    parser.add_argument("--interval", type=float, default=2.0)
+    parser.add_argument("--duration", type=float, default=60.0)
+    args = parser.parse_args()
+
+    runtime = DockerRuntime()
+    if not runtime.connect():
+        raise SystemExit("Docker is not available")
+    containers = {}
+    try:
+        for i in range(args.containers):
+            container = runtime.run_container(
+                args.image, name=f"appmgr-bench-{i:03d}", command="sleep 3600", detach=True,
+                labels={APP_LABEL: "appmgr-bench", COMPONENT_LABEL: f"c{i:03d}"},
+            )
+            containers[container.id] = ("appmgr-bench", f"c{i:03d}")
+
+        sampler = StatsSampler(runtime, lambda: containers, args.interval)
+        samples = 0
+        start_cpu, start = time.process_time(), time.monotonic()
+        for stats in sampler:
+            format_ndjson(stats, time.time())
+            samples += 1
+            if time.monotonic() - start >= args.duration:
+                break
+        cpu, elapsed = time.process_time() - start_cpu, time.monotonic() - start
+        sampler.close()
+        print("%d containers, %d samples in %.0fs" % (args.containers, samples, elapsed))
+        print("CPU: %.2f%% of one CPU" % (100 * cpu / elapsed))
+    finally:
+        for container_id in containers:
+            runtime.remove_container(container_id, force=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#! /usr/bin/python3
+
+"""Measure the overhead of the tracing spans
+
+Usage: bench_tracing.py [--count N] [-n RUNS]
+
+Calls a function that does nothing N times: as is, decorated with
+traced(), and wrapped in a span(), with tracing disabled then enabled,
+and reports the cost of a call for each.
+"""
+
+import argparse
+import statistics
+import time
+
+from appmgr.utils import tracing
+
+
+def noop():
+    pass
+
+
+traced_noop = tracing.traced()(noop)
+
+
+def with_span():
+    with tracing.span("noop"):
+        pass
+
+
+def timeit(func, count, runs):
+    timings = []
+    for _ in range(runs):
+        tracing.reset()
+        start = time.perf_counter()
+        for _ in range(count):
+            func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) / count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=100000)
+    parser.add_argument("-n", "--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    print("%d calls, median of %d runs" % (args.count, args.runs))
+    print("%-10s %10s %10s %10s" % ("", "plain", "traced()", "span()"))
+    for state in ("disabled", "enabled"):
+        if state == "enabled":
+            tracing.enable()
+        print("%-10s %8.0fns %8.0fns %8.0fns" % (
+            state,
+            timeit(noop, args.count, args.runs) * 1e9,
+            timeit(traced_noop, args.count, args.runs) * 1e9,
+            timeit(with_span, args.count, args.runs) * 1e9,
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#! /usr/bin/python3
+
+"""Measure 'appmgr validate' over a tree of applications
+
+Usage: bench_validation.py [--apps N] [-j JOBS]
+
+Writes N app.yaml files (with a few containers each) in a temporary
+tree, then validates them as 'appmgr validate' does: with no cache, then
+again with the cache of the first run, and with one process instead of
+a pool.
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from appmgr.utils.validation import ValidationCache, find_config_files, validate_files
+
+APP = """\
+id: app{i}
+name: App {i}
+version: '1.{i}'
+containers:
+  - name: db
+    image: postgres:15
+    environment:
+      POSTGRES_DB: app{i}
+    volumes:
+      - source: data{i}
+        target: /var/lib/postgresql/data
+    healthcheck:
+      test: [CMD, pg_isready]
+      interval: 10s
+      retries: 5
+  - name: web
+    image: registry.example.com/app{i}:1.{i}
+    ports:
+      "80": {port}
+    depends_on: [db]
+    restart: unless-stopped
+"""
+
+
+def run(label, files, **kwargs):
+    start = time.perf_counter()
+    report = validate_files(files, **kwargs)
+    print("%-24s %8.0fms  (%d cached, %d issues)" % (
+        label, (time.perf_counter() - start) * 1000, report.cached, len(report.issues)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--apps", type=int, default=500)
+    parser.add_argument("-j", "--jobs", type=int, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tree = Path(tmp)
+        for i in range(args.apps):
+            (tree / f"app{i}").mkdir()
+            (tree / f"app{i}" / "app.yaml").write_text(APP.format(i=i, port=8000 + i))
+        files = find_config_files([tree])
+        print("%d files" % len(files))
+        run("one process", files, jobs=1)
+        run("process pool", files, jobs=args.jobs)
+        run("pool, cold cache", files, jobs=args.jobs, cache=ValidationCache(tree / "cache"))
+        run("warm cache", files, jobs=args.jobs, cache=ValidationCache(tree / "cache"))
+
+
+if __name__ == "__main__":
+    main()
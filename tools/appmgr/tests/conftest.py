@@ -1,8 +1,18 @@
 """Pytest configuration and fixtures for ThreatOS Application Manager tests."""
 
+import base64
+import io
+import json
 import os
+import re
 import shutil
+import socketserver
+import struct
+import tarfile
 import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
 from pathlib import Path
 from typing import Generator
 
@@ -12,6 +22,12 @@ from docker import DockerClient
 from appmgr.core.runtime import ContainerRuntime, DockerRuntime, PodmanRuntime
 from appmgr.core.application import ApplicationManager
 
+@pytest.fixture(autouse=True)
+def state_dir(tmp_path, monkeypatch) -> Path:
+    """Keep the state appmgr records (like the last runtime) out of the home directory."""
+    monkeypatch.setenv("XDG_STATE_HOME", str(tmp_path / "state"))
+    return tmp_path / "state" / "threatos" / "appmgr"
+
 @pytest.fixture(scope="session")
 def test_data_dir() -> Path:
     """Return the path to the test data directory."""
@@ -90,3 +106,194 @@ def sample_app_config() -> dict:
             "web-data": {}
         }
     }
+
+CONTAINER = {
+    "Id": "c0ffee",
+    "Name": "/web",
+    "Created": "2023-01-01T00:00:00.123456789Z",
+    "Image": "sha256:abc123",
+    "State": {"Status": "running"},
+    "Config": {"Image": "nginx:alpine", "Labels": {"app": "test"}, "Tty": False},
+    "NetworkSettings": {"Ports": {"80/tcp": [{"HostIp": "0.0.0.0", "HostPort": "8080"}]}},
+}
+
+
+class FakeEngineHandler(BaseHTTPRequestHandler):
+    """Answers a few Engine API endpoints, keeping connections alive."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_chunked(self, chunks):
+        self.send_response(200)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for chunk in chunks:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def response_lost(self):
+        """Whether to close the connection instead of answering, see FakeEngine."""
+        if self.server.stall:
+            time.sleep(self.server.stall)
+        if not self.server.lose_responses:
+            return False
+        self.server.lose_responses -= 1
+        self.close_connection = True
+        return True
+
+    def route(self):
+        """The path of the request, without the libpod prefix, and whether it had it."""
+        path = self.path.split("?", 1)[0]
+        if path.startswith("/libpod/"):
+            return path[len("/libpod"):], True
+        return path, False
+
+    def do_GET(self):
+        path, libpod = self.route()
+        self.server.requests.append(("GET", self.path))
+        if self.response_lost():
+            return
+        if path == "/_ping":
+            self.send_response(200)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"OK")
+        elif path == "/images/nginx%3Aalpine/json":
+            self.send_json({"Id": "sha256:abc123", "RepoTags": ["nginx:alpine"],
+                            "Created": "2023-01-01T00:00:00Z", "Size": 1234})
+        elif path == "/containers/c0ffee/json":
+            self.send_json(CONTAINER)
+        elif path == "/containers/json" and libpod:
+            self.send_json([{
+                "Id": "c0ffee", "Names": ["web"], "Image": "nginx:alpine",
+                "ImageID": "sha256:abc123", "Created": "2023-01-01T00:00:00Z",
+                "State": "running", "Labels": {}, "Ports": [
+                    {"host_ip": "", "container_port": 80, "host_port": 8080, "range": 1,
+                     "protocol": "tcp"}
+                ],
+            }])
+        elif path == "/containers/json":
+            self.send_json([{
+                "Id": "c0ffee", "Names": ["/web"], "Image": "nginx:alpine",
+                "ImageID": "sha256:abc123", "Created": 1672531200, "State": "running",
+                "Status": "Up 2 minutes", "Labels": {}, "Ports": [
+                    {"IP": "0.0.0.0", "PrivatePort": 80, "PublicPort": 8080, "Type": "tcp"}
+                ],
+            }])
+        elif path == "/images/json":
+            self.send_json([
+                {"Id": f"sha256:{i:064x}", "RepoTags": [f"appmgr/app{i}:1.0"], "Size": i}
+                for i in range(3)
+            ])
+        elif path == "/containers/c0ffee/archive":
+            buf = io.BytesIO()
+            with tarfile.open(fileobj=buf, mode="w") as tf:
+                ti = tarfile.TarInfo("version")
+                ti.size = 4
+                tf.addfile(ti, io.BytesIO(b"1.2\n"))
+            stat = {"name": "version", "size": 4, "mode": 420}
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-tar")
+            self.send_header("X-Docker-Container-Path-Stat",
+                             base64.b64encode(json.dumps(stat).encode()).decode())
+            self.send_header("Content-Length", str(len(buf.getvalue())))
+            self.end_headers()
+            self.wfile.write(buf.getvalue())
+        elif path == "/containers/c0ffee/logs":
+            frames = b"".join(
+                struct.pack(">BxxxL", stream, len(line)) + line
+                for stream, line in [(1, b"hello\n"), (2, b"oops\n")]
+            )
+            self.send_chunked([frames[:10], frames[10:]])
+        elif path == "/containers/c0ffee/stats" and not libpod:
+            self.send_chunked([
+                json.dumps({"pids_stats": {"current": pids}}).encode() + b"\n"
+                for pids in (1, 2)
+            ])
+        else:
+            self.send_json({"message": f"No such object: {path}"}, status=404)
+
+    def do_PUT(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.server.requests.append(("PUT", self.path, self.rfile.read(length)))
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_DELETE(self):
+        path, _ = self.route()
+        self.server.requests.append(("DELETE", self.path))
+        if path == "/containers/c0ffee":
+            self.send_response(204)
+            self.end_headers()
+        else:
+            self.send_json({"message": f"No such container: {path}"}, status=404)
+
+    def do_POST(self):
+        path, _ = self.route()
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length)) if length else None
+        self.server.requests.append(("POST", self.path, body))
+        if self.response_lost():
+            return
+        if path == "/images/create":
+            if "fromImage=broken" in self.path:
+                self.send_chunked([b'{"status":"Pulling"}\n', b'{"error":"manifest unknown"}\n'])
+            else:
+                self.send_chunked([b'{"status":"Pulling"}\n{"status":"Downloaded"}\n'])
+        elif path == "/images/pull":
+            if "reference=broken" in self.path:
+                self.send_chunked([b'{"stream":"Trying to pull"}\n', b'{"error":"manifest unknown"}\n'])
+            else:
+                self.send_chunked([b'{"stream":"Trying to pull"}\n{"images":["sha256:abc123"]}\n'])
+        elif path == "/containers/c0ffee/wait":
+            self.send_json({"StatusCode": 0})
+        elif path == "/containers/create":
+            self.send_json({"Id": "c0ffee", "Warnings": []}, status=201)
+        elif re.match(r"^/containers/c0ffee/(start|stop)$", path):
+            self.send_response(204)
+            self.end_headers()
+        else:
+            self.send_json({"message": f"No such container: {path}"}, status=404)
+
+
+class FakeEngine(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path):
+        super().__init__(path, FakeEngineHandler)
+        self.connections = 0
+        self.requests = []
+        # How many requests get no answer, and how long each answer takes
+        self.lose_responses = 0
+        self.stall = 0
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects a (host, port) address
+        return request, ("local", 0)
+
+
+@pytest.fixture
+def fake_engine(tmp_path):
+    """Serve a fake Engine API on a Unix socket."""
+    server = FakeEngine(str(tmp_path / "docker.sock"))
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
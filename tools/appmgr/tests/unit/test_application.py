@@ -1,12 +1,24 @@
 """Unit tests for application management functionality."""
 
+import threading
+import time
+from datetime import datetime
 from pathlib import Path
 from unittest.mock import MagicMock, patch, call
 import pytest
 
-from appmgr.core.application import ApplicationManager
-from appmgr.core.exceptions import ApplicationError, ValidationError
-from appmgr.models import Application, ApplicationConfig, ContainerSpec
+from appmgr.core.application import (
+    APP_LABEL,
+    COMPONENT_LABEL,
+    ApplicationManager,
+    healthcheck_options,
+    parse_duration,
+    restart_policy_options,
+)
+from appmgr.core.exceptions import ApplicationError, ContainerRuntimeError, ValidationError
+from appmgr.core.runtime import StatsStream
+from appmgr.utils.config import load_config
+from appmgr.models import Application, ApplicationConfig, Container, ContainerSpec, Image
 
 class TestApplicationManager:
     """Tests for the ApplicationManager class."""
@@ -19,15 +31,16 @@ class TestApplicationManager:
         manager = ApplicationManager(config_dir=config_dir)
         assert config_dir.exists()
     
-    def test_init_no_runtimes_raises_error(self, monkeypatch):
-        """Test that an error is raised if no container runtimes are available."""
+    def test_init_no_runtimes_raises_error(self, monkeypatch, tmp_path):
+        """Test that an error is raised on first use if no container runtimes are available."""
         monkeypatch.setattr(
-            'appmgr.core.runtime.get_available_runtimes',
+            'appmgr.core.application.get_available_runtimes',
             lambda: {}
         )
         
+        manager = ApplicationManager(config_dir=tmp_path)
         with pytest.raises(ApplicationError, match="No container runtime"):
-            ApplicationManager()
+            manager.default_runtime
     
     def test_load_applications_empty_dir(self, app_manager):
         """Test loading applications from an empty directory."""
@@ -85,9 +98,320 @@ class TestApplicationManager:
         result = app_manager.start_application("test-app")
         
         assert result is True
-        runtime.pull_image.assert_called_once_with("nginx", tag="alpine")
+        runtime.pull_image.assert_called_once_with("nginx", tag="alpine", policy="if-not-present")
     
     def test_start_application_not_found(self, app_manager):
         """Test starting a non-existent application."""
         with pytest.raises(ApplicationError, match="Application not found"):
             app_manager.start_application("nonexistent-app")
+
+
+class FakeRuntime:
+    """A container runtime that takes its time to start containers."""
+
+    runtime_name = "fake"
+
+    def __init__(self, start_delay=0.1, healthy_after=0.1, unhealthy=()):
+        self.start_delay = start_delay
+        self.healthy_after = healthy_after
+        self.unhealthy = unhealthy
+        self.pulls = []
+        self.runs = {}
+        self.started = {}
+        self.stops = {}
+        self.stop_delay = 0.1
+        self.lock = threading.Lock()
+
+    def pull_image(self, image_name, tag="latest", policy="always"):
+        time.sleep(0.1)
+        with self.lock:
+            self.pulls.append((image_name, tag, policy))
+        return Image(id="sha256:" + image_name, tags=[f"{image_name}:{tag}"], created="", size=0)
+
+    def container(self, name, health=None):
+        kwargs = self.runs[name]
+        return Container(
+            id=name, name=name, image=Image(id="", tags=[], created="", size=0),
+            status="running", state="running", created=datetime.now(), ports={},
+            labels=kwargs["labels"], network_settings={}, health=health,
+        )
+
+    def get_container(self, container_id):
+        if container_id not in self.runs:
+            return None
+        if "healthcheck" not in self.runs[container_id]:
+            return self.container(container_id)
+        if container_id in self.unhealthy:
+            return self.container(container_id, "unhealthy")
+        ready = time.monotonic() - self.started[container_id] >= self.healthy_after
+        return self.container(container_id, "healthy" if ready else "starting")
+
+    def remove_container(self, container_id, force=False):
+        return True
+
+    def events(self, filters=None):
+        raise ContainerRuntimeError("no events")
+
+    def list_containers(self, all=False, filters=None):
+        _, _, app_id = filters["label"].partition("=")
+        return [
+            self.container(name) for name, kwargs in self.runs.items()
+            if kwargs["labels"][APP_LABEL] == app_id or not app_id
+        ]
+
+    def stats(self, container_id):
+        closed = threading.Event()
+
+        def samples():
+            yield {"pids_stats": {"current": 1}}
+            closed.wait()
+
+        return StatsStream(samples(), closed.set)
+
+    def stop_container(self, container_id, timeout=10):
+        # The containers ignore SIGTERM, and take the whole timeout
+        self.stops[container_id] = (time.monotonic(), timeout)
+        time.sleep(min(timeout, self.stop_delay))
+        return True
+
+    def run_container(self, image, **kwargs):
+        time.sleep(self.start_delay)
+        with self.lock:
+            self.runs[kwargs["name"]] = dict(kwargs, image=image)
+            self.started[kwargs["name"]] = time.monotonic()
+        return self.container(kwargs["name"])
+
+
+@pytest.fixture
+def runtime():
+    return FakeRuntime()
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch, runtime):
+    monkeypatch.setattr(
+        'appmgr.core.application.get_available_runtimes',
+        lambda: {"fake": runtime}
+    )
+    return ApplicationManager(config_dir=tmp_path)
+
+def add_app(manager, containers):
+    config = {"id": "lab", "name": "Lab", "version": "1.0", "containers": containers}
+    app = manager._create_application(config, Path("/tmp"))
+    manager.applications[app.id] = app
+    return app
+
+
+class TestStartApplication:
+    """Tests for the dependency-ordered startup of the applications."""
+
+    def test_start_follows_dependencies(self, manager, runtime):
+        healthcheck = {"test": "pg_isready", "interval": "1s"}
+        add_app(manager, [
+            {"name": "ui", "image": "lab/ui:1.0", "depends_on": ["c2"]},
+            {"name": "c2", "image": "lab/c2:1.0", "depends_on": ["db"]},
+            {"name": "db", "image": "postgres:15", "healthcheck": healthcheck},
+            {"name": "redirector", "image": "nginx"},
+        ])
+        assert manager.start_application("lab") is True
+
+        assert sorted(runtime.pulls) == [
+            ("lab/c2", "1.0", "if-not-present"),
+            ("lab/ui", "1.0", "if-not-present"),
+            ("nginx", "latest", "if-not-present"),
+            ("postgres", "15", "if-not-present"),
+        ]
+        started = runtime.started
+        # c2 waited for db to be healthy, the redirector didn't wait for anyone
+        assert started["lab-c2"] >= started["lab-db"] + runtime.healthy_after
+        assert started["lab-ui"] > started["lab-c2"]
+        assert started["lab-redirector"] < started["lab-c2"]
+        db = runtime.runs["lab-db"]
+        assert db["labels"] == {APP_LABEL: "lab", COMPONENT_LABEL: "db"}
+        assert db["healthcheck"] == {"test": "pg_isready", "interval": 1000000000}
+
+    def test_start_unhealthy_dependency(self, manager):
+        manager.default_runtime.unhealthy = ("lab-db",)
+        add_app(manager, [
+            {"name": "db", "image": "postgres", "healthcheck": {"test": "pg_isready"}},
+            {"name": "c2", "image": "lab/c2", "depends_on": ["db"]},
+        ])
+        with pytest.raises(ApplicationError, match="db: lab-db is unhealthy"):
+            manager.start_application("lab")
+        assert "lab-c2" not in manager.default_runtime.runs
+
+    def test_start_pull_policies(self, manager, runtime):
+        add_app(manager, [
+            {"name": "c2", "image": "lab/c2", "pull_policy": "if-digest-changed"},
+            {"name": "worker", "image": "lab/c2", "pull_policy": "if-not-present"},
+            {"name": "db", "image": "postgres", "pull_policy": "always"},
+        ])
+        manager.start_application("lab")
+        assert sorted(runtime.pulls) == [
+            ("lab/c2", "latest", "if-digest-changed"), ("postgres", "latest", "always")
+        ]
+
+    def test_invalid_pull_policy(self, manager):
+        with pytest.raises(ValidationError, match="Invalid pull policy for db: never"):
+            add_app(manager, [{"name": "db", "image": "postgres", "pull_policy": "never"}])
+
+    def test_start_dependency_cycle(self, manager):
+        add_app(manager, [
+            {"name": "a", "image": "a", "depends_on": ["b"]},
+            {"name": "b", "image": "b", "depends_on": ["a"]},
+        ])
+        with pytest.raises(ValidationError, match="Dependency cycle"):
+            manager.start_application("lab")
+
+    @pytest.mark.parametrize("restart, policy", [
+        (None, "no"), (False, "no"), ("no", "no"), ("on-failure:3", "on-failure:3"),
+    ])
+    def test_restart_policy(self, manager, restart, policy):
+        container = {"name": "db", "image": "postgres"}
+        if restart is not None:
+            container["restart"] = restart
+        app = add_app(manager, [container])
+        assert app.config.containers[0].restart_policy == policy
+
+    @pytest.mark.parametrize("restart", [True, 1, ["always"]])
+    def test_invalid_restart_policy(self, manager, restart):
+        # 'restart: yes' or 'on' in YAML 1.1
+        with pytest.raises(ValidationError, match="Invalid restart policy"):
+            add_app(manager, [{"name": "db", "image": "postgres", "restart": restart}])
+
+    def test_helpers(self):
+        assert parse_duration("1m30s") == 90 * 10**9
+        assert parse_duration("500ms") == 500 * 10**6
+        assert parse_duration(2) == 2 * 10**9
+        with pytest.raises(ValidationError):
+            parse_duration("soon")
+        assert healthcheck_options({"test": ["CMD", "true"], "disable": True}) is None
+        assert restart_policy_options("no") is None
+        assert restart_policy_options("on-failure:3") == {"Name": "on-failure", "MaximumRetryCount": 3}
+
+
+class TestStopApplication:
+    """Tests for the reverse-ordered shutdown of the applications."""
+
+    @pytest.fixture
+    def runtime(self):
+        return FakeRuntime(start_delay=0)
+
+    def test_stop_reverse_order(self, manager, runtime):
+        add_app(manager, [
+            {"name": "ui", "image": "lab/ui", "depends_on": ["c2"]},
+            {"name": "c2", "image": "lab/c2", "depends_on": ["db"]},
+            {"name": "db", "image": "postgres"},
+            {"name": "redirector", "image": "nginx"},
+        ])
+        manager.start_application("lab")
+        assert manager.stop_application("lab") is True
+
+        stops = {name: t for name, (t, _) in runtime.stops.items()}
+        assert stops["lab-c2"] >= stops["lab-ui"] + runtime.stop_delay
+        assert stops["lab-db"] >= stops["lab-c2"] + runtime.stop_delay
+        assert stops["lab-redirector"] < stops["lab-c2"]
+        latency = manager.applications["lab"].state["stop_latency"]
+        assert sorted(latency) == ["c2", "db", "redirector", "ui"]
+
+    def test_stop_shared_deadline(self, manager, runtime):
+        runtime.stop_delay = 10
+        add_app(manager, [
+            {"name": "c2", "image": "lab/c2", "depends_on": ["db"]},
+            {"name": "db", "image": "postgres"},
+        ])
+        manager.start_application("lab")
+        start = time.monotonic()
+        manager.stop_application("lab", timeout=1)
+        assert time.monotonic() - start < 1.5
+        # c2 spent the whole budget, db is killed
+        assert runtime.stops["lab-c2"][1] == 1
+        assert runtime.stops["lab-db"][1] == 0
+
+    def test_stop_not_running(self, manager, runtime):
+        add_app(manager, [{"name": "db", "image": "postgres"}])
+        assert manager.stop_application("lab") is True
+        assert runtime.stops == {}
+
+
+def test_sample_stats(manager, runtime):
+    add_app(manager, [{"name": "db", "image": "postgres"}, {"name": "c2", "image": "lab/c2"}])
+    manager.start_application("lab")
+    runtime.run_container("nginx", name="other-web", labels={APP_LABEL: "other"})
+    with pytest.raises(ApplicationError, match="Application not found: nope"):
+        manager.sample_stats(["nope"])
+
+    samples = iter(manager.sample_stats(["lab"], interval=0.01))
+    stats = next(samples)
+    while len(stats) < 2:
+        stats = next(samples)
+    samples.close()
+    assert [(s.app_id, s.component, s.pids) for s in stats] == [("lab", "c2", 1), ("lab", "db", 1)]
+
+
+def test_list_installed(tmp_path):
+    config_dir = tmp_path / "apps"
+    manager = ApplicationManager(config_dir=config_dir)
+
+    def write(directory, app_id, version):
+        (config_dir / directory).mkdir(exist_ok=True)
+        (config_dir / directory / "app.yaml").write_text(
+            f"id: {app_id}\nname: App {app_id}\nversion: '{version}'\ncontainers: []\n"
+        )
+
+    write("web", "web", "1.0")
+    write("db", "db", "15")
+    assert [(r.app_id, r.version) for r in manager.list_installed()] == [
+        ("db", "15"), ("web", "1.0")
+    ]
+
+    # Only what changed is parsed again
+    write("web", "web", "1.1")
+    (config_dir / "db" / "app.yaml").unlink()
+    write("web2", "web", "0.1")
+    with patch('appmgr.core.application.load_config', wraps=load_config) as mock_load:
+        assert [(r.app_id, r.version) for r in manager.list_installed()] == [("web", "1.1")]
+        assert mock_load.call_count == 2
+    assert [(e["app_id"], e["action"]) for e in manager.state_store.history()] == [
+        ("db", "install"), ("web", "install"), ("web", "upgrade"), ("db", "remove"),
+    ]
+
+    # The state of an application is kept across managers
+    manager.state_store.save_state("web", {"stop_latency": {"main": 1.0}})
+    assert ApplicationManager(config_dir=config_dir).applications["web"].state == {
+        "stop_latency": {"main": 1.0}
+    }
+
+
+class TestApplicationIndex:
+    """Tests for the lazy loading of the applications."""
+
+    @pytest.fixture
+    def config_dir(self, tmp_path):
+        for i in range(3):
+            (tmp_path / f"app{i}").mkdir()
+            (tmp_path / f"app{i}" / "app.yaml").write_text(
+                f"id: app{i}\nname: App {i}\nversion: '1.0'\ncontainers: []\n"
+            )
+        # The id doesn't have to be the name of the directory
+        (tmp_path / "other").mkdir()
+        (tmp_path / "other" / "app.yaml").write_text(
+            "id: renamed\nname: Renamed\nversion: '1.0'\ncontainers: []\n"
+        )
+        return tmp_path
+
+    def test_lazy_lookup(self, config_dir, monkeypatch):
+        monkeypatch.setattr(
+            'appmgr.core.application.get_available_runtimes',
+            MagicMock(side_effect=AssertionError("no runtime needed"))
+        )
+        manager = ApplicationManager(config_dir=config_dir)
+        with patch('appmgr.core.application.load_config', wraps=load_config) as mock_load:
+            assert manager.applications["app1"].name == "App 1"
+            assert "app2" in manager.applications
+            assert mock_load.call_count == 2
+
+    def test_fallback_scan(self, config_dir):
+        manager = ApplicationManager(config_dir=config_dir)
+        assert manager.applications["renamed"].name == "Renamed"
+        assert "missing" not in manager.applications
+        assert sorted(manager.applications) == ["app0", "app1", "app2", "renamed"]
@@ -0,0 +1,195 @@
+"""Unit tests for the asynchronous container runtime."""
+
+import asyncio
+import struct
+
+import pytest
+
+from appmgr.core.async_runtime import (
+    AsyncDockerRuntime,
+    AsyncEngineClient,
+    SyncRuntimeAdapter,
+    build_create_config,
+    demux_log_stream,
+    split_image_name,
+)
+from appmgr.core.exceptions import ContainerRuntimeError
+
+@pytest.fixture
+def runtime(fake_engine):
+    adapter = SyncRuntimeAdapter(AsyncDockerRuntime(socket_path=fake_engine.server_address))
+    yield adapter
+    adapter.close()
+
+
+class TestHelpers:
+    """Tests for the helper functions."""
+
+    def test_split_image_name(self):
+        assert split_image_name("nginx") == ("nginx", "latest")
+        assert split_image_name("nginx:alpine") == ("nginx", "alpine")
+        assert split_image_name("localhost:5000/app") == ("localhost:5000/app", "latest")
+        assert split_image_name("localhost:5000/app:1.0") == ("localhost:5000/app", "1.0")
+        assert split_image_name("app@sha256:abc") == ("app", "sha256:abc")
+
+    def test_demux_log_stream(self):
+        data = struct.pack(">BxxxL", 1, 3) + b"out" + struct.pack(">BxxxL", 2, 3) + b"err"
+        assert demux_log_stream(data) == b"outerr"
+
+    def test_build_create_config(self):
+        config = build_create_config(
+            "nginx:alpine",
+            command="nginx -g 'daemon off;'",
+            environment={"ENV": "test"},
+            volumes={"web-data": {"bind": "/data", "mode": "ro"}},
+            ports={"80/tcp": 8080, 443: ("127.0.0.1", 8443)},
+            labels={"app": "test"},
+            healthcheck={"test": "curl -f localhost", "interval": 10**9},
+        )
+        assert config["Healthcheck"] == {
+            "Test": ["CMD-SHELL", "curl -f localhost"], "Interval": 10**9
+        }
+        assert config["Cmd"] == ["/bin/sh", "-c", "nginx -g 'daemon off;'"]
+        assert config["Env"] == ["ENV=test"]
+        assert config["Labels"] == {"app": "test"}
+        assert config["ExposedPorts"] == {"80/tcp": {}, "443/tcp": {}}
+        assert config["HostConfig"]["Binds"] == ["web-data:/data:ro"]
+        assert config["HostConfig"]["PortBindings"] == {
+            "80/tcp": [{"HostPort": "8080"}],
+            "443/tcp": [{"HostIp": "127.0.0.1", "HostPort": "8443"}],
+        }
+
+    def test_build_create_config_unknown_option(self):
+        with pytest.raises(TypeError):
+            build_create_config("nginx", unknown_option=True)
+
+
+class TestAsyncDockerRuntime:
+    """Tests for AsyncDockerRuntime, through the sync adapter."""
+
+    def test_connect(self, runtime):
+        assert runtime.connect() is True
+        assert runtime.connected is True
+
+    def test_connect_no_daemon(self, tmp_path):
+        adapter = SyncRuntimeAdapter(AsyncDockerRuntime(socket_path=str(tmp_path / "none")))
+        assert adapter.is_available() is False
+        assert adapter.connect() is False
+        adapter.close()
+
+    def test_pull_image(self, runtime):
+        image = runtime.pull_image("nginx", tag="alpine")
+        assert image.id == "sha256:abc123"
+        assert image.tags == ["nginx:alpine"]
+        assert image.size == 1234
+
+    def test_pull_image_failure(self, runtime):
+        with pytest.raises(ContainerRuntimeError, match="manifest unknown"):
+            runtime.pull_image("broken")
+
+    def test_run_container(self, runtime, fake_engine):
+        container = runtime.run_container(
+            "nginx:alpine", name="web", ports={"80/tcp": 8080}, detach=True
+        )
+        assert container.id == "c0ffee"
+        assert container.name == "web"
+        assert container.state == "running"
+        assert container.ports["80/tcp"][0]["HostPort"] == "8080"
+        create = next(r for r in fake_engine.requests if r[1].startswith("/containers/create"))
+        assert create[1] == "/containers/create?name=web"
+        assert create[2]["Image"] == "nginx:alpine"
+
+    def test_stop_container(self, runtime):
+        assert runtime.stop_container("c0ffee") is True
+        assert runtime.stop_container("missing") is False
+
+    def test_list_containers(self, runtime, fake_engine):
+        containers = runtime.list_containers(filters={"label": "app=test"})
+        assert [c.name for c in containers] == ["web"]
+        assert containers[0].ports == {"80/tcp": [{"HostIp": "0.0.0.0", "HostPort": "8080"}]}
+        assert "filters=%7B%22label%22%3A+%5B%22app%3Dtest%22%5D%7D" in fake_engine.requests[-1][1]
+
+    def test_get_container_missing(self, runtime):
+        assert runtime.get_container("missing") is None
+
+    def test_get_container_logs(self, runtime):
+        assert runtime.get_container_logs("c0ffee") == "hello\noops\n"
+
+    def test_connection_reused(self, runtime, fake_engine):
+        runtime.connect()
+        runtime.pull_image("nginx", tag="alpine")
+        runtime.get_container("c0ffee")
+        runtime.list_containers()
+        assert fake_engine.connections == 1
+
+    def test_concurrent_operations(self, fake_engine):
+        async def main():
+            rt = AsyncDockerRuntime(socket_path=fake_engine.server_address, max_connections=3)
+            try:
+                return await asyncio.gather(
+                    *[rt.pull_image("nginx", tag="alpine") for _ in range(6)],
+                    rt.stop_container("c0ffee"),
+                )
+            finally:
+                await rt.close()
+
+        results = asyncio.run(main())
+        assert [i.id for i in results[:6]] == ["sha256:abc123"] * 6
+        assert results[6] is True
+        assert 1 < fake_engine.connections <= 3
+
+
+class TestAsyncEngineClient:
+    """Tests for the reuse of the connections of AsyncEngineClient."""
+
+    def run(self, fake_engine, *requests, before=None):
+        """Ping, to leave an idle connection, then send the requests"""
+        async def main():
+            client = AsyncEngineClient(fake_engine.server_address, timeout=1)
+            try:
+                await (await client.request("GET", "/_ping")).read()
+                if before:
+                    before(client)
+                return [await (await client.request(*r)).read() for r in requests]
+            finally:
+                await client.close()
+
+        return asyncio.run(main())
+
+    def count(self, fake_engine, method, path):
+        return sum(1 for r in fake_engine.requests if r[:2] == (method, path))
+
+    def test_response_lost_retry(self, fake_engine):
+        def lose(client):
+            fake_engine.lose_responses = 1
+
+        self.run(fake_engine, ("GET", "/containers/c0ffee/json"), before=lose)
+        assert self.count(fake_engine, "GET", "/containers/c0ffee/json") == 2
+
+    def test_response_lost_no_retry(self, fake_engine):
+        def lose(client):
+            fake_engine.lose_responses = 1
+
+        # The engine might have run it already, it's not sent twice
+        with pytest.raises(ContainerRuntimeError):
+            self.run(fake_engine, ("POST", "/containers/create", None, {"Image": "nginx"}),
+                     before=lose)
+        assert self.count(fake_engine, "POST", "/containers/create") == 1
+
+    def test_connection_dropped(self, fake_engine):
+        def drop(client):
+            client._idle[0].reader.feed_eof()
+
+        # The engine closed the idle connection: a new one is opened
+        self.run(fake_engine, ("POST", "/containers/create", None, {"Image": "nginx"}),
+                 before=drop)
+        assert self.count(fake_engine, "POST", "/containers/create") == 1
+        assert fake_engine.connections == 2
+
+    def test_timeout(self, fake_engine):
+        def stall(client):
+            client.timeout = 0.1
+            fake_engine.stall = 0.5
+
+        with pytest.raises(ContainerRuntimeError):
+            self.run(fake_engine, ("GET", "/containers/c0ffee/json"), before=stall)
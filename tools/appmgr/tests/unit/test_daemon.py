@@ -0,0 +1,254 @@
+"""Unit tests for appmgrd and its protocol."""
+
+import argparse
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import types
+
+import pytest
+
+from appmgr import DEFAULT_ENGINE, DockerBackend, daemon
+
+
+@pytest.fixture
+def socket_path(tmp_path):
+    return str(tmp_path / "run" / "appmgrd.sock")
+
+
+def test_get_socket_path(monkeypatch):
+    monkeypatch.setenv("APPMGRD_SOCKET", "/somewhere/appmgrd.sock")
+    assert daemon.get_socket_path() == "/somewhere/appmgrd.sock"
+    monkeypatch.delenv("APPMGRD_SOCKET")
+    monkeypatch.setenv("XDG_RUNTIME_DIR", "/run/user/1000")
+    assert daemon.get_socket_path() == "/run/user/1000/appmgrd.sock"
+    # Never right in /tmp, where anybody could take the name first
+    monkeypatch.delenv("XDG_RUNTIME_DIR")
+    assert daemon.get_socket_path() == os.path.join(
+        tempfile.gettempdir(), "appmgrd-%d" % os.getuid(), "appmgrd.sock"
+    )
+
+
+def test_prepare_socket_path(socket_path):
+    daemon.prepare_socket_path(socket_path)
+    directory = os.path.dirname(socket_path)
+    assert os.stat(directory).st_mode & 0o777 == 0o700
+    # A socket left behind is removed, anything else is left alone
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(socket_path)
+    sock.close()
+    daemon.prepare_socket_path(socket_path)
+    assert not os.path.exists(socket_path)
+    with open(socket_path, "w"):
+        pass
+    with pytest.raises(FileExistsError):
+        daemon.prepare_socket_path(socket_path)
+
+
+def test_prepare_socket_path_unsafe(tmp_path):
+    shared = tmp_path / "shared"
+    shared.mkdir()
+    shared.chmod(0o1777)
+    with pytest.raises(PermissionError):
+        daemon.prepare_socket_path(str(shared / "appmgrd.sock"))
+    # Not through a symlink either, its target could be anywhere
+    private = tmp_path / "private"
+    private.mkdir(0o700)
+    (tmp_path / "link").symlink_to(private)
+    with pytest.raises(PermissionError):
+        daemon.prepare_socket_path(str(tmp_path / "link" / "appmgrd.sock"))
+
+
+def test_filter_env():
+    env = {
+        "HOME": "/home/user",
+        "APPMGR_ENGINE": "podman",
+        "APPMGRD_SOCKET": "/run/appmgrd.sock",
+        "DOCKER_HOST": "unix:///run/docker.sock",
+        "LC_ALL": "C",
+        "https_proxy": "http://proxy:3128",
+        "AWS_SECRET_ACCESS_KEY": "secret",
+        "SSH_AUTH_SOCK": "/run/ssh-agent",
+    }
+    assert daemon.filter_env(env) == {
+        "HOME": "/home/user",
+        "APPMGR_ENGINE": "podman",
+        "DOCKER_HOST": "unix:///run/docker.sock",
+        "LC_ALL": "C",
+        "https_proxy": "http://proxy:3128",
+    }
+
+
+def test_environment(monkeypatch):
+    monkeypatch.setenv("APPMGR_ENGINE", "docker")
+    monkeypatch.setenv("DAEMON_ONLY", "1")
+    with daemon.environment({"DOCKER_HOST": "tcp://remote", "SECRET": "1"}):
+        assert os.environ["DOCKER_HOST"] == "tcp://remote"
+        # The forwarded variables the client doesn't have are unset
+        assert "APPMGR_ENGINE" not in os.environ
+        assert "SECRET" not in os.environ
+        assert os.environ["DAEMON_ONLY"] == "1"
+    assert os.environ["APPMGR_ENGINE"] == "docker"
+    assert "DOCKER_HOST" not in os.environ
+
+
+class FakeAppmgr:
+    """Just enough of Appmgr for the daemon to run its commands"""
+
+    def __init__(self):
+        self.registry = types.SimpleNamespace(cache_ttl=None)
+        self.backend = DockerBackend()
+        self.commands = []
+        self.parser = argparse.ArgumentParser(prog="appmgr")
+        self.parser.add_argument("--engine")
+        self.parser.add_argument("action")
+        self.parser.set_defaults(func=self.run)
+
+    def setup_logging(self):
+        pass
+
+    def run(self):
+        self.commands.append((self.args.action, os.getcwd(), os.getenv("APPMGR_TEST")))
+        if self.args.action == "fail":
+            raise RuntimeError("boom")
+        print("running %s" % self.args.action)
+        print("on %s" % self.backend.engine, file=sys.stderr)
+        sys.exit(3)
+
+
+@pytest.fixture
+def server(socket_path):
+    server = daemon.AppmgrDaemon(socket_path, FakeAppmgr())
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    thread.join()
+    server.server_close()
+
+
+def send(socket_path, request):
+    """Send a request to the daemon, return the frames of the reply"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        with sock.makefile("rwb") as f:
+            f.write((json.dumps(request) + "\n").encode())
+            f.flush()
+            return [json.loads(line) for line in f]
+
+
+def test_server(server, socket_path, tmp_path):
+    cwd = os.getcwd()
+    assert server.appmgr.registry.cache_ttl == daemon.REGISTRY_CACHE_TTL
+    assert os.stat(socket_path).st_mode & 0o777 == 0o600
+    frames = send(socket_path, {
+        "argv": ["--engine", "podman", "list"],
+        "cwd": str(tmp_path),
+        "env": {"APPMGR_TEST": "1"},
+    })
+    assert frames == [
+        {"stdout": "running list"},
+        {"stdout": "\n"},
+        {"stderr": "on podman"},
+        {"stderr": "\n"},
+        {"exit": 3},
+    ]
+    assert server.appmgr.commands == [("list", str(tmp_path), "1")]
+    assert server.appmgr.backend.engine == "podman"
+    # The daemon is back in its own directory and environment
+    assert os.getcwd() == cwd
+    assert "APPMGR_TEST" not in os.environ
+
+
+def test_server_engine(server, socket_path, monkeypatch):
+    monkeypatch.setenv("APPMGR_ENGINE", "native")
+    # The engine comes from the environment of the client, not the daemon's
+    frames = send(socket_path, {"argv": ["list"], "env": {}})
+    assert {"stderr": "on %s" % DEFAULT_ENGINE} in frames
+    frames = send(socket_path, {"argv": ["list"], "env": {"APPMGR_ENGINE": "native"}})
+    assert {"stderr": "on native"} in frames
+    assert server.appmgr.backend.engine == "native"
+
+
+def test_server_errors(server, socket_path):
+    assert send(socket_path, {"argv": ["fail"]}) == [{"exit": 1}]
+    assert send(socket_path, {"argv": ["--no-such-option"]})[-1] == {"exit": 2}
+    # A malformed request is dropped
+    assert send(socket_path, {"args": ["list"]}) == []
+    assert [c[0] for c in server.appmgr.commands] == ["fail"]
+
+
+def test_server_peer_check(server, socket_path, monkeypatch):
+    monkeypatch.setattr(daemon.os, "getuid", lambda: 12345)
+    # The connection is closed before the request is even read
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        assert sock.recv(1) == b""
+    assert server.appmgr.commands == []
+
+
+class FakeServer:
+    """The daemon side of the protocol, that replies with frames"""
+
+    def __init__(self, socket_path, frames):
+        os.mkdir(os.path.dirname(socket_path), 0o700)
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(socket_path)
+        self.listener.listen(1)
+        self.frames = frames
+        self.received = None
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.start()
+
+    def serve(self):
+        conn, _ = self.listener.accept()
+        with conn, conn.makefile("rb") as f:
+            self.received = f.readline()
+            try:
+                for frame in self.frames:
+                    conn.sendall((json.dumps(frame) + "\n").encode())
+            except OSError:
+                pass
+
+    def close(self):
+        self.thread.join(5)
+        self.listener.close()
+
+
+def test_forward_command(socket_path, monkeypatch, capsys, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("APPMGR_ENGINE", "podman")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "secret")
+    server = FakeServer(socket_path, [{"stdout": "out\n"}, {"stderr": "err\n"}, {"exit": 4}])
+    assert daemon.forward_command(["list", "--all"], socket_path) == 4
+    server.close()
+    assert capsys.readouterr() == ("out\n", "err\n")
+    request = json.loads(server.received)
+    assert request["argv"] == ["list", "--all"]
+    assert request["cwd"] == str(tmp_path)
+    assert request["env"] == daemon.filter_env(os.environ)
+    assert request["env"]["APPMGR_ENGINE"] == "podman"
+    assert "AWS_SECRET_ACCESS_KEY" not in request["env"]
+
+
+def test_forward_command_connection_lost(socket_path, capsys):
+    server = FakeServer(socket_path, [{"stdout": "partial"}])
+    assert daemon.forward_command(["upgrade"], socket_path) == 1
+    server.close()
+    assert capsys.readouterr() == ("partial", "appmgrd: connection lost\n")
+
+
+def test_forward_command_not_running(socket_path):
+    assert daemon.forward_command(["list"], socket_path) is None
+
+
+def test_forward_command_peer_check(socket_path, monkeypatch):
+    server = FakeServer(socket_path, [{"exit": 0}])
+    # The socket is another user's: nothing is sent, the command runs here
+    monkeypatch.setattr(daemon.os, "getuid", lambda: 12345)
+    assert daemon.forward_command(["list"], socket_path) is None
+    server.close()
+    assert server.received == b""
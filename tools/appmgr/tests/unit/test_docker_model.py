@@ -0,0 +1,202 @@
+"""Unit tests for the model of the docker objects, kept up to date from the events."""
+
+import time
+
+import docker
+import pytest
+
+from appmgr import DockerModel, format_event_time, parse_system_time
+
+HOUR = 3600 * 10**9
+
+
+class FakeObject:
+    def __init__(self, id, name="", tags=(), status="running"):
+        self.id = id
+        self.name = name
+        self.status = status
+        self.attrs = {"RepoTags": list(tags)}
+
+    @property
+    def tags(self):
+        return self.attrs["RepoTags"]
+
+
+class FakeCollection:
+    """images, containers or networks of a docker-py client"""
+
+    def __init__(self, client):
+        self.client = client
+        self.objects = {}
+
+    def add(self, obj):
+        self.objects[obj.id] = obj
+
+    def list(self):
+        self.client.calls.append("list")
+        return list(self.objects.values())
+
+    def get(self, id):
+        self.client.calls.append("get %s" % id)
+        try:
+            return self.objects[id]
+        except KeyError:
+            raise docker.errors.NotFound(id)
+
+    def prepare_model(self, attrs):
+        return self.objects[attrs["Id"]]
+
+
+class FakeApi:
+    def __init__(self, client):
+        self.client = client
+
+    def events(self, since, until=None, filters=None, decode=None):
+        since = int(since.replace(".", ""))
+        until = int(until.replace(".", ""))
+        return [e for e in self.client.events if since <= e["timeNano"] <= until]
+
+
+class FakeClient:
+    """A docker daemon whose clock is off by 'skew' nanoseconds"""
+
+    def __init__(self, skew=0):
+        self.skew = skew
+        self.calls = []
+        self.events = []
+        self.images = FakeCollection(self)
+        self.containers = FakeCollection(self)
+        self.networks = FakeCollection(self)
+        self.api = FakeApi(self)
+
+    def now(self):
+        return time.time_ns() + self.skew
+
+    def info(self):
+        seconds, ns = divmod(self.now(), 10**9)
+        t = time.gmtime(seconds)
+        return {"SystemTime": "%04d-%02d-%02dT%02d:%02d:%02d.%09dZ" % (t[:6] + (ns,))}
+
+    def emit(self, kind, action, id, obj=None):
+        """Something happened on the daemon"""
+        collection = getattr(self, kind + "s")
+        if obj is None:
+            collection.objects.pop(id, None)
+        else:
+            collection.add(obj)
+        self.events.append({
+            "Type": kind,
+            "Action": action,
+            "Actor": {"ID": id},
+            "timeNano": self.now(),
+        })
+
+
+class FakeBackend:
+    def list_images(self, client):
+        client.calls.append("images")
+        return [{"Id": id} for id in client.images.objects]
+
+
+@pytest.mark.parametrize("value, t", [
+    ("2024-05-01T12:00:00Z", 1714564800 * 10**9),
+    ("2024-05-01T12:00:00.5Z", 1714564800 * 10**9 + 5 * 10**8),
+    ("2024-05-01T12:00:00.123456789Z", 1714564800 * 10**9 + 123456789),
+    ("2024-05-01T14:00:00.123456789+02:00", 1714564800 * 10**9 + 123456789),
+    ("2024-05-01T10:30:00-01:30", 1714564800 * 10**9),
+])
+def test_parse_system_time(value, t):
+    assert parse_system_time(value) == t
+
+
+def test_parse_system_time_invalid():
+    with pytest.raises(ValueError):
+        parse_system_time("yesterday")
+
+
+def test_format_event_time():
+    assert format_event_time(1714564800 * 10**9 + 5) == "1714564800.000000005"
+
+
+def test_lazy_collections():
+    client = FakeClient()
+    client.images.add(FakeObject("sha256:1", tags=["appmgr/web:1.0"]))
+    client.networks.add(FakeObject("n1", name="appmgr"))
+    model = DockerModel(client, FakeBackend())
+    assert [i.id for i in model.list_images()] == ["sha256:1"]
+    # Only the images were listed
+    assert client.calls == ["images"]
+    model.list_images()
+    assert client.calls == ["images"]
+    assert model.find_network("appmgr").id == "n1"
+    assert model.find_network("other") is None
+    assert client.calls == ["images", "list"]
+
+
+@pytest.mark.parametrize("skew", [0, HOUR, -HOUR])
+def test_events(skew):
+    """The events are applied, whichever clock is ahead"""
+    client = FakeClient(skew)
+    model = DockerModel(client, FakeBackend())
+    assert model.list_images() == []
+    assert model.find_containers("web") == []
+
+    client.emit("image", "pull", "sha256:1", FakeObject("sha256:1", tags=["appmgr/web:1.0"]))
+    client.emit("container", "start", "c1", FakeObject("c1", name="web-1"))
+    client.emit("container", "start", "c2", FakeObject("c2", name="db-1", status="exited"))
+    assert [i.id for i in model.list_images()] == ["sha256:1"]
+    # Only the running containers are kept
+    assert [c.id for c in model.find_containers("web")] == ["c1"]
+    assert model.find_containers("db") == []
+
+    client.emit("container", "die", "c1")
+    assert model.find_containers("web") == []
+
+
+def test_events_applied_once():
+    client = FakeClient()
+    model = DockerModel(client, FakeBackend())
+    model.list_images()
+    client.emit("image", "pull", "sha256:1", FakeObject("sha256:1", tags=["appmgr/web:1.0"]))
+    model.list_images()
+    model.list_images()
+    assert client.calls == ["images", "get sha256:1"]
+
+
+def test_events_of_unlisted_collections():
+    client = FakeClient()
+    model = DockerModel(client, FakeBackend())
+    model.list_images()
+    client.emit("network", "create", "n1", FakeObject("n1", name="appmgr"))
+    client.emit("container", "start", "c1", FakeObject("c1", name="web-1"))
+    model.list_images()
+    # Nothing to update, they'll be listed as they are
+    assert client.calls == ["images"]
+    assert model.find_network("appmgr").id == "n1"
+    assert client.calls == ["images", "list"]
+
+
+def test_tag_moved():
+    client = FakeClient()
+    client.images.add(FakeObject("sha256:1", tags=["appmgr/web:1.0", "appmgr/web:current"]))
+    model = DockerModel(client, FakeBackend())
+    model.list_images()
+    client.emit("image", "tag", "sha256:2",
+                FakeObject("sha256:2", tags=["appmgr/web:1.1", "appmgr/web:current"]))
+    images = {i.id: i.tags for i in model.list_images()}
+    assert images == {
+        "sha256:1": ["appmgr/web:1.0"],
+        "sha256:2": ["appmgr/web:1.1", "appmgr/web:current"],
+    }
+
+
+def test_gap():
+    client = FakeClient()
+    model = DockerModel(client, FakeBackend())
+    model.list_images()
+    model.list_images()
+    assert client.calls == ["images"]
+    # Not read for a while: the model is rebuilt
+    model.synced_at -= 301 * 10**9
+    model.list_images()
+    assert client.calls == ["images", "images"]
@@ -0,0 +1,172 @@
+"""Unit tests for the lean Engine API client."""
+
+import http.client
+import io
+import socket
+import struct
+import tarfile
+import threading
+
+import pytest
+
+from appmgr import DockerBackend
+from appmgr.core.engine import (
+    EngineClient,
+    get_docker_socket_path,
+    iter_log_frames,
+    iter_log_lines,
+)
+from appmgr.core.exceptions import ContainerRuntimeError, EngineAPIError
+
+
+@pytest.fixture
+def client(fake_engine):
+    client = EngineClient(socket_path=fake_engine.server_address)
+    yield client
+    client.close()
+
+
+def test_get_docker_socket_path(monkeypatch):
+    monkeypatch.delenv("DOCKER_HOST", raising=False)
+    assert get_docker_socket_path() == "/var/run/docker.sock"
+    monkeypatch.setenv("DOCKER_HOST", "unix:///run/user/1000/docker.sock")
+    assert get_docker_socket_path() == "/run/user/1000/docker.sock"
+    monkeypatch.setenv("DOCKER_HOST", "tcp://127.0.0.1:2375")
+    assert get_docker_socket_path() is None
+    with pytest.raises(ContainerRuntimeError):
+        EngineClient()
+
+
+def test_iter_log_lines():
+    data = b"".join(
+        struct.pack(">BxxxL", stream, len(chunk)) + chunk
+        for stream, chunk in [(1, b"hel"), (2, b"oops\n"), (1, b"lo\nworld\n"), (1, b"end")]
+    )
+    # Frames split anywhere by the transport
+    chunks = [data[i:i + 5] for i in range(0, len(data), 5)]
+    assert list(iter_log_lines(iter_log_frames(chunks))) == ["oops", "hello", "world", "end"]
+
+
+class TestEngineClient:
+    """Tests for the EngineClient class."""
+
+    def test_ping(self, client):
+        assert client.ping() is True
+
+    def test_images(self, client):
+        images = client.images()
+        assert [i["RepoTags"] for i in images] == [
+            ["appmgr/app0:1.0"], ["appmgr/app1:1.0"], ["appmgr/app2:1.0"]
+        ]
+
+    def test_containers_filters(self, client, fake_engine):
+        containers = client.containers(filters={"name": "web"})
+        assert containers[0]["Names"] == ["/web"]
+        assert "filters=%7B%22name%22%3A+%5B%22web%22%5D%7D" in fake_engine.requests[-1][1]
+
+    def test_inspect_container_missing(self, client):
+        with pytest.raises(EngineAPIError, match="No such object") as excinfo:
+            client.inspect_container("missing")
+        assert excinfo.value.status == 404
+
+    def test_create_and_remove_container(self, client, fake_engine):
+        assert client.create_container({"Image": "nginx"}) == "c0ffee"
+        client.remove_container("c0ffee", force=True)
+        assert fake_engine.requests[-1] == ("DELETE", "/containers/c0ffee?force=true&v=false")
+
+    def test_get_archive(self, client):
+        stream, stat = client.get_archive("c0ffee", "/appmgr/version")
+        assert stat["name"] == "version"
+        data = b"".join(stream.iter_chunks())
+        with tarfile.open(fileobj=io.BytesIO(data)) as tf:
+            assert tf.extractfile("version").read() == b"1.2\n"
+
+    def test_put_archive(self, client, fake_engine):
+        client.put_archive("c0ffee", "/", b"tar data")
+        method, path, body = fake_engine.requests[-1]
+        assert (method, path, body) == ("PUT", "/containers/c0ffee/archive?path=%2F", b"tar data")
+
+    def test_connection_reused(self, client, fake_engine):
+        client.ping()
+        client.images()
+        client.get_archive("c0ffee", "/appmgr/version")[0].read()
+        client.inspect_container("c0ffee")
+        assert fake_engine.connections == 1
+
+    def test_connection_dropped(self, client, fake_engine):
+        client.ping()
+        # The engine closed the idle connection: a new one is opened
+        client._idle[0].sock.shutdown(socket.SHUT_RD)
+        assert client.create_container({"Image": "nginx"}) == "c0ffee"
+        assert fake_engine.connections == 2
+        assert [r[0] for r in fake_engine.requests].count("POST") == 1
+
+    def lose_response(self, client, error):
+        """The response to the next request on the idle connection is lost"""
+        conn = client._idle[0]
+
+        def getresponse():
+            # Once the engine answered, so that it surely got the request
+            del conn.getresponse
+            conn.getresponse().read()
+            raise error
+
+        conn.getresponse = getresponse
+
+    def test_reused_connection_retry(self, client, fake_engine):
+        client.ping()
+        self.lose_response(client, http.client.RemoteDisconnected("Remote end closed"))
+        assert client.images()
+        assert [r[1] for r in fake_engine.requests].count("/images/json?all=false") == 2
+
+    def test_reused_connection_no_retry(self, client, fake_engine):
+        client.ping()
+        self.lose_response(client, ConnectionResetError())
+        # The engine might have run it already, it's not sent twice
+        with pytest.raises(ContainerRuntimeError):
+            client.remove_container("c0ffee", force=True)
+        assert [r[0] for r in fake_engine.requests].count("DELETE") == 1
+
+    def test_reused_connection_not_sent(self, client, fake_engine):
+        client.ping()
+        conn = client._idle[0]
+
+        def request(*args, **kwargs):
+            del conn.request
+            raise BrokenPipeError()
+
+        conn.request = request
+        # The request didn't get through, it's safe to send it again
+        assert client.create_container({"Image": "nginx"}) == "c0ffee"
+        assert [r[0] for r in fake_engine.requests].count("POST") == 1
+
+    def test_threads(self, client, fake_engine):
+        def work():
+            for _ in range(10):
+                client.images()
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert fake_engine.connections <= 4
+
+
+class TestDockerBackend:
+    """Tests for the engine selection of DockerBackend."""
+
+    def test_native_engine(self, fake_engine, monkeypatch):
+        monkeypatch.setenv("DOCKER_HOST", "unix://" + fake_engine.server_address)
+        backend = DockerBackend(engine="native")
+        container_id = backend.create_container(None, "sha256:abc123")
+        chunks, stat = backend.get_archive(None, container_id, "/appmgr/version")
+        assert stat["size"] == 4
+        assert b"".join(chunks)
+        backend.remove_container(None, container_id)
+
+    def test_native_engine_unsupported_host(self, monkeypatch):
+        monkeypatch.setenv("DOCKER_HOST", "tcp://127.0.0.1:2375")
+        backend = DockerBackend(engine="native")
+        assert backend.get_engine_client() is None
+        assert backend.engine == "docker-py"
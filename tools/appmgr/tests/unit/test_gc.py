@@ -0,0 +1,126 @@
+"""Unit tests for the garbage collection of the images of the apps."""
+
+from appmgr import is_dangling, plan_image_gc
+
+APP_IMAGE_NAMES = {
+    "appmgr/web": "web",
+    "registry.example.com/team/web": "web",
+    "appmgr/db": "db",
+}
+
+
+def image(id, *tags, parent="", containers=0):
+    """An image summary, as /system/df returns it"""
+    return {
+        "Id": "sha256:%s" % id,
+        "ParentId": "sha256:%s" % parent if parent else "",
+        "RepoTags": list(tags) or ["<none>:<none>"],
+        "Containers": containers,
+        "Size": 100,
+        "SharedSize": 0,
+    }
+
+
+def ids(images):
+    return [i["Id"][7:] for i in images]
+
+
+def plan(images, keep=2, keep_current=True):
+    plan = plan_image_gc(images, APP_IMAGE_NAMES, keep, keep_current=keep_current)
+    return {
+        "remove": ids(plan["remove"]),
+        "untag": [(i["Id"][7:], tags) for i, tags in plan["untag"]],
+        "in_use": ids(plan["in_use"]),
+    }
+
+
+def test_is_dangling():
+    assert is_dangling(image("a"))
+    assert is_dangling({"RepoTags": None})
+    assert not is_dangling(image("a", "appmgr/web:1.0"))
+
+
+def test_keep_versions():
+    images = [
+        image("w10", "appmgr/web:1.0"),
+        image("w11", "appmgr/web:1.1", "registry.example.com/team/web:1.1"),
+        image("w19", "appmgr/web:1.9"),
+        image("w110", "appmgr/web:1.10", "appmgr/web:current"),
+        image("d1", "appmgr/db:1"),
+        image("other", "debian:12"),
+    ]
+    # 1.10 comes after 1.9, and the only version of db stays
+    assert plan(images) == {"remove": ["w10", "w11"], "untag": [], "in_use": []}
+    assert plan(images, keep=3)["remove"] == ["w10"]
+
+
+def test_keep_current():
+    images = [
+        image("w10", "appmgr/web:1.0", "appmgr/web:current"),
+        image("w11", "appmgr/web:1.1"),
+        image("w12", "appmgr/web:1.2"),
+        image("wl", "appmgr/web:latest"),
+    ]
+    # The current version stays, even if it's an old one
+    assert plan(images, keep=1)["remove"] == ["w11", "wl"]
+    assert plan(images, keep=1, keep_current=False)["remove"] == ["w10", "w11", "wl"]
+
+
+def test_untag_and_in_use():
+    images = [
+        image("w10", "appmgr/web:1.0", "mirror/web:1.0"),
+        image("w11", "appmgr/web:1.1", containers=1),
+        image("w12", "appmgr/web:1.2"),
+    ]
+    assert plan(images, keep=1) == {
+        "remove": [],
+        "untag": [("w10", ["appmgr/web:1.0"])],
+        "in_use": ["w11"],
+    }
+
+
+def test_dangling_descendants():
+    images = [
+        image("c2", parent="c1"),
+        image("w10", "appmgr/web:1.0"),
+        image("c1", parent="w10"),
+        image("w11", "appmgr/web:1.1"),
+        image("c3", parent="w11", containers=1),
+        image("c4", parent="w11"),
+        # Neither the descendants of other images, nor their ancestors
+        image("x", parent="base"),
+        image("base", "debian:12"),
+        image("w09", "appmgr/web:0.9", parent="base"),
+    ]
+    result = plan(images)
+    # The children go before their parents
+    assert result["remove"] == ["c2", "c1", "c4", "w09"]
+    assert result["in_use"] == ["c3"]
+
+
+def test_not_a_version():
+    images = [
+        image("w10", "appmgr/web:1.0"),
+        image("wn", "appmgr/web:nightly"),
+        image("wc", "appmgr/web:current", "appmgr/web:dev-build"),
+    ]
+    # Tags that appmgr didn't make are left alone by gc
+    assert plan(images, keep=0)["remove"] == ["w10"]
+
+
+def test_purge():
+    images = [
+        image("w10", "appmgr/web:1.0"),
+        image("wn", "appmgr/web:nightly"),
+        image("wc", "appmgr/web:current", "registry.example.com/team/web:nightly"),
+        image("wl", "registry.example.com/team/web:latest"),
+        image("wm", "appmgr/web:1.1", "mirror/web:1.1"),
+        image("wu", "appmgr/web:1.2", containers=2),
+        image("c1", parent="wc"),
+    ]
+    # Every image of the app goes, whatever its tags
+    assert plan(images, keep=0, keep_current=False) == {
+        "remove": ["c1", "w10", "wn", "wc", "wl"],
+        "untag": [("wm", ["appmgr/web:1.1"])],
+        "in_use": ["wu"],
+    }
@@ -0,0 +1,75 @@
+"""Unit tests for the dependency graph of the containers."""
+
+import threading
+import time
+
+import pytest
+
+from appmgr.core.exceptions import ValidationError
+from appmgr.core.graph import DependencyError, DependencyGraph
+from appmgr.models import ContainerSpec
+
+
+def make_graph(**dependencies):
+    return DependencyGraph({name: deps for name, deps in dependencies.items()})
+
+
+class TestDependencyGraph:
+    """Tests for the DependencyGraph class."""
+
+    def test_order_and_levels(self):
+        graph = make_graph(web=["api"], api=["db", "cache"], db=[], cache=[], worker=["db"])
+        assert graph.order == ["db", "cache", "api", "web", "worker"]
+        assert graph.levels() == [["db", "cache"], ["api", "worker"], ["web"]]
+        assert graph.reversed().levels() == [["web", "worker"], ["api"], ["db", "cache"]]
+
+    def test_cycle(self):
+        with pytest.raises(ValidationError, match="Dependency cycle: a -> b -> c -> a"):
+            make_graph(a=["b"], b=["c"], c=["a"])
+
+    def test_unknown_dependency(self):
+        with pytest.raises(ValidationError, match="web depends on an unknown container: db"):
+            make_graph(web=["db"])
+
+    def test_duplicate_container(self):
+        specs = [ContainerSpec(name="web", image="nginx"), ContainerSpec(name="web", image="httpd")]
+        with pytest.raises(ValidationError, match="Duplicate container name"):
+            DependencyGraph.from_containers(specs)
+
+    def test_run_longest_chain(self):
+        # Two chains of 3 nodes, and a lone node: 3 steps, not 7
+        graph = make_graph(a1=[], a2=["a1"], a3=["a2"], b1=[], b2=["b1"], b3=["b2"], c=[])
+        started = {}
+        lock = threading.Lock()
+
+        def func(name):
+            with lock:
+                started[name] = time.monotonic()
+            time.sleep(0.1)
+            return name.upper()
+
+        start = time.monotonic()
+        futures = graph.run(func)
+        assert time.monotonic() - start < 0.6
+        assert {name: f.result() for name, f in futures.items()}["a3"] == "A3"
+        assert started["a2"] >= started["a1"] + 0.1
+        assert started["a3"] >= started["a2"] + 0.1
+
+    def test_run_failure_skips_dependents(self):
+        graph = make_graph(db=[], api=["db"], web=["api"], cache=[])
+        calls = []
+
+        def func(name):
+            calls.append(name)
+            if name == "db":
+                raise RuntimeError("db failed")
+
+        futures = graph.run(func)
+        assert sorted(calls) == ["cache", "db"]
+        assert isinstance(futures["db"].exception(), RuntimeError)
+        assert isinstance(futures["api"].exception(), DependencyError)
+        assert isinstance(futures["web"].exception(), DependencyError)
+        assert futures["cache"].exception() is None
+
+    def test_run_empty(self):
+        assert make_graph().run(lambda name: None) == {}
@@ -0,0 +1,122 @@
+"""Unit tests for the waiting on the healthchecks of the containers."""
+
+import queue
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+from appmgr.core.exceptions import ContainerRuntimeError
+from appmgr.core.health import HealthWaiter
+from appmgr.core.runtime import EventStream, event_health_status
+from appmgr.models import Container, Image
+
+
+class EventsRuntime:
+    """A runtime whose events are sent by the tests."""
+
+    runtime_name = "fake"
+
+    def __init__(self, events=True):
+        self.has_events = events
+        self.health = {}
+        self.state = {}
+        self.inspects = 0
+        self.streams = 0
+        self.closed = threading.Event()
+        self.queue = queue.Queue()
+
+    def events(self, filters=None):
+        if not self.has_events:
+            raise ContainerRuntimeError("no events")
+        self.streams += 1
+
+        def events():
+            while True:
+                event = self.queue.get()
+                if event is None:
+                    self.closed.set()
+                    return
+                yield event
+
+        return EventStream(events(), lambda: self.queue.put(None))
+
+    def get_container(self, container_id):
+        self.inspects += 1
+        return Container(
+            id=container_id, name=container_id, image=Image(id="", tags=[], created="", size=0),
+            status="", state=self.state.get(container_id, "running"), created=datetime.now(),
+            ports={}, labels={}, network_settings={},
+            health=self.health.get(container_id, "starting"),
+        )
+
+    def emit(self, container_id, action):
+        self.queue.put({"Type": "container", "Action": action, "Actor": {"ID": container_id}})
+
+
+def test_event_health_status():
+    assert event_health_status({"Action": "health_status: healthy"}) == "healthy"
+    # libpod
+    assert event_health_status({
+        "Action": "health_status", "Actor": {"Attributes": {"health_status": "unhealthy"}}
+    }) == "unhealthy"
+    assert event_health_status({"Action": "die"}) is None
+
+
+class TestHealthWaiter:
+    """Tests for the HealthWaiter class."""
+
+    def test_events(self):
+        runtime = EventsRuntime()
+        waiter = HealthWaiter(runtime)
+        db = waiter.wait("db", timeout=5)
+        cache = waiter.wait("cache", timeout=5)
+        assert not db.done() and not cache.done()
+
+        runtime.health["db"] = "healthy"
+        runtime.emit("db", "health_status: healthy")
+        assert db.result(timeout=1).health == "healthy"
+        runtime.health["cache"] = "unhealthy"
+        runtime.emit("cache", "health_status: unhealthy")
+        with pytest.raises(ContainerRuntimeError, match="cache is unhealthy"):
+            cache.result(timeout=1)
+
+        # One stream for both, closed once nothing is waited for, and an
+        # inspect per container, and per healthy event
+        assert runtime.streams == 1
+        assert runtime.closed.wait(1)
+        assert runtime.inspects == 3
+
+    def test_already_healthy(self):
+        runtime = EventsRuntime()
+        runtime.health["db"] = "healthy"
+        assert HealthWaiter(runtime).wait("db", timeout=5).result(timeout=1).id == "db"
+
+    def test_died(self):
+        runtime = EventsRuntime()
+        future = HealthWaiter(runtime).wait("db", timeout=5)
+        runtime.state["db"] = "exited"
+        runtime.emit("db", "die")
+        with pytest.raises(ContainerRuntimeError, match="db exited"):
+            future.result(timeout=1)
+
+    def test_deadline(self):
+        runtime = EventsRuntime()
+        waiter = HealthWaiter(runtime)
+        slow = waiter.wait("slow", timeout=0.1)
+        fast = waiter.wait("fast", timeout=5)
+        with pytest.raises(ContainerRuntimeError, match="slow is not healthy after 0.1s"):
+            slow.result(timeout=1)
+        assert not fast.done()
+        waiter.close()
+        with pytest.raises(ContainerRuntimeError):
+            fast.result(timeout=1)
+
+    def test_no_events(self):
+        runtime = EventsRuntime(events=False)
+        future = HealthWaiter(runtime, poll_interval=0.01).wait("db", timeout=5)
+        time.sleep(0.1)
+        runtime.health["db"] = "healthy"
+        assert future.result(timeout=1).health == "healthy"
+        assert runtime.inspects > 1
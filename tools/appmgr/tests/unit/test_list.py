@@ -0,0 +1,119 @@
+"""Unit tests for the output of 'appmgr list'."""
+
+import json
+
+import pytest
+
+from appmgr import Appmgr
+
+KEYS = ["app", "installed", "available", "packaging_revision_yaml",
+        "packaging_revision_image", "source"]
+
+
+def installed(version):
+    return {
+        "version": version,
+        "packaging-revision-from-yaml": "1",
+        "packaging-revision-from-image": "2",
+    }
+
+
+def apps():
+    current_apps = {"web": installed("1.0"), "db": installed("15")}
+    registry_apps = {
+        "web": {"url": "https://registry.example.com", "image": "team/web"},
+        "c2": {"url": "https://registry.example.com", "image": "team/c2"},
+    }
+    tarball_apps = {"db": {"version": "16"}}
+    available_apps = {"editor": {"maxversion": {"version": "3.0"}}}
+    return current_apps, registry_apps, tarball_apps, available_apps
+
+
+@pytest.fixture
+def appmgr():
+    appmgr = Appmgr()
+    appmgr.list_apps = apps
+    appmgr.list_installed_apps = apps
+    appmgr.lookups = []
+
+    def get_versions_for_app(url, image):
+        appmgr.lookups.append(image)
+        return {"team/web": ["1.0", "1.1"], "team/c2": ["0.9"]}[image]
+
+    appmgr.registry.get_versions_for_app = get_versions_for_app
+    appmgr.records = []
+    make_list_record = appmgr.make_list_record
+
+    def count_records(aid, *args):
+        appmgr.records.append(aid)
+        return make_list_record(aid, *args)
+
+    appmgr.make_list_record = count_records
+    return appmgr
+
+
+def run(appmgr, capsys, *args):
+    appmgr.args = appmgr.parser.parse_args(["list", *args])
+    appmgr.args.func()
+    return capsys.readouterr().out
+
+
+def test_ndjson(appmgr, capsys):
+    out = run(appmgr, capsys, "--all", "--format", "ndjson")
+    records = [json.loads(line) for line in out.splitlines()]
+    assert all(list(record) == KEYS for record in records)
+    # The apps that need no lookup come first
+    assert [r["app"] for r in records[:2]] == ["db", "editor"]
+    assert sorted(records[2:], key=lambda r: r["app"]) == [
+        {"app": "c2", "installed": None, "available": "0.9", "packaging_revision_yaml": None,
+         "packaging_revision_image": None, "source": "registry"},
+        {"app": "web", "installed": "1.0", "available": "1.1", "packaging_revision_yaml": "1",
+         "packaging_revision_image": "2", "source": "registry"},
+    ]
+    assert records[0] == {
+        "app": "db", "installed": "15", "available": "16", "packaging_revision_yaml": "1",
+        "packaging_revision_image": "2", "source": "tarball",
+    }
+
+
+def test_json(appmgr, capsys):
+    out = run(appmgr, capsys, "--available", "--format", "json")
+    records = json.loads(out)
+    assert sorted(r["app"] for r in records) == ["c2", "editor", "web"]
+    assert {r["app"]: r["available"] for r in records} == {
+        "c2": "0.9", "editor": "3.0", "web": "1.1",
+    }
+    assert all(list(record) == KEYS for record in records)
+
+
+def test_json_empty(appmgr, capsys):
+    appmgr.list_installed_apps = lambda: ({}, {}, {}, {})
+    assert json.loads(run(appmgr, capsys, "--format", "json")) == []
+
+
+def test_installed(appmgr, capsys):
+    records = json.loads(run(appmgr, capsys, "--format", "json"))
+    assert [(r["app"], r["installed"], r["available"]) for r in records] == [
+        ("web", "1.0", None), ("db", "15", None),
+    ]
+    assert appmgr.lookups == []
+
+
+def test_upgradeable_lookups(appmgr, capsys):
+    records = json.loads(run(appmgr, capsys, "--upgradeable", "--format", "json"))
+    # Only the installed apps are looked up
+    assert appmgr.lookups == ["team/web"]
+    assert [(r["app"], r["available"]) for r in records] == [("db", "16"), ("web", "1.1")]
+
+
+def test_table(appmgr, capsys):
+    out = run(appmgr, capsys, "--all", "--skip-headers")
+    rows = [line.split() for line in out.splitlines()[1:-1]]
+    # In the order of the apps, each record built once
+    assert rows == [
+        ["web", "1.0", "1.1", "1", "2"],
+        ["db", "15", "16", "1", "2"],
+        ["c2", "-", "0.9", "-", "-"],
+        ["editor", "-", "3.0", "-", "-"],
+    ]
+    assert sorted(appmgr.records) == ["c2", "db", "editor", "web"]
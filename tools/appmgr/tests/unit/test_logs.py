@@ -0,0 +1,128 @@
+"""Unit tests for the merging of the logs of the containers."""
+
+import queue
+import time
+
+from appmgr.core.logs import LogMultiplexer, multiplex_logs, parse_log_line, parse_timestamp
+from appmgr.core.runtime import LogStream
+
+T0 = 1672531200  # 2023-01-01T00:00:00Z
+
+
+def stamp(seconds):
+    whole, fraction = divmod(round(seconds * 10**9), 10**9)
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(whole)) + f".{fraction:09d}Z"
+
+
+def stream(*lines):
+    """A stream of (seconds after T0, text) lines."""
+    return LogStream(iter([f"{stamp(T0 + t)} {text}" for t, text in lines]), lambda: None)
+
+
+class FollowStream:
+    """A stream whose lines are sent by the tests."""
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.closed = False
+
+    def send(self, seconds, text):
+        self.queue.put(f"{stamp(seconds)} {text}")
+
+    def __iter__(self):
+        while True:
+            line = self.queue.get()
+            if line is None:
+                return
+            yield line
+
+    def close(self):
+        self.closed = True
+        self.queue.put(None)
+
+
+def test_parse_timestamp():
+    assert parse_timestamp("2023-01-01T00:00:00.123456789Z") == T0 * 10**9 + 123456789
+    assert parse_timestamp("2023-01-01T00:00:00Z") == T0 * 10**9
+    assert parse_timestamp("2023-01-01T01:00:00.5+01:00") == T0 * 10**9 + 500000000
+    assert parse_log_line("no timestamp here") == (0, "no timestamp here")
+
+
+class TestLogMultiplexer:
+    """Tests for the LogMultiplexer class."""
+
+    def test_time_order(self):
+        streams = {
+            "db": stream((0.1, "db 1"), (0.4, "db 2"), (0.5, "db 3")),
+            "web": stream((0.2, "web 1"), (0.3, "web 2"), (0.6, "web 3")),
+            "c2": stream(),
+        }
+        lines = list(LogMultiplexer(streams))
+        assert [line.text for line in lines] == ["db 1", "web 1", "web 2", "db 2", "db 3", "web 3"]
+        assert lines[0].container == "db"
+        assert lines[0].time.timestamp() == T0 + 0.1
+
+    def test_since_until(self):
+        streams = {"db": stream((1, "a"), (2.5, "b"), (4, "c"))}
+        lines = LogMultiplexer(streams, since=T0 + 2, until=T0 + 3)
+        assert [line.text for line in lines] == ["b"]
+
+    def test_bounded(self):
+        # A reader stops reading when the merge is full
+        streams = {
+            "db": stream(*[(i, f"db {i}") for i in range(100)]),
+            "web": stream(*[(i + 0.5, f"web {i}") for i in range(100)]),
+        }
+        lines = list(LogMultiplexer(streams, max_buffered=4))
+        assert len(lines) == 200
+        assert [line.timestamp for line in lines] == sorted(line.timestamp for line in lines)
+
+    def test_follow(self):
+        db, web = FollowStream(), FollowStream()
+        lines = iter(LogMultiplexer({"db": db, "web": web}, window=0.05))
+        db.send(T0 + 2, "db late")
+        web.send(T0 + 1, "web early")
+        # web stays silent, db's line comes out after the window anyway
+        assert next(lines).text == "web early"
+        assert next(lines).text == "db late"
+        db.send(T0 + 3, "db new")
+        assert next(lines).text == "db new"
+        lines.close()
+        assert db.closed and web.closed
+
+
+def test_multiplex_logs_tail():
+    history = {
+        "db": [(1, "db 1"), (3, "db 2"), (5, "db 3")],
+        "web": [(2, "web 1"), (4, "web 2")],
+    }
+    calls = []
+
+    def open_logs(name, follow, tail, since, until):
+        calls.append((name, follow, tail))
+        return stream(*history[name][-tail:])
+
+    lines = list(multiplex_logs(["db", "web"], open_logs, tail=3))
+    assert [line.text for line in lines] == ["db 2", "web 2", "db 3"]
+    # The tail was pushed down to the engine
+    assert calls == [("db", False, 3), ("web", False, 3)]
+
+
+def test_multiplex_logs_tail_follow():
+    db = FollowStream()
+    opened = {}
+
+    def open_logs(name, follow, tail, since, until):
+        if not follow:
+            return stream((1, "db 1"), (2, "db 2"))
+        opened[name] = (tail, since)
+        return db
+
+    lines = multiplex_logs(["db"], open_logs, follow=True, tail=1)
+    assert next(lines).text == "db 2"
+    # The engine resends the last line, only the new ones come out
+    db.send(T0 + 2, "db 2")
+    db.send(T0 + 3, "db 3")
+    assert next(lines).text == "db 3"
+    assert opened["db"] == (None, T0 + 2)
+    lines.close()
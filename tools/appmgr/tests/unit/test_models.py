@@ -144,3 +144,51 @@ class TestContainer:
         assert container.ports["80/tcp"][0]["HostPort"] == "8080"
         assert container.labels["com.example.app"] == "test-app"
         assert container.network_settings["Networks"]["bridge"]["IPAddress"] == "172.17.0.2"
+
+class TestApiModel:
+    """Tests for the lazily-decoded models of the engine objects."""
+
+    def test_keywords(self):
+        image = Image("sha256:1", ["nginx:alpine"], created="", size=0)
+        assert image.labels == {} and image.digests == []
+        assert image.raw is None
+        assert not hasattr(image, "__dict__")
+        assert repr(image) == (
+            "Image(id='sha256:1', tags=['nginx:alpine'], created='', size=0, labels={}, digests=[])"
+        )
+        # Each model gets its own default
+        image.labels["a"] = "b"
+        assert Image("sha256:2", [], "", 0).labels == {}
+        with pytest.raises(TypeError, match="missing required argument: 'size'"):
+            Image(id="sha256:1", tags=[], created="")
+        with pytest.raises(TypeError, match="unexpected arguments: color"):
+            Image(id="sha256:1", tags=[], created="", size=0, color="red")
+
+    def test_lazy_decoding(self):
+        decoded = []
+
+        def decoder(name, key):
+            def decode(data):
+                decoded.append(name)
+                return data[key]
+            return decode
+
+        decoders = {"name": decoder("name", "Name"), "driver": decoder("driver", "Driver"),
+                    "mountpoint": decoder("mountpoint", "Mountpoint")}
+        volumes = Volume.from_list(
+            [{"Name": f"data{i}", "Driver": "local", "Mountpoint": "/var"} for i in range(3)],
+            decoders,
+        )
+        assert decoded == []
+        assert [v.name for v in volumes] == ["data0", "data1", "data2"]
+        assert volumes[0].name == "data0"
+        assert decoded == ["name"] * 3
+        # Without a decoder, the default
+        assert volumes[0].labels == {} and volumes[0].created is None
+        assert volumes[0].raw == {"Name": "data0", "Driver": "local", "Mountpoint": "/var"}
+
+        volumes[1].driver = "nfs"
+        assert volumes[1].driver == "nfs"
+        assert decoded.count("driver") == 0
+        assert volumes[0] == Volume(name="data0", driver="local", mountpoint="/var")
+        assert volumes[0] != volumes[2]
@@ -0,0 +1,301 @@
+"""Unit tests for the pulls of 'appmgr prepare' and 'appmgr upgrade'."""
+
+import json
+import threading
+
+import pytest
+import requests
+
+from appmgr import Appmgr, AppmgrAppConfig, PullScheduler, is_transient_pull_error
+
+
+class FakeImage:
+    def __init__(self, id, tags=()):
+        self.id = id
+        self.tags = list(tags)
+
+    def tag(self, name):
+        self.tags.append(name)
+
+
+def test_scheduler():
+    pulled = []
+    lock = threading.Lock()
+
+    def pull(name, progress):
+        with lock:
+            pulled.append(name)
+        return None if name == "missing" else FakeImage(name)
+
+    scheduler = PullScheduler(pull, jobs=2, progress_mode="none")
+    calls = []
+    scheduler.submit("web", lambda image: calls.append(("a", image.id)))
+    scheduler.submit("web", lambda image: calls.append(("b", image.id)))
+    scheduler.submit("db", lambda image: calls.append(("c", image.id)))
+    scheduler.submit("missing", lambda image: calls.append(("d", image.id)))
+    assert scheduler.run() == ["missing"]
+    # Every image is pulled once, whatever the number of callbacks
+    assert sorted(pulled) == ["db", "missing", "web"]
+    assert sorted(calls) == [("a", "web"), ("b", "web"), ("c", "db")]
+
+
+def test_scheduler_empty():
+    assert PullScheduler(None, progress_mode="none").run() == []
+
+
+def test_scheduler_pull_error():
+    def pull(name, progress):
+        if name == "broken":
+            raise RuntimeError("no space left on device")
+        return FakeImage(name)
+
+    scheduler = PullScheduler(pull, progress_mode="none")
+    scheduler.submit("broken", lambda image: None)
+    scheduler.submit("web", lambda image: None)
+    assert scheduler.run() == ["broken"]
+
+
+def test_scheduler_cancel():
+    """The queued pulls don't start once a callback failed"""
+    started = []
+    release = threading.Event()
+
+    def pull(name, progress):
+        started.append(name)
+        if name != "first":
+            release.wait(5)
+        return FakeImage(name)
+
+    def callback(image):
+        # The pull that started is let go once the others are cancelled
+        threading.Timer(0.2, release.set).start()
+        raise KeyboardInterrupt()
+
+    scheduler = PullScheduler(pull, jobs=1, progress_mode="none")
+    scheduler.submit("first", callback)
+    for i in range(5):
+        scheduler.submit("image%d" % i, lambda image: None)
+    with pytest.raises(KeyboardInterrupt):
+        scheduler.run()
+    assert started == ["first", "image0"]
+
+
+CONFIG = {
+    "application": {"id": "web", "name": "Web"},
+    "components": {"default": {"run_mode": "cli"}},
+    "container": {"origin": {"registry": {
+        "url": "https://registry.example.com", "image": "team/web",
+    }}},
+}
+
+
+@pytest.fixture
+def appmgr():
+    appmgr = Appmgr()
+    appmgr.args = appmgr.parser.parse_args(["--progress", "none", "prepare", "web"])
+    appmgr.read_config = lambda app: None
+    appmgr.load_config = lambda app: AppmgrAppConfig(config=CONFIG)
+    appmgr.images = []
+    appmgr.find_image = lambda name: next(
+        (image for image in appmgr.images if name in image.tags), None
+    )
+    appmgr.upgrades = []
+    appmgr.do_upgrade_scripts = lambda *args: appmgr.upgrades.append(args)
+    return appmgr
+
+
+def resolve(appmgr, app, upgrade=False, current=None, registry=None, tarball=None,
+            available=None):
+    current_apps = {"web": {"version": current}} if current else {}
+    registry_apps = {"web": {"maxversion": registry}} if registry else {}
+    tarball_apps = {"web": {"version": tarball}} if tarball else {}
+    available_apps = {"web": {"maxversion": {"version": available}}} if available else {}
+    return appmgr.resolve_target_version(
+        app, upgrade, current_apps, registry_apps, tarball_apps, available_apps
+    )
+
+
+def test_resolve_target_version(appmgr):
+    # The highest version, wherever it is
+    assert resolve(appmgr, "web", registry="1.2", tarball="1.1", available="1.0") == (
+        "web", None, "1.2"
+    )
+    assert resolve(appmgr, "web", registry="1.2", tarball="1.3") == ("web", None, "1.3")
+    # Installed, it stays at its version unless it's an upgrade
+    assert resolve(appmgr, "web", current="1.0", registry="1.2") == ("web", "1.0", "1.0")
+    assert resolve(appmgr, "web", True, current="1.0", registry="1.2") == ("web", "1.0", "1.2")
+    # An upgrade never downgrades
+    assert resolve(appmgr, "web", True, current="1.5", registry="1.2") == ("web", "1.5", "1.5")
+    assert resolve(appmgr, "web") == ("web", None, "latest")
+
+
+def test_resolve_explicit_version(appmgr):
+    assert resolve(appmgr, "web=2.0") == ("web", None, "2.0")
+    assert resolve(appmgr, "web=2.0", True, current="1.0") == ("web", "1.0", "2.0")
+    assert resolve(appmgr, "web=1.0", current="1.0") == ("web", "1.0", "1.0")
+    with pytest.raises(SystemExit):
+        resolve(appmgr, "web=2.0", current="1.0")
+
+
+class FakeScheduler:
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, image_name, callback):
+        self.submitted.append((image_name, callback))
+
+
+def test_prepare_app_pull(appmgr):
+    scheduler = FakeScheduler()
+    appmgr.prepare_app("web", None, "latest", {}, scheduler)
+    [(name, callback)] = scheduler.submitted
+    assert name == "registry.example.com/team/web:latest"
+
+    appmgr.get_meta_file = lambda image, filename: "1.3\n"
+    image = FakeImage("sha256:1", [name])
+    callback(image)
+    assert image.tags == [
+        name, "registry.example.com/team/web:1.3", "appmgr/web:1.3", "appmgr/web:current",
+    ]
+    assert appmgr.upgrades == [("web", None, "latest")]
+
+
+def test_prepare_app_pulled_already(appmgr):
+    image = FakeImage("sha256:1", ["registry.example.com/team/web:1.3"])
+    appmgr.images = [image]
+    scheduler = FakeScheduler()
+    appmgr.prepare_app("web", "1.2", "1.3", {}, scheduler)
+    assert scheduler.submitted == []
+    assert image.tags[-1] == "appmgr/web:current"
+
+
+def test_prepare_app_available(appmgr):
+    image = FakeImage("sha256:1", ["appmgr/web:1.3"])
+    appmgr.images = [image]
+    scheduler = FakeScheduler()
+    appmgr.prepare_app("web", "1.2", "1.3", {"web": {"maxversion": {"version": "1.3"}}},
+                       scheduler)
+    assert scheduler.submitted == []
+    assert image.tags == ["appmgr/web:1.3", "appmgr/web:current"]
+    assert appmgr.upgrades == [("web", "1.2", "1.3")]
+
+
+def test_prepare_app_up_to_date(appmgr):
+    scheduler = FakeScheduler()
+    appmgr.prepare_app("web", "1.3", "1.3", {}, scheduler)
+    assert scheduler.submitted == []
+    assert appmgr.upgrades == []
+
+
+def test_tag_pulled_image(appmgr):
+    appmgr.get_meta_file = lambda image, filename: "1.3\n"
+    image = FakeImage("sha256:1", ["registry.example.com/team/web:1.3"])
+    # The pulled version is tagged already
+    appmgr.images = [FakeImage("sha256:1", ["appmgr/web:1.3"])]
+    appmgr.tag_pulled_image(
+        "web", "appmgr/web", "registry.example.com/team/web", "1.2", "1.3", image
+    )
+    assert image.tags == ["registry.example.com/team/web:1.3", "appmgr/web:current"]
+    assert appmgr.upgrades == [("web", "1.2", "1.3")]
+
+
+class FakeApi:
+    """The pull endpoint of docker-py, that fails as it's told to"""
+
+    def __init__(self, failures):
+        self.failures = list(failures)
+        self.pulls = 0
+
+    def pull(self, repository, tag, stream, decode):
+        self.pulls += 1
+        yield {"status": "Pulling from %s" % repository, "id": tag}
+        yield {"status": "Pulling fs layer", "progressDetail": {}, "id": "a1"}
+        if self.failures:
+            failure = self.failures.pop(0)
+            if isinstance(failure, Exception):
+                raise failure
+            yield {"error": failure, "errorDetail": {"message": failure}}
+            return
+        yield {"status": "Downloading", "progressDetail": {"current": 5, "total": 10},
+               "id": "a1"}
+        yield {"status": "Pull complete", "progressDetail": {}, "id": "a1"}
+        yield {"status": "Digest: sha256:1"}
+
+
+class FakeConn:
+    def __init__(self, failures=()):
+        self.api = FakeApi(failures)
+        self.images = self
+
+    def get(self, name):
+        return FakeImage("sha256:1", [name])
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr("appmgr.time.sleep", sleeps.append)
+    return sleeps
+
+
+def pull(appmgr, failures, progress="none"):
+    appmgr.args.progress = progress
+    appmgr._docker_conn = FakeConn(failures)
+    return appmgr.docker_pull("registry.example.com/team/web:1.3")
+
+
+@pytest.mark.parametrize("message, status_code, transient", [
+    ("Get https://registry/v2/: net/http: TLS handshake timeout", None, True),
+    ("read tcp 10.0.0.2:443: connection reset by peer", None, True),
+    ("received unexpected HTTP status: 503 Service Unavailable", None, True),
+    ("toomanyrequests: You have reached your pull rate limit", None, True),
+    ("manifest for team/web:1.3 not found: manifest unknown", None, False),
+    ("unauthorized: authentication required", None, False),
+    ("pull access denied for web, repository does not exist", 500, False),
+    ("something else", None, False),
+    ("something else", 502, True),
+])
+def test_is_transient_pull_error(message, status_code, transient):
+    assert is_transient_pull_error(message, status_code) is transient
+
+
+def test_pull_retry(appmgr, sleeps):
+    image = pull(appmgr, ["net/http: TLS handshake timeout", requests.ConnectionError()])
+    assert image.tags == ["registry.example.com/team/web:1.3"]
+    assert appmgr.docker_conn.api.pulls == 3
+    # Exponential backoff
+    assert sleeps == [2, 4]
+
+
+def test_pull_retry_exhausted(appmgr, sleeps):
+    assert pull(appmgr, ["unexpected EOF"] * 4) is None
+    assert appmgr.docker_conn.api.pulls == 4
+    assert sleeps == [2, 4, 8]
+
+
+def test_pull_permanent_error(appmgr, sleeps):
+    assert pull(appmgr, ["manifest unknown", "manifest unknown"]) is None
+    assert appmgr.docker_conn.api.pulls == 1
+    assert sleeps == []
+
+
+def test_pull_progress_json(appmgr, sleeps, capsys):
+    pull(appmgr, ["i/o timeout"], progress="json")
+    events = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert all(isinstance(event.pop("time"), float) for event in events)
+    image = "registry.example.com/team/web:1.3"
+    layers = [(e["layer"], e["status"], e["current"], e["total"])
+              for e in events if e["event"] == "layer"]
+    # The 'Pulling from' and 'Digest' events are not about layers
+    assert layers == [
+        ("a1", "Pulling fs layer", 0, 0),
+        ("a1", "Downloading", 5, 10),
+        ("a1", "Pull complete", 10, 10),
+    ]
+    assert events[0] == {"event": "start", "image": image}
+    assert [e for e in events if e["event"] == "retry"] == [{
+        "event": "retry", "image": image, "attempt": 1, "delay": 2, "error": "i/o timeout",
+    }]
+    assert {"event": "done", "image": image, "ok": True} in events
+    assert events[-1]["event"] == "progress"
+    assert (events[-1]["done"], events[-1]["failed"], events[-1]["current"]) == (1, 0, 10)
@@ -0,0 +1,103 @@
+"""Unit tests for the registry client."""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from appmgr.core.exceptions import RegistryError
+from appmgr.core.registry import remote_digest, split_registry
+from appmgr.core.runtime import needs_pull
+from appmgr.models import Image
+
+DIGEST = "sha256:" + "ab" * 32
+
+
+class FakeRegistryHandler(BaseHTTPRequestHandler):
+    """A registry that wants a bearer token, like Docker Hub."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.server.requests.append(("HEAD", self.path, self.headers.get("Authorization")))
+        if self.headers.get("Authorization") != "Bearer t0ken":
+            realm = f"http://127.0.0.1:{self.server.server_port}/token"
+            self.send_response(401)
+            self.send_header(
+                "WWW-Authenticate",
+                f'Bearer realm="{realm}",service="registry",scope="repository:lab/c2:pull"',
+            )
+            self.end_headers()
+        elif self.path == "/v2/lab/c2/manifests/1.0":
+            self.send_response(200)
+            self.send_header("Docker-Content-Digest", DIGEST)
+            self.end_headers()
+        else:
+            self.send_response(404)
+            self.end_headers()
+
+    def do_GET(self):
+        self.server.requests.append(("GET", self.path, None))
+        body = json.dumps({"token": "t0ken"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def registry():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeRegistryHandler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_split_registry():
+    assert split_registry("nginx") == ("docker.io", "library/nginx")
+    assert split_registry("bitnami/redis") == ("docker.io", "bitnami/redis")
+    assert split_registry("ghcr.io/threatos/c2") == ("ghcr.io", "threatos/c2")
+    assert split_registry("localhost:5000/c2") == ("localhost:5000", "c2")
+
+
+def test_remote_digest(registry):
+    image_name = f"127.0.0.1:{registry.server_port}/lab/c2"
+    assert remote_digest(image_name, "1.0") == DIGEST
+    assert registry.requests == [
+        ("HEAD", "/v2/lab/c2/manifests/1.0", None),
+        ("GET", "/token?service=registry&scope=repository%3Alab%2Fc2%3Apull", None),
+        ("HEAD", "/v2/lab/c2/manifests/1.0", "Bearer t0ken"),
+    ]
+
+
+def test_remote_digest_unknown_tag(registry):
+    with pytest.raises(RegistryError, match="404"):
+        remote_digest(f"127.0.0.1:{registry.server_port}/lab/c2", "2.0")
+
+
+def test_needs_pull(registry):
+    image_name = f"127.0.0.1:{registry.server_port}/lab/c2"
+    local = Image(id="sha256:1", tags=[f"{image_name}:1.0"], created="", size=0,
+                  digests=[f"{image_name}@{DIGEST}"])
+    assert needs_pull(None, image_name, "1.0", "if-not-present") is True
+    assert needs_pull(local, image_name, "1.0", "always") is True
+    assert needs_pull(local, image_name, "1.0", "if-not-present") is False
+    assert needs_pull(local, image_name, "1.0", "if-digest-changed") is False
+    local.digests = [f"{image_name}@sha256:{'cd' * 32}"]
+    assert needs_pull(local, image_name, "1.0", "if-digest-changed") is True
+    with pytest.raises(ValueError):
+        needs_pull(local, image_name, "1.0", "never")
+
+
+def test_needs_pull_offline(registry):
+    # The registry is gone, the local image is good enough
+    image_name = f"127.0.0.1:{registry.server_port}/lab/c2"
+    registry.shutdown()
+    registry.server_close()
+    local = Image(id="sha256:1", tags=[], created="", size=0)
+    assert needs_pull(local, image_name, "1.0", "if-digest-changed") is False
@@ -1,10 +1,19 @@
 """Unit tests for container runtime functionality."""
 
+import json
+import threading
+import time
 from unittest.mock import MagicMock, patch
 import pytest
 from docker.errors import APIError
 
-from appmgr.core.runtime import ContainerRuntime, DockerRuntime, get_available_runtimes
+from appmgr.core.runtime import (
+    ContainerRuntime,
+    DockerRuntime,
+    PodmanRuntime,
+    build_podman_spec,
+    get_available_runtimes,
+)
 from appmgr.core.exceptions import ContainerRuntimeError
 
 class TestContainerRuntime:
@@ -58,28 +67,25 @@ class TestDockerRuntime:
         mock_import.side_effect = ImportError()
         assert runtime.is_available() is False
     
-    @patch('docker.DockerClient.images.pull')
-    def test_pull_image_success(self, mock_pull):
+    def test_pull_image_success(self):
         """Test successful image pull."""
-        mock_image = MagicMock()
-        mock_image.short_id = "sha256:abc123"
-        mock_image.tags = ["test-image:latest"]
-        mock_image.attrs = {
-            'Created': '2023-01-01T00:00:00Z',
-            'Size': 12345678
-        }
-        mock_pull.return_value = mock_image
-        
         runtime = DockerRuntime()
         runtime._client = MagicMock()  # Pretend we're connected
         runtime.connected = True
-        
+        runtime._client.images.pull.return_value.attrs = {
+            "Id": "sha256:" + "ab" * 32,
+            "RepoTags": ["test-image:latest"],
+            "Created": "2023-01-01T00:00:00Z",
+            "Size": 12345678,
+        }
+
         image = runtime.pull_image("test-image")
-        
-        assert image.id == "sha256:abc123"
+
+        # The full id, not the short one
+        assert image.id == "sha256:" + "ab" * 32
         assert image.tags == ["test-image:latest"]
-        mock_pull.assert_called_once_with("test-image", tag="latest")
-    
+        runtime._client.images.pull.assert_called_once_with("test-image", tag="latest")
+
     @patch('docker.DockerClient.images.pull')
     def test_pull_image_failure(self, mock_pull):
         """Test failed image pull."""
@@ -92,6 +98,51 @@ class TestDockerRuntime:
         with pytest.raises(ContainerRuntimeError, match="Failed to pull image"):
             runtime.pull_image("test-image")
 
+    def test_pull_image_if_not_present(self):
+        """Test that a present image is not pulled again, and a missing one is."""
+        from docker.errors import ImageNotFound
+
+        runtime = DockerRuntime()
+        runtime._client = MagicMock()
+        runtime.connected = True
+        runtime._client.api.inspect_image.return_value = {
+            "Id": "sha256:abc123", "RepoTags": ["nginx:alpine"], "Size": 1234
+        }
+        image = runtime.pull_image("nginx", tag="alpine", policy="if-not-present")
+        assert image.id == "sha256:abc123"
+        runtime._client.images.pull.assert_not_called()
+
+        runtime._client.api.inspect_image.side_effect = ImageNotFound("No such image")
+        runtime.pull_image("nginx", tag="alpine", policy="if-not-present")
+        runtime._client.images.pull.assert_called_once_with("nginx", tag="alpine")
+
+    def test_stop_container(self):
+        """Test stopping a container, and a missing one."""
+        from docker.errors import NotFound
+
+        runtime = DockerRuntime()
+        runtime._client = MagicMock()
+        runtime.connected = True
+        assert runtime.stop_container("c0ffee", timeout=5) is True
+        runtime._client.api.stop.assert_called_once_with("c0ffee", timeout=5)
+
+        runtime._client.api.stop.side_effect = NotFound("No such container")
+        assert runtime.stop_container("missing") is False
+
+    def test_list_containers(self):
+        """Test that containers are listed from the summaries, without inspects."""
+        runtime = DockerRuntime()
+        runtime._client = MagicMock()
+        runtime._client.api.containers.return_value = [{
+            "Id": "c0ffee", "Names": ["/web"], "Image": "nginx:alpine", "ImageID": "sha256:abc",
+            "Created": 1672531200, "State": "running", "Status": "Up", "Labels": {}, "Ports": [],
+        }]
+        runtime.connected = True
+        containers = runtime.list_containers(all=True)
+        assert [c.name for c in containers] == ["web"]
+        runtime._client.api.containers.assert_called_once_with(all=True, filters=None)
+        runtime._client.containers.list.assert_not_called()
+
 class TestGetAvailableRuntimes:
     """Tests for the get_available_runtimes function."""
     
@@ -134,3 +185,124 @@ class TestGetAvailableRuntimes:
         """Test when no container runtimes are available."""
         runtimes = get_available_runtimes()
         assert len(runtimes) == 0
+
+    @patch('appmgr.core.runtime.DockerRuntime.is_available', return_value=True)
+    @patch('appmgr.core.runtime.DockerRuntime.connect', return_value=True)
+    @patch('appmgr.core.runtime.PodmanRuntime.is_available', return_value=True)
+    @patch('appmgr.core.runtime.PodmanRuntime.connect', return_value=True)
+    def test_last_runtime_first(self, mock_podman_connect, mock_podman_avail,
+                                mock_docker_connect, mock_docker_avail, state_dir):
+        """Test that the runtime that worked last time is tried alone."""
+        (state_dir / "runtime.json").parent.mkdir(parents=True)
+        (state_dir / "runtime.json").write_text('{"runtime": "podman"}')
+        runtimes = get_available_runtimes()
+        assert list(runtimes) == ["podman"]
+        mock_docker_avail.assert_not_called()
+
+    @patch('appmgr.core.runtime.DockerRuntime.is_available', return_value=True)
+    @patch('appmgr.core.runtime.DockerRuntime.connect', return_value=True)
+    @patch('appmgr.core.runtime.PodmanRuntime.is_available', return_value=False)
+    def test_last_runtime_gone(self, mock_podman_avail, mock_docker_connect,
+                               mock_docker_avail, state_dir):
+        """Test that all the runtimes are probed if the last one fails."""
+        (state_dir / "runtime.json").parent.mkdir(parents=True)
+        (state_dir / "runtime.json").write_text('{"runtime": "podman"}')
+        assert list(get_available_runtimes()) == ["docker"]
+        assert json.loads((state_dir / "runtime.json").read_text()) == {"runtime": "docker"}
+
+    @patch('appmgr.core.runtime.DockerRuntime.is_available', return_value=True)
+    @patch('appmgr.core.runtime.PodmanRuntime.is_available', return_value=True)
+    @patch('appmgr.core.runtime.PodmanRuntime.connect', return_value=True)
+    def test_probe_timeout(self, mock_podman_connect, mock_podman_avail, mock_docker_avail):
+        """Test that a runtime that hangs doesn't stall the discovery."""
+        hung = threading.Event()
+        with patch('appmgr.core.runtime.DockerRuntime.connect', side_effect=hung.wait):
+            start = time.monotonic()
+            runtimes = get_available_runtimes(timeout=0.2)
+            hung.set()
+        assert time.monotonic() - start < 1
+        assert list(runtimes) == ["podman"]
+
+class TestPodmanRuntime:
+    """Tests for the PodmanRuntime class, against a fake libpod service."""
+
+    @pytest.fixture
+    def runtime(self, fake_engine):
+        return PodmanRuntime(socket_path=fake_engine.server_address)
+
+    def test_socket_path(self, monkeypatch):
+        monkeypatch.delenv("CONTAINER_HOST", raising=False)
+        monkeypatch.setenv("XDG_RUNTIME_DIR", "/run/user/1000")
+        monkeypatch.setattr("os.getuid", lambda: 1000)
+        assert PodmanRuntime().socket_path == "/run/user/1000/podman/podman.sock"
+        monkeypatch.setenv("CONTAINER_HOST", "unix:///tmp/podman.sock")
+        assert PodmanRuntime().socket_path == "/tmp/podman.sock"
+
+    def test_connect(self, runtime, fake_engine):
+        assert runtime.is_available() is True
+        assert runtime.connect() is True
+        assert fake_engine.requests[-1] == ("GET", "/libpod/_ping")
+
+    def test_connect_failure(self, tmp_path):
+        runtime = PodmanRuntime(socket_path=str(tmp_path / "podman.sock"))
+        assert runtime.is_available() is False
+        assert runtime.connect() is False
+
+    def test_pull_image(self, runtime, fake_engine):
+        image = runtime.pull_image("nginx", tag="alpine")
+        assert image.id == "sha256:abc123"
+        assert ("POST", "/libpod/images/pull?reference=nginx%3Aalpine", None) in fake_engine.requests
+
+    def test_pull_image_policy(self, runtime, fake_engine):
+        runtime.pull_image("nginx", tag="alpine", policy="if-digest-changed")
+        assert ("POST", "/libpod/images/pull?reference=nginx%3Aalpine&policy=newer", None) \
+            in fake_engine.requests
+
+    def test_pull_image_failure(self, runtime):
+        with pytest.raises(ContainerRuntimeError, match="manifest unknown"):
+            runtime.pull_image("broken")
+
+    def test_run_container(self, runtime, fake_engine):
+        container = runtime.run_container("nginx:alpine", name="web", ports={"80/tcp": 8080},
+                                          detach=True)
+        assert container.id == "c0ffee"
+        assert container.name == "web"
+        create = next(r for r in fake_engine.requests if r[1] == "/libpod/containers/create")
+        assert create[2]["portmappings"] == [
+            {"container_port": 80, "protocol": "tcp", "host_port": 8080}
+        ]
+
+    def test_list_containers(self, runtime):
+        containers = runtime.list_containers(all=True)
+        assert [c.name for c in containers] == ["web"]
+        assert containers[0].ports == {"80/tcp": [{"HostIp": "", "HostPort": "8080"}]}
+
+    def test_stop_and_remove(self, runtime):
+        assert runtime.stop_container("c0ffee") is True
+        assert runtime.stop_container("missing") is False
+        assert runtime.remove_container("c0ffee", force=True) is True
+        assert runtime.remove_container("missing") is False
+
+    def test_get_container_logs(self, runtime):
+        assert runtime.get_container_logs("c0ffee", tail=10) == "hello\noops\n"
+
+    def test_stream_logs(self, runtime, fake_engine):
+        assert list(runtime.stream_logs("c0ffee", tail=10)) == ["hello", "oops"]
+        assert "timestamps=true" in fake_engine.requests[-1][1]
+
+    def test_stats(self, runtime, fake_engine):
+        samples = list(runtime.stats("c0ffee"))
+        assert [s["pids_stats"]["current"] for s in samples] == [1, 2]
+        assert fake_engine.requests[-1][1] == "/containers/c0ffee/stats?stream=true"
+
+    def test_build_podman_spec(self):
+        spec = build_podman_spec(
+            "nginx:alpine",
+            volumes={"/srv/data": {"bind": "/data", "mode": "ro"}, "cache": {"bind": "/cache"}},
+            environment={"ENV": "test"},
+        )
+        assert spec["mounts"] == [
+            {"Type": "bind", "Source": "/srv/data", "Destination": "/data", "Options": ["ro"]}
+        ]
+        assert spec["volumes"] == [{"Name": "cache", "Dest": "/cache", "Options": ["rw"]}]
+        assert spec["env"] == {"ENV": "test"}
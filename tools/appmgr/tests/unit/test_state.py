@@ -0,0 +1,111 @@
+"""Unit tests for the state store of the applications."""
+
+import sqlite3
+
+import pytest
+
+from appmgr.core.state import StateStore, get_state_db_path
+from appmgr.models import AppRecord
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = StateStore(tmp_path / "state.db")
+    yield store
+    store.close()
+
+
+def test_default_path(state_dir):
+    assert get_state_db_path() == state_dir / "state.db"
+    assert get_state_db_path("appmgr").name == "appmgr.db"
+
+
+def test_wal(store):
+    assert store._conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_record_app(store):
+    assert store.record_app(AppRecord("web", version="1.0", image_id="sha256:1")) == "install"
+    assert store.record_app(AppRecord("web", version="1.0", image_id="sha256:1")) is None
+    installed_at = store.get_app("web").installed_at
+    assert store.record_app(AppRecord("web", version="1.1", image_id="sha256:2")) == "upgrade"
+    assert store.get_app("web").installed_at == installed_at
+    assert store.record_app(AppRecord("db", version="15")) == "install"
+    assert [r.app_id for r in store.list_apps()] == ["db", "web"]
+
+    assert store.remove_app("web")
+    assert not store.remove_app("web")
+    assert not store.remove_app("missing")
+    assert [r.app_id for r in store.list_apps()] == ["db"]
+    assert [(e["action"], e["version"], e["previous_version"]) for e in store.history("web")] == [
+        ("install", "1.0", None), ("upgrade", "1.1", "1.0"), ("remove", None, "1.1"),
+    ]
+    assert len(store.history()) == 4
+    # Back again, it's a new install
+    assert store.record_app(AppRecord("web", version="1.1")) == "install"
+
+
+def test_state(store):
+    assert store.load_state("web") == {}
+    store.save_state("web", {"stop_latency": {"db": 0.5}})
+    assert store.load_state("web") == {"stop_latency": {"db": 0.5}}
+    # Neither an install, nor a removal touches the state
+    store.record_app(AppRecord("web", version="1.0"))
+    store.remove_app("web")
+    assert store.load_state("web") == {"stop_latency": {"db": 0.5}}
+    assert store.list_apps() == []
+
+
+def test_images(store):
+    store.record_image("sha256:1", "web", "nginx", "1.0", ["nginx@sha256:a"])
+    store.record_image("sha256:1", digests=None)
+    store.record_image("sha256:2", "other", "redis", "7", [])
+    images = store.list_images("web")
+    assert [(i["image_id"], i["digests"]) for i in images] == [("sha256:1", ["nginx@sha256:a"])]
+
+
+def test_meta_files(store):
+    assert store.get_meta_file("sha256:1", "version") is None
+    store.set_meta_file("sha256:1", "version", "1.0\n")
+    assert store.get_meta_file("sha256:1", "version") == "1.0\n"
+
+
+def test_fingerprints(store):
+    assert store.get_fingerprint("installed-apps") is None
+    store.set_fingerprint("installed-apps", "a")
+    store.set_fingerprint("installed-apps", "b")
+    assert store.get_fingerprint("installed-apps") == "b"
+
+
+def test_registry_checks(store):
+    assert store.get_registry_check("web") is None
+    store.record_registry_check("web", "https://registry", "web", ["1.0", "1.1"], "1.1")
+    check = store.get_registry_check("web")
+    assert check["versions"] == ["1.0", "1.1"]
+    assert check["max_version"] == "1.1"
+    assert check["checked_at"] > 0
+
+
+def test_reopen(tmp_path):
+    store = StateStore(tmp_path / "state.db")
+    store.record_app(AppRecord("web", version="1.0"))
+    store.close()
+    store = StateStore(tmp_path / "state.db")
+    assert store.get_app("web").version == "1.0"
+    store.close()
+
+
+def test_open_fallback(tmp_path):
+    (tmp_path / "file").write_text("")
+    # The parent of the database is a file
+    store = StateStore.open(tmp_path / "file" / "state.db")
+    assert store.path == ":memory:"
+    store.record_app(AppRecord("web", version="1.0"))
+    assert store.get_app("web").version == "1.0"
+
+
+def test_sqlite_too_old(tmp_path, monkeypatch):
+    monkeypatch.setattr("sqlite3.sqlite_version_info", (3, 22, 0))
+    # No fallback, the in-memory store wouldn't work any better
+    with pytest.raises(sqlite3.NotSupportedError, match="needs 3.24.0"):
+        StateStore.open(tmp_path / "state.db")
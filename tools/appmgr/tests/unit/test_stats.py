@@ -0,0 +1,158 @@
+"""Unit tests for the sampling of the resource usage of the containers."""
+
+import json
+import queue
+
+import pytest
+
+from appmgr.core.runtime import StatsStream
+from appmgr.core.stats import (
+    StatsSampler,
+    aggregate_stats,
+    container_stats_from_api,
+    format_ndjson,
+    format_prometheus,
+    write_textfile,
+)
+from appmgr.models import ContainerStats
+
+SAMPLE = {
+    "cpu_stats": {
+        "cpu_usage": {"total_usage": 3_000_000_000},
+        "system_cpu_usage": 40_000_000_000,
+        "online_cpus": 4,
+    },
+    "precpu_stats": {
+        "cpu_usage": {"total_usage": 2_000_000_000},
+        "system_cpu_usage": 36_000_000_000,
+    },
+    "memory_stats": {"usage": 300 << 20, "limit": 1 << 30, "stats": {"inactive_file": 100 << 20}},
+    "networks": {"eth0": {"rx_bytes": 1000, "tx_bytes": 200},
+                 "eth1": {"rx_bytes": 10, "tx_bytes": 2}},
+    "blkio_stats": {"io_service_bytes_recursive": [
+        {"major": 8, "minor": 0, "op": "read", "value": 4096},
+        {"major": 8, "minor": 0, "op": "write", "value": 512},
+        {"major": 8, "minor": 16, "op": "Read", "value": 4096},
+    ]},
+    "pids_stats": {"current": 7},
+}
+
+
+def test_container_stats_from_api():
+    stats = container_stats_from_api(SAMPLE, "app", "web")
+    # 1s of CPU time over 4s of the 4 CPUs: one CPU
+    assert stats.cpu_percent == pytest.approx(100.0)
+    assert stats.memory_usage == 200 << 20
+    assert stats.memory_percent == pytest.approx(100 * 200 / 1024)
+    assert (stats.network_rx, stats.network_tx) == (1010, 202)
+    assert (stats.block_read, stats.block_write) == (8192, 512)
+    assert stats.pids == 7
+
+
+def test_container_stats_from_api_first_sample():
+    # The first sample has no previous one, and a stopped container sends zeros
+    stats = container_stats_from_api({"cpu_stats": SAMPLE["cpu_stats"]}, "app", "web")
+    assert stats.cpu_percent == 0.0
+    assert container_stats_from_api({}, "app", "web") == ContainerStats("app", "web")
+
+
+def test_aggregate_stats():
+    stats = [
+        ContainerStats("app", "db", cpu_percent=10, memory_usage=100, memory_limit=1000, pids=2),
+        ContainerStats("app", "web", cpu_percent=5, memory_usage=50, memory_limit=1000, pids=1),
+        ContainerStats("other", "main", cpu_percent=1),
+    ]
+    totals = aggregate_stats(stats)
+    assert list(totals) == ["app", "other"]
+    assert totals["app"] == ContainerStats(
+        "app", None, cpu_percent=15, memory_usage=150, memory_limit=1000, pids=3
+    )
+
+
+def test_format_ndjson():
+    stats = [ContainerStats("app", "web", cpu_percent=1.2345, pids=3)]
+    records = [json.loads(line) for line in format_ndjson(stats, 1700000000.5).splitlines()]
+    assert records[0]["component"] == "web"
+    assert records[0]["cpu_percent"] == 1.23
+    assert records[1]["component"] is None
+    assert records[1]["time"] == 1700000000.5
+
+
+def test_format_prometheus():
+    text = format_prometheus([ContainerStats("app", 'we"b', memory_usage=2048, pids=3)])
+    lines = text.splitlines()
+    assert "# TYPE appmgr_container_memory_usage_bytes gauge" in lines
+    assert 'appmgr_container_memory_usage_bytes{app="app",component="we\\"b"} 2048' in lines
+    assert "# TYPE appmgr_app_network_receive_bytes_total counter" in lines
+    assert 'appmgr_app_pids{app="app"} 3' in lines
+
+
+def test_format_prometheus_precision():
+    stats = [
+        ContainerStats("app", "web", cpu_percent=12.345678901, memory_usage=123456789012,
+                       network_rx=987654321),
+        ContainerStats("app", "db", network_rx=1),
+    ]
+    lines = format_prometheus(stats).splitlines()
+    # No digit of the counters is lost, in the sums either
+    assert 'appmgr_container_memory_usage_bytes{app="app",component="web"} 123456789012' in lines
+    assert 'appmgr_container_network_receive_bytes_total{app="app",component="web"} 987654321' \
+        in lines
+    assert 'appmgr_app_network_receive_bytes_total{app="app"} 987654322' in lines
+    assert 'appmgr_container_cpu_percent{app="app",component="web"} 12.345678901' in lines
+    assert 'appmgr_container_cpu_percent{app="app",component="db"} 0.0' in lines
+
+
+def test_write_textfile(tmp_path):
+    path = tmp_path / "appmgr.prom"
+    write_textfile(path, "a 1\n")
+    write_textfile(path, "a 2\n")
+    assert path.read_text() == "a 2\n"
+    assert [p.name for p in tmp_path.iterdir()] == ["appmgr.prom"]
+
+
+class FakeRuntime:
+    """Streams the samples the tests send, per container."""
+
+    def __init__(self):
+        self.queues = {}
+        self.closed = []
+
+    def send(self, container_id, pids):
+        self.queues[container_id].put({"pids_stats": {"current": pids}})
+
+    def stop(self, container_id):
+        self.queues[container_id].put(None)
+
+    def stats(self, container_id):
+        samples = self.queues.setdefault(container_id, queue.Queue())
+        return StatsStream(
+            iter(samples.get, None), lambda: (self.closed.append(container_id), samples.put(None))
+        )
+
+
+class TestStatsSampler:
+    """Tests for the StatsSampler class."""
+
+    def test_sample(self):
+        runtime = FakeRuntime()
+        containers = {"c1": ("app", "web"), "c2": ("app", "db")}
+        sampler = StatsSampler(runtime, lambda: dict(containers), interval=0.05, refresh=0.2)
+        samples = iter(sampler)
+        runtime.queues.update({cid: queue.Queue() for cid in containers})
+        runtime.send("c1", 1)
+        runtime.send("c2", 2)
+        stats = next(samples)
+        while len(stats) < 2:
+            stats = next(samples)
+        assert [(s.component, s.pids) for s in stats] == [("db", 2), ("web", 1)]
+
+        # A stopped container goes away, a new one is found at the next listing
+        runtime.stop("c2")
+        containers = {"c1": ("app", "web"), "c3": ("other", "main")}
+        runtime.queues["c3"] = queue.Queue()
+        runtime.send("c3", 3)
+        while [s.component for s in stats] != ["web", "main"]:
+            stats = next(samples)
+        samples.close()
+        assert sorted(runtime.closed) == ["c1", "c3"]
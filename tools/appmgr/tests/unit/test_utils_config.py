@@ -7,7 +7,14 @@ from pathlib import Path
 import pytest
 import yaml
 
-from appmgr.utils.config import load_config, save_config, merge_configs, load_environment_vars
+from appmgr.utils.config import (
+    ConfigResolver,
+    load_config,
+    load_environment_vars,
+    merge_configs,
+    merge_layers,
+    save_config,
+)
 
 def test_load_config_valid_file():
     """Test loading a valid YAML configuration file."""
@@ -141,3 +148,71 @@ def test_load_environment_vars():
         # Clean up
         for key in test_vars:
             os.environ.pop(key, None)
+
+def test_merge_layers():
+    """Test merging layers, sharing what a single layer defines."""
+    defaults = {"runtime": {"name": "docker", "timeout": 10}, "logging": {"level": "info"}}
+    user = {"runtime": {"name": "podman"}, "apps": {"web": {"port": 80}}}
+    cli = {"logging": "quiet"}
+    merged = merge_layers([defaults, user, cli])
+    assert merged == {
+        "runtime": {"name": "podman", "timeout": 10},
+        "logging": "quiet",
+        "apps": {"web": {"port": 80}},
+    }
+    assert merged["apps"] is user["apps"]
+    assert defaults["runtime"]["name"] == "docker"
+    assert merge_layers([{}, user, {}]) is user
+
+class TestConfigResolver:
+    """Tests for the ConfigResolver class."""
+
+    @pytest.fixture
+    def resolver(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("XDG_CONFIG_HOME", str(tmp_path))
+        monkeypatch.setattr("appmgr.utils.config.SYSTEM_CONFIG_FILE", tmp_path / "etc.yaml")
+        for name in list(os.environ):
+            if name.startswith("THREATOS_"):
+                monkeypatch.delenv(name)
+        (tmp_path / "etc.yaml").write_text("log_level: warning\nruntime:\n  timeout: 30\n")
+        return ConfigResolver.default(
+            {"log_level": "info", "runtime": {"name": "docker", "timeout": 10}},
+            cli={"config_dir": "/tmp/apps", "log_file": None},
+        )
+
+    def test_layers(self, resolver, monkeypatch):
+        """Test the precedence of the layers, and where the values come from."""
+        assert resolver.get("log_level") == "warning"
+        assert resolver.get("runtime.timeout") == 30
+        assert resolver.get("runtime.missing", "default") == "default"
+        assert resolver.origin("runtime.name") == "defaults"
+        assert resolver.origin("runtime.timeout") == "system"
+        assert resolver.origin("config_dir") == "cli"
+        assert resolver.origin("log_file") is None
+
+        monkeypatch.setenv("THREATOS_RUNTIME__NAME", "podman")
+        assert resolver.get("runtime.name") == "podman"
+        assert resolver.explain() == {
+            "log_level": ("warning", "system"),
+            "runtime.name": ("podman", "environment"),
+            "runtime.timeout": (30, "system"),
+            "config_dir": ("/tmp/apps", "cli"),
+        }
+
+    def test_reload(self, resolver, tmp_path):
+        """Test that a file layer is read again when it changes, and only then."""
+        config = resolver.config
+        assert resolver.config is config
+        user_file = tmp_path / "threatos" / "appmgr.yaml"
+        user_file.parent.mkdir()
+        user_file.write_text("log_level: debug\n")
+        assert resolver.get("log_level") == "debug"
+        assert resolver.origin("log_level") == "user"
+        user_file.write_text("log_level: error\n")
+        os.utime(user_file, ns=(1, 1))
+        assert resolver.get("log_level") == "error"
+        user_file.unlink()
+        assert resolver.get("log_level") == "warning"
+
+        resolver.set_layer("cli", {"log_level": "critical"})
+        assert resolver.get("log_level") == "critical"
@@ -1,13 +1,24 @@
 """Unit tests for logging utilities."""
 
+import json
 import logging
 import os
+import signal
+import subprocess
+import sys
 import tempfile
+import time
 from pathlib import Path
 
 import pytest
 
-from appmgr.utils.logging import setup_logging, LoggingContext, get_logger
+from appmgr.utils.logging import (
+    AsyncHandler,
+    JsonFormatter,
+    LoggingContext,
+    get_logger,
+    setup_logging,
+)
 
 def test_setup_logging_console():
     """Test setting up console logging."""
@@ -94,3 +105,123 @@ def test_get_logger():
     # Verify the logger has the same handlers as the root logger
     root_logger = logging.getLogger()
     assert logger.handlers == root_logger.handlers
+
+class SlowHandler(logging.Handler):
+    """A handler on a slow disk."""
+
+    def __init__(self, delay=0.02):
+        super().__init__()
+        self.delay = delay
+        self.messages = []
+
+    def emit(self, record):
+        time.sleep(self.delay)
+        self.messages.append(record.getMessage())
+
+def test_async_handler():
+    """Test that logging doesn't wait for the handlers, and flush() does."""
+    slow = SlowHandler()
+    handler = AsyncHandler([slow])
+    logger = logging.getLogger("test_async")
+    with LoggingContext(logger, level=logging.INFO, handler=handler):
+        start = time.monotonic()
+        for i in range(20):
+            logger.info("step %d", i)
+        assert time.monotonic() - start < 20 * slow.delay / 2
+        handler.flush()
+        assert slow.messages == [f"step {i}" for i in range(20)]
+        logger.info("last")
+    # Closing waits for the queued records too
+    assert slow.messages[-1] == "last"
+
+def test_setup_logging_queue(tmp_path):
+    """Test setting up logging from a background thread, in JSON."""
+    log_file = tmp_path / "test.log"
+    setup_logging(level="info", log_file=log_file, json_format=True, use_queue=True)
+    root_logger = logging.getLogger()
+    try:
+        assert [type(h) for h in root_logger.handlers] == [AsyncHandler]
+        logging.getLogger("test_queue").info("Test %s", "message", extra={"app": "web"})
+        root_logger.handlers[0].flush()
+        record = json.loads(log_file.read_text())
+        assert record["message"] == "Test message"
+        assert record["logger"] == "test_queue"
+        assert record["app"] == "web"
+    finally:
+        setup_logging(level="info")
+
+def test_setup_logging_queue_exception(tmp_path):
+    """Test that the exceptions go through the queue, in JSON."""
+    log_file = tmp_path / "test.log"
+    setup_logging(level="info", log_file=log_file, json_format=True, use_queue=True)
+    root_logger = logging.getLogger()
+    try:
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logging.getLogger("test_queue").exception("Failed to %s", "start")
+        root_logger.handlers[0].flush()
+        record = json.loads(log_file.read_text())
+        assert record["message"] == "Failed to start"
+        assert record["exception"].startswith("Traceback")
+        assert record["exception"].endswith("ValueError: boom")
+    finally:
+        setup_logging(level="info")
+
+def test_async_handler_record():
+    """Test that the handlers get the record as it was logged."""
+    records = []
+    target = logging.Handler()
+    target.emit = records.append
+    handler = AsyncHandler([target])
+    logger = logging.getLogger("test_async_record")
+    with LoggingContext(logger, level=logging.INFO, handler=handler):
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logger.exception("Failed to %s", "start")
+        handler.flush()
+    [record] = records
+    assert (record.msg, record.args) == ("Failed to %s", ("start",))
+    assert record.exc_info[0] is ValueError
+
+def test_json_formatter():
+    """Test the JSON format, with an exception."""
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = logging.makeLogRecord({
+            "name": "test", "levelno": logging.ERROR, "levelname": "ERROR", "msg": "failed",
+            "exc_info": sys.exc_info(), "created": 0.0, "component": "db",
+        })
+    data = json.loads(JsonFormatter().format(record))
+    assert data["time"] == "1970-01-01T00:00:00.000+00:00"
+    assert data["level"] == "ERROR"
+    assert data["component"] == "db"
+    assert data["exception"].endswith("ValueError: boom")
+
+def test_flush_on_signal(tmp_path):
+    """Test that the queued records are written before a SIGTERM kills the process."""
+    log_file = tmp_path / "test.log"
+    script = f"""
+import logging, os, signal, time
+from appmgr.utils.logging import setup_logging
+
+class SlowFile(logging.FileHandler):
+    def emit(self, record):
+        time.sleep(0.01)
+        super().emit(record)
+
+setup_logging(level="info", use_queue=True)
+logging.getLogger().handlers[0].add_handler(SlowFile({str(log_file)!r}))
+for i in range(50):
+    logging.info("step %d", i)
+os.kill(os.getpid(), signal.SIGTERM)
+time.sleep(5)
+"""
+    result = subprocess.run(
+        [sys.executable, "-c", script], cwd=Path(__file__).parents[2],
+        stderr=subprocess.DEVNULL, timeout=30,
+    )
+    assert result.returncode == -signal.SIGTERM
+    assert log_file.read_text().splitlines()[-1] == "step 49"
@@ -0,0 +1,80 @@
+"""Unit tests for the profiling of the commands."""
+
+import pytest
+import requests
+from docker.api.client import APIClient
+
+from appmgr.core.engine import EngineClient
+from appmgr.core.exceptions import ContainerRuntimeError
+from appmgr.utils.profiling import ApiStats, Profiler, endpoint, percentile
+
+
+@pytest.mark.parametrize("method, path, expected", [
+    ("GET", "/v1.43/images/json?all=false", "GET /images/json"),
+    ("post", "/containers/create?name=web", "POST /containers/create"),
+    ("GET", "/containers/3f4e/archive?path=/appmgr", "GET /containers/{id}/archive"),
+    ("DELETE", "/v1.41/containers/3f4e", "DELETE /containers/{id}"),
+    ("GET", "/images/registry.example.com/team/web:1.0/json", "GET /images/{name}/json"),
+    ("GET", "/images/registry.example.com%2Fweb%3A1.0/json", "GET /images/{name}/json"),
+    ("DELETE", "/images/team/web", "DELETE /images/{name}"),
+    ("POST", "/images/create?fromImage=web&tag=1.0", "POST /images/create"),
+    ("HEAD", "/_ping", "HEAD /_ping"),
+])
+def test_endpoint(method, path, expected):
+    assert endpoint(method, path) == expected
+
+
+def test_percentile():
+    values = [float(i) for i in range(1, 101)]
+    assert (percentile(values, 50), percentile(values, 95), percentile(values, 100)) == (
+        50, 95, 100
+    )
+    assert percentile([1.0], 95) == 1.0
+
+
+def test_report():
+    stats = ApiStats()
+    for latency in (0.0005, 0.002, 0.003, 2.0):
+        stats.record("GET", "/containers/1/archive", latency)
+    stats.record("GET", "/images/json", 0.02)
+    assert stats.count == 5
+    assert stats.histogram("GET /containers/{id}/archive") == [1, 2, 0, 0, 0, 0, 0, 1]
+
+    lines = stats.format_report().splitlines()
+    assert lines[0] == "Engine API: 5 requests, 2025.5ms"
+    assert lines[1].split()[:6] == ["endpoint", "count", "total", "p50", "p95", "max"]
+    assert lines[2].split()[:6] == [
+        "GET", "/containers/{id}/archive", "4", "2005.5ms", "2.0ms", "2000.0ms"
+    ]
+    assert lines[3].startswith("GET /images/json")
+    assert len(stats.format_report(top=1).splitlines()) == 3
+
+
+def test_install(tmp_path):
+    stats = ApiStats()
+    stats.install()
+    try:
+        client = EngineClient(str(tmp_path / "docker.sock"))
+        with pytest.raises(ContainerRuntimeError):
+            client.create_container({"Image": "web"})
+        api = APIClient(base_url="unix://%s" % (tmp_path / "docker.sock"), version="1.41")
+        with pytest.raises(requests.ConnectionError):
+            api.images()
+    finally:
+        stats.uninstall()
+    assert sorted(stats.latencies) == ["GET /images/json", "POST /containers/create"]
+    # The classes are as they were
+    assert "send" not in APIClient.__dict__
+    assert EngineClient.request.__qualname__ == "EngineClient.request"
+
+
+def test_profiler():
+    profiler = Profiler()
+    profiler.start()
+    try:
+        sorted(range(1000), key=str)
+    finally:
+        profiler.stop()
+    report = profiler.format_report(top=5)
+    assert "function calls" in report
+    assert "Engine API: 0 requests" in report
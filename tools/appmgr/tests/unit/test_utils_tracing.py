@@ -0,0 +1,95 @@
+"""Unit tests for the tracing of the operations."""
+
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from appmgr.utils import tracing
+
+
+@pytest.fixture
+def enabled():
+    tracing.enable()
+    yield
+    tracing.disable()
+    tracing.reset()
+
+
+@tracing.traced()
+def work(n=0):
+    with tracing.span("inner", n=n) as span:
+        span.set(done=True)
+    return n
+
+
+def test_disabled():
+    assert not tracing.is_enabled()
+    with tracing.span("outer") as span:
+        span.set(x=1)
+        assert work(1) == 1
+    assert tracing.span("other") is span
+    assert tracing.events() == []
+
+
+def test_nesting(enabled):
+    with tracing.span("outer"):
+        work()
+        work()
+    paths = [path for path, *_ in tracing.events()]
+    assert paths == [
+        ("outer", "work", "inner"), ("outer", "work"),
+        ("outer", "work", "inner"), ("outer", "work"),
+        ("outer",),
+    ]
+    assert tracing.events()[0][4] == {"n": 0, "done": True}
+
+
+def test_error(enabled):
+    with pytest.raises(ValueError):
+        with tracing.span("outer"):
+            raise ValueError()
+    assert tracing.events()[0][4] == {"error": "ValueError"}
+    # The stack is back to empty
+    with tracing.span("next"):
+        pass
+    assert tracing.events()[1][0] == ("next",)
+
+
+def test_bind(enabled):
+    with tracing.span("outer"):
+        with ThreadPoolExecutor(2) as pool:
+            assert list(pool.map(tracing.bind(work), [1, 2])) == [1, 2]
+            list(pool.map(work, [3]))
+    paths = {path for path, *_ in tracing.events()}
+    assert paths == {
+        ("outer",), ("outer", "work"), ("outer", "work", "inner"), ("work",), ("work", "inner"),
+    }
+
+
+def test_chrome_trace(enabled, tmp_path):
+    with tracing.span("outer", app="web"):
+        work()
+    tracing.export_chrome_trace(tmp_path / "trace.json")
+    trace = json.loads((tmp_path / "trace.json").read_text())
+    events = trace["traceEvents"]
+    assert [(e["name"], e["ph"]) for e in events] == [
+        ("outer", "X"), ("work", "X"), ("inner", "X"), ("thread_name", "M"),
+    ]
+    outer, inner = events[0], events[2]
+    assert outer["args"] == {"app": "web"}
+    assert outer["ts"] <= inner["ts"]
+    assert inner["ts"] + inner["dur"] <= outer["ts"] + outer["dur"]
+    assert events[3]["args"] == {"name": "MainThread"}
+
+
+def test_format_summary(enabled):
+    with tracing.span("outer"):
+        for i in range(3):
+            work(i)
+    lines = tracing.format_summary().splitlines()
+    assert len(lines) == 3
+    assert lines[0].split()[1:] == ["100.0%", "#" * 20, "outer", "(1)"]
+    assert lines[1].endswith("  work (3)")
+    assert lines[2].endswith("    inner (3)")
+    assert tracing.format_summary(min_percent=101) == ""
@@ -0,0 +1,178 @@
+"""Unit tests for the validation of the configuration files."""
+
+import json
+
+import pytest
+import yaml
+
+from appmgr.utils.validation import (
+    ERROR,
+    WARNING,
+    ValidationCache,
+    compile_schema,
+    find_config_files,
+    validate_content,
+    validate_files,
+)
+
+VALID_APP = b"""\
+id: web
+name: Web
+version: '1.0'
+containers:
+  - name: db
+    image: postgres:15
+    restart: no
+    healthcheck:
+      test: [CMD, pg_isready]
+      interval: 1m30s
+  - name: web
+    image: nginx:alpine
+    depends_on: [db]
+    pull_policy: always
+"""
+
+INVALID_APP = b"""\
+id: web
+name: Web
+version: 1.10
+containers:
+  - name: web
+    imag: nginx:alpine
+    restart: sometimes
+    volumes:
+      - target: /data
+        type: nfs
+"""
+
+VALID_APPMGR = b"""\
+application:
+  id: editor
+  name: Editor
+components:
+  main:
+    run_mode: gui
+    allow_x11: true
+    mounts:
+      - source: ~/Documents
+        target: ~/Documents
+container:
+  origin:
+    registry:
+      url: https://registry.example.com
+"""
+
+
+def messages(issues):
+    return [(line, path, message, severity) for line, _, path, message, severity in issues]
+
+
+def test_valid():
+    assert validate_content(VALID_APP, "app") == []
+    assert validate_content(VALID_APPMGR, "appmgr") == []
+
+
+def test_invalid_app():
+    assert messages(validate_content(INVALID_APP, "app")) == [
+        (3, "version", "must be string, not number", ERROR),
+        (5, "containers[0]", "missing required key: image", ERROR),
+        (6, "containers[0].imag", "unknown key", WARNING),
+        (7, "containers[0].restart", "invalid value: 'sometimes'", ERROR),
+        (10, "containers[0].volumes[0].type", "must be one of volume, bind, tmpfs, not 'nfs'",
+         ERROR),
+    ]
+
+
+def test_invalid_appmgr():
+    content = b"application:\n  id: a b\ncomponents:\n  main: {}\n  main: {run_mode: tui}\n"
+    assert messages(validate_content(content, "appmgr")) == [
+        (2, "application", "missing required key: name", ERROR),
+        (2, "application.id", "invalid value: 'a b'", ERROR),
+        (4, "components.main", "missing required key: run_mode", ERROR),
+        (5, "components.main", "duplicate key", ERROR),
+        (5, "components.main.run_mode", "must be one of cli, gui, headless, not 'tui'", ERROR),
+    ]
+
+
+def test_invalid_yaml():
+    assert messages(validate_content(b"id: [web\n", "app"))[0][0] == 2
+    assert messages(validate_content(b"", "app")) == [(1, "", "empty file", ERROR)]
+    assert messages(validate_content(b"- web\n", "app")) == [
+        (1, "", "must be object, not array", ERROR)
+    ]
+
+
+def test_compile_schema():
+    validate = compile_schema({"type": "number", "enum": [1, 2]})
+    issues = []
+    for value in ("3", "2", "'2'"):
+        validate(yaml.compose(value), "x", issues)
+    assert [message for _, _, _, message, _ in issues] == [
+        "must be one of 1, 2, not '3'", "must be number, not string"
+    ]
+
+
+@pytest.mark.parametrize("value, message", [
+    ("no", None),
+    ("false", None),
+    ("Off", None),
+    ("on-failure:3", None),
+    ("'no'", None),
+    ("true", "must be false, not 'true'"),
+    ("yes", "must be false, not 'yes'"),
+    ("'yes'", "invalid value: 'yes'"),
+])
+def test_restart_policy(value, message):
+    content = b"id: web\nname: Web\nversion: '1.0'\ncontainers:\n  - name: web\n" \
+        b"    image: nginx\n    restart: " + value.encode() + b"\n"
+    issues = messages(validate_content(content, "app"))
+    assert issues == ([] if message is None else [(7, "containers[0].restart", message, ERROR)])
+
+
+@pytest.fixture
+def tree(tmp_path):
+    for i in range(20):
+        (tmp_path / f"app{i}").mkdir()
+        (tmp_path / f"app{i}" / "app.yaml").write_bytes(VALID_APP)
+    (tmp_path / "app3" / "app.yaml").write_bytes(INVALID_APP)
+    (tmp_path / "editor.appmgr.yaml").write_bytes(VALID_APPMGR)
+    (tmp_path / ".git").mkdir()
+    (tmp_path / ".git" / "app.yaml").write_bytes(INVALID_APP)
+    (tmp_path / "other.yaml").write_bytes(INVALID_APP)
+    return tmp_path
+
+
+def test_find_config_files(tree):
+    files = find_config_files([tree])
+    assert len(files) == 21
+    assert files[0] == tree / "editor.appmgr.yaml"
+    assert find_config_files([tree / "other.yaml"]) == [tree / "other.yaml"]
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_validate_files(tree, jobs):
+    report = validate_files(find_config_files([tree]), jobs=jobs)
+    assert report.files == 21
+    assert {issue.file for issue in report.issues} == {str(tree / "app3" / "app.yaml")}
+    assert len(report.errors) == 4
+    assert len(report.warnings) == 1
+    assert str(report.warnings[0]) == (
+        f"{tree}/app3/app.yaml:6:5: warning: containers[0].imag: unknown key"
+    )
+
+
+def test_validate_files_cache(tree, tmp_path):
+    files = find_config_files([tree])
+    report = validate_files(files, jobs=1, cache=ValidationCache(tmp_path / "cache.json"))
+    assert report.cached == 0
+    # Every content is in the cache now
+    cache = ValidationCache(tmp_path / "cache.json")
+    report = validate_files(files, jobs=1, cache=cache)
+    assert (report.cached, len(report.errors)) == (21, 4)
+
+    (tree / "app3" / "app.yaml").write_bytes(VALID_APP)
+    report = validate_files(files, jobs=1, cache=ValidationCache(tmp_path / "cache.json"))
+    assert (report.cached, len(report.errors)) == (21, 0)
+    # Only the entries of the last run are kept
+    entries = json.loads((tmp_path / "cache.json").read_text())["entries"]
+    assert len(entries) == 2
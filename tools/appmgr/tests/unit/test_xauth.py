@@ -0,0 +1,149 @@
+"""Unit tests for the handling of the X authority files."""
+
+import os
+
+import pytest
+
+from appmgr import (
+    XAUTH_FAMILY_LOCAL,
+    XAUTH_FAMILY_WILD,
+    Appmgr,
+    get_local_xauth_entries,
+    merge_xauth_entries,
+    parse_local_display_number,
+    read_xauth_entries,
+    write_xauth_entries,
+)
+
+COOKIE = "MIT-MAGIC-COOKIE-1"
+
+
+def record(family, address, number, name, data):
+    fields = b""
+    for field in (address, number, name, data):
+        fields += len(field).to_bytes(2, "big") + field
+    return family.to_bytes(2, "big") + fields
+
+
+# Two displays of the host 'kali', and a display forwarded over TCP
+XAUTHORITY = (
+    record(XAUTH_FAMILY_LOCAL, b"kali", b"0", COOKIE.encode(), bytes(range(16)))
+    + record(XAUTH_FAMILY_LOCAL, b"kali", b"1", COOKIE.encode(), b"\x01" * 16)
+    + record(0, b"\x7f\x00\x00\x01", b"10", COOKIE.encode(), b"\xff" * 16)
+)
+
+
+@pytest.fixture
+def xauthority(tmp_path):
+    path = tmp_path / ".Xauthority"
+    path.write_bytes(XAUTHORITY)
+    return path
+
+
+@pytest.mark.parametrize("display, number", [
+    (":0", "0"), (":1.0", "1"), ("unix:12", "12"), ("localhost:10.0", None), ("", None),
+])
+def test_parse_local_display_number(display, number):
+    assert parse_local_display_number(display) == number
+
+
+def test_round_trip(xauthority, tmp_path):
+    entries = read_xauth_entries(xauthority)
+    assert entries == [
+        (XAUTH_FAMILY_LOCAL, b"kali", b"0", COOKIE.encode(), bytes(range(16))),
+        (XAUTH_FAMILY_LOCAL, b"kali", b"1", COOKIE.encode(), b"\x01" * 16),
+        (0, b"\x7f\x00\x00\x01", b"10", COOKIE.encode(), b"\xff" * 16),
+    ]
+    write_xauth_entries(str(tmp_path / "copy"), entries)
+    assert (tmp_path / "copy").read_bytes() == XAUTHORITY
+    # Nothing is left behind by the atomic replace
+    assert sorted(os.listdir(tmp_path)) == [".Xauthority", "copy"]
+
+
+@pytest.mark.parametrize("size", [1, 3, 10, len(XAUTHORITY) - 1])
+def test_truncated(tmp_path, size):
+    (tmp_path / "truncated").write_bytes(XAUTHORITY[:size])
+    with pytest.raises(ValueError):
+        read_xauth_entries(tmp_path / "truncated")
+
+
+def test_empty(tmp_path):
+    (tmp_path / "empty").write_bytes(b"")
+    assert read_xauth_entries(tmp_path / "empty") == []
+
+
+def test_merge():
+    old = [
+        (XAUTH_FAMILY_WILD, b"kali", b"0", COOKIE.encode(), b"old"),
+        (XAUTH_FAMILY_WILD, b"kali", b"0", b"XDM-AUTHORIZATION-1", b"xdm"),
+        (XAUTH_FAMILY_WILD, b"kali", b"1", COOKIE.encode(), b"other"),
+    ]
+    new = [(XAUTH_FAMILY_WILD, b"kali", b"0", COOKIE.encode(), b"new")]
+    # Only the entry with the same family, address, number and name is replaced
+    assert merge_xauth_entries(old, new) == [old[1], old[2], new[0]]
+    assert merge_xauth_entries([], new) == new
+    assert merge_xauth_entries(old, []) == old
+
+
+def test_get_local_entries(xauthority, monkeypatch):
+    monkeypatch.setattr("socket.gethostname", lambda: "kali")
+    assert get_local_xauth_entries(xauthority, "1") == [
+        (XAUTH_FAMILY_WILD, b"kali", b"1", COOKIE.encode(), b"\x01" * 16),
+    ]
+    # The entries of another host don't match
+    monkeypatch.setattr("socket.gethostname", lambda: "other")
+    assert get_local_xauth_entries(xauthority, "1") == []
+
+
+@pytest.fixture
+def appmgr(tmp_path, xauthority, monkeypatch):
+    monkeypatch.setattr("socket.gethostname", lambda: "kali")
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv("DISPLAY", ":0")
+    monkeypatch.setenv("XAUTHORITY", str(xauthority))
+    appmgr = Appmgr()
+    appmgr.home_in = "/home/user"
+    return appmgr
+
+
+def test_create_xauth(appmgr, tmp_path):
+    appmgr.create_xauth()
+    out = tmp_path / ".docker.xauth"
+    assert appmgr.xauth_out == str(out)
+    assert appmgr.xauth_in == "/home/user/.docker.xauth"
+    assert read_xauth_entries(out) == [
+        (XAUTH_FAMILY_WILD, b"kali", b"0", COOKIE.encode(), bytes(range(16))),
+    ]
+
+
+def test_create_xauth_stamp(appmgr, tmp_path, xauthority, monkeypatch):
+    out = tmp_path / ".docker.xauth"
+    appmgr.create_xauth()
+    generated = out.read_bytes()
+
+    # Same display, same source, same mtime: the file is reused as is
+    out.write_bytes(b"")
+    appmgr.create_xauth()
+    assert out.read_bytes() == b""
+
+    # Another display
+    monkeypatch.setenv("DISPLAY", ":1")
+    appmgr.create_xauth()
+    assert [e[2] for e in read_xauth_entries(out)] == [b"1"]
+
+    # The source changed
+    monkeypatch.setenv("DISPLAY", ":0")
+    appmgr.create_xauth()
+    out.write_bytes(b"")
+    st = xauthority.stat()
+    os.utime(xauthority, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    appmgr.create_xauth()
+    assert out.read_bytes() == generated
+
+    # Another source
+    other = tmp_path / "other"
+    other.write_bytes(XAUTHORITY)
+    monkeypatch.setenv("XAUTHORITY", str(other))
+    out.write_bytes(b"")
+    appmgr.create_xauth()
+    assert out.read_bytes() == generated